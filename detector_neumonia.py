@@ -11,6 +11,11 @@ import cv2
 import numpy as np
 import os
 
+# ✅ Hilos de TensorFlow/OpenCV y oneDNN según el perfil de ejecución,
+# antes de que integrator importe TensorFlow
+from src.modulos.runtime_profile import aplicar_perfil_o_defecto
+aplicar_perfil_o_defecto()
+
 # ✅ CORREGIDO: Importaciones desde  estructura de módulos
 from src.modulos.read_img import read_image_file
 from src.modulos.integrator import predict
@@ -148,12 +153,14 @@ class App:
         
         # ✅ MEJORADO: Manejo de errores en la predicción
         try:
-            self.label, self.proba, self.heatmap = predict(self.array)
-            
+            resultado = predict(self.array)
+            self.label, self.proba = resultado.diagnostico, resultado.probabilidad
+            # ✅ MEJORADO: El heatmap se renderiza directamente al tamaño de la vista
+            self.heatmap = resultado.heatmap((250, 250))
+
             if self.heatmap is not None:
                 # Mostrar heatmap generado
                 self.img_heatmap = Image.fromarray(self.heatmap)
-                self.img_heatmap = self.img_heatmap.resize((250, 250), Image.LANCZOS)
                 self.img_heatmap_tk = ImageTk.PhotoImage(self.img_heatmap)
                 self.texto_imagen_heatmap.image_create(END, image=self.img_heatmap_tk)
                 
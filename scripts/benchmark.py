@@ -0,0 +1,568 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks de rendimiento del pipeline de detección de neumonía.
+
+Uso:
+    python scripts/benchmark.py preprocesamiento --max-workers 8
+    python scripts/benchmark.py cache --directorio /tmp/cache_tensores
+    python scripts/benchmark.py explicadores --presupuesto 16
+    python scripts/benchmark.py overlay --tamano 250
+    python scripts/benchmark.py dicom --cuadros 64 --tamano 1024
+    python scripts/benchmark.py grafo --lote 8
+    python scripts/benchmark.py precision --precisiones float32,bfloat16,float16
+    python scripts/benchmark.py cascada --umbrales 0.5,0.7,0.9
+    python scripts/benchmark.py --perfil shared-node workers --procesos 4
+    python scripts/benchmark.py salida --imagenes 64
+    python scripts/benchmark.py --perfil shared-node explicadores
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Agregar la raíz del proyecto al path para imports
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, RAIZ)
+
+from src.modulos.read_img import read_image_file
+from src.modulos.preprocess_img import preprocess_batch
+from src.modulos.tensor_cache import TensorCache
+from src.modulos.runtime_profile import aplicar_perfil, describir_perfil
+
+DIRECTORIO_IMAGENES = os.path.join(RAIZ, 'tests', 'JPG', 'JPG')
+
+
+def rutas_imagenes_prueba():
+    """Devuelve las rutas de las imágenes de prueba incluidas en el repositorio"""
+    return sorted(glob.glob(os.path.join(DIRECTORIO_IMAGENES, '*', '*.jpeg')))
+
+
+def cargar_imagenes_prueba(n=None):
+    """
+    Carga las imágenes de prueba incluidas en el repositorio.
+
+    Args:
+        n (int): Número de imágenes a devolver (se repiten si hacen falta más)
+
+    Returns:
+        list: Imágenes como arrays numpy
+    """
+    imagenes = [read_image_file(ruta)[0] for ruta in rutas_imagenes_prueba()]
+    imagenes = [img for img in imagenes if img is not None]
+    if not imagenes:
+        raise FileNotFoundError(f"No hay imágenes de prueba en {DIRECTORIO_IMAGENES}")
+    if n is not None:
+        imagenes = [imagenes[i % len(imagenes)] for i in range(n)]
+    return imagenes
+
+
+def medir(funcion, repeticiones=3):
+    """Ejecuta ``funcion`` varias veces y devuelve el mejor tiempo en segundos"""
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+def bench_preprocesamiento(args):
+    """Curva de escalado de preprocess_batch de 1 a N hilos"""
+    imagenes = cargar_imagenes_prueba(args.imagenes)
+    max_workers = args.max_workers or os.cpu_count() or 1
+    filas = []
+    base = None
+    for workers in range(1, max_workers + 1):
+        segundos = medir(lambda: preprocess_batch(imagenes, workers=workers), args.repeticiones)
+        base = base or segundos
+        filas.append({
+            'workers': workers,
+            'segundos': round(segundos, 4),
+            'imagenes_por_segundo': round(len(imagenes) / segundos, 2),
+            'aceleracion': round(base / segundos, 2),
+        })
+
+    print(f"\n📈 Escalado de preprocess_batch ({len(imagenes)} imágenes, {os.cpu_count()} núcleos)")
+    print(f"{'workers':>8} {'seg':>9} {'img/s':>9} {'x':>6}")
+    for fila in filas:
+        print(f"{fila['workers']:>8} {fila['segundos']:>9.4f} "
+              f"{fila['imagenes_por_segundo']:>9.2f} {fila['aceleracion']:>6.2f}")
+    return {'benchmark': 'preprocesamiento', 'nucleos': os.cpu_count(), 'resultados': filas}
+
+
+def bench_cache(args):
+    """Carga de un batch desde archivos: caché fría frente a caché caliente"""
+    rutas = rutas_imagenes_prueba()
+    directorio = args.directorio or tempfile.mkdtemp(prefix='cache_tensores_')
+    cache = TensorCache(directorio, dtype=args.dtype)
+
+    inicio = time.perf_counter()
+    cache.load_batch(rutas)
+    fria = time.perf_counter() - inicio
+    caliente = medir(lambda: cache.load_batch(rutas), args.repeticiones)
+    cache.close()
+
+    print(f"\n🗄️  Caché de tensores ({len(rutas)} imágenes, dtype={args.dtype})")
+    print(f"   - Fría:     {fria:.4f} s ({len(rutas) / fria:.1f} img/s)")
+    print(f"   - Caliente: {caliente:.4f} s ({len(rutas) / caliente:.1f} img/s)")
+    print(f"   - Aceleración: {fria / caliente:.1f}x")
+    return {'benchmark': 'cache', 'dtype': args.dtype, 'imagenes': len(rutas),
+            'segundos_fria': round(fria, 4), 'segundos_caliente': round(caliente, 4)}
+
+
+def similitud_cam(cam, referencia, percentil=80):
+    """
+    Compara dos CAMs de la misma resolución.
+
+    Returns:
+        tuple: (correlación de Pearson, IoU de la región por encima del percentil)
+    """
+    a = cam.astype(np.float32).ravel()
+    b = referencia.astype(np.float32).ravel()
+    if a.std() == 0 or b.std() == 0:
+        correlacion = 1.0 if np.array_equal(a, b) else 0.0
+    else:
+        correlacion = float(np.corrcoef(a, b)[0, 1])
+    region_a = a >= np.percentile(a, percentil)
+    region_b = b >= np.percentile(b, percentil)
+    union = np.logical_or(region_a, region_b).sum()
+    iou = float(np.logical_and(region_a, region_b).sum() / union) if union else 1.0
+    return correlacion, iou
+
+
+def bench_explicadores(args):
+    """Latencia y parecido con Grad-CAM de los explicadores sin gradientes"""
+    from src.modulos.load_model import model_fun
+    from src.modulos.preprocess_img import preprocess
+    from src.modulos.grad_cam import (calcular_cam, predecir_con_activaciones,
+                                      cam_por_activaciones, calcular_score_cam)
+
+    model = model_fun()
+    tensores = [preprocess(img) for img in cargar_imagenes_prueba()]
+
+    def gradcam(tensor):
+        # Predicción + backpropagation, como el camino por defecto
+        probabilidades, _ = predecir_con_activaciones(model, tensor)
+        return calcular_cam(model, tensor, int(np.argmax(probabilidades[0])))
+
+    def activaciones(tensor):
+        _, conv = predecir_con_activaciones(model, tensor)
+        return cam_por_activaciones(conv[0])
+
+    def scorecam(tensor):
+        probabilidades, conv = predecir_con_activaciones(model, tensor)
+        return calcular_score_cam(model, tensor, int(np.argmax(probabilidades[0])),
+                                  presupuesto=args.presupuesto, activaciones=conv[0])
+
+    metodos = {'gradcam': gradcam, 'activaciones': activaciones, 'scorecam': scorecam}
+    for funcion in metodos.values():
+        funcion(tensores[0])  # Calentamiento (trazado de funciones de TF)
+
+    resultados = {}
+    referencias = [gradcam(t) for t in tensores]
+    for nombre, funcion in metodos.items():
+        latencias, correlaciones, ious = [], [], []
+        for tensor, referencia in zip(tensores, referencias):
+            inicio = time.perf_counter()
+            cam = funcion(tensor)
+            latencias.append(time.perf_counter() - inicio)
+            correlacion, iou = similitud_cam(cam, referencia)
+            correlaciones.append(correlacion)
+            ious.append(iou)
+        resultados[nombre] = {
+            'latencia_ms': round(1000 * float(np.median(latencias)), 2),
+            'correlacion_gradcam': round(float(np.mean(correlaciones)), 3),
+            'iou_top20_gradcam': round(float(np.mean(ious)), 3),
+        }
+
+    print(f"\n🔥 Explicadores sobre {len(tensores)} imágenes (predicción + mapa, mediana)")
+    print(f"{'método':>14} {'ms':>9} {'corr':>7} {'IoU':>7}")
+    for nombre, r in resultados.items():
+        print(f"{nombre:>14} {r['latencia_ms']:>9.2f} {r['correlacion_gradcam']:>7.3f} "
+              f"{r['iou_top20_gradcam']:>7.3f}")
+    return {'benchmark': 'explicadores', 'presupuesto_scorecam': args.presupuesto,
+            'resultados': resultados}
+
+
+def bench_overlay(args):
+    """Superposición del heatmap: camino original frente al renderizador con LUT"""
+    import cv2
+    from src.modulos.grad_cam import preparar_imagen_original
+    from src.modulos.overlay import RenderizadorOverlay
+
+    tamano = (args.tamano, args.tamano)
+    imagenes = cargar_imagenes_prueba(args.imagenes)
+    rng = np.random.default_rng(0)
+    cams_float = rng.random((len(imagenes), 31, 31), dtype=np.float32)
+    cams = np.uint8(255 * cams_float)
+
+    def original():
+        # Seis pasadas completas: resize, escala, color, imagen, mezcla y BGR->RGB
+        for cam, imagen in zip(cams_float, imagenes):
+            heatmap = np.uint8(255 * cv2.resize(cam, tamano))
+            heatmap_color = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
+            img_original = preparar_imagen_original(imagen, tamano)
+            mezcla = cv2.addWeighted(img_original, 0.5, heatmap_color, 0.5, 0)
+            cv2.cvtColor(mezcla, cv2.COLOR_BGR2RGB)
+
+    renderizador = RenderizadorOverlay(tamano)
+    salida = np.empty((len(imagenes), args.tamano, args.tamano, 3), dtype=np.uint8)
+
+    def individual():
+        for i, (cam, imagen) in enumerate(zip(cams, imagenes)):
+            renderizador.render(cam, imagen, out=salida[i])
+
+    def lote():
+        renderizador.render_batch(cams, imagenes, out=salida)
+
+    resultados = {}
+    for nombre, funcion in (('original', original), ('lut', individual), ('lut_lote', lote)):
+        segundos = medir(funcion, args.repeticiones)
+        resultados[nombre] = {
+            'ms_por_imagen': round(1000 * segundos / len(imagenes), 3),
+            'imagenes_por_segundo': round(len(imagenes) / segundos, 1),
+        }
+
+    print(f"\n🎨 Superposición {tamano[0]}x{tamano[1]} ({len(imagenes)} imágenes)")
+    print(f"{'camino':>10} {'ms/img':>9} {'img/s':>10} {'x':>6}")
+    base = resultados['original']['ms_por_imagen']
+    for nombre, r in resultados.items():
+        print(f"{nombre:>10} {r['ms_por_imagen']:>9.3f} {r['imagenes_por_segundo']:>10.1f} "
+              f"{base / r['ms_por_imagen']:>6.2f}")
+    return {'benchmark': 'overlay', 'tamano': tamano, 'resultados': resultados}
+
+
+def crear_dicom_multicuadro(ruta, cuadros, tamano):
+    """Escribe un DICOM sintético de 16 bits con ``cuadros`` cuadros de tamano x tamano"""
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, SecondaryCaptureImageStorage, generate_uid
+
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = SecondaryCaptureImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Rows = ds.Columns = tamano
+    ds.NumberOfFrames = cuadros
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 12, 11, 0
+    rng = np.random.default_rng(0)
+    ds.PixelData = rng.integers(0, 4096, (cuadros, tamano, tamano), dtype=np.uint16).tobytes()
+    ds.save_as(ruta, enforce_file_format=True)
+
+
+def bench_dicom(args):
+    """Memoria pico y tiempo de decodificación de un DICOM multi-cuadro"""
+    import tracemalloc
+    import pydicom
+    from src.modulos.read_img import cuadro_a_rgb, read_dicom_frames
+
+    ruta = os.path.join(tempfile.mkdtemp(prefix='dicom_'), 'multicuadro.dcm')
+    crear_dicom_multicuadro(ruta, args.cuadros, args.tamano)
+
+    def completo():
+        # Camino anterior: pixel_array decodifica el volumen entero
+        volumen = pydicom.dcmread(ruta).pixel_array
+        return [cuadro_a_rgb(cuadro) for cuadro in volumen]
+
+    caminos = {'completo': completo}
+    for seleccion in ('primero', 'medio', 'todos'):
+        caminos[seleccion] = lambda seleccion=seleccion: read_dicom_frames(ruta, seleccion)[0]
+
+    resultados = {}
+    for nombre, funcion in caminos.items():
+        segundos = medir(funcion, args.repeticiones)
+        tracemalloc.start()
+        imagenes = funcion()
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        resultados[nombre] = {
+            'cuadros': len(imagenes),
+            'ms': round(1000 * segundos, 2),
+            'memoria_pico_mb': round(pico / 2 ** 20, 1),
+        }
+        del imagenes
+
+    mb = os.path.getsize(ruta) / 2 ** 20
+    print(f"\n🩻 DICOM sintético: {args.cuadros} cuadros de {args.tamano}x{args.tamano} ({mb:.0f} MB)")
+    print(f"{'camino':>10} {'cuadros':>8} {'ms':>10} {'pico MB':>9}")
+    for nombre, r in resultados.items():
+        print(f"{nombre:>10} {r['cuadros']:>8} {r['ms']:>10.2f} {r['memoria_pico_mb']:>9.1f}")
+    os.remove(ruta)
+    return {'benchmark': 'dicom', 'cuadros': args.cuadros, 'tamano': args.tamano,
+            'resultados': resultados}
+
+
+def bench_grafo(args):
+    """Net5Blocks original frente al grafo con BatchNorm plegada y operaciones fusionadas"""
+    import tensorflow as tf
+    from src.modulos.model_optimizer import (construir_net5blocks, optimizar_modelo, verificar_paridad,
+                                             lote_de_verificacion, bytes_activaciones)
+
+    original = construir_net5blocks()
+    optimizado, cambios = optimizar_modelo(original)
+    verificacion = lote_de_verificacion()
+    paridad = verificar_paridad(original, optimizado, verificacion)
+
+    firma = tf.TensorSpec((None,) + tuple(original.inputs[0].shape[1:]), tf.float32)
+    rng = np.random.default_rng(0)
+    lote = tf.constant(rng.random((args.lote,) + tuple(firma.shape[1:]), dtype=np.float32))
+    individual = lote[:1]
+
+    resultados = {}
+    for nombre, model in (('original', original), ('optimizado', optimizado)):
+        funcion = tf.function(lambda x, model=model: model(x, training=False)).get_concrete_function(firma)
+        funcion(lote)  # Calentamiento
+        latencia = medir(lambda: funcion(individual).numpy(), args.repeticiones)
+        segundos_lote = medir(lambda: funcion(lote).numpy(), args.repeticiones)
+        resultados[nombre] = {
+            'capas': len(model.layers),
+            'latencia_ms': round(1000 * latencia, 2),
+            'imagenes_por_segundo': round(args.lote / segundos_lote, 2),
+            'activaciones_mb_por_imagen': round(bytes_activaciones(model) / 2 ** 20, 1),
+        }
+
+    print(f"\n🧮 Net5Blocks: grafo original frente a optimizado (lote={args.lote})")
+    print(f"   - Cambios: {cambios}")
+    print(f"   - Paridad en {len(verificacion)} imágenes de prueba: diferencia máxima "
+          f"{paridad['diferencia_maxima']:.2e}, misma clase={paridad['misma_clase']}")
+    print(f"{'grafo':>11} {'capas':>6} {'ms (1)':>9} {'img/s':>8} {'MB act/img':>11}")
+    for nombre, r in resultados.items():
+        print(f"{nombre:>11} {r['capas']:>6} {r['latencia_ms']:>9.2f} {r['imagenes_por_segundo']:>8.2f} "
+              f"{r['activaciones_mb_por_imagen']:>11.1f}")
+    return {'benchmark': 'grafo', 'lote': args.lote, 'cambios': cambios,
+            'paridad': paridad, 'resultados': resultados}
+
+
+def bench_precision(args):
+    """Net5Blocks optimizado en float32 frente a bfloat16/float16: latencia, img/s, memoria y paridad"""
+    import tensorflow as tf
+    from src.modulos.model_optimizer import construir_net5blocks, optimizar_modelo
+    from src.modulos.batch_planner import memoria_por_muestra
+    from src.modulos.grad_cam import grad_cam_batch
+    from src.modulos.precision import (convertir_precision, reporte_paridad, dtype_entrada,
+                                       soporta)
+
+    base, _ = optimizar_modelo(construir_net5blocks())
+    verificacion, _ = preprocess_batch(cargar_imagenes_prueba())
+    cams_base, _ = grad_cam_batch(base, verificacion)
+    rng = np.random.default_rng(0)
+    lote = rng.random((args.lote,) + tuple(base.inputs[0].shape[1:]), dtype=np.float32)
+
+    resultados = {}
+    for precision in args.precisiones.split(','):
+        model = base if precision == 'float32' else convertir_precision(base, precision)
+        tipo = dtype_entrada(model)
+        firma = tf.TensorSpec((None,) + tuple(model.inputs[0].shape[1:]), tf.as_dtype(tipo))
+        funcion = tf.function(lambda x, model=model: model(x, training=False)).get_concrete_function(firma)
+        entrada = tf.constant(lote.astype(tipo))
+        funcion(entrada)  # Calentamiento
+        latencia = medir(lambda: funcion(entrada[:1]).numpy(), args.repeticiones)
+        segundos_lote = medir(lambda: funcion(entrada).numpy(), args.repeticiones)
+        cams, _ = grad_cam_batch(model, verificacion.astype(tipo))
+        resultados[precision] = {
+            'hardware': soporta(precision),
+            'latencia_ms': round(1000 * latencia, 2),
+            'imagenes_por_segundo': round(args.lote / segundos_lote, 2),
+            'entrada_mb_por_imagen': round(lote[0].size * tipo.itemsize / 2 ** 20, 2),
+            'memoria_mb_por_imagen': round(memoria_por_muestra(model) / 2 ** 20, 1),
+            'paridad': reporte_paridad(base, model, verificacion),
+            'cam_diferencia_media': round(float(np.abs(cams.astype(int) - cams_base).mean()), 2),
+        }
+
+    print(f"\n🎚️  Net5Blocks optimizado por precisión (lote={args.lote}, "
+          f"{len(verificacion)} imágenes de paridad)")
+    print(f"{'precisión':>10} {'hw':>3} {'ms (1)':>9} {'img/s':>8} {'MB ent':>7} {'MB pico':>8} "
+          f"{'concord.':>9} {'Δp máx':>9} {'Δcam':>6}")
+    for nombre, r in resultados.items():
+        print(f"{nombre:>10} {'sí' if r['hardware'] else 'no':>3} {r['latencia_ms']:>9.2f} "
+              f"{r['imagenes_por_segundo']:>8.2f} {r['entrada_mb_por_imagen']:>7.2f} "
+              f"{r['memoria_mb_por_imagen']:>8.1f} {r['paridad']['concordancia']:>9.0%} "
+              f"{r['paridad']['delta_maximo']:>9.2e} {r['cam_diferencia_media']:>6.2f}")
+    return {'benchmark': 'precision', 'lote': args.lote, 'resultados': resultados}
+
+
+def bench_cascada(args):
+    """Cascada (modelo rápido destilado + Net5Blocks) frente a Net5Blocks solo"""
+    from src.modulos.model_optimizer import construir_net5blocks, optimizar_modelo
+    from src.modulos.cascade import (construir_modelo_rapido, destilar, Cascada, evaluar_cascada,
+                                     imprimir_reporte_cascada)
+
+    completo, _ = optimizar_modelo(construir_net5blocks())
+    batch, _ = preprocess_batch(cargar_imagenes_prueba(args.imagenes))
+    lotes = [batch[i:i + args.lote] for i in range(0, len(batch), args.lote)]
+    rapido = construir_modelo_rapido()
+    destilar(rapido, lambda: iter(lotes), maestro=completo, epocas=args.epocas)
+
+    resultados = []
+    for umbral in (float(u) for u in args.umbrales.split(',')):
+        reporte = evaluar_cascada(lotes, Cascada(rapido, completo, umbral=umbral))
+        imprimir_reporte_cascada(reporte)
+        resultados.append(reporte)
+    return {'benchmark': 'cascada', 'imagenes': len(batch), 'resultados': resultados}
+
+
+def bench_workers(args):
+    """Memoria por worker con los pesos de Net5Blocks compartidos (mmap) frente a copiados"""
+    from src.modulos.model_optimizer import construir_net5blocks, optimizar_modelo
+    from src.modulos.job_queue import ColaTrabajos
+    from src.modulos.worker_launcher import LanzadorWorkers, imprimir_memoria
+
+    model, _ = optimizar_modelo(construir_net5blocks())
+    origenes = rutas_imagenes_prueba()
+    resultados = {}
+    with tempfile.TemporaryDirectory() as directorio:
+        # Copias con nombres distintos: la cola no admite rutas repetidas
+        rutas = [os.path.join(directorio, f"{i:04d}_{os.path.basename(origenes[i % len(origenes)])}")
+                 for i in range(args.imagenes)]
+        for i, ruta in enumerate(rutas):
+            shutil.copyfile(origenes[i % len(origenes)], ruta)
+        for modo, compartir in (('copiados', False), ('compartidos', True)):
+            ruta_db = os.path.join(directorio, f'{modo}.sqlite')
+            cola = ColaTrabajos(ruta_db)
+            cola.agregar(rutas)
+            cola.close()
+            reporte = LanzadorWorkers(procesos=args.procesos, model=model,
+                                      compartir=compartir).ejecutar_trabajo(ruta_db, tamano_lote=args.lote)
+            imprimir_memoria(reporte)
+            resultados[modo] = reporte
+
+    print("\n🧠 PSS medio por worker al quedar listo:")
+    for modo, r in resultados.items():
+        pss = [w['listo']['pss_mb'] for w in r['workers']]
+        print(f"   - {modo}: {sum(pss) / len(pss):.1f} MB (pesos {r['pesos_mb']} MB)")
+    return {'benchmark': 'workers', 'procesos': args.procesos, 'resultados': resultados}
+
+
+def bench_salida(args):
+    """Escritura de heatmaps: cv2.imwrite en línea frente a la salida asíncrona por formato"""
+    import cv2
+    from src.modulos.overlay import RenderizadorOverlay
+    from src.modulos.output_sink import SalidaAsincrona
+
+    imagenes = cargar_imagenes_prueba(args.imagenes)
+    cams = np.random.default_rng(0).integers(0, 255, (len(imagenes), 31, 31), dtype=np.uint8)
+    overlays = RenderizadorOverlay((512, 512)).render_batch(cams, imagenes)
+    resultados = {}
+    with tempfile.TemporaryDirectory() as directorio:
+        inicio = time.perf_counter()
+        for i, overlay in enumerate(overlays):
+            cv2.imwrite(os.path.join(directorio, f'{i}.png'), cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR))
+        segundos = time.perf_counter() - inicio
+        resultados['en_linea_png'] = {'bloqueo_ms_por_imagen': round(1000 * segundos / len(overlays), 2),
+                                      'total_s': round(segundos, 3)}
+
+        for formato in ('png', 'webp', 'jpg', 'npz'):
+            salida = SalidaAsincrona(os.path.join(directorio, formato), formato=formato,
+                                     workers=args.workers)
+            inicio = time.perf_counter()
+            for i, (overlay, cam) in enumerate(zip(overlays, cams)):
+                salida.escribir_heatmap(str(i), overlay=overlay, cam=cam)
+            # Lo que espera el hilo de inferencia (solo la contrapresión)
+            bloqueo = time.perf_counter() - inicio
+            salida.cerrar()
+            total = time.perf_counter() - inicio
+            resultados[f'asincrona_{formato}'] = dict(
+                salida.estadisticas(), bloqueo_ms_por_imagen=round(1000 * bloqueo / len(overlays), 2),
+                total_s=round(total, 3))
+
+    print(f"\n💾 Escritura de {len(overlays)} heatmaps 512x512 ({args.workers} hilos de salida)")
+    print(f"{'camino':>16} {'bloqueo ms/img':>15} {'total s':>8} {'KB/img':>8} {'codif. ms':>10}")
+    for nombre, r in resultados.items():
+        kb = f"{r['bytes_por_imagen'] / 1024:.0f}" if 'bytes_por_imagen' in r else '-'
+        codificacion = f"{r['codificacion_ms']:.1f}" if 'codificacion_ms' in r else '-'
+        print(f"{nombre:>16} {r['bloqueo_ms_por_imagen']:>15.2f} {r['total_s']:>8.3f} {kb:>8} {codificacion:>10}")
+    return {'benchmark': 'salida', 'imagenes': len(overlays), 'resultados': resultados}
+
+
+def main(argv=None):
+    """Punto de entrada de la línea de comandos"""
+    parser = argparse.ArgumentParser(description="Benchmarks del detector de neumonía")
+    parser.add_argument('--json', help="Guardar los resultados en este archivo JSON")
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--perfil', default=None,
+                        help="Perfil de ejecución: latency, throughput, shared-node o autotune")
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+
+    p = sub.add_parser('preprocesamiento', help=bench_preprocesamiento.__doc__)
+    p.add_argument('--imagenes', type=int, default=64)
+    p.add_argument('--max-workers', type=int, default=None)
+    p.set_defaults(funcion=bench_preprocesamiento)
+
+    p = sub.add_parser('cache', help=bench_cache.__doc__)
+    p.add_argument('--directorio', default=None)
+    p.add_argument('--dtype', choices=['uint8', 'float16'], default='uint8')
+    p.set_defaults(funcion=bench_cache)
+
+    p = sub.add_parser('explicadores', help=bench_explicadores.__doc__)
+    p.add_argument('--presupuesto', type=int, default=16,
+                   help="Pasadas forward enmascaradas de Score-CAM")
+    p.set_defaults(funcion=bench_explicadores)
+
+    p = sub.add_parser('overlay', help=bench_overlay.__doc__)
+    p.add_argument('--tamano', type=int, default=512, help="Lado de la imagen de salida")
+    p.add_argument('--imagenes', type=int, default=32)
+    p.set_defaults(funcion=bench_overlay)
+
+    p = sub.add_parser('dicom', help=bench_dicom.__doc__)
+    p.add_argument('--cuadros', type=int, default=32)
+    p.add_argument('--tamano', type=int, default=1024, help="Lado de cada cuadro en píxeles")
+    p.set_defaults(funcion=bench_dicom)
+
+    p = sub.add_parser('grafo', help=bench_grafo.__doc__)
+    p.add_argument('--lote', type=int, default=8)
+    p.set_defaults(funcion=bench_grafo)
+
+    p = sub.add_parser('precision', help=bench_precision.__doc__)
+    p.add_argument('--lote', type=int, default=8)
+    p.add_argument('--precisiones', default='float32,bfloat16',
+                   help="Lista separada por comas (float32, bfloat16, float16)")
+    p.set_defaults(funcion=bench_precision)
+
+    p = sub.add_parser('cascada', help=bench_cascada.__doc__)
+    p.add_argument('--imagenes', type=int, default=48)
+    p.add_argument('--lote', type=int, default=8)
+    p.add_argument('--epocas', type=int, default=10)
+    p.add_argument('--umbrales', default='0.5,0.7,0.9', help="Umbrales separados por comas")
+    p.set_defaults(funcion=bench_cascada)
+
+    p = sub.add_parser('workers', help=bench_workers.__doc__)
+    p.add_argument('--procesos', type=int, default=2)
+    p.add_argument('--imagenes', type=int, default=12)
+    p.add_argument('--lote', type=int, default=4)
+    p.set_defaults(funcion=bench_workers)
+
+    p = sub.add_parser('salida', help=bench_salida.__doc__)
+    p.add_argument('--imagenes', type=int, default=64)
+    p.add_argument('--workers', type=int, default=2, help="Hilos de la salida asíncrona")
+    p.set_defaults(funcion=bench_salida)
+
+    args = parser.parse_args(argv)
+    # El perfil se aplica antes de que cualquier benchmark importe TensorFlow
+    perfil = aplicar_perfil(args.perfil)
+    print(f"⚙️  {describir_perfil(perfil)}")
+    resultado = args.funcion(args)
+    resultado['perfil'] = perfil
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        print(f"💾 Resultados guardados en: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
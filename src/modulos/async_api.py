@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+API de predicción para servicios asyncio.
+
+``integrator.predict`` bloquea: llamada desde una corrutina detiene el bucle
+de eventos durante toda la inferencia. Aquí la lectura del archivo y el
+preprocesamiento se hacen en un ejecutor de hilos y la inferencia en otro,
+con tantos hilos como sesiones tiene el pool (ver inference_session), así
+que el bucle solo coordina.
+
+Las peticiones que llegan a la vez se agrupan: cada tensor preprocesado
+espera como mucho ``espera_max`` segundos a que se le unan otros hasta
+``tamano_lote`` y el grupo se ejecuta en un solo predict_batch. Cada lote
+toma el pool una vez, así que todos sus resultados llevan la misma versión
+del modelo aunque se sustituya en medio (ver model_manager).
+
+Un límite de turnos acota las peticiones en vuelo (lectura, preprocesamiento y
+espera de su lote); las que lo superan esperan turno. El timeout cubre esa
+espera. Una petición cancelada o vencida antes de que salga su lote se
+retira de él; si el lote ya está en el modelo, termina y su resultado se
+descarta.
+
+No depende de ningún framework web: basta un bucle de asyncio.
+
+Uso:
+    resultado = await predict_async('radiografia.dcm', timeout=5)
+    resultados = await predict_many_async(rutas)
+"""
+
+import asyncio
+import os
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    from .read_img import read_image_file
+    from .preprocess_img import get_preprocessor
+    from .inference_session import get_pool, configuracion_pool
+    from .load_model import version_modelo
+    from .integrator import (ResultadoPrediccion, predict_batch, validar_entrada,
+                             obtener_etiqueta_diagnostico)
+except ImportError:
+    from src.modulos.read_img import read_image_file
+    from src.modulos.preprocess_img import get_preprocessor
+    from src.modulos.inference_session import get_pool, configuracion_pool
+    from src.modulos.load_model import version_modelo
+    from src.modulos.integrator import (ResultadoPrediccion, predict_batch, validar_entrada,
+                                        obtener_etiqueta_diagnostico)
+
+TAMANO_LOTE = 8
+ESPERA_MAX = 0.005
+MAX_EN_VUELO = 64
+
+
+class AgrupadorAsync:
+    """
+    Atiende predicciones desde corrutinas agrupándolas en lotes compartidos.
+
+    Pertenece al bucle de eventos en el que se usa por primera vez (los
+    futuros son de ese bucle); get_agrupador da uno por bucle. Sin peticiones
+    en curso no guarda ninguna referencia al bucle, así que el de
+    get_agrupador se libera (con sus hilos) junto con su bucle. Uno creado a
+    mano se cierra con cerrar().
+    """
+
+    def __init__(self, tamano_lote=None, espera_max=None, max_en_vuelo=None,
+                 workers_preproceso=None, workers_inferencia=None, model=None):
+        """
+        Args:
+            tamano_lote (int): Peticiones por lote como máximo
+                (por defecto NEUMONIA_ASYNC_LOTE o 8)
+            espera_max (float): Segundos que una petición espera a que se
+                complete su lote (por defecto NEUMONIA_ASYNC_ESPERA_MS o 5 ms)
+            max_en_vuelo (int): Peticiones admitidas a la vez
+                (por defecto NEUMONIA_ASYNC_EN_VUELO o 64)
+            workers_preproceso (int): Hilos de lectura y preprocesamiento
+                (por defecto uno por CPU)
+            workers_inferencia (int): Hilos de inferencia (por defecto uno
+                por sesión del pool)
+            model (tf.keras.Model): Modelo a usar en lugar del pool compartido
+        """
+        self.tamano_lote = max(1, int(tamano_lote or os.environ.get('NEUMONIA_ASYNC_LOTE', TAMANO_LOTE)))
+        if espera_max is None:
+            espera_ms = os.environ.get('NEUMONIA_ASYNC_ESPERA_MS')
+            espera_max = float(espera_ms) / 1000 if espera_ms else ESPERA_MAX
+        self.espera_max = espera_max
+        self.max_en_vuelo = max(1, int(max_en_vuelo or os.environ.get('NEUMONIA_ASYNC_EN_VUELO', MAX_EN_VUELO)))
+        self.model = model
+
+        workers_inferencia = workers_inferencia or configuracion_pool()['sesiones']
+        self._preproceso = ThreadPoolExecutor(workers_preproceso or os.cpu_count() or 1,
+                                              thread_name_prefix='async-preproceso')
+        self._inferencia = ThreadPoolExecutor(max(1, int(workers_inferencia)),
+                                              thread_name_prefix='async-inferencia')
+        # Turnos propios en lugar de asyncio.Semaphore, que guarda su bucle
+        # para siempre en cuanto hay contención
+        self._en_vuelo = 0
+        self._esperando = deque()
+        self._pendientes = []
+        self._temporizador = None
+        self._lotes_en_curso = set()
+
+        self.peticiones = 0
+        self.lotes = 0
+        self.agrupadas = 0
+        self.canceladas = 0
+        self.vencidas = 0
+
+    # ------------------------------------------------------------------
+    # Trabajo en los ejecutores
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _preparar(entrada):
+        """Lee (si es una ruta) y preprocesa; corre en el ejecutor de preprocesamiento"""
+        array = entrada
+        if isinstance(entrada, (str, os.PathLike)):
+            array, _ = read_image_file(os.fspath(entrada))
+        if not validar_entrada(array):
+            return None, None
+        try:
+            return array, get_preprocessor().preprocess(array)
+        except Exception as e:
+            print(f"❌ Error preprocesando la imagen: {e}")
+            return array, None
+
+    def _inferir(self, lote):
+        """Ejecuta un lote con el pool tomado una sola vez; corre en el ejecutor de inferencia"""
+        if self.model is not None:
+            return predict_batch(lote, model=self.model), self.model, version_modelo(self.model)
+        pool = get_pool()
+        return predict_batch(lote, pool=pool), pool.model, pool.version
+
+    # ------------------------------------------------------------------
+    # Turnos
+    # ------------------------------------------------------------------
+    async def _admitir(self):
+        """Espera un turno libre (como mucho max_en_vuelo peticiones a la vez)"""
+        if self._en_vuelo < self.max_en_vuelo and not self._esperando:
+            self._en_vuelo += 1
+            return
+        futuro = asyncio.get_running_loop().create_future()
+        self._esperando.append(futuro)
+        try:
+            await futuro
+        except asyncio.CancelledError:
+            if futuro.cancelled():
+                if futuro in self._esperando:
+                    self._esperando.remove(futuro)
+            else:
+                # Recibió el turno justo antes de cancelarse: se pasa al siguiente
+                self._liberar()
+            raise
+
+    def _liberar(self):
+        """Devuelve un turno, cediéndolo a la primera petición que espera"""
+        while self._esperando:
+            futuro = self._esperando.popleft()
+            if not futuro.done():
+                futuro.set_result(None)
+                return
+        self._en_vuelo -= 1
+
+    # ------------------------------------------------------------------
+    # Agrupación
+    # ------------------------------------------------------------------
+    def _encolar(self, tensor):
+        futuro = asyncio.get_running_loop().create_future()
+        self._pendientes.append((tensor, futuro))
+        if len(self._pendientes) >= self.tamano_lote:
+            self._despachar()
+        elif self._temporizador is None:
+            self._temporizador = asyncio.get_running_loop().call_later(self.espera_max, self._despachar)
+        return futuro
+
+    def _retirar(self, futuro):
+        """Quita del lote pendiente una petición cancelada o vencida"""
+        self._pendientes = [(t, f) for t, f in self._pendientes if f is not futuro]
+        if not self._pendientes and self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+
+    def _despachar(self):
+        """Saca las peticiones pendientes y lanza su lote"""
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        pendientes, self._pendientes = self._pendientes, []
+        vivas = [(tensor, futuro) for tensor, futuro in pendientes if not futuro.done()]
+        if not vivas:
+            return
+        tarea = asyncio.ensure_future(self._ejecutar_lote(vivas))
+        self._lotes_en_curso.add(tarea)
+        tarea.add_done_callback(self._lotes_en_curso.discard)
+
+    async def _ejecutar_lote(self, vivas):
+        lote = np.concatenate([tensor for tensor, _ in vivas])
+        self.lotes += 1
+        self.agrupadas += len(vivas)
+        try:
+            predicciones, model, version = await asyncio.get_running_loop().run_in_executor(
+                self._inferencia, self._inferir, lote)
+        except Exception as e:
+            print(f"❌ Error en el lote asíncrono: {e}")
+            predicciones, model, version = None, None, None
+
+        for i, (tensor, futuro) in enumerate(vivas):
+            if futuro.done():
+                continue
+            if predicciones is None:
+                futuro.set_result(None)
+            else:
+                futuro.set_result((predicciones[i], model, version))
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+    async def _predecir(self, entrada, calcular_heatmap):
+        bucle = asyncio.get_running_loop()
+        await self._admitir()
+        try:
+            array, tensor = await bucle.run_in_executor(self._preproceso, self._preparar, entrada)
+            if tensor is None:
+                return ResultadoPrediccion.error()
+
+            futuro = self._encolar(tensor)
+            try:
+                salida = await futuro
+            except asyncio.CancelledError:
+                self._retirar(futuro)
+                raise
+            if salida is None:
+                return ResultadoPrediccion.error()
+            probabilidades, model, version = salida
+            indice = int(np.argmax(probabilidades))
+            probabilidad = float(np.max(probabilidades)) * 100
+            if np.isnan(probabilidad) or probabilidad < 0 or probabilidad > 100:
+                probabilidad = 50.0
+            resultado = ResultadoPrediccion(
+                obtener_etiqueta_diagnostico(indice), probabilidad, array=array, tensor=tensor,
+                model=model, indice=indice, probabilidades=probabilidades, version_modelo=version)
+            if calcular_heatmap:
+                # Grad-CAM necesita otra pasada con gradientes: también fuera del bucle
+                await bucle.run_in_executor(self._inferencia, lambda: resultado.cam)
+            return resultado
+        finally:
+            self._liberar()
+
+    async def predict(self, entrada, timeout=None, calcular_heatmap=False):
+        """
+        Predice una imagen sin bloquear el bucle de eventos.
+
+        Args:
+            entrada (numpy.ndarray o str): Imagen ya leída o ruta de un
+                archivo (DICOM, JPG/PNG o 'archivo.zip::miembro')
+            timeout (float): Segundos máximos en total, incluida la espera
+                por un turno y por el lote (None = sin límite)
+            calcular_heatmap (bool): Calcular también el Grad-CAM
+
+        Returns:
+            ResultadoPrediccion: Como integrator.predict (ResultadoPrediccion.error()
+                si la imagen no se pudo leer o el modelo falló)
+
+        Raises:
+            asyncio.TimeoutError: Si vence el timeout
+            asyncio.CancelledError: Si se cancela la corrutina
+        """
+        self.peticiones += 1
+        try:
+            return await asyncio.wait_for(self._predecir(entrada, calcular_heatmap), timeout)
+        except asyncio.TimeoutError:
+            self.vencidas += 1
+            raise
+        except asyncio.CancelledError:
+            self.canceladas += 1
+            raise
+
+    async def predict_many(self, entradas, timeout=None, calcular_heatmap=False,
+                           return_exceptions=False):
+        """
+        Predice varias imágenes a la vez; se agrupan en lotes compartidos.
+
+        Args:
+            entradas (iterable): Imágenes o rutas
+            timeout (float): Límite de cada predicción
+            calcular_heatmap (bool): Calcular también el Grad-CAM
+            return_exceptions (bool): Devolver los timeouts como elementos
+                de la lista en lugar de propagar el primero
+
+        Returns:
+            list: ResultadoPrediccion en el mismo orden que ``entradas``
+        """
+        return await asyncio.gather(
+            *(self.predict(entrada, timeout, calcular_heatmap) for entrada in entradas),
+            return_exceptions=return_exceptions)
+
+    def estadisticas(self):
+        """Contadores de peticiones y del agrupamiento en lotes"""
+        return {
+            'peticiones': self.peticiones,
+            'lotes': self.lotes,
+            'tamano_medio_lote': round(self.agrupadas / self.lotes, 2) if self.lotes else 0.0,
+            'canceladas': self.canceladas,
+            'vencidas': self.vencidas,
+            'pendientes': len(self._pendientes),
+            'en_vuelo': self._en_vuelo,
+        }
+
+    def cerrar(self, esperar=True):
+        """
+        Libera los hilos de los ejecutores.
+
+        Los agrupadores de get_agrupador se liberan solos con su bucle; uno
+        creado a mano debe cerrarse al terminar (el agrupador ya no admite
+        peticiones después).
+
+        Args:
+            esperar (bool): Esperar a que terminen los trabajos en curso
+        """
+        self._preproceso.shutdown(wait=esperar)
+        self._inferencia.shutdown(wait=esperar)
+
+
+# Un agrupador por bucle de eventos (los futuros son del bucle). La entrada
+# desaparece cuando el bucle se libera (p. ej. al terminar asyncio.run)
+_agrupadores = weakref.WeakKeyDictionary()
+
+
+def get_agrupador(**kwargs):
+    """
+    Devuelve el agrupador del bucle de eventos en curso, creándolo la primera vez.
+
+    Los argumentos (ver AgrupadorAsync) solo se usan al crearlo.
+
+    Returns:
+        AgrupadorAsync: Agrupador del bucle
+    """
+    bucle = asyncio.get_running_loop()
+    agrupador = _agrupadores.get(bucle)
+    if agrupador is None:
+        agrupador = _agrupadores[bucle] = AgrupadorAsync(**kwargs)
+    return agrupador
+
+
+async def predict_async(entrada, timeout=None, calcular_heatmap=False):
+    """
+    Versión asíncrona de integrator.predict con el agrupador del bucle.
+
+    Args:
+        entrada (numpy.ndarray o str): Imagen ya leída o ruta de un archivo
+        timeout (float): Segundos máximos en total (None = sin límite)
+        calcular_heatmap (bool): Calcular también el Grad-CAM
+
+    Returns:
+        ResultadoPrediccion: Diagnóstico, probabilidad y mapa de calor bajo demanda
+
+    Raises:
+        asyncio.TimeoutError: Si vence el timeout
+    """
+    return await get_agrupador().predict(entrada, timeout, calcular_heatmap)
+
+
+async def predict_many_async(entradas, timeout=None, calcular_heatmap=False,
+                             return_exceptions=False):
+    """
+    Predice varias imágenes con el agrupador del bucle.
+
+    Args:
+        entradas (iterable): Imágenes o rutas
+        timeout (float): Límite de cada predicción
+        calcular_heatmap (bool): Calcular también el Grad-CAM
+        return_exceptions (bool): Devolver los timeouts en la lista
+
+    Returns:
+        list: ResultadoPrediccion en el mismo orden que ``entradas``
+    """
+    return await get_agrupador().predict_many(entradas, timeout, calcular_heatmap,
+                                              return_exceptions)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Planificación del tamaño de lote según la memoria de activaciones.
+
+Las primeras capas de Net5Blocks producen mapas (512, 512, 16) float32 y,
+por las ramas de atajo, varios están vivos a la vez: un lote grande puede
+agotar la memoria de una estación de trabajo y un lote de 1 desaprovecha
+el rendimiento. El planificador recorre las capas del modelo en orden,
+calcula cuándo deja de usarse la salida de cada una y obtiene la memoria
+pico por imagen. Con eso elige el lote más grande que cabe en el
+presupuesto (``NEUMONIA_MEMORIA_LOTE_MB`` o la mitad de la memoria disponible).
+
+Si aun así falla una reserva de memoria, el lote se parte por la mitad y
+se reintenta; el tamaño reducido se mantiene para las llamadas siguientes.
+"""
+
+import os
+import threading
+import weakref
+
+import numpy as np
+import tensorflow as tf
+
+try:
+    from .model_optimizer import entradas_capa
+    from .inference_session import get_pool
+except ImportError:
+    from src.modulos.model_optimizer import entradas_capa
+    from src.modulos.inference_session import get_pool
+
+ERRORES_MEMORIA = (MemoryError, tf.errors.ResourceExhaustedError)
+PRESUPUESTO_POR_DEFECTO_MB = 2048
+# Memoria de trabajo de las convoluciones y del runtime sobre las activaciones
+MARGEN = 1.5
+LOTE_MAXIMO = 256
+MODOS = ('inferencia', 'gradientes')
+
+
+def _bytes_salida(tensor):
+    """Bytes por imagen de un tensor simbólico (sin la dimensión del lote)"""
+    tamano = np.dtype(getattr(tensor.dtype, 'name', tensor.dtype) or 'float32').itemsize
+    return int(np.prod([d or 1 for d in tensor.shape[1:]])) * tamano
+
+
+def memoria_por_muestra(model, modo='inferencia'):
+    """
+    Estima la memoria pico de activaciones de una imagen.
+
+    En inferencia, la salida de cada capa vive desde que se calcula hasta
+    que la usa su último consumidor; el pico es la mayor suma de salidas
+    vivas a la vez. Con gradientes (Grad-CAM) todas las activaciones se
+    conservan para la pasada hacia atrás, que además necesita el pico de
+    inferencia como espacio temporal.
+
+    Args:
+        model (tf.keras.Model): Modelo cargado
+        modo (str): 'inferencia' o 'gradientes'
+
+    Returns:
+        int: Bytes por imagen (0 si el modelo no expone sus capas)
+    """
+    if modo not in MODOS:
+        raise ValueError(f"Modo desconocido: {modo} (opciones: {MODOS})")
+    try:
+        capas = [c for c in model.layers if not isinstance(c, tf.keras.layers.InputLayer)]
+        tamanos = {c.name: _bytes_salida(c.output) for c in capas}
+        entradas = {c.name: entradas_capa(c) for c in capas}
+        tamano_entrada = _bytes_salida(model.inputs[0])
+        salidas = {t._keras_history.operation.name for t in model.outputs}
+    except Exception:
+        return 0
+
+    orden = {c.name: i for i, c in enumerate(capas)}
+    ultimo_uso = {}
+    for i, capa in enumerate(capas):
+        for nombre in entradas[capa.name]:
+            ultimo_uso[nombre] = i
+    for nombre in salidas:
+        ultimo_uso[nombre] = len(capas)
+
+    if modo == 'gradientes':
+        conservadas = tamano_entrada + sum(tamanos.values())
+    else:
+        conservadas = 0
+
+    pico = 0
+    vivas = {}
+    for i, capa in enumerate(capas):
+        # Las entradas que no son capas (InputLayer) viven hasta su último uso
+        for nombre in entradas[capa.name]:
+            if nombre not in orden and nombre not in vivas:
+                vivas[nombre] = tamano_entrada
+        vivas[capa.name] = tamanos[capa.name]
+        pico = max(pico, sum(vivas.values()))
+        for nombre in [n for n in vivas if ultimo_uso.get(n, i) <= i]:
+            del vivas[nombre]
+    return conservadas + pico
+
+
+def memoria_disponible(ruta_meminfo='/proc/meminfo'):
+    """
+    Memoria física que se puede usar sin llevar el sistema a swap, en bytes.
+
+    En Linux es MemAvailable, que incluye la caché de páginas recuperable:
+    la memoria "libre" (SC_AVPHYS_PAGES) la excluye y en un equipo que lleva
+    tiempo encendido es una fracción de lo realmente utilizable. Sin
+    /proc/meminfo (otros sistemas) se usa la memoria libre.
+
+    Returns:
+        int: Bytes disponibles, o None si no se puede consultar
+    """
+    try:
+        with open(ruta_meminfo, encoding='ascii') as f:
+            for linea in f:
+                if linea.startswith('MemAvailable:'):
+                    return int(linea.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def presupuesto_por_defecto():
+    """
+    Memoria disponible para los lotes en bytes.
+
+    Returns:
+        int: NEUMONIA_MEMORIA_LOTE_MB si está definida; si no, la mitad de la
+            memoria disponible (o 2 GB si no se puede consultar)
+    """
+    if os.environ.get('NEUMONIA_MEMORIA_LOTE_MB'):
+        return int(float(os.environ['NEUMONIA_MEMORIA_LOTE_MB']) * 2 ** 20)
+    disponible = memoria_disponible()
+    if disponible is None:
+        return PRESUPUESTO_POR_DEFECTO_MB * 2 ** 20
+    return int(disponible // 2)
+
+
+class PlanificadorLotes:
+    """
+    Elige el tamaño de lote para un modelo y ejecuta lotes grandes en partes.
+
+    Uso:
+        planificador = PlanificadorLotes(model, presupuesto_mb=1024)
+        probabilidades = planificador.ejecutar(batch, model.predict_on_batch)
+    """
+
+    def __init__(self, model, presupuesto_mb=None, modo='inferencia', maximo=LOTE_MAXIMO,
+                 margen=MARGEN):
+        """
+        Args:
+            model (tf.keras.Model): Modelo cargado
+            presupuesto_mb (float): Memoria para los lotes (por defecto presupuesto_por_defecto())
+            modo (str): 'inferencia' o 'gradientes' (Grad-CAM)
+            maximo (int): Tope del tamaño de lote
+            margen (float): Factor sobre la memoria estimada por imagen
+        """
+        self.modo = modo
+        self.presupuesto = (int(presupuesto_mb * 2 ** 20) if presupuesto_mb is not None
+                            else presupuesto_por_defecto())
+        self.por_muestra = memoria_por_muestra(model, modo)
+        try:
+            self.pesos = int(model.count_params()) * 4
+        except Exception:
+            self.pesos = 0
+        self.maximo = max(1, int(maximo))
+        self.margen = margen
+        self.tamano_lote = self.planificar()
+        self.reducciones = 0
+        self._lock = threading.Lock()
+
+    def planificar(self):
+        """
+        Tamaño de lote que cabe en el presupuesto.
+
+        Returns:
+            int: Entre 1 y ``maximo``
+        """
+        if not self.por_muestra:
+            return self.maximo
+        disponible = self.presupuesto - self.pesos
+        return int(min(self.maximo, max(1, disponible // (self.por_muestra * self.margen))))
+
+    def ejecutar(self, batch, funcion, unir=np.concatenate):
+        """
+        Aplica ``funcion`` al batch en partes del tamaño planificado.
+
+        Si una parte falla por falta de memoria se parte por la mitad y se
+        reintenta; el tamaño reducido queda para las llamadas siguientes.
+
+        Args:
+            batch (numpy.ndarray): Tensor (N, 512, 512, 1)
+            funcion (callable): Recibe un sub-lote y devuelve su resultado
+            unir (callable): Une la lista de resultados parciales
+
+        Returns:
+            Resultado unido, o None si alguna parte devolvió None
+
+        Raises:
+            MemoryError, ResourceExhaustedError: Si ni un lote de 1 cabe
+        """
+        partes = []
+        inicio = 0
+        while inicio < len(batch):
+            tamano = min(self.tamano_lote, len(batch) - inicio)
+            try:
+                resultado = funcion(batch[inicio:inicio + tamano])
+            except ERRORES_MEMORIA:
+                if tamano == 1:
+                    raise
+                with self._lock:
+                    self.tamano_lote = min(self.tamano_lote, max(1, tamano // 2))
+                    self.reducciones += 1
+                print(f"⚠️  Memoria insuficiente con lotes de {tamano}: "
+                      f"se reintenta con {self.tamano_lote}")
+                continue
+            if resultado is None:
+                return None
+            partes.append(resultado)
+            inicio += tamano
+        if len(partes) == 1:
+            return partes[0]
+        return unir(partes)
+
+    def describir(self):
+        """Resumen del plan en una línea"""
+        return (f"lote={self.tamano_lote} ({self.modo}, {self.por_muestra / 2 ** 20:.0f} MB/imagen, "
+                f"presupuesto {self.presupuesto / 2 ** 20:.0f} MB)")
+
+
+def unir_tuplas(partes):
+    """Une resultados parciales que son tuplas de arrays (p. ej. cams y probabilidades)"""
+    return tuple(np.concatenate(p) for p in zip(*partes))
+
+
+# Planificadores por modelo y modo: modelo -> {modo: planificador}. La clave
+# es débil para no mantener vivo un modelo retirado
+_planificadores = weakref.WeakKeyDictionary()
+_planificadores_lock = threading.Lock()
+
+
+def get_planificador(model, modo='inferencia'):
+    """
+    Devuelve el planificador compartido de un modelo, creándolo la primera vez.
+
+    Args:
+        model (tf.keras.Model): Modelo cargado
+        modo (str): 'inferencia' o 'gradientes'
+
+    Returns:
+        PlanificadorLotes: Planificador con el presupuesto por defecto
+    """
+    with _planificadores_lock:
+        planificador = _planificadores.get(model, {}).get(modo)
+        if planificador is not None:
+            return planificador
+        planificador = PlanificadorLotes(model, modo=modo)
+        _planificadores.setdefault(model, {})[modo] = planificador
+        print(f"📐 Planificador de lotes: {planificador.describir()}")
+        return planificador
+
+
+def olvidar_modelo(model):
+    """Descarta los planificadores de un modelo retirado (se liberan igual con el modelo)"""
+    with _planificadores_lock:
+        _planificadores.pop(model, None)
+
+
+def tamano_lote_planificado(model=None, modo='inferencia'):
+    """
+    Tamaño de lote planificado para un modelo.
+
+    Args:
+        model (tf.keras.Model): Modelo (por defecto el del pool de sesiones)
+        modo (str): 'inferencia' o 'gradientes'
+
+    Returns:
+        int: Imágenes por lote
+    """
+    return get_planificador(model or get_pool().model, modo).tamano_lote
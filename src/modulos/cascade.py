@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Cascada de cribado en dos etapas.
+
+La mayoría de los estudios de un cribado son claramente normales y aun así
+cada uno paga la pasada completa de Net5Blocks a 512x512. La cascada pone
+delante un modelo pequeño que trabaja a 128x128 (la imagen preprocesada
+reducida 4x por lado dentro del propio modelo): si su confianza en una de
+las clases de salida (por defecto solo "normal") supera el umbral, ese es
+el resultado; el resto de estudios pasa al modelo completo.
+
+El modelo rápido se destila del completo: aprende a reproducir sus
+probabilidades sobre un dataset empaquetado, sin necesitar etiquetas.
+Se guarda en models/cascada_rapido.keras (o NEUMONIA_MODELO_RAPIDO).
+
+La cascada se activa con NEUMONIA_CASCADA=1 (o ``predict(..., cascada=True)``)
+y el umbral con NEUMONIA_CASCADA_UMBRAL (0.9 por defecto).
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import layers, models
+
+try:
+    from .integrator import predict_batch, obtener_etiqueta_diagnostico
+    from .load_model import huella_archivo, registrar_version
+    from .model_optimizer import RAIZ
+except ImportError:
+    from src.modulos.integrator import predict_batch, obtener_etiqueta_diagnostico
+    from src.modulos.load_model import huella_archivo, registrar_version
+    from src.modulos.model_optimizer import RAIZ
+
+RUTA_MODELO_RAPIDO = os.path.join(RAIZ, 'models', 'cascada_rapido.keras')
+UMBRAL_POR_DEFECTO = 0.9
+# Índices de clase que la primera etapa puede resolver sola (1 = normal)
+CLASES_SALIDA = (1,)
+REDUCCION = 4
+
+
+def construir_modelo_rapido(forma=(512, 512, 1), reduccion=REDUCCION):
+    """
+    Modelo pequeño de la primera etapa, en la línea del modelo temporal de
+    load_model pero a 1/``reduccion`` de resolución por lado.
+
+    La reducción es la primera capa, así que recibe el mismo tensor
+    (N, 512, 512, 1) que el modelo completo.
+
+    Args:
+        forma (tuple): Forma de la entrada sin el lote
+        reduccion (int): Factor de reducción por lado (4 -> 128x128)
+
+    Returns:
+        tf.keras.Model: Modelo sin entrenar
+    """
+    model = models.Sequential([
+        layers.Input(shape=forma),
+        layers.AveragePooling2D(reduccion, name='reduccion'),
+        layers.Conv2D(16, (3, 3), strides=2, activation='relu', name='rapido_conv1'),
+        layers.Conv2D(32, (3, 3), activation='relu', name='rapido_conv2'),
+        layers.MaxPooling2D((2, 2)),
+        layers.Conv2D(32, (3, 3), activation='relu', name='rapido_conv3'),
+        layers.GlobalAveragePooling2D(),
+        layers.Dense(3, activation='softmax', name='rapido_salida'),
+    ], name='cascada_rapido')
+    model.compile(optimizer=tf.keras.optimizers.Adam(1e-3), loss='categorical_crossentropy')
+    return model
+
+
+def destilar(rapido, lotes, maestro=None, epocas=5):
+    """
+    Entrena el modelo rápido para reproducir las probabilidades del completo.
+
+    Las probabilidades del maestro se calculan una sola vez (primera
+    pasada) y se reutilizan en las épocas siguientes.
+
+    Args:
+        rapido (tf.keras.Model): Modelo de la primera etapa (compilado)
+        lotes (callable): Devuelve un iterable nuevo de batches (N, 512, 512, 1)
+            en cada llamada, p. ej. ``lambda: (b for b, _ in dataset.iterar_lotes(32))``
+        maestro (tf.keras.Model): Modelo completo (por defecto el del pool de sesiones)
+        epocas (int): Pasadas sobre el dataset
+
+    Returns:
+        list: Pérdida media por época
+    """
+    objetivos = []
+    historial = []
+    for epoca in range(epocas):
+        perdidas = []
+        for i, batch in enumerate(lotes()):
+            if epoca == 0:
+                probabilidades = predict_batch(batch, maestro)
+                if probabilidades is None:
+                    raise RuntimeError("Falló la inferencia del modelo completo")
+                objetivos.append(np.asarray(probabilidades, dtype=np.float32))
+            perdida = rapido.train_on_batch(np.asarray(batch, dtype=np.float32), objetivos[i])
+            perdidas.append(float(np.asarray(perdida).reshape(-1)[0]))
+        historial.append(float(np.mean(perdidas)) if perdidas else 0.0)
+        print(f"🎓 Época {epoca + 1}/{epocas}: pérdida {historial[-1]:.4f}")
+    return historial
+
+
+def guardar_modelo_rapido(rapido, ruta=None):
+    """Guarda el modelo rápido (por defecto en NEUMONIA_MODELO_RAPIDO o models/)"""
+    ruta = ruta or os.environ.get('NEUMONIA_MODELO_RAPIDO', RUTA_MODELO_RAPIDO)
+    os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+    rapido.save(ruta)
+    print(f"💾 Modelo rápido guardado en: {ruta}")
+    return ruta
+
+
+def cargar_modelo_rapido(ruta=None):
+    """
+    Carga el modelo de la primera etapa y registra su versión
+    ("archivo@huella"), con la que se etiquetan los estudios que resuelve.
+
+    Returns:
+        tf.keras.Model: Modelo rápido o None si no existe
+    """
+    ruta = ruta or os.environ.get('NEUMONIA_MODELO_RAPIDO', RUTA_MODELO_RAPIDO)
+    if not os.path.exists(ruta):
+        print(f"⚠️  No hay modelo rápido en {ruta}: cascada desactivada (ver cli destilar)")
+        return None
+    try:
+        rapido = tf.keras.models.load_model(ruta, compile=False)
+    except Exception as e:
+        print(f"❌ Error cargando el modelo rápido: {e}")
+        return None
+    return registrar_version(rapido, f"{os.path.basename(ruta)}@{huella_archivo(ruta)[:12]}")
+
+
+class Cascada:
+    """
+    Clasificación en dos etapas: modelo rápido y, si no está seguro, el completo.
+
+    Uso:
+        cascada = Cascada(cargar_modelo_rapido(), umbral=0.9)
+        probabilidades, etapa = cascada.clasificar(batch)
+    """
+
+    def __init__(self, rapido, completo=None, umbral=UMBRAL_POR_DEFECTO, clases_salida=CLASES_SALIDA):
+        """
+        Args:
+            rapido (tf.keras.Model): Modelo de la primera etapa
+            completo (tf.keras.Model): Modelo completo (por defecto el del pool de sesiones)
+            umbral (float): Confianza mínima (0-1) para quedarse con la primera etapa
+            clases_salida (tuple): Clases que la primera etapa puede resolver
+        """
+        self.rapido = rapido
+        self.completo = completo
+        self.umbral = float(umbral)
+        self.clases_salida = tuple(clases_salida)
+        self._lock = threading.Lock()
+        self.estudios = 0
+        self.resueltos = 0
+
+    def primera_etapa(self, batch):
+        """
+        Ejecuta solo el modelo rápido.
+
+        Args:
+            batch (numpy.ndarray): Tensor (N, 512, 512, 1)
+
+        Returns:
+            tuple: (probabilidades (N, 3), resueltos (N,) bool), o (None, None) si falla
+        """
+        probabilidades = predict_batch(batch, self.rapido)
+        if probabilidades is None:
+            return None, None
+        probabilidades = np.array(probabilidades, dtype=np.float32)
+        resueltos = (np.isin(probabilidades.argmax(axis=1), self.clases_salida)
+                     & (probabilidades.max(axis=1) >= self.umbral))
+        with self._lock:
+            self.estudios += len(batch)
+            self.resueltos += int(resueltos.sum())
+        return probabilidades, resueltos
+
+    def clasificar(self, batch):
+        """
+        Clasifica un lote pasando al modelo completo solo los estudios dudosos.
+
+        Args:
+            batch (numpy.ndarray): Tensor (N, 512, 512, 1)
+
+        Returns:
+            tuple: (probabilidades (N, 3), etapa (N,) con 1 = resuelto por el
+                modelo rápido y 2 = por el completo), o (None, None) si falla
+        """
+        probabilidades, resueltos = self.primera_etapa(batch)
+        if probabilidades is None:
+            return None, None
+        etapa = np.where(resueltos, 1, 2)
+
+        dudosos = np.flatnonzero(~resueltos)
+        if len(dudosos):
+            completas = predict_batch(batch[dudosos], self.completo)
+            if completas is None:
+                return None, None
+            probabilidades[dudosos] = completas
+        return probabilidades, etapa
+
+    def tasa_acierto(self):
+        """Fracción de estudios resueltos por la primera etapa"""
+        with self._lock:
+            return self.resueltos / self.estudios if self.estudios else 0.0
+
+
+def evaluar_cascada(lotes, cascada, completo=None):
+    """
+    Compara la cascada con el modelo completo solo sobre los mismos lotes.
+
+    Args:
+        lotes (iterable): Batches (N, 512, 512, 1) o tuplas (batch, etiquetas)
+        cascada (Cascada): Cascada a evaluar
+        completo (tf.keras.Model): Modelo de referencia (por defecto el de la cascada)
+
+    Returns:
+        dict: imagenes, tasa_acierto (resueltos en la primera etapa),
+            concordancia con el modelo completo, imágenes por segundo de
+            cada camino, aceleración y, si hay etiquetas, accuracy de ambos
+    """
+    completo = completo if completo is not None else cascada.completo
+    total = resueltos = iguales = 0
+    segundos_cascada = segundos_completo = 0.0
+    aciertos = {'cascada': 0, 'completo': 0}
+    con_etiquetas = False
+
+    calentado = False
+    for lote in lotes:
+        batch, etiquetas = lote if isinstance(lote, tuple) else (lote, None)
+        if not calentado:
+            # Trazar ambos modelos antes de medir, para no cargar el primer lote
+            predict_batch(batch[:1], completo)
+            predict_batch(batch[:1], cascada.rapido)
+            calentado = True
+
+        inicio = time.perf_counter()
+        referencia = predict_batch(batch, completo)
+        segundos_completo += time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        probabilidades, etapa = cascada.clasificar(batch)
+        segundos_cascada += time.perf_counter() - inicio
+
+        if referencia is None or probabilidades is None:
+            raise RuntimeError("Falló la inferencia durante la evaluación de la cascada")
+        predichas, esperadas = probabilidades.argmax(axis=1), np.asarray(referencia).argmax(axis=1)
+        total += len(batch)
+        resueltos += int((etapa == 1).sum())
+        iguales += int((predichas == esperadas).sum())
+        if etiquetas is not None:
+            con_etiquetas = True
+            aciertos['cascada'] += int((predichas == etiquetas).sum())
+            aciertos['completo'] += int((esperadas == etiquetas).sum())
+
+    reporte = {
+        'imagenes': total,
+        'umbral': cascada.umbral,
+        'clases_salida': [obtener_etiqueta_diagnostico(c) for c in cascada.clases_salida],
+        'tasa_acierto': round(resueltos / total, 4) if total else 0.0,
+        'concordancia': round(iguales / total, 4) if total else 0.0,
+        'imagenes_por_segundo_cascada': round(total / segundos_cascada, 2) if segundos_cascada else 0.0,
+        'imagenes_por_segundo_completo': round(total / segundos_completo, 2) if segundos_completo else 0.0,
+        'aceleracion': round(segundos_completo / segundos_cascada, 2) if segundos_cascada else 0.0,
+    }
+    if con_etiquetas and total:
+        reporte['accuracy_cascada'] = round(aciertos['cascada'] / total, 4)
+        reporte['accuracy_completo'] = round(aciertos['completo'] / total, 4)
+    return reporte
+
+
+def imprimir_reporte_cascada(reporte):
+    """Muestra en consola el reporte de evaluar_cascada"""
+    print(f"\n⚡ Cascada sobre {reporte['imagenes']} imágenes (umbral {reporte['umbral']:.2f}, "
+          f"salida en: {', '.join(reporte['clases_salida'])})")
+    print(f"   - Resueltas por el modelo rápido: {reporte['tasa_acierto']:.1%}")
+    print(f"   - Concordancia con el modelo completo: {reporte['concordancia']:.2%}")
+    print(f"   - Imágenes/s: cascada {reporte['imagenes_por_segundo_cascada']:.2f}, "
+          f"solo completo {reporte['imagenes_por_segundo_completo']:.2f} "
+          f"(x{reporte['aceleracion']:.2f})")
+    if 'accuracy_cascada' in reporte:
+        print(f"   - Accuracy: cascada {reporte['accuracy_cascada']:.2%}, "
+              f"solo completo {reporte['accuracy_completo']:.2%}")
+
+
+# Cascada compartida del proceso
+_cascada = None
+_cascada_cargada = False
+_cascada_lock = threading.Lock()
+
+
+def resolver_cascada(cascada=None):
+    """
+    Cascada a usar según el argumento de predict.
+
+    Args:
+        cascada (bool o Cascada): True = la compartida, False = ninguna,
+            None = según NEUMONIA_CASCADA, o una Cascada concreta
+
+    Returns:
+        Cascada: o None si la cascada no está activa o no hay modelo rápido
+    """
+    if cascada is None:
+        cascada = os.environ.get('NEUMONIA_CASCADA', '0') not in ('', '0')
+    if cascada is True:
+        return get_cascada()
+    return cascada or None
+
+
+def get_cascada():
+    """
+    Devuelve la cascada compartida, cargando el modelo rápido la primera vez.
+
+    Returns:
+        Cascada: o None si no hay modelo rápido guardado
+    """
+    global _cascada, _cascada_cargada
+    with _cascada_lock:
+        if not _cascada_cargada:
+            _cascada_cargada = True
+            rapido = cargar_modelo_rapido()
+            if rapido is not None:
+                umbral = float(os.environ.get('NEUMONIA_CASCADA_UMBRAL', UMBRAL_POR_DEFECTO))
+                _cascada = Cascada(rapido, umbral=umbral)
+                print(f"✅ Cascada lista: umbral {umbral:.2f}")
+        return _cascada
@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Interfaz de línea de comandos para trabajos sin interfaz gráfica.
+
+Uso:
+    python -m src.modulos.cli empaquetar tests/JPG/JPG data/empaquetado
+    python -m src.modulos.cli --perfil throughput evaluar data/empaquetado --lote 32
+    python -m src.modulos.cli autotune --objetivo rendimiento
+    python -m src.modulos.cli encolar data/rescoring.sqlite /pacs/export
+    python -m src.modulos.cli procesar data/rescoring.sqlite --lote 32
+    python -m src.modulos.cli procesar data/rescoring.sqlite --heatmaps data/heatmaps --formato-heatmap jpg --registros data/resultados.csv
+    python -m src.modulos.cli --perfil shared-node procesar data/rescoring.sqlite --procesos 4
+    python -m src.modulos.cli estado data/rescoring.sqlite
+    python -m src.modulos.cli distribuir /mnt/compartido/rescoring /mnt/compartido/pacs
+    python -m src.modulos.cli nodo /mnt/compartido/rescoring            # en cada nodo
+    python -m src.modulos.cli fusionar /mnt/compartido/rescoring data/rescoring.sqlite
+    python -m src.modulos.cli vigilar /pacs/export data/entrantes.sqlite --heatmaps data/heatmaps
+    python -m src.modulos.cli vigilar /pacs/export data/entrantes.sqlite --recargar-modelo
+    python -m src.modulos.cli destilar data/empaquetado --epocas 5
+    python -m src.modulos.cli cascada data/empaquetado --umbral 0.9
+    python -m src.modulos.cli --perfilar 20 procesar data/rescoring.sqlite   # o kill -USR2 <pid>
+"""
+
+import argparse
+import json
+import sys
+
+try:
+    from . import profiler_hook, runtime_profile
+except ImportError:
+    from src.modulos import profiler_hook, runtime_profile
+
+
+def _dataset():
+    """Importa el módulo de dataset (y TensorFlow) después de aplicar el perfil"""
+    try:
+        from . import dataset
+    except ImportError:
+        from src.modulos import dataset
+    return dataset
+
+
+def cmd_empaquetar(args):
+    """Empaqueta un directorio etiquetado por carpetas en shards memory-mapped"""
+    _dataset().empaquetar_dataset(args.directorio, args.destino,
+                               imagenes_por_shard=args.por_shard, workers=args.workers)
+    return 0
+
+
+def cmd_evaluar(args):
+    """Evalúa el modelo sobre un dataset empaquetado"""
+    dataset = _dataset()
+    reporte = dataset.evaluar(args.destino, tamano_lote=args.lote)
+    dataset.imprimir_reporte(reporte)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(reporte, f, indent=2, ensure_ascii=False)
+        print(f"💾 Reporte guardado en: {args.json}")
+    return 0
+
+
+def _cascade():
+    """Importa la cascada (y TensorFlow) después de aplicar el perfil"""
+    try:
+        from . import cascade
+    except ImportError:
+        from src.modulos import cascade
+    return cascade
+
+
+def cmd_destilar(args):
+    """Entrena el modelo rápido de la cascada con las salidas del modelo completo"""
+    cascade = _cascade()
+    dataset = _dataset().DatasetEmpaquetado(args.destino)
+    rapido = cascade.construir_modelo_rapido()
+    cascade.destilar(rapido, lambda: (b for b, _ in dataset.iterar_lotes(args.lote)),
+                     epocas=args.epocas)
+    cascade.guardar_modelo_rapido(rapido, args.salida)
+    return 0
+
+
+def cmd_cascada(args):
+    """Compara la cascada con el modelo completo: tasa de acierto, img/s y concordancia"""
+    cascade = _cascade()
+    rapido = cascade.cargar_modelo_rapido(args.modelo)
+    if rapido is None:
+        return 1
+    dataset = _dataset().DatasetEmpaquetado(args.destino)
+    reporte = cascade.evaluar_cascada(dataset.iterar_lotes(args.lote),
+                                      cascade.Cascada(rapido, umbral=args.umbral))
+    cascade.imprimir_reporte_cascada(reporte)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(reporte, f, indent=2, ensure_ascii=False)
+        print(f"💾 Reporte guardado en: {args.json}")
+    return 0
+
+
+def _job_queue():
+    """Importa la cola de trabajos (y TensorFlow) después de aplicar el perfil"""
+    try:
+        from . import job_queue
+    except ImportError:
+        from src.modulos import job_queue
+    return job_queue
+
+
+def cmd_encolar(args):
+    """Agrega a un trabajo en lote las imágenes de uno o más directorios"""
+    cola = _job_queue().ColaTrabajos(args.trabajo)
+    for directorio in args.directorios:
+        nuevas = cola.agregar_directorio(directorio)
+        print(f"📥 {nuevas} imágenes nuevas desde {directorio}")
+    print(f"🗂️  Total en el trabajo: {cola.progreso()['total']}")
+    cola.close()
+    return 0
+
+
+def _salida(heatmaps, args, registros=None):
+    """Salida asíncrona para los heatmaps y registros según los argumentos"""
+    try:
+        from .output_sink import SalidaAsincrona
+    except ImportError:
+        from src.modulos.output_sink import SalidaAsincrona
+    return SalidaAsincrona(heatmaps, formato=args.formato_heatmap, calidad=args.calidad,
+                           registros=registros)
+
+
+def _imprimir_salida(salida):
+    """Muestra los bytes y tiempos de la salida asíncrona"""
+    try:
+        from .output_sink import imprimir_estadisticas
+    except ImportError:
+        from src.modulos.output_sink import imprimir_estadisticas
+    imprimir_estadisticas(salida.estadisticas())
+
+
+def cmd_procesar(args):
+    """Procesa (o reanuda) los archivos pendientes de un trabajo en lote"""
+    job_queue = _job_queue()
+    cola = job_queue.ColaTrabajos(args.trabajo, max_intentos=args.max_intentos)
+    if args.reintentar_fallidos:
+        print(f"🔁 {cola.reintentar_fallidos()} archivos fallidos devueltos a la cola")
+    cache = None
+    if args.cache:
+        try:
+            from .tensor_cache import TensorCache
+        except ImportError:
+            from src.modulos.tensor_cache import TensorCache
+        cache = TensorCache(args.cache)
+    salida = None
+    if args.heatmaps or args.registros:
+        if args.heatmaps and cache is not None:
+            print("⚠️  Los heatmaps necesitan la imagen original: se ignora la caché de tensores")
+            cache.close()
+            cache = None
+        salida = _salida(args.heatmaps, args, registros=args.registros)
+    try:
+        if args.procesos > 1:
+            try:
+                from .worker_launcher import LanzadorWorkers, imprimir_memoria
+                from .output_sink import imprimir_estadisticas
+            except ImportError:
+                from src.modulos.worker_launcher import LanzadorWorkers, imprimir_memoria
+                from src.modulos.output_sink import imprimir_estadisticas
+            # Cada worker abre su caché y su salida, con un archivo de registros
+            # propio (--heatmaps con --procesos lo rechaza main)
+            opciones_salida = None
+            if salida is not None:
+                opciones_salida = {'formato': salida.formato, 'calidad': salida.calidad,
+                                   'registros': salida.registros}
+                salida.cerrar()
+                salida = None
+            if cache is not None:
+                cache.close()
+                cache = None
+            lanzador = LanzadorWorkers(procesos=args.procesos, compartir=not args.pesos_copiados)
+            reporte = lanzador.ejecutar_trabajo(
+                args.trabajo, tamano_lote=args.lote, lotes_por_commit=args.por_commit,
+                workers=args.workers, max_intentos=args.max_intentos, cache=args.cache,
+                salida=opciones_salida)
+            imprimir_memoria(reporte)
+            for worker in reporte['workers']:
+                if worker.get('salida'):
+                    imprimir_estadisticas(worker['salida'])
+        else:
+            job_queue.ejecutar_trabajo(cola, tamano_lote=args.lote, lotes_por_commit=args.por_commit,
+                                       workers=args.workers, cache=cache, salida=salida)
+    finally:
+        if cache is not None:
+            cache.close()
+        if salida is not None:
+            salida.cerrar()
+            _imprimir_salida(salida)
+        cola.close()
+    return 0
+
+
+def cmd_estado(args):
+    """Muestra el progreso, el rendimiento y el ETA de un trabajo en lote"""
+    job_queue = _job_queue()
+    cola = job_queue.ColaTrabajos(args.trabajo)
+    progreso = cola.progreso()
+    if args.json:
+        print(json.dumps(progreso, indent=2))
+    else:
+        print(f"🗂️  {args.trabajo}: {progreso['done'] + progreso['failed']}/{progreso['total']} "
+              f"({progreso['porcentaje']:.1f}%)")
+        print(f"   - pendientes={progreso['pending']} hechos={progreso['done']} "
+              f"fallidos={progreso['failed']}")
+        print(f"   - {progreso['imagenes_por_segundo']:.2f} img/s | "
+              f"ETA {job_queue.formatear_segundos(progreso['eta_segundos'])}")
+        if args.fallidos:
+            for item in cola.resultados('failed'):
+                print(f"   ❌ {item['ruta']}: {item['error']}")
+    cola.close()
+    return 0
+
+
+def _distributed_job():
+    """Importa el trabajo repartido entre nodos"""
+    try:
+        from . import distributed_job
+    except ImportError:
+        from src.modulos import distributed_job
+    return distributed_job
+
+
+def cmd_distribuir(args):
+    """Crea en una carpeta compartida un trabajo que pueden procesar varios nodos"""
+    _distributed_job().crear_trabajo(args.compartido, args.directorios, por_bloque=args.por_bloque)
+    return 0
+
+
+def cmd_nodo(args):
+    """Procesa bloques de un trabajo compartido hasta que no quede ninguno (en cada nodo)"""
+    distributed_job = _distributed_job()
+    opciones = {'tamano_lote': args.lote, 'workers': args.workers, 'ttl': args.ttl,
+                'max_intentos': args.max_intentos, 'ruta_modelo': args.modelo}
+    if args.procesos > 1:
+        reportes = distributed_job.lanzar_nodos(args.compartido, procesos=args.procesos,
+                                                prefijo=args.nombre, **opciones)
+    else:
+        reportes = [distributed_job.ejecutar_nodo(args.compartido, nodo=args.nombre, **opciones)]
+    progreso = distributed_job.progreso(args.compartido, args.ttl)
+    print(f"🗂️  {progreso['hechos']}/{progreso['bloques']} bloques terminados | "
+          f"en curso={progreso['en_curso']} vencidos={progreso['vencidos']}")
+    for nodo, archivos in sorted(progreso['por_nodo'].items()):
+        print(f"   - {nodo}: {archivos} archivos")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'nodos': reportes, 'progreso': progreso}, f, indent=2)
+        print(f"💾 Reporte guardado en: {args.json}")
+    return 0
+
+
+def cmd_fusionar(args):
+    """Reúne los resultados de todos los nodos en un trabajo SQLite local"""
+    reporte = _distributed_job().fusionar(args.compartido, args.trabajo)
+    return 0 if reporte['pending'] == 0 else 1
+
+
+def cmd_vigilar(args):
+    """Vigila una carpeta y clasifica cada estudio nuevo en cuanto termina de escribirse"""
+    try:
+        from .hot_folder import ObservadorCarpeta
+    except ImportError:
+        from src.modulos.hot_folder import ObservadorCarpeta
+    gestor = None
+    if args.recargar_modelo:
+        try:
+            from .model_manager import GestorModelos
+        except ImportError:
+            from src.modulos.model_manager import GestorModelos
+        gestor = GestorModelos()
+        gestor.vigilar_archivo(None if args.recargar_modelo == 'auto' else args.recargar_modelo)
+    cola = _job_queue().ColaTrabajos(args.trabajo)
+    heatmaps = _salida(args.heatmaps, args) if args.heatmaps else None
+    observador = ObservadorCarpeta(args.carpeta, cola, heatmaps=heatmaps,
+                                   tamano_lote=args.lote, max_espera=args.espera,
+                                   intervalo=args.intervalo, estabilidad=args.estabilidad,
+                                   workers=args.workers)
+    try:
+        estadisticas = observador.ejecutar(duracion=args.duracion, reporte_cada=args.reporte)
+    finally:
+        cola.close()
+        if heatmaps is not None:
+            heatmaps.cerrar()
+        if gestor is not None:
+            gestor.detener(esperar=False)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(estadisticas, f, indent=2)
+        print(f"💾 Latencias guardadas en: {args.json}")
+    return 0
+
+
+def cmd_autotune(args):
+    """Prueba configuraciones de hilos/oneDNN en esta máquina y guarda la mejor"""
+    config = runtime_profile.autoajustar(objetivo=args.objetivo, lote=args.lote,
+                                         lotes=args.lotes, guardar=not args.no_guardar)
+    if config is None:
+        print("❌ Ninguna configuración se pudo medir")
+        return 1
+    print(f"🏆 Mejor configuración: {runtime_profile.describir_perfil(dict(config, nombre='autotune'))}")
+    print(f"   - {config['medicion']['imagenes_por_segundo']:.2f} img/s, "
+          f"{config['medicion']['latencia_ms']:.2f} ms por imagen suelta")
+    return 0
+
+
+def construir_parser():
+    """Construye el parser de argumentos con un subcomando por tarea"""
+    parser = argparse.ArgumentParser(description="Detector de neumonía - línea de comandos")
+    parser.add_argument('--perfil', default=None,
+                        help="Perfil de ejecución: latency, throughput, shared-node o autotune")
+    parser.add_argument('--perfilar', type=int, default=None, metavar='N',
+                        help="Perfila las próximas N predicciones (traza de TensorFlow + cProfile)")
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    p = sub.add_parser('empaquetar', help=cmd_empaquetar.__doc__)
+    p.add_argument('directorio', help="Raíz con subcarpetas bacteria/normal/virus")
+    p.add_argument('destino', help="Carpeta de salida del dataset empaquetado")
+    p.add_argument('--por-shard', type=int, default=1024, help="Imágenes por shard")
+    p.add_argument('--workers', type=int, default=None)
+    p.set_defaults(funcion=cmd_empaquetar)
+
+    p = sub.add_parser('evaluar', help=cmd_evaluar.__doc__)
+    p.add_argument('destino', help="Carpeta del dataset empaquetado")
+    p.add_argument('--lote', type=int, default=None,
+                   help="Imágenes por lote de inferencia (por defecto, según la memoria)")
+    p.add_argument('--json', help="Guardar el reporte en este archivo JSON")
+    p.set_defaults(funcion=cmd_evaluar)
+
+    p = sub.add_parser('encolar', help=cmd_encolar.__doc__)
+    p.add_argument('trabajo', help="Archivo SQLite del trabajo (se crea si no existe)")
+    p.add_argument('directorios', nargs='+', help="Directorios con imágenes a procesar")
+    p.set_defaults(funcion=cmd_encolar)
+
+    p = sub.add_parser('procesar', help=cmd_procesar.__doc__)
+    p.add_argument('trabajo', help="Archivo SQLite del trabajo")
+    p.add_argument('--lote', type=int, default=None,
+                   help="Imágenes por lote de inferencia (por defecto, según la memoria)")
+    p.add_argument('--por-commit', type=int, default=4, help="Lotes confirmados por transacción")
+    p.add_argument('--workers', type=int, default=None)
+    p.add_argument('--cache', default=None, help="Directorio de caché de tensores (opcional)")
+    p.add_argument('--max-intentos', type=int, default=3,
+                   help="Caídas toleradas por archivo antes de marcarlo fallido")
+    p.add_argument('--reintentar-fallidos', action='store_true',
+                   help="Devolver los archivos fallidos a la cola antes de empezar")
+    p.add_argument('--procesos', type=int, default=1,
+                   help="Procesos worker que comparten los pesos del modelo (memoria por worker al final)")
+    p.add_argument('--pesos-copiados', action='store_true',
+                   help="Con --procesos, una copia de los pesos por worker (para comparar la memoria)")
+    p.add_argument('--heatmaps', default=None,
+                   help="Carpeta donde guardar los heatmaps (se escriben en segundo plano; "
+                        "no admite --procesos)")
+    p.add_argument('--formato-heatmap', choices=['png', 'webp', 'jpg', 'npz'], default=None,
+                   help="Formato de los heatmaps (npz = CAM de baja resolución sin superponer; "
+                        "por defecto NEUMONIA_SALIDA_FORMATO o png)")
+    p.add_argument('--calidad', type=int, default=None,
+                   help="Calidad de webp/jpg (0-100) o compresión de png (0-9)")
+    p.add_argument('--registros', default=None, metavar='ARCHIVO',
+                   help="Añadir los resultados a este archivo .csv o .jsonl en bloques "
+                        "(con --procesos, uno por worker: ARCHIVO.workerK.csv)")
+    p.set_defaults(funcion=cmd_procesar)
+
+    p = sub.add_parser('estado', help=cmd_estado.__doc__)
+    p.add_argument('trabajo', help="Archivo SQLite del trabajo")
+    p.add_argument('--json', action='store_true', help="Salida en JSON")
+    p.add_argument('--fallidos', action='store_true', help="Listar los archivos fallidos")
+    p.set_defaults(funcion=cmd_estado)
+
+    p = sub.add_parser('distribuir', help=cmd_distribuir.__doc__)
+    p.add_argument('compartido', help="Carpeta del trabajo en el sistema de archivos compartido")
+    p.add_argument('directorios', nargs='+', help="Directorios o archivos zip/tar con imágenes")
+    p.add_argument('--por-bloque', type=int, default=64,
+                   help="Archivos por bloque (la unidad que reclama cada nodo)")
+    p.set_defaults(funcion=cmd_distribuir)
+
+    p = sub.add_parser('nodo', help=cmd_nodo.__doc__)
+    p.add_argument('compartido', help="Carpeta del trabajo en el sistema de archivos compartido")
+    p.add_argument('--nombre', default=None,
+                   help="Nombre único del nodo (por defecto host-pid; con --procesos, prefijo)")
+    p.add_argument('--lote', type=int, default=None,
+                   help="Imágenes por lote de inferencia (por defecto, según la memoria)")
+    p.add_argument('--workers', type=int, default=None)
+    p.add_argument('--ttl', type=float, default=120.0,
+                   help="Segundos sin latido tras los que otro nodo recupera un bloque")
+    p.add_argument('--max-intentos', type=int, default=3,
+                   help="Leases vencidos tolerados por bloque antes de darlo por fallido")
+    p.add_argument('--modelo', default=None, help="Archivo del modelo (por defecto el principal)")
+    p.add_argument('--procesos', type=int, default=1,
+                   help="Nodos a lanzar como procesos locales en esta máquina")
+    p.add_argument('--json', help="Guardar el reporte en este archivo JSON")
+    p.set_defaults(funcion=cmd_nodo)
+
+    p = sub.add_parser('fusionar', help=cmd_fusionar.__doc__)
+    p.add_argument('compartido', help="Carpeta del trabajo en el sistema de archivos compartido")
+    p.add_argument('trabajo', help="Archivo SQLite local donde reunir los resultados")
+    p.set_defaults(funcion=cmd_fusionar)
+
+    p = sub.add_parser('vigilar', help=cmd_vigilar.__doc__)
+    p.add_argument('carpeta', help="Carpeta donde llegan los estudios")
+    p.add_argument('trabajo', help="Archivo SQLite donde se guardan los resultados")
+    p.add_argument('--heatmaps', default=None, help="Carpeta donde guardar los heatmaps")
+    p.add_argument('--formato-heatmap', choices=['png', 'webp', 'jpg', 'npz'], default=None,
+                   help="Formato de los heatmaps (npz = CAM de baja resolución sin superponer; "
+                        "por defecto NEUMONIA_SALIDA_FORMATO o png)")
+    p.add_argument('--calidad', type=int, default=None,
+                   help="Calidad de webp/jpg (0-100) o compresión de png (0-9)")
+    p.add_argument('--lote', type=int, default=8, help="Imágenes por micro-lote")
+    p.add_argument('--espera', type=float, default=0.5,
+                   help="Segundos máximos que un estudio listo espera a completar su lote")
+    p.add_argument('--intervalo', type=float, default=0.5, help="Segundos entre recorridos")
+    p.add_argument('--estabilidad', type=float, default=1.0,
+                   help="Segundos sin cambios para dar un archivo por completo")
+    p.add_argument('--workers', type=int, default=None)
+    p.add_argument('--duracion', type=float, default=None, help="Terminar tras estos segundos")
+    p.add_argument('--reporte', type=float, default=30.0, help="Segundos entre reportes de latencia")
+    p.add_argument('--json', help="Guardar las latencias finales en este archivo JSON")
+    p.add_argument('--recargar-modelo', nargs='?', const='auto', default=None, metavar='ARCHIVO',
+                   help="Cargar en caliente el modelo cuando se reemplace su archivo "
+                        "(por defecto el modelo principal)")
+    p.set_defaults(funcion=cmd_vigilar)
+
+    p = sub.add_parser('destilar', help=cmd_destilar.__doc__)
+    p.add_argument('destino', help="Carpeta del dataset empaquetado")
+    p.add_argument('--epocas', type=int, default=5)
+    p.add_argument('--lote', type=int, default=32, help="Imágenes por lote de entrenamiento")
+    p.add_argument('--salida', default=None,
+                   help="Archivo .keras del modelo rápido (por defecto models/cascada_rapido.keras)")
+    p.set_defaults(funcion=cmd_destilar)
+
+    p = sub.add_parser('cascada', help=cmd_cascada.__doc__)
+    p.add_argument('destino', help="Carpeta del dataset empaquetado")
+    p.add_argument('--umbral', type=float, default=0.9,
+                   help="Confianza mínima del modelo rápido para no pasar al completo")
+    p.add_argument('--modelo', default=None, help="Archivo .keras del modelo rápido")
+    p.add_argument('--lote', type=int, default=32)
+    p.add_argument('--json', help="Guardar el reporte en este archivo JSON")
+    p.set_defaults(funcion=cmd_cascada)
+
+    p = sub.add_parser('autotune', help=cmd_autotune.__doc__)
+    p.add_argument('--objetivo', choices=['rendimiento', 'latencia'], default='rendimiento')
+    p.add_argument('--lote', type=int, default=8, help="Imágenes por lote en la medición")
+    p.add_argument('--lotes', type=int, default=4, help="Lotes medidos por sesión")
+    p.add_argument('--no-guardar', action='store_true',
+                   help="Solo mostrar el resultado, sin escribir config/runtime.json")
+    p.set_defaults(funcion=cmd_autotune)
+
+    return parser
+
+
+def main(argv=None):
+    """Punto de entrada de la línea de comandos"""
+    parser = construir_parser()
+    args = parser.parse_args(argv)
+    if args.comando == 'procesar' and args.procesos > 1 and args.heatmaps:
+        # Antes de reclamar nada: los workers no calculan Grad-CAM sobre los
+        # pesos compartidos y los archivos quedarían hechos sin heatmap
+        parser.error("--heatmaps no se puede usar con --procesos > 1")
+    if args.comando in ('empaquetar', 'evaluar', 'procesar', 'nodo', 'vigilar', 'destilar', 'cascada'):
+        perfil = runtime_profile.aplicar_perfil(args.perfil)
+        print(f"⚙️  {runtime_profile.describir_perfil(perfil)}")
+    if args.perfilar:
+        profiler_hook.activar(args.perfilar)
+    profiler_hook.instalar_senal()
+    return args.funcion(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Formato de dataset empaquetado y evaluación en streaming.
+
+Un directorio etiquetado por carpetas (bacteria/, normal/, virus/) se
+empaqueta una sola vez en shards ``.npy`` memory-mapped con las imágenes ya
+ecualizadas (uint8, 512x512) más un índice JSON con etiquetas y metadatos.
+La evaluación recorre los shards por lotes con un único buffer reutilizable,
+así que la memoria no depende del tamaño del dataset.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    from .preprocess_img import get_preprocessor
+    from .read_img import read_image_file, es_archivo_comprimido, listar_archivo, dividir_ruta
+    from .integrator import predict_batch, obtener_etiqueta_diagnostico
+    from .batch_planner import tamano_lote_planificado
+    from .inference_session import get_pool
+    from .precision import dtype_entrada
+    from .load_model import version_modelo
+except ImportError:
+    from src.modulos.preprocess_img import get_preprocessor
+    from src.modulos.read_img import read_image_file, es_archivo_comprimido, listar_archivo, dividir_ruta
+    from src.modulos.integrator import predict_batch, obtener_etiqueta_diagnostico
+    from src.modulos.batch_planner import tamano_lote_planificado
+    from src.modulos.inference_session import get_pool
+    from src.modulos.precision import dtype_entrada
+    from src.modulos.load_model import version_modelo
+
+# Nombre de carpeta -> índice de clase del modelo (0 bacteriana, 1 normal, 2 viral)
+CARPETAS_CLASE = {
+    'bacteria': 0, 'bacteriana': 0, 'bacterial': 0,
+    'normal': 1,
+    'virus': 2, 'viral': 2,
+}
+EXTENSIONES = ('.dcm', '.jpg', '.jpeg', '.png')
+VERSION_FORMATO = 1
+
+
+def listar_dataset(directorio):
+    """
+    Recorre un directorio etiquetado por carpetas.
+
+    Args:
+        directorio (str): Raíz con una subcarpeta por clase, o un archivo
+            zip/tar con la misma estructura (se lee sin extraerlo)
+
+    Returns:
+        list: Tuplas (ruta, etiqueta) ordenadas por ruta
+    """
+    if es_archivo_comprimido(directorio):
+        elementos = []
+        for ruta in listar_archivo(directorio, EXTENSIONES):
+            partes = dividir_ruta(ruta)[1].split('/')
+            clase = CARPETAS_CLASE.get(partes[-2].lower()) if len(partes) > 1 else None
+            if clase is not None:
+                elementos.append((ruta, clase))
+        return elementos
+
+    elementos = []
+    for raiz, _, archivos in os.walk(directorio):
+        clase = CARPETAS_CLASE.get(os.path.basename(raiz).lower())
+        if clase is None:
+            continue
+        for archivo in archivos:
+            if archivo.lower().endswith(EXTENSIONES):
+                elementos.append((os.path.join(raiz, archivo), clase))
+    return sorted(elementos)
+
+
+def empaquetar_dataset(directorio, destino, imagenes_por_shard=1024, lote=64, workers=None):
+    """
+    Empaqueta un directorio etiquetado en shards memory-mapped.
+
+    Args:
+        directorio (str): Raíz del dataset (una subcarpeta por clase)
+        destino (str): Carpeta de salida
+        imagenes_por_shard (int): Imágenes por archivo .npy
+        lote (int): Imágenes leídas y preprocesadas a la vez
+        workers (int): Hilos para decodificar y preprocesar
+
+    Returns:
+        dict: Índice del dataset empaquetado
+    """
+    preprocesador = get_preprocessor()
+    ancho, alto = preprocesador.target_size
+    elementos = listar_dataset(directorio)
+    if not elementos:
+        raise ValueError(f"No se encontraron imágenes etiquetadas en {directorio}")
+
+    os.makedirs(destino, exist_ok=True)
+    print(f"📦 Empaquetando {len(elementos)} imágenes de {directorio} -> {destino}")
+
+    def _leer(elemento):
+        ruta, _ = elemento
+        try:
+            array, _ = read_image_file(ruta)
+            if array is None:
+                return None
+            return preprocesador.equalize(array).copy()
+        except Exception as e:
+            print(f"❌ Error empaquetando {ruta}: {e}")
+            return None
+
+    shards, rutas, etiquetas, fallidos = [], [], [], []
+    shard, ocupadas = None, 0
+    workers = max(1, int(workers or os.cpu_count() or 1))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for inicio in range(0, len(elementos), lote):
+            bloque = elementos[inicio:inicio + lote]
+            for (ruta, etiqueta), imagen in zip(bloque, pool.map(_leer, bloque)):
+                if imagen is None:
+                    fallidos.append(ruta)
+                    continue
+                if shard is None:
+                    nombre = f"shard_{len(shards):05d}.npy"
+                    restantes = len(elementos) - len(rutas) - len(fallidos)
+                    shard = np.lib.format.open_memmap(
+                        os.path.join(destino, nombre), mode='w+', dtype=np.uint8,
+                        shape=(min(imagenes_por_shard, restantes), alto, ancho))
+                    shards.append({'archivo': nombre, 'n': 0})
+                    ocupadas = 0
+                shard[ocupadas] = imagen
+                ocupadas += 1
+                shards[-1]['n'] = ocupadas
+                _, miembro = dividir_ruta(ruta)
+                rutas.append(miembro if miembro is not None else os.path.relpath(ruta, directorio))
+                etiquetas.append(etiqueta)
+                if ocupadas == shard.shape[0]:
+                    shard.flush()
+                    shard = None
+            print(f"   - {len(rutas) + len(fallidos)}/{len(elementos)} procesadas")
+
+    if shard is not None:
+        # El último shard puede quedar con filas sin usar si hubo fallos
+        shard.flush()
+        del shard
+
+    np.save(os.path.join(destino, 'etiquetas.npy'), np.asarray(etiquetas, dtype=np.int8))
+    indice = {
+        'version': VERSION_FORMATO,
+        'origen': os.path.abspath(directorio),
+        'forma': [alto, ancho],
+        'dtype': 'uint8',
+        'preprocesamiento': preprocesador.firma(),
+        'clases': {str(i): obtener_etiqueta_diagnostico(i) for i in range(3)},
+        'total': len(rutas),
+        'shards': shards,
+        'rutas': rutas,
+        'fallidos': fallidos,
+    }
+    with open(os.path.join(destino, 'indice.json'), 'w', encoding='utf-8') as f:
+        json.dump(indice, f, indent=1, ensure_ascii=False)
+
+    print(f"✅ Dataset empaquetado: {len(rutas)} imágenes en {len(shards)} shards "
+          f"({len(fallidos)} fallidas)")
+    return indice
+
+
+class DatasetEmpaquetado:
+    """Acceso de solo lectura a un dataset empaquetado con empaquetar_dataset"""
+
+    def __init__(self, destino):
+        with open(os.path.join(destino, 'indice.json'), encoding='utf-8') as f:
+            self.indice = json.load(f)
+        if self.indice.get('version') != VERSION_FORMATO:
+            raise ValueError(f"Versión de formato no soportada: {self.indice.get('version')}")
+        self.destino = destino
+        self.forma = tuple(self.indice['forma'])
+        self.etiquetas = np.load(os.path.join(destino, 'etiquetas.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return self.indice['total']
+
+    def iterar_lotes(self, tamano_lote=32, dtype=np.float32):
+        """
+        Recorre el dataset por lotes listos para el modelo.
+
+        El batch entregado es siempre el mismo buffer reutilizado: consumirlo
+        antes de pedir el siguiente.
+
+        Args:
+            tamano_lote (int): Imágenes por lote
+            dtype (numpy.dtype): Tipo del batch (float32, bfloat16 o float16)
+
+        Yields:
+            tuple: (batch (n, 512, 512, 1), etiquetas int (n,))
+        """
+        buffer = np.empty((tamano_lote,) + self.forma + (1,), dtype=dtype)
+        llenas, inicio_etiquetas = 0, 0
+        for shard_info in self.indice['shards']:
+            shard = np.load(os.path.join(self.destino, shard_info['archivo']), mmap_mode='r')
+            posicion = 0
+            while posicion < shard_info['n']:
+                cantidad = min(tamano_lote - llenas, shard_info['n'] - posicion)
+                np.divide(shard[posicion:posicion + cantidad], np.float32(255.0),
+                          out=buffer[llenas:llenas + cantidad, ..., 0], casting='unsafe')
+                llenas += cantidad
+                posicion += cantidad
+                if llenas == tamano_lote:
+                    yield buffer, np.asarray(self.etiquetas[inicio_etiquetas:inicio_etiquetas + llenas])
+                    inicio_etiquetas += llenas
+                    llenas = 0
+            del shard
+        if llenas:
+            yield buffer[:llenas], np.asarray(self.etiquetas[inicio_etiquetas:inicio_etiquetas + llenas])
+
+
+def evaluar(destino, model=None, tamano_lote=None):
+    """
+    Evalúa el modelo sobre un dataset empaquetado.
+
+    Args:
+        destino (str): Carpeta del dataset empaquetado
+        model (tf.keras.Model): Modelo a evaluar (por defecto el del pool de sesiones)
+        tamano_lote (int): Imágenes por lote de inferencia (por defecto, el
+            que cabe en el presupuesto de memoria según el planificador de lotes)
+
+    Returns:
+        dict: accuracy, matriz de confusión (filas = real, columnas = predicha),
+              métricas por clase, imágenes por segundo y la versión del modelo
+    """
+    dataset = DatasetEmpaquetado(destino)
+    # Un solo pool para toda la evaluación aunque se sustituya el modelo
+    pool = None if model is not None else get_pool()
+    dtype = dtype_entrada(model or pool.model)
+    if tamano_lote is None:
+        tamano_lote = tamano_lote_planificado(model or pool.model)
+    confusion = np.zeros((3, 3), dtype=np.int64)
+    total = 0
+    print(f"🧪 Evaluando {len(dataset)} imágenes en lotes de {tamano_lote}...")
+
+    inicio = time.perf_counter()
+    for batch, etiquetas in dataset.iterar_lotes(tamano_lote, dtype):
+        probabilidades = predict_batch(batch, model, pool=pool)
+        if probabilidades is None:
+            raise RuntimeError("Falló la inferencia durante la evaluación")
+        predichas = np.argmax(probabilidades, axis=1)
+        np.add.at(confusion, (etiquetas.astype(np.intp), predichas), 1)
+        total += len(etiquetas)
+    segundos = time.perf_counter() - inicio
+
+    por_clase = {}
+    for i in range(3):
+        reales, predichas = confusion[i].sum(), confusion[:, i].sum()
+        por_clase[obtener_etiqueta_diagnostico(i)] = {
+            'soporte': int(reales),
+            'precision': float(confusion[i, i] / predichas) if predichas else 0.0,
+            'recall': float(confusion[i, i] / reales) if reales else 0.0,
+        }
+
+    return {
+        'imagenes': total,
+        'accuracy': float(np.trace(confusion) / total) if total else 0.0,
+        'matriz_confusion': confusion.tolist(),
+        'por_clase': por_clase,
+        'segundos': round(segundos, 3),
+        'imagenes_por_segundo': round(total / segundos, 2) if segundos > 0 else 0.0,
+        'version_modelo': pool.version if pool is not None else version_modelo(model),
+    }
+
+
+def imprimir_reporte(reporte):
+    """Muestra en consola el resultado de evaluar()"""
+    etiquetas = [obtener_etiqueta_diagnostico(i) for i in range(3)]
+    print(f"\n📊 Accuracy: {reporte['accuracy'] * 100:.2f}% sobre {reporte['imagenes']} imágenes"
+          f" (modelo {reporte.get('version_modelo', 'desconocida')})")
+    print(f"⚡ Rendimiento: {reporte['imagenes_por_segundo']:.2f} img/s")
+    print("\nMatriz de confusión (filas = real, columnas = predicha)")
+    print(f"{'':>12}" + "".join(f"{e:>12}" for e in etiquetas))
+    for etiqueta, fila in zip(etiquetas, reporte['matriz_confusion']):
+        print(f"{etiqueta:>12}" + "".join(f"{v:>12}" for v in fila))
+    print()
+    for etiqueta, metricas in reporte['por_clase'].items():
+        print(f"   - {etiqueta}: precision={metricas['precision']:.3f} "
+              f"recall={metricas['recall']:.3f} (n={metricas['soporte']})")
@@ -0,0 +1,593 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Trabajos en lote repartidos entre varios nodos sin coordinador.
+
+Los nodos solo comparten una carpeta (NFS u otro sistema de archivos
+compartido) con esta estructura:
+
+    trabajo.json          total de archivos y de bloques
+    bloques/000012.json   (id, ruta) de cada bloque de ``por_bloque`` archivos
+    leases/000012.lease   quién procesa el bloque (creado con O_EXCL)
+    intentos/000012/      una marca por lease tomado del bloque (solo se añaden)
+    hechos/000012.json    marca de bloque terminado
+    resultados/<nodo>.jsonl  resultados de cada nodo, un bloque por escritura
+
+SQLite no sirve aquí: su bloqueo (y WAL) no es fiable sobre NFS. En su lugar
+cada bloque se reclama creando su archivo de lease con O_CREAT | O_EXCL, que
+es atómico en NFSv3 y posteriores. Mientras lo procesa, el nodo renueva la
+fecha de modificación del lease (latido); un lease sin latido durante ``ttl``
+segundos es de un nodo muerto y otro nodo lo recupera renombrándolo (solo un
+renombrado gana). Los relojes de los nodos tienen que estar sincronizados
+(NTP) con un desfase muy inferior a ``ttl``.
+
+Un bloque se puede llegar a procesar dos veces (un nodo lento al que le
+recuperan el lease); fusionar() se queda con un resultado por archivo. Un
+bloque cuyos leases vencieron ``max_intentos`` veces se da por fallido para
+que un archivo que tumba el proceso no bloquee el trabajo. Los intentos se
+cuentan con las marcas de intentos/, no en el lease: un lease se puede
+retirar y volver a crear por otro nodo entre medias, y su cuenta se
+perdería.
+
+Cada nodo escribe sus resultados en su propio archivo; al final fusionar()
+los reúne en una ColaTrabajos SQLite local. Los archivos de bloques sin
+terminar quedan pending en ella y se pueden procesar con ``procesar``.
+
+Uso (cada nodo monta /mnt/compartido):
+    crear_trabajo('/mnt/compartido/rescoring', ['/mnt/compartido/pacs'])
+    ejecutar_nodo('/mnt/compartido/rescoring')           # en cada nodo
+    fusionar('/mnt/compartido/rescoring', 'data/rescoring.sqlite')
+"""
+
+import glob
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+
+try:
+    from .job_queue import ColaTrabajos, procesar_lote, formatear_segundos, EXTENSIONES
+    from .read_img import normalizar_ruta, es_archivo_comprimido, listar_archivo
+    from .runtime_profile import perfil_activo, ejecutar_con_perfil
+except ImportError:
+    from src.modulos.job_queue import ColaTrabajos, procesar_lote, formatear_segundos, EXTENSIONES
+    from src.modulos.read_img import normalizar_ruta, es_archivo_comprimido, listar_archivo
+    from src.modulos.runtime_profile import perfil_activo, ejecutar_con_perfil
+
+POR_BLOQUE = 64
+TTL = 120.0
+MAX_INTENTOS = 3
+
+
+def _escribir_json(ruta, datos):
+    """Escribe un JSON de forma atómica (temporal + rename)"""
+    temporal = f"{ruta}.{uuid.uuid4().hex}.tmp"
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ruta)
+
+
+def _leer_json(ruta):
+    """Lee un JSON; None si no existe o está incompleto"""
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _listar_rutas(origenes, extensiones=EXTENSIONES):
+    """Rutas de imágenes de directorios, archivos zip/tar o archivos sueltos"""
+    for origen in origenes:
+        if es_archivo_comprimido(origen):
+            yield from listar_archivo(origen, extensiones)
+        elif os.path.isdir(origen):
+            for raiz, directorios, archivos in os.walk(origen):
+                directorios.sort()
+                for archivo in sorted(archivos):
+                    if archivo.lower().endswith(extensiones):
+                        yield os.path.join(raiz, archivo)
+        else:
+            yield origen
+
+
+def crear_trabajo(directorio, origenes, por_bloque=POR_BLOQUE):
+    """
+    Crea un trabajo repartible en la carpeta compartida.
+
+    Args:
+        directorio (str): Carpeta compartida del trabajo (no debe tener ya uno)
+        origenes (list): Directorios, archivos zip/tar o rutas de imágenes
+        por_bloque (int): Archivos por bloque (la unidad que reclama un nodo)
+
+    Returns:
+        dict: Contenido de trabajo.json (total y bloques)
+
+    Raises:
+        FileExistsError: Si la carpeta ya tiene un trabajo
+    """
+    if os.path.exists(os.path.join(directorio, 'trabajo.json')):
+        raise FileExistsError(f"Ya hay un trabajo en {directorio}")
+    for sub in ('bloques', 'leases', 'intentos', 'hechos', 'resultados'):
+        os.makedirs(os.path.join(directorio, sub), exist_ok=True)
+
+    por_bloque = max(1, int(por_bloque))
+    vistas = set()
+    bloque, n_bloques, total = [], 0, 0
+    for ruta in _listar_rutas(origenes):
+        ruta = normalizar_ruta(ruta)
+        if ruta in vistas:
+            continue
+        vistas.add(ruta)
+        total += 1
+        bloque.append((total, ruta))
+        if len(bloque) == por_bloque:
+            _escribir_json(os.path.join(directorio, 'bloques', f"{n_bloques:06d}.json"), bloque)
+            bloque, n_bloques = [], n_bloques + 1
+    if bloque:
+        _escribir_json(os.path.join(directorio, 'bloques', f"{n_bloques:06d}.json"), bloque)
+        n_bloques += 1
+
+    # trabajo.json se escribe al final: su presencia indica que los bloques están completos
+    trabajo = {'total': total, 'bloques': n_bloques, 'por_bloque': por_bloque, 'creado': time.time()}
+    _escribir_json(os.path.join(directorio, 'trabajo.json'), trabajo)
+    print(f"🗂️  Trabajo repartible en {directorio}: {total} archivos en {n_bloques} bloques")
+    return trabajo
+
+
+class TrabajoCompartido:
+    """
+    Vista de un nodo sobre un trabajo en la carpeta compartida.
+
+    Reclama bloques con leases, mantiene el latido de los que tiene y
+    escribe sus resultados en su propio archivo.
+    """
+
+    def __init__(self, directorio, nodo=None, ttl=TTL, max_intentos=MAX_INTENTOS):
+        """
+        Args:
+            directorio (str): Carpeta compartida creada con crear_trabajo
+            nodo (str): Nombre del nodo (por defecto host-pid); tiene que ser
+                único entre los nodos que procesan a la vez
+            ttl (float): Segundos sin latido tras los que un lease vence
+            max_intentos (int): Leases vencidos tolerados por bloque antes
+                de darlo por fallido
+        """
+        self.directorio = directorio
+        self.trabajo = _leer_json(os.path.join(directorio, 'trabajo.json'))
+        if self.trabajo is None:
+            raise FileNotFoundError(f"No hay un trabajo en {directorio} (ver crear_trabajo)")
+        self.nodo = nodo or f"{socket.gethostname()}-{os.getpid()}"
+        self.ttl = float(ttl)
+        self.max_intentos = max(1, int(max_intentos))
+        self.ruta_resultados = os.path.join(directorio, 'resultados', f"{self.nodo}.jsonl")
+
+        # bloque -> (token, marca de intento) de los leases que tiene este nodo
+        self._leases = {}
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._latido = None
+        self.recuperados = 0
+        self.perdidos = 0
+
+    def _ruta_lease(self, bloque):
+        return os.path.join(self.directorio, 'leases', f"{bloque:06d}.lease")
+
+    def _ruta_intentos(self, bloque):
+        return os.path.join(self.directorio, 'intentos', f"{bloque:06d}")
+
+    def _ruta_hecho(self, bloque):
+        return os.path.join(self.directorio, 'hechos', f"{bloque:06d}.json")
+
+    def hechos(self):
+        """Conjunto de bloques terminados"""
+        return {int(nombre[:6]) for nombre in os.listdir(os.path.join(self.directorio, 'hechos'))
+                if nombre.endswith('.json')}
+
+    def items(self, bloque):
+        """Lista de (id, ruta) de un bloque"""
+        return [tuple(item) for item in _leer_json(os.path.join(self.directorio, 'bloques',
+                                                                f"{bloque:06d}.json"))]
+
+    # ------------------------------------------------------------------
+    # Leases
+    # ------------------------------------------------------------------
+    def _recuperar(self, ruta):
+        """
+        Retira un lease vencido.
+
+        Returns:
+            bool: True si el bloque quedó sin lease, o None si el lease sigue
+                vivo u otro nodo se adelantó
+        """
+        try:
+            if time.time() - os.stat(ruta).st_mtime < self.ttl:
+                return None
+        except FileNotFoundError:
+            return True
+        previo = _leer_json(ruta) or {}
+        retirado = f"{ruta}.{self.nodo}.{uuid.uuid4().hex}"
+        try:
+            # Solo un nodo consigue renombrarlo
+            os.rename(ruta, retirado)
+        except FileNotFoundError:
+            return None
+        # Un latido pudo llegar entre la comprobación y el renombrado: devolverlo
+        if time.time() - os.stat(retirado).st_mtime < self.ttl:
+            try:
+                os.link(retirado, ruta)
+            except FileExistsError:
+                pass
+            os.unlink(retirado)
+            return None
+        os.unlink(retirado)
+        print(f"⚠️  Lease vencido del nodo {previo.get('nodo', '?')} recuperado: "
+              f"{os.path.basename(ruta)}")
+        self.recuperados += 1
+        return True
+
+    def _tomar(self, bloque):
+        """Intenta reclamar un bloque; devuelve los intentos o None"""
+        ruta = self._ruta_lease(bloque)
+        if os.path.exists(ruta) and self._recuperar(ruta) is None:
+            return None
+        token = uuid.uuid4().hex
+        try:
+            descriptor = os.open(ruta, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return None
+        # Cada lease tomado deja su marca antes de procesar nada: los intentos
+        # son las marcas del bloque, sin importar qué nodo retiró cada lease
+        carpeta = self._ruta_intentos(bloque)
+        os.makedirs(carpeta, exist_ok=True)
+        marca = os.path.join(carpeta, f"{self.nodo}.{token}")
+        os.close(os.open(marca, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+        intentos = len(os.listdir(carpeta))
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as f:
+            json.dump({'nodo': self.nodo, 'pid': os.getpid(), 'token': token,
+                       'intentos': intentos, 'tomado': time.time()}, f)
+        # Otro nodo pudo terminarlo entre el recorrido y la creación del lease
+        if os.path.exists(self._ruta_hecho(bloque)):
+            os.unlink(ruta)
+            os.unlink(marca)
+            return None
+        with self._lock:
+            self._leases[bloque] = (token, marca)
+        return intentos
+
+    def _liberar(self, bloque):
+        """
+        Borra el lease del bloque si sigue siendo de este nodo.
+
+        Su marca de intento también se borra: un lease soltado a tiempo no
+        cuenta como un nodo caído.
+        """
+        with self._lock:
+            token, marca = self._leases.pop(bloque, (None, None))
+        ruta = self._ruta_lease(bloque)
+        if token is not None and (_leer_json(ruta) or {}).get('token') == token:
+            for archivo in (marca, ruta):
+                try:
+                    os.unlink(archivo)
+                except FileNotFoundError:
+                    pass
+
+    def latir(self):
+        """Renueva los leases de este nodo; cuenta los que otro nodo recuperó"""
+        with self._lock:
+            leases = dict(self._leases)
+        for bloque, (token, _) in leases.items():
+            ruta = self._ruta_lease(bloque)
+            if (_leer_json(ruta) or {}).get('token') != token:
+                with self._lock:
+                    if self._leases.pop(bloque, None) is not None:
+                        self.perdidos += 1
+                print(f"⚠️  Lease del bloque {bloque} perdido: otro nodo lo recuperó")
+                continue
+            try:
+                os.utime(ruta)
+            except FileNotFoundError:
+                pass
+
+    def iniciar_latido(self, intervalo=None):
+        """
+        Renueva los leases en un hilo de fondo.
+
+        Args:
+            intervalo (float): Segundos entre latidos (por defecto ttl / 4)
+        """
+        intervalo = intervalo or self.ttl / 4
+
+        def latir():
+            while not self._detener.wait(intervalo):
+                self.latir()
+
+        self._latido = threading.Thread(target=latir, name=f"latido-{self.nodo}", daemon=True)
+        self._latido.start()
+
+    def detener(self):
+        """Detiene el latido y suelta los leases que queden"""
+        self._detener.set()
+        if self._latido is not None:
+            self._latido.join()
+        for bloque in list(self._leases):
+            self._liberar(bloque)
+
+    def reclamar(self):
+        """
+        Reclama el siguiente bloque sin terminar y sin lease vivo.
+
+        Cada nodo empieza a recorrer los bloques en un punto distinto para
+        que no compitan todos por el primero.
+
+        Returns:
+            tuple: (bloque, intentos) o None si no hay ninguno disponible
+        """
+        n = self.trabajo['bloques']
+        hechos = self.hechos()
+        inicio = int(uuid.uuid5(uuid.NAMESPACE_DNS, self.nodo).int % n) if n else 0
+        for desplazamiento in range(n):
+            bloque = (inicio + desplazamiento) % n
+            if bloque in hechos:
+                continue
+            intentos = self._tomar(bloque)
+            if intentos is not None:
+                return bloque, intentos
+        return None
+
+    def completar(self, bloque, resultados, segundos=None):
+        """
+        Guarda los resultados de un bloque y lo marca terminado.
+
+        Los resultados se añaden en una sola escritura y se sincronizan con
+        el disco antes de crear la marca: un bloque marcado nunca pierde sus
+        resultados.
+
+        Args:
+            bloque (int): Bloque reclamado
+            resultados (list): Resultados de procesar_lote (con 'id' y 'ruta')
+            segundos (float): Tiempo de proceso del bloque (para el reporte)
+        """
+        contenido = "".join(json.dumps(dict(r, nodo=self.nodo, bloque=bloque), ensure_ascii=False) + "\n"
+                            for r in resultados)
+        with open(self.ruta_resultados, 'a', encoding='utf-8') as f:
+            f.write(contenido)
+            f.flush()
+            os.fsync(f.fileno())
+        _escribir_json(self._ruta_hecho(bloque), {
+            'nodo': self.nodo, 'archivos': len(resultados), 'terminado': time.time(),
+            'segundos': None if segundos is None else round(segundos, 3),
+            'fallidos': sum(r['estado'] == 'failed' for r in resultados)})
+        self._liberar(bloque)
+
+    def pendientes(self):
+        """True si queda algún bloque sin terminar"""
+        return len(self.hechos()) < self.trabajo['bloques']
+
+
+def progreso(directorio, ttl=TTL):
+    """
+    Estado del trabajo compartido visto desde la carpeta.
+
+    Args:
+        directorio (str): Carpeta compartida del trabajo
+        ttl (float): Segundos sin latido tras los que un lease cuenta como vencido
+
+    Returns:
+        dict: total, bloques, hechos, en_curso, vencidos, archivos_hechos,
+              fallidos y por_nodo (archivos terminados por cada nodo)
+    """
+    trabajo = _leer_json(os.path.join(directorio, 'trabajo.json')) or {'total': 0, 'bloques': 0}
+    por_nodo, archivos, fallidos = {}, 0, 0
+    for ruta in glob.glob(os.path.join(directorio, 'hechos', '*.json')):
+        marca = _leer_json(ruta) or {}
+        por_nodo[marca.get('nodo', '?')] = por_nodo.get(marca.get('nodo', '?'), 0) + marca.get('archivos', 0)
+        archivos += marca.get('archivos', 0)
+        fallidos += marca.get('fallidos', 0)
+    en_curso, vencidos = 0, 0
+    ahora = time.time()
+    for ruta in glob.glob(os.path.join(directorio, 'leases', '*.lease')):
+        try:
+            if ahora - os.stat(ruta).st_mtime < ttl:
+                en_curso += 1
+            else:
+                vencidos += 1
+        except FileNotFoundError:
+            pass
+    return {'total': trabajo['total'], 'bloques': trabajo['bloques'],
+            'hechos': len(glob.glob(os.path.join(directorio, 'hechos', '*.json'))),
+            'en_curso': en_curso, 'vencidos': vencidos, 'archivos_hechos': archivos,
+            'fallidos': fallidos, 'por_nodo': por_nodo}
+
+
+def ejecutar_nodo(directorio, nodo=None, tamano_lote=None, workers=None, model=None,
+                  ruta_modelo=None, ttl=TTL, max_intentos=MAX_INTENTOS, esperar=True):
+    """
+    Procesa bloques del trabajo compartido hasta que no quede ninguno.
+
+    Args:
+        directorio (str): Carpeta compartida del trabajo
+        nodo (str): Nombre único del nodo (por defecto host-pid)
+        tamano_lote (int): Imágenes por lote (por defecto según el planificador)
+        workers (int): Hilos para decodificar y preprocesar
+        model (tf.keras.Model): Modelo (por defecto el del pool de sesiones)
+        ruta_modelo (str): Archivo del modelo a cargar en lugar del principal
+        ttl (float): Segundos sin latido tras los que un lease vence
+        max_intentos (int): Leases vencidos tolerados por bloque
+        esperar (bool): Si no hay bloques libres pero otros nodos tienen
+            alguno en curso, seguir esperando por si vencen (un nodo que
+            muere no deja el trabajo incompleto)
+
+    Returns:
+        dict: Bloques y archivos procesados por este nodo, recuperados de
+            otros nodos y perdidos, más el progreso global
+    """
+    if ruta_modelo is not None:
+        try:
+            from .load_model import model_fun
+        except ImportError:
+            from src.modulos.load_model import model_fun
+        model = model_fun(ruta=ruta_modelo)
+        if model is None:
+            raise RuntimeError(f"No se pudo cargar el modelo: {ruta_modelo}")
+    if tamano_lote is None:
+        try:
+            from .batch_planner import tamano_lote_planificado
+        except ImportError:
+            from src.modulos.batch_planner import tamano_lote_planificado
+        tamano_lote = tamano_lote_planificado(model)
+
+    trabajo = TrabajoCompartido(directorio, nodo=nodo, ttl=ttl, max_intentos=max_intentos)
+    print(f"🖥️  Nodo {trabajo.nodo}: {trabajo.trabajo['bloques']} bloques en {directorio}")
+    trabajo.iniciar_latido()
+    bloques, archivos = 0, 0
+    inicio = time.time()
+    try:
+        while True:
+            reclamado = trabajo.reclamar()
+            if reclamado is None:
+                if not (esperar and trabajo.pendientes()):
+                    break
+                # Bloques en curso en otros nodos: esperar a que terminen o venzan
+                time.sleep(min(trabajo.ttl / 4, 5.0))
+                continue
+            bloque, intentos = reclamado
+            items = trabajo.items(bloque)
+            comienzo = time.perf_counter()
+            if intentos > trabajo.max_intentos:
+                print(f"❌ Bloque {bloque}: {intentos - 1} leases vencidos, se da por fallido")
+                resultados = [{'id': i, 'ruta': r, 'estado': 'failed',
+                               'error': f'el nodo se interrumpió {intentos - 1} veces con este bloque'}
+                              for i, r in items]
+            else:
+                resultados = []
+                for desde in range(0, len(items), tamano_lote):
+                    resultados.extend(procesar_lote(items[desde:desde + tamano_lote],
+                                                    workers=workers, model=model))
+            trabajo.completar(bloque, resultados, time.perf_counter() - comienzo)
+            bloques += 1
+            archivos += len(items)
+            segundos = time.time() - inicio
+            print(f"   - [{trabajo.nodo}] bloque {bloque}: {len(trabajo.hechos())}/{trabajo.trabajo['bloques']} bloques | "
+                  f"{archivos / segundos:.2f} img/s en este nodo | {formatear_segundos(segundos)}")
+    finally:
+        trabajo.detener()
+
+    reporte = {'nodo': trabajo.nodo, 'bloques': bloques, 'archivos': archivos,
+               'recuperados': trabajo.recuperados, 'perdidos': trabajo.perdidos,
+               'segundos': round(time.time() - inicio, 3), 'progreso': progreso(directorio, trabajo.ttl)}
+    print(f"✅ Nodo {trabajo.nodo} terminado: {bloques} bloques, {archivos} archivos "
+          f"({trabajo.recuperados} recuperados de otros nodos)")
+    return reporte
+
+
+def _nodo_local(directorio, nodo, opciones, mensajes):
+    """Proceso que hace de nodo en lanzar_nodos"""
+    try:
+        mensajes.put(('fin', nodo, ejecutar_nodo(directorio, nodo=nodo, **opciones)))
+    except Exception as e:
+        mensajes.put(('error', nodo, str(e)))
+
+
+def lanzar_nodos(directorio, procesos=2, prefijo=None, **opciones):
+    """
+    Ejecuta varios nodos como procesos locales (pruebas, o varios nodos por máquina).
+
+    Args:
+        directorio (str): Carpeta compartida del trabajo
+        procesos (int): Nodos a lanzar
+        prefijo (str): Prefijo de los nombres de nodo (por defecto el host)
+        **opciones: Argumentos de ejecutar_nodo (el modelo se pasa como
+            ``ruta_modelo``: cada proceso carga el suyo)
+
+    Returns:
+        list: Reporte de cada nodo (ver ejecutar_nodo)
+
+    Raises:
+        RuntimeError: Si algún nodo falló
+    """
+    prefijo = prefijo or socket.gethostname()
+    perfil = perfil_activo()
+    if perfil is not None:
+        # Los nodos aplican el mismo perfil antes de importar TensorFlow
+        os.environ.setdefault('NEUMONIA_PERFIL', perfil['nombre'])
+    # spawn: TensorFlow no admite fork después de inicializarse
+    contexto = multiprocessing.get_context('spawn')
+    mensajes = contexto.Queue()
+    nodos = [f"{prefijo}-{k}" for k in range(max(1, int(procesos)))]
+    lanzados = [contexto.Process(target=ejecutar_con_perfil, name=nodo,
+                                 args=(__name__, '_nodo_local', directorio, nodo, opciones, mensajes))
+                for nodo in nodos]
+    for proceso in lanzados:
+        proceso.start()
+    reportes, errores = {}, {}
+    for _ in lanzados:
+        tipo, nodo, datos = mensajes.get()
+        (reportes if tipo == 'fin' else errores)[nodo] = datos
+    for proceso in lanzados:
+        proceso.join()
+    if errores:
+        raise RuntimeError(f"Nodos con error: {errores}")
+    return [reportes[nodo] for nodo in nodos]
+
+
+def fusionar(directorio, ruta_db):
+    """
+    Reúne los resultados de todos los nodos en una ColaTrabajos local.
+
+    Si un archivo aparece varias veces (bloque repetido tras recuperar un
+    lease) se conserva un solo resultado, preferentemente uno done. Las
+    líneas incompletas (un nodo que murió escribiendo) se ignoran: su
+    bloque no tiene marca y otro nodo lo volvió a procesar. Los archivos
+    sin resultado quedan pending.
+
+    Args:
+        directorio (str): Carpeta compartida del trabajo
+        ruta_db (str): Archivo SQLite de destino (ver ColaTrabajos)
+
+    Returns:
+        dict: total, done, failed, pending, duplicados y nodos
+    """
+    trabajo = _leer_json(os.path.join(directorio, 'trabajo.json'))
+    if trabajo is None:
+        raise FileNotFoundError(f"No hay un trabajo en {directorio}")
+    items = {}
+    for ruta in sorted(glob.glob(os.path.join(directorio, 'bloques', '*.json'))):
+        items.update((int(i), r) for i, r in _leer_json(ruta))
+
+    resultados, duplicados, nodos = {}, 0, set()
+    for ruta in sorted(glob.glob(os.path.join(directorio, 'resultados', '*.jsonl'))):
+        with open(ruta, encoding='utf-8') as f:
+            for linea in f:
+                try:
+                    resultado = json.loads(linea)
+                except ValueError:
+                    continue
+                nodos.add(resultado.get('nodo'))
+                previo = resultados.get(resultado['id'])
+                if previo is not None:
+                    duplicados += 1
+                    if previo['estado'] == 'done' or resultado['estado'] != 'done':
+                        continue
+                resultados[resultado['id']] = resultado
+
+    cola = ColaTrabajos(ruta_db)
+    try:
+        cola.agregar(items[i] for i in sorted(items))
+        ids = cola.ids_por_ruta()
+        cola.registrar([dict(r, id=ids[normalizar_ruta(r['ruta'])]) for r in resultados.values()])
+        estado = cola.progreso()
+    finally:
+        cola.close()
+    reporte = {'total': len(items), 'done': estado['done'], 'failed': estado['failed'],
+               'pending': estado['pending'], 'duplicados': duplicados, 'nodos': sorted(nodos)}
+    print(f"🔗 Fusionados {len(resultados)} resultados de {len(nodos)} nodos en {ruta_db}: "
+          f"{reporte['done']} hechos, {reporte['failed']} fallidos, {reporte['pending']} pendientes"
+          f"{f', {duplicados} duplicados descartados' if duplicados else ''}")
+    return reporte
@@ -7,11 +7,468 @@ Visualiza las regiones de la imagen que más influyen en la predicción del mode
 Versión actualizada para TensorFlow 2.x con eager execution.
 """
 
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
 import numpy as np
 import cv2
 import tensorflow as tf
 from tensorflow.keras import backend as K
 
+try:
+    from .preprocess_img import get_preprocessor
+    from .overlay import get_renderizador
+except ImportError:
+    from src.modulos.preprocess_img import get_preprocessor
+    from src.modulos.overlay import get_renderizador
+
+# Modelos auxiliares (entrada -> activaciones, salida) reutilizados entre llamadas:
+# modelo -> {capa: (grad_model, capa_softmax)}. La clave es débil para que un
+# modelo retirado se libere aunque un resultado antiguo vuelva a pedir su mapa
+_modelos_grad_cam = weakref.WeakKeyDictionary()
+_modelos_grad_cam_lock = threading.Lock()
+
+# Activaciones y pesos por clase de los últimos estudios (LRU)
+_cache_estudios = OrderedDict()
+_cache_estudios_lock = threading.Lock()
+_MAX_ESTUDIOS = 32
+
+def obtener_modelo_grad_cam(model, conv_layer_name="conv10_thisone"):
+    """
+    Construye (una sola vez por modelo y capa) el modelo auxiliar que
+    devuelve las activaciones de la capa convolucional y la salida.
+    
+    Si la última capa es una Dense con softmax, el modelo auxiliar devuelve
+    su entrada para poder calcular los logits de cada clase.
+    
+    Args:
+        model (tf.keras.Model): Modelo cargado
+        conv_layer_name (str): Nombre de la capa convolucional para Grad-CAM
+        
+    Returns:
+        tuple: (grad_model, capa_softmax) o (None, None) si no hay capa adecuada
+    """
+    with _modelos_grad_cam_lock:
+        entrada = _modelos_grad_cam.get(model, {}).get(conv_layer_name)
+    if entrada is not None:
+        return entrada
+    
+    try:
+        target_layer = model.get_layer(conv_layer_name)
+    except ValueError:
+        print(f"❌ No se encontró la capa '{conv_layer_name}'")
+        # Intentar encontrar una capa convolucional alternativa
+        target_layer = encontrar_capa_convolucional_alternativa(model)
+        if target_layer is None:
+            return None, None
+    
+    capa_salida = model.layers[-1]
+    capa_softmax = None
+    if (isinstance(capa_salida, tf.keras.layers.Dense)
+            and getattr(capa_salida.activation, '__name__', '') == 'softmax'):
+        capa_softmax = capa_salida
+        salida = capa_salida.input
+    else:
+        salida = model.outputs[0]
+    
+    grad_model = tf.keras.models.Model(
+        inputs=model.inputs[0],
+        outputs=[target_layer.output, salida]
+    )
+    with _modelos_grad_cam_lock:
+        _modelos_grad_cam.setdefault(model, {})[conv_layer_name] = (grad_model, capa_softmax)
+    return grad_model, capa_softmax
+
+def _activaciones_y_logits(grad_model, capa_softmax, tensor):
+    """
+    Forward del modelo auxiliar; debe llamarse dentro de un GradientTape.
+    Los logits salen en float32 aunque el modelo calcule en precisión
+    reducida (ver precision); las activaciones, en el tipo del modelo.
+    """
+    conv_outputs, salida = grad_model(tensor, training=False)
+    salida = tf.cast(salida, tf.float32)
+    if capa_softmax is None:
+        return conv_outputs, salida
+    logits = tf.matmul(salida, tf.cast(capa_softmax.kernel, tf.float32))
+    if capa_softmax.use_bias:
+        logits = logits + tf.cast(capa_softmax.bias, tf.float32)
+    return conv_outputs, logits
+
+def calcular_cam(model, tensor, clase=None, conv_layer_name="conv10_thisone"):
+    """
+    Calcula el mapa Grad-CAM en la resolución de la capa convolucional
+    (31x31 para conv10_thisone), sin redimensionar ni colorear.
+    
+    Args:
+        model (tf.keras.Model): Modelo cargado
+        tensor (numpy.ndarray): Imagen preprocesada (1, 512, 512, 1)
+        clase (int): Clase objetivo (por defecto la predicha)
+        conv_layer_name (str): Nombre de la capa convolucional para Grad-CAM
+        
+    Returns:
+        numpy.ndarray: CAM uint8 (alto, ancho) escalado a [0, 255]
+                      o None en caso de error
+    """
+    try:
+        grad_model, capa_softmax = obtener_modelo_grad_cam(model, conv_layer_name)
+        if grad_model is None:
+            return None
+        
+        with tf.GradientTape() as tape:
+            conv_outputs, logits = _activaciones_y_logits(grad_model, capa_softmax, tensor)
+            if clase is None:
+                clase = int(tf.argmax(logits[0]))
+            loss = logits[:, clase]
+        
+        grads = tape.gradient(loss, conv_outputs)
+        if grads is None:
+            print("⚠️  Gradientes son None")
+            return None
+        
+        # Promediar gradientes espacialmente y ponderar los mapas de características
+        pooled_grads = tf.reduce_mean(tf.cast(grads, tf.float32), axis=(0, 1, 2))
+        heatmap = tf.reduce_sum(tf.cast(conv_outputs[0], tf.float32) * pooled_grads, axis=-1).numpy()
+        
+        return escalar_cam(heatmap)
+        
+    except Exception as e:
+        print(f"❌ Error en cálculo de Grad-CAM: {e}")
+        return None
+
+def grad_cam_batch(model, batch, clases=None, conv_layer_name="conv10_thisone"):
+    """
+    Grad-CAM de N imágenes con una sola GradientTape y una única pasada
+    forward/backward. Los gradientes se promedian por muestra (ejes
+    espaciales), no sobre todo el batch.
+    
+    Args:
+        model (tf.keras.Model): Modelo cargado
+        batch (numpy.ndarray): Imágenes preprocesadas (N, 512, 512, 1)
+        clases (array-like): Clase objetivo por imagen (por defecto la predicha)
+        conv_layer_name (str): Nombre de la capa convolucional para Grad-CAM
+        
+    Returns:
+        tuple: (cams uint8 (N, alto, ancho), probabilidades (N, clases))
+               o (None, None) en caso de error
+    """
+    try:
+        grad_model, capa_softmax = obtener_modelo_grad_cam(model, conv_layer_name)
+        if grad_model is None:
+            return None, None
+        
+        with tf.GradientTape() as tape:
+            conv_outputs, logits = _activaciones_y_logits(grad_model, capa_softmax, batch)
+            if clases is None:
+                clases = tf.argmax(logits, axis=1)
+            clases = tf.cast(tf.reshape(clases, (-1,)), tf.int32)
+            # Cada muestra solo influye en su propio score: la suma separa los gradientes
+            loss = tf.reduce_sum(tf.gather(logits, clases, axis=1, batch_dims=1))
+        
+        grads = tape.gradient(loss, conv_outputs)
+        if grads is None:
+            print("⚠️  Gradientes son None")
+            return None, None
+        
+        pooled_grads = tf.reduce_mean(tf.cast(grads, tf.float32), axis=(1, 2))  # (N, canales)
+        heatmaps = tf.einsum('nhwc,nc->nhw', tf.cast(conv_outputs, tf.float32), pooled_grads).numpy()
+        probabilidades = tf.nn.softmax(logits) if capa_softmax is not None else logits
+        
+        return escalar_cams(heatmaps), probabilidades.numpy()
+        
+    except (MemoryError, tf.errors.ResourceExhaustedError):
+        # El planificador de lotes reintenta con un lote más pequeño
+        raise
+    except Exception as e:
+        print(f"❌ Error en Grad-CAM por lotes: {e}")
+        return None, None
+
+def escalar_cams(heatmaps):
+    """
+    Versión vectorizada de escalar_cam para un lote (N, alto, ancho).
+    
+    Args:
+        heatmaps (numpy.ndarray): Mapas de activación en punto flotante
+        
+    Returns:
+        numpy.ndarray: CAMs uint8 con la misma forma
+    """
+    heatmaps = np.maximum(heatmaps, 0)
+    maximos = heatmaps.max(axis=(1, 2), keepdims=True)
+    cams = np.full(heatmaps.shape, 128, dtype=np.uint8)
+    validos = maximos[:, 0, 0] > 0
+    cams[validos] = np.round(255 * heatmaps[validos] / maximos[validos]).astype(np.uint8)
+    return cams
+
+class ActivacionesCam:
+    """
+    Activaciones de la capa convolucional y pesos Grad-CAM de todas las clases
+    para un estudio. Con esto el mapa de cualquier clase sale de un producto
+    matricial, sin volver a ejecutar el modelo.
+    """
+    
+    def __init__(self, activaciones, pesos, logits):
+        self.activaciones = activaciones.astype(np.float16)  # (alto, ancho, canales)
+        self.pesos = pesos.astype(np.float32)                # (clases, canales)
+        self.logits = logits.astype(np.float32)              # (clases,)
+    
+    @property
+    def num_clases(self):
+        return self.pesos.shape[0]
+    
+    @property
+    def nbytes(self):
+        return self.activaciones.nbytes + self.pesos.nbytes + self.logits.nbytes
+    
+    def mapa(self, clase):
+        """
+        CAM de una clase a partir de las activaciones guardadas.
+        
+        Args:
+            clase (int): Índice de la clase
+            
+        Returns:
+            numpy.ndarray: CAM uint8 (alto, ancho)
+        """
+        heatmap = np.tensordot(self.activaciones.astype(np.float32), self.pesos[clase], axes=([2], [0]))
+        return escalar_cam(heatmap)
+
+def calcular_activaciones_cam(model, tensor, conv_layer_name="conv10_thisone"):
+    """
+    Calcula en una sola pasada las activaciones y los gradientes de los
+    logits de todas las clases (Jacobiano vectorizado).
+    
+    Args:
+        model (tf.keras.Model): Modelo cargado
+        tensor (numpy.ndarray): Imagen preprocesada (1, 512, 512, 1)
+        conv_layer_name (str): Nombre de la capa convolucional para Grad-CAM
+        
+    Returns:
+        ActivacionesCam: Activaciones y pesos por clase o None en caso de error
+    """
+    try:
+        grad_model, capa_softmax = obtener_modelo_grad_cam(model, conv_layer_name)
+        if grad_model is None:
+            return None
+        
+        with tf.GradientTape() as tape:
+            conv_outputs, logits = _activaciones_y_logits(grad_model, capa_softmax, tensor)
+            logits_estudio = logits[0]
+        
+        # (clases, 1, alto, ancho, canales): una fila de gradientes por clase
+        jacobiano = tape.jacobian(logits_estudio, conv_outputs)
+        if jacobiano is None:
+            print("⚠️  Gradientes son None")
+            return None
+        pesos = tf.reduce_mean(tf.cast(jacobiano, tf.float32), axis=(1, 2, 3))
+        
+        return ActivacionesCam(conv_outputs[0].numpy(), pesos.numpy(), logits_estudio.numpy())
+        
+    except Exception as e:
+        print(f"❌ Error en cálculo de activaciones Grad-CAM: {e}")
+        return None
+
+def obtener_activaciones_cam(model, tensor, clave=None, conv_layer_name="conv10_thisone"):
+    """
+    Devuelve las activaciones Grad-CAM de un estudio, calculándolas solo la
+    primera vez. Las últimas se guardan en una caché LRU en memoria.
+    
+    Args:
+        model (tf.keras.Model): Modelo cargado
+        tensor (numpy.ndarray): Imagen preprocesada (1, 512, 512, 1)
+        clave (str): Identificador del estudio (por defecto, hash del tensor)
+        conv_layer_name (str): Nombre de la capa convolucional para Grad-CAM
+        
+    Returns:
+        ActivacionesCam: Activaciones y pesos por clase o None en caso de error
+    """
+    if clave is None:
+        clave = hashlib.sha1(np.ascontiguousarray(tensor).data).hexdigest()
+    clave = (id(model), conv_layer_name, clave)
+    
+    with _cache_estudios_lock:
+        entrada = _cache_estudios.get(clave)
+        # La referencia débil evita confundir un modelo nuevo que reutilice el id
+        if entrada is not None and entrada[0]() is model:
+            _cache_estudios.move_to_end(clave)
+            return entrada[1]
+    
+    activaciones = calcular_activaciones_cam(model, tensor, conv_layer_name)
+    if activaciones is not None:
+        with _cache_estudios_lock:
+            _cache_estudios[clave] = (weakref.ref(model), activaciones)
+            while len(_cache_estudios) > _MAX_ESTUDIOS:
+                _cache_estudios.popitem(last=False)
+    return activaciones
+
+def olvidar_modelo(model):
+    """
+    Descarta el modelo auxiliar y las activaciones en caché de un modelo
+    (p. ej. al sustituirlo por una versión nueva). Ninguna de las dos cachés
+    mantiene vivo al modelo; esto solo adelanta la liberación de lo que
+    ocupan.
+    
+    Args:
+        model (tf.keras.Model): Modelo retirado
+    """
+    with _modelos_grad_cam_lock:
+        _modelos_grad_cam.pop(model, None)
+    with _cache_estudios_lock:
+        for clave in [c for c, e in _cache_estudios.items() if e[0]() is model]:
+            del _cache_estudios[clave]
+
+# Explicadores disponibles: Grad-CAM (con backpropagation) y dos variantes
+# que solo usan pasadas forward, para cribados de alto volumen
+EXPLICADORES = ("gradcam", "activaciones", "scorecam")
+
+def predecir_con_activaciones(model, tensor, conv_layer_name="conv10_thisone"):
+    """
+    Ejecuta una única pasada forward que devuelve a la vez las
+    probabilidades y las activaciones de la capa convolucional.
+    
+    Args:
+        model (tf.keras.Model): Modelo cargado
+        tensor (numpy.ndarray): Imagen(es) preprocesada(s) (N, 512, 512, 1)
+        conv_layer_name (str): Nombre de la capa convolucional
+        
+    Returns:
+        tuple: (probabilidades (N, clases), activaciones (N, alto, ancho, canales))
+               o (None, None) en caso de error
+    """
+    try:
+        grad_model, capa_softmax = obtener_modelo_grad_cam(model, conv_layer_name)
+        if grad_model is None:
+            return None, None
+        conv_outputs, logits = _activaciones_y_logits(grad_model, capa_softmax, tensor)
+        probabilidades = tf.nn.softmax(logits) if capa_softmax is not None else logits
+        return probabilidades.numpy(), conv_outputs.numpy()
+    except Exception as e:
+        print(f"❌ Error en la pasada con activaciones: {e}")
+        return None, None
+
+def cam_por_activaciones(activaciones):
+    """
+    CAM sin gradientes: cada canal se pondera por su activación media.
+    No depende de la clase; resalta las regiones con más energía en la capa.
+    
+    Args:
+        activaciones (numpy.ndarray): Activaciones (alto, ancho, canales)
+        
+    Returns:
+        numpy.ndarray: CAM uint8 (alto, ancho)
+    """
+    activaciones = np.asarray(activaciones, dtype=np.float32)
+    pesos = activaciones.mean(axis=(0, 1))
+    return escalar_cam(np.tensordot(activaciones, pesos, axes=([2], [0])))
+
+def calcular_score_cam(model, tensor, clase=None, presupuesto=16, lote=16,
+                       conv_layer_name="conv10_thisone", activaciones=None):
+    """
+    Score-CAM con presupuesto fijo: los ``presupuesto`` canales más activos
+    se usan como máscaras sobre la entrada y cada canal se pondera por el
+    score que obtiene la imagen enmascarada. Solo pasadas forward, en lotes.
+    
+    Args:
+        model (tf.keras.Model): Modelo cargado
+        tensor (numpy.ndarray): Imagen preprocesada (1, 512, 512, 1)
+        clase (int): Clase objetivo (por defecto la predicha)
+        presupuesto (int): Número de pasadas enmascaradas
+        lote (int): Máscaras evaluadas por pasada del modelo
+        conv_layer_name (str): Nombre de la capa convolucional
+        activaciones (numpy.ndarray): Activaciones (alto, ancho, canales) ya
+            calculadas, para ahorrar la primera pasada
+        
+    Returns:
+        numpy.ndarray: CAM uint8 (alto, ancho) o None en caso de error
+    """
+    try:
+        if activaciones is None or clase is None:
+            probabilidades, conv = predecir_con_activaciones(model, tensor, conv_layer_name)
+            if conv is None:
+                return None
+            activaciones = conv[0]
+            if clase is None:
+                clase = int(np.argmax(probabilidades[0]))
+        activaciones = np.asarray(activaciones, dtype=np.float32)
+        
+        # Canales con mayor activación media
+        canales = np.argsort(activaciones.mean(axis=(0, 1)))[::-1][:presupuesto]
+        alto, ancho = tensor.shape[1:3]
+        
+        mascaras = np.empty((len(canales), alto, ancho, 1), dtype=np.float32)
+        for i, canal in enumerate(canales):
+            mapa = cv2.resize(activaciones[:, :, canal], (ancho, alto))
+            minimo, maximo = mapa.min(), mapa.max()
+            mascaras[i, ..., 0] = (mapa - minimo) / (maximo - minimo) if maximo > minimo else 0.0
+        entradas = mascaras * tensor[0]
+        
+        grad_model, capa_softmax = obtener_modelo_grad_cam(model, conv_layer_name)
+        scores = []
+        for inicio in range(0, len(entradas), lote):
+            _, logits = _activaciones_y_logits(grad_model, capa_softmax, entradas[inicio:inicio + lote])
+            scores.append(logits.numpy()[:, clase])
+        scores = np.concatenate(scores)
+        
+        # Pesos = softmax de los scores de las imágenes enmascaradas
+        pesos = np.exp(scores - scores.max())
+        pesos /= pesos.sum()
+        heatmap = np.tensordot(activaciones[:, :, canales], pesos, axes=([2], [0]))
+        return escalar_cam(heatmap)
+        
+    except Exception as e:
+        print(f"❌ Error en cálculo de Score-CAM: {e}")
+        return None
+
+def escalar_cam(heatmap):
+    """
+    Aplica ReLU y escala un mapa de activación a uint8 [0, 255].
+    
+    Args:
+        heatmap (numpy.ndarray): Mapa de activación en punto flotante
+        
+    Returns:
+        numpy.ndarray: CAM uint8 con la misma forma
+    """
+    heatmap = np.maximum(heatmap, 0)
+    maximo = float(np.max(heatmap))
+    if maximo > 0:
+        return np.uint8(np.round(255 * heatmap / maximo))
+    print("⚠️  Heatmap vacío, usando valores por defecto")
+    return np.full(heatmap.shape, 128, dtype=np.uint8)
+
+def renderizar_overlay(cam, array, target_size=(512, 512), alpha=0.5):
+    """
+    Superpone un CAM de baja resolución sobre la imagen original.
+    Todo se calcula directamente en el tamaño de visualización pedido.
+    
+    Args:
+        cam (numpy.ndarray): CAM uint8 de baja resolución
+        array (numpy.ndarray): Imagen original
+        target_size (tuple): Tamaño de salida (ancho, alto)
+        alpha (float): Transparencia del heatmap
+        
+    Returns:
+        numpy.ndarray: Imagen RGB con el mapa de calor superpuesto
+    """
+    return get_renderizador(target_size, alpha).render(cam, array)
+
+def renderizar_overlays(cams, arrays, target_size=(512, 512), alpha=0.5):
+    """
+    Superpone un lote de CAMs sobre sus imágenes originales.
+    El mapa de colores y la mezcla se aplican a todo el lote de una vez.
+    
+    Args:
+        cams (numpy.ndarray): CAMs uint8 (N, alto, ancho)
+        arrays (list): Imágenes originales (pueden tener tamaños distintos)
+        target_size (tuple): Tamaño de salida (ancho, alto)
+        alpha (float): Transparencia del heatmap
+        
+    Returns:
+        numpy.ndarray: Imágenes RGB (N, alto, ancho, 3)
+    """
+    return get_renderizador(target_size, alpha).render_batch(cams, arrays)
+
 def grad_cam(model, array, conv_layer_name="conv10_thisone"):
     """
     Genera un mapa de calor Grad-CAM para la imagen proporcionada.
@@ -34,114 +491,26 @@ def grad_cam(model, array, conv_layer_name="conv10_thisone"):
             print("❌ Error en el preprocesamiento: El array de entrada es None")
             return None
         
-        # 1. PREPROCESAR la imagen (versión simplificada para prueba)
-        try:
-            # Procesamiento básico para la prueba
-            if len(array.shape) == 3 and array.shape[2] == 3:
-                # Convertir RGB a escala de grises
-                img_gray = cv2.cvtColor(array, cv2.COLOR_RGB2GRAY)
-            else:
-                img_gray = array
-            
-            # Redimensionar a 512x512
-            img_resized = cv2.resize(img_gray, (512, 512))
-            
-            # Normalizar y expandir dimensiones
-            img_normalized = img_resized.astype(np.float32) / 255.0
-            img_preprocesada = np.expand_dims(img_normalized, axis=0)  # Batch dimension
-            img_preprocesada = np.expand_dims(img_preprocesada, axis=-1)  # Channel dimension
-            
-            print(f"🔧 Imagen preprocesada: {img_preprocesada.shape}")
-            
-        except Exception as e:
-            print(f"❌ Error en preprocesamiento simplificado: {e}")
-            return None
-        
-        # 2. VALIDAR el modelo
+        # 1. VALIDAR el modelo
         if model is None:
             print("❌ Modelo no disponible para Grad-CAM")
             return None
         
-        # 3. OBTENER la predicción y clase objetivo
+        # 2. PREPROCESAR la imagen igual que para la predicción
         try:
-            preds = model.predict(img_preprocesada, verbose=0)
-            class_idx = np.argmax(preds[0])
-            print(f"   - Clase predicha: {class_idx}, Probabilidad: {np.max(preds[0]):.3f}")
+            img_preprocesada = get_preprocessor().preprocess(array)
         except Exception as e:
-            print(f"❌ Error en predicción: {e}")
-            class_idx = 0  # Usar clase por defecto
+            print(f"❌ Error en preprocesamiento: {e}")
+            return None
         
-        # 4. OBTENER la capa convolucional objetivo
-        try:
-            target_layer = model.get_layer(conv_layer_name)
-            print(f"   - Capa objetivo: {conv_layer_name}")
-        except ValueError:
-            print(f"❌ No se encontró la capa '{conv_layer_name}'")
-            # Intentar encontrar una capa convolucional alternativa
-            target_layer = encontrar_capa_convolucional_alternativa(model)
-            if target_layer is None:
-                return generar_heatmap_simulado(array)
-        
-        # 5. CALCULAR Grad-CAM usando método compatible con TensorFlow 2.x
-        try:
-            # Crear un modelo que devuelva tanto la salida como las activaciones de la capa
-            grad_model = tf.keras.models.Model(
-                inputs=[model.inputs],
-                outputs=[model.output, target_layer.output]
-            )
-            
-            # Calcular gradientes usando GradientTape (método moderno de TF 2.x)
-            with tf.GradientTape() as tape:
-                conv_outputs, predictions = grad_model(img_preprocesada)
-                loss = predictions[:, :, :, :]  # Usar todas las características
-                if len(predictions.shape) == 4:  # Para capas convolucionales
-                    loss = tf.reduce_mean(loss, axis=[1, 2])
-            
-            # Obtener gradientes
-            grads = tape.gradient(loss, conv_outputs)
-            
-            # Manejar caso donde grads es None
-            if grads is None:
-                print("⚠️  Gradientes son None, usando método alternativo")
-                return generar_heatmap_simulado(array)
-            
-            # Promediar gradientes espacialmente
-            pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
-            
-            # Ponderar los mapas de características con los gradientes
-            conv_outputs = conv_outputs[0]  # Primer batch
-            heatmap = tf.reduce_mean(tf.multiply(conv_outputs, pooled_grads), axis=-1)
-            
-            # Aplicar ReLU
-            heatmap = np.maximum(heatmap, 0)
-            
-        except Exception as e:
-            print(f"❌ Error en cálculo de Grad-CAM: {e}")
+        # 3. CALCULAR Grad-CAM en la resolución de la capa convolucional
+        cam = calcular_cam(model, img_preprocesada, conv_layer_name=conv_layer_name)
+        if cam is None:
             print("🔄 Usando método de heatmap simulado...")
             return generar_heatmap_simulado(array)
         
-        # 6. NORMALIZAR el heatmap
-        if np.max(heatmap) > 0:
-            heatmap /= np.max(heatmap)
-        else:
-            print("⚠️  Heatmap vacío, usando valores por defecto")
-            heatmap = np.ones_like(heatmap) * 0.5
-        
-        # 7. PREPARAR visualización
-        heatmap = cv2.resize(heatmap.numpy() if hasattr(heatmap, 'numpy') else heatmap, 
-                            (512, 512))
-        heatmap = np.uint8(255 * heatmap)
-        heatmap_color = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
-        
-        # 8. PREPARAR imagen original
-        img_original = preparar_imagen_original(array, (512, 512))
-        
-        # 9. SUPERPOR heatmap sobre imagen original
-        alpha = 0.5  # Transparencia del heatmap
-        imagen_superpuesta = cv2.addWeighted(img_original, 1-alpha, heatmap_color, alpha, 0)
-        
-        # 10. CONVERTIR de BGR a RGB para visualización correcta
-        imagen_superpuesta_rgb = cv2.cvtColor(imagen_superpuesta, cv2.COLOR_BGR2RGB)
+        # 4. SUPERPONER heatmap sobre imagen original
+        imagen_superpuesta_rgb = renderizar_overlay(cam, array, (512, 512))
         
         print("✅ Grad-CAM generado exitosamente")
         return imagen_superpuesta_rgb
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Carpeta vigilada para la ingesta continua de estudios nuevos.
+
+El PACS deja los DICOM exportados en una carpeta compartida. El observador
+la recorre con ``os.scandir`` (el tipo de cada entrada sale del propio
+listado y solo los archivos todavía no encolados se consultan con ``stat``;
+en carpetas compartidas por red inotify no avisa de todos modos) y da por
+completo un archivo cuando su tamaño y su fecha de modificación no cambian
+durante ``estabilidad`` segundos.
+
+Los archivos completos entran en una ColaTrabajos, que hace de almacén de
+resultados y permite reanudar tras una caída. Se procesan en micro-lotes:
+en cuanto hay ``tamano_lote`` listos o el más antiguo lleva ``max_espera``
+segundos esperando. Para cada archivo se mide la latencia desde que se vio
+por primera vez en la carpeta hasta que su resultado quedó confirmado.
+"""
+
+import os
+import time
+
+import numpy as np
+
+try:
+    from .job_queue import procesar_lote, confirmar_heatmaps, EXTENSIONES
+    from .output_sink import SalidaAsincrona, imprimir_estadisticas as imprimir_salida
+except ImportError:
+    from src.modulos.job_queue import procesar_lote, confirmar_heatmaps, EXTENSIONES
+    from src.modulos.output_sink import SalidaAsincrona, imprimir_estadisticas as imprimir_salida
+
+
+class ObservadorCarpeta:
+    """
+    Vigila una carpeta y clasifica cada imagen nueva cuando termina de escribirse.
+
+    Uso:
+        cola = ColaTrabajos('data/entrantes.sqlite')
+        ObservadorCarpeta('/pacs/export', cola, heatmaps='data/heatmaps').ejecutar()
+    """
+
+    def __init__(self, directorio, cola, heatmaps=None, tamano_lote=8, max_espera=0.5,
+                 intervalo=0.5, estabilidad=1.0, recursivo=True, workers=None, model=None):
+        """
+        Args:
+            directorio (str): Carpeta vigilada
+            cola (ColaTrabajos): Almacén de resultados (archivos ya vistos incluidos)
+            heatmaps (str o SalidaAsincrona): Carpeta donde guardar los heatmaps,
+                o salida asíncrona con su formato (None = sin heatmaps). Se
+                escriben en segundo plano y cada ciclo espera a que estén todos
+            tamano_lote (int): Imágenes por micro-lote
+            max_espera (float): Segundos máximos que un archivo listo espera a su lote
+            intervalo (float): Segundos entre recorridos de la carpeta
+            estabilidad (float): Segundos sin cambios para dar un archivo por completo
+            recursivo (bool): Vigilar también las subcarpetas
+            workers (int): Hilos para decodificar y preprocesar
+            model (tf.keras.Model): Modelo (por defecto el del pool de sesiones)
+        """
+        self.directorio = os.path.abspath(directorio)
+        self.cola = cola
+        if isinstance(heatmaps, str):
+            heatmaps = SalidaAsincrona(heatmaps)
+        self.heatmaps = heatmaps
+        self.tamano_lote = max(1, int(tamano_lote))
+        self.max_espera = float(max_espera)
+        self.intervalo = float(intervalo)
+        self.estabilidad = float(estabilidad)
+        self.recursivo = recursivo
+        self.workers = workers
+        self.model = model
+
+        # Archivos ya encolados (también los de ejecuciones anteriores)
+        self._conocidos = cola.rutas()
+        # ruta -> (tamaño, mtime_ns, primera vez visto, sin cambios desde)
+        self._en_escritura = {}
+        # Momento en que quedó completo el archivo más antiguo sin procesar
+        self._listo_desde = None
+        self._listos = 0
+        self.latencias = []
+        self._detener = False
+
+    def _recorrer(self, directorio):
+        """Entradas de archivo de la carpeta (y subcarpetas) con extensión reconocida"""
+        try:
+            with os.scandir(directorio) as entradas:
+                for entrada in entradas:
+                    if entrada.name.startswith('.'):
+                        continue
+                    if entrada.is_dir(follow_symlinks=False):
+                        if self.recursivo:
+                            yield from self._recorrer(entrada.path)
+                    elif entrada.name.lower().endswith(EXTENSIONES):
+                        yield entrada
+        except OSError as e:
+            print(f"⚠️  No se pudo recorrer {directorio}: {e}")
+
+    def escanear(self, ahora=None):
+        """
+        Recorre la carpeta una vez y devuelve los archivos que terminaron de escribirse.
+
+        Args:
+            ahora (float): Momento del recorrido (por defecto time.time())
+
+        Returns:
+            list: Tuplas (ruta, llegada) listas para encolar
+        """
+        ahora = time.time() if ahora is None else ahora
+        completos = []
+        presentes = set()
+        for entrada in self._recorrer(self.directorio):
+            ruta = entrada.path
+            if ruta in self._conocidos:
+                continue
+            presentes.add(ruta)
+            try:
+                info = entrada.stat()
+            except OSError:
+                continue
+            firma = (info.st_size, info.st_mtime_ns)
+            previo = self._en_escritura.get(ruta)
+            if previo is None or previo[:2] != firma:
+                llegada = ahora if previo is None else previo[2]
+                self._en_escritura[ruta] = firma + (llegada, ahora)
+            elif info.st_size > 0 and ahora - previo[3] >= self.estabilidad:
+                completos.append((ruta, previo[2]))
+
+        # Archivos que desaparecieron antes de completarse (movidos o borrados)
+        for ruta in set(self._en_escritura) - presentes:
+            del self._en_escritura[ruta]
+        for ruta, _ in completos:
+            del self._en_escritura[ruta]
+            self._conocidos.add(ruta)
+        return completos
+
+    def procesar_pendientes(self):
+        """
+        Clasifica todos los archivos pending de la cola en micro-lotes.
+
+        Returns:
+            int: Archivos procesados
+        """
+        procesados = 0
+        while True:
+            items = self.cola.reclamar(self.tamano_lote)
+            if not items:
+                break
+            resultados = procesar_lote(items, workers=self.workers, model=self.model,
+                                       heatmaps=self.heatmaps)
+            if self.heatmaps is not None:
+                confirmar_heatmaps(self.heatmaps, resultados)
+            self.cola.registrar(resultados)
+            self.latencias.extend(self.cola.latencias([i for i, _ in items]))
+            procesados += len(items)
+        if self.heatmaps is not None:
+            self.heatmaps.vaciar()
+        self._listo_desde, self._listos = None, 0
+        return procesados
+
+    def paso(self, ahora=None):
+        """
+        Un ciclo del observador: recorrer, encolar y, si toca, procesar.
+
+        Returns:
+            int: Archivos procesados en este ciclo
+        """
+        ahora = time.time() if ahora is None else ahora
+        completos = self.escanear(ahora)
+        if completos:
+            self.cola.agregar([r for r, _ in completos], [t for _, t in completos])
+            self._listos += len(completos)
+            if self._listo_desde is None:
+                self._listo_desde = ahora
+
+        if not self._listos:
+            return 0
+        if self._listos < self.tamano_lote and ahora - self._listo_desde < self.max_espera:
+            return 0
+
+        return self.procesar_pendientes()
+
+    def estadisticas(self):
+        """
+        Latencia llegada -> resultado de los archivos procesados en esta ejecución.
+
+        Returns:
+            dict: procesados y latencias p50, p95 y máxima en milisegundos
+        """
+        if not self.latencias:
+            return {'procesados': 0, 'p50_ms': None, 'p95_ms': None, 'max_ms': None}
+        latencias = np.asarray(self.latencias) * 1000
+        return {
+            'procesados': len(latencias),
+            'p50_ms': round(float(np.percentile(latencias, 50)), 1),
+            'p95_ms': round(float(np.percentile(latencias, 95)), 1),
+            'max_ms': round(float(latencias.max()), 1),
+        }
+
+    def calentar(self):
+        """
+        Carga el modelo y traza sus funciones antes de vigilar, para que el
+        primer estudio que llega no pague ese costo en su latencia.
+        """
+        try:
+            from .grad_cam import grad_cam_batch
+            from .integrator import predict_batch
+            from .inference_session import get_pool
+        except ImportError:
+            from src.modulos.grad_cam import grad_cam_batch
+            from src.modulos.integrator import predict_batch
+            from src.modulos.inference_session import get_pool
+        vacio = np.zeros((1, 512, 512, 1), dtype=np.float32)
+        if self.heatmaps is not None:
+            grad_cam_batch(self.model or get_pool().model, vacio)
+        else:
+            predict_batch(vacio, self.model)
+
+    def detener(self):
+        """Pide al bucle de ejecutar() que termine tras el ciclo en curso"""
+        self._detener = True
+
+    def ejecutar(self, duracion=None, reporte_cada=30.0):
+        """
+        Vigila la carpeta hasta que se llame a detener() o pase ``duracion``.
+
+        Los archivos pending que hubieran quedado de una ejecución anterior
+        se procesan al arrancar.
+
+        Args:
+            duracion (float): Segundos de vigilancia (None = sin límite)
+            reporte_cada (float): Segundos entre reportes de latencia
+
+        Returns:
+            dict: Estadísticas de latencia (ver estadisticas)
+        """
+        print(f"👀 Vigilando {self.directorio} (lote={self.tamano_lote}, "
+              f"espera máx={self.max_espera}s, estabilidad={self.estabilidad}s)")
+        self.calentar()
+        self.cola.iniciar_ejecucion()
+        self.procesar_pendientes()
+        inicio = ultimo_reporte = time.time()
+        self._detener = False
+        try:
+            while not self._detener:
+                ciclo = time.time()
+                self.paso()
+                if reporte_cada and ciclo - ultimo_reporte >= reporte_cada:
+                    self.imprimir_estadisticas()
+                    ultimo_reporte = ciclo
+                if duracion is not None and ciclo - inicio >= duracion:
+                    break
+                time.sleep(max(0.0, self.intervalo - (time.time() - ciclo)))
+        except KeyboardInterrupt:
+            print("\n🛑 Observador detenido")
+        self.imprimir_estadisticas()
+        if self.heatmaps is not None:
+            self.heatmaps.vaciar()
+            imprimir_salida(self.heatmaps.estadisticas())
+        return self.estadisticas()
+
+    def imprimir_estadisticas(self):
+        """Muestra en consola la latencia llegada -> resultado"""
+        e = self.estadisticas()
+        if e['procesados']:
+            print(f"📊 {e['procesados']} estudios | latencia llegada->resultado: "
+                  f"p50={e['p50_ms']:.0f} ms p95={e['p95_ms']:.0f} ms máx={e['max_ms']:.0f} ms")
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Sesiones de inferencia compartidas entre hilos.
+
+``model.predict`` construye un data adapter en cada llamada y no está pensado
+para llamarse a la vez desde varios hilos (la interfaz con su hilo de trabajo,
+un servidor HTTP...). Aquí el modelo se carga una sola vez y se expone a
+través de un pool de ``InferenceSession``: cada sesión envuelve una función
+concreta de TensorFlow que llama a ``model(x, training=False)`` y atiende una
+petición a la vez. Si todas las sesiones están ocupadas, la admisión aplica
+contrapresión: se espera hasta ``timeout`` segundos o se rechaza de inmediato
+cuando ya hay demasiadas peticiones en espera.
+
+Los pools de hilos de TensorFlow son del proceso, no de cada sesión: el
+presupuesto por sesión (intra_op) se multiplica por el número de sesiones y
+se aplica una sola vez, antes de que el runtime de TensorFlow arranque. Por
+defecto lo fija el perfil de ejecución activo (ver runtime_profile).
+"""
+
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import tensorflow as tf
+
+try:
+    from .load_model import model_fun, version_modelo
+    from .runtime_profile import configurar_hilos_tf, perfil_activo, aplicar_perfil_o_defecto
+except ImportError:
+    from src.modulos.load_model import model_fun, version_modelo
+    from src.modulos.runtime_profile import configurar_hilos_tf, perfil_activo, aplicar_perfil_o_defecto
+
+FORMA_ENTRADA = (None, 512, 512, 1)
+
+
+class PoolSaturado(RuntimeError):
+    """No se pudo admitir la petición: todas las sesiones están ocupadas"""
+
+
+class InferenceSession:
+    """
+    Sesión de inferencia sobre un modelo Keras ya cargado.
+
+    La función concreta se traza una vez con el lote como dimensión libre,
+    así que lotes de distinto tamaño no vuelven a trazar el grafo.
+    """
+
+    def __init__(self, model, nombre="sesion-0"):
+        """
+        Args:
+            model (tf.keras.Model): Modelo cargado (compartido entre sesiones)
+            nombre (str): Identificador de la sesión
+        """
+        self.model = model
+        self.nombre = nombre
+        self.llamadas = 0
+        self.segundos = 0.0
+        forma = tuple(model.inputs[0].shape) if model.inputs else FORMA_ENTRADA
+        # float32, o bfloat16/float16 si el modelo está en precisión reducida
+        self.dtype = tf.as_dtype(model.inputs[0].dtype) if model.inputs else tf.float32
+        firma = tf.TensorSpec((None,) + tuple(forma[1:]), self.dtype)
+        self._funcion = tf.function(
+            lambda x: model(x, training=False)
+        ).get_concrete_function(firma)
+
+    def run(self, batch):
+        """
+        Ejecuta el modelo sobre un lote preprocesado.
+
+        Args:
+            batch (numpy.ndarray): Tensor (N, 512, 512, 1) float32 (o ya en
+                el tipo de la entrada del modelo)
+
+        Returns:
+            numpy.ndarray: Probabilidades (N, clases)
+        """
+        inicio = time.perf_counter()
+        salida = self._funcion(tf.cast(batch, self.dtype))
+        resultado = salida.numpy()
+        self.llamadas += 1
+        self.segundos += time.perf_counter() - inicio
+        return resultado
+
+
+class PoolSesiones:
+    """
+    Pool de sesiones de inferencia con control de admisión.
+
+    Uso:
+        pool = get_pool()
+        probabilidades = pool.run(batch, timeout=5)
+    """
+
+    def __init__(self, model=None, sesiones=1, intra_op=None, inter_op=None,
+                 max_en_espera=None, timeout=None):
+        """
+        Args:
+            model (tf.keras.Model): Modelo a servir (por defecto se carga con model_fun)
+            sesiones (int): Peticiones que se atienden a la vez
+            intra_op (int): Hilos intra-op por sesión
+            inter_op (int): Hilos inter-op del proceso
+            max_en_espera (int): Peticiones que pueden esperar turno; por encima
+                se rechazan de inmediato (None = sin límite)
+            timeout (float): Espera máxima por defecto en segundos (None = sin límite)
+        """
+        self.sesiones = max(1, int(sesiones))
+        if intra_op or inter_op:
+            configurar_hilos_tf(intra_op and int(intra_op) * self.sesiones, inter_op)
+
+        if model is None:
+            model = model_fun()
+            if model is None:
+                raise RuntimeError("No se pudo cargar el modelo")
+        self.model = model
+        # Con la que se etiquetan los resultados (ver model_manager)
+        self.version = version_modelo(model)
+        self.max_en_espera = max_en_espera
+        self.timeout = timeout
+
+        self._libres = queue.LifoQueue()
+        self._todas = [InferenceSession(model, f"sesion-{i}") for i in range(self.sesiones)]
+        for sesion in self._todas:
+            self._libres.put(sesion)
+
+        self._lock = threading.Lock()
+        self._en_espera = 0
+        self.atendidas = 0
+        self.rechazadas = 0
+        self.espera_total = 0.0
+
+    @contextmanager
+    def sesion(self, timeout=None):
+        """
+        Reserva una sesión libre durante el bloque ``with``.
+
+        Args:
+            timeout (float): Espera máxima en segundos (por defecto la del pool)
+
+        Raises:
+            PoolSaturado: Si hay demasiadas peticiones en espera o vence el timeout
+        """
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock:
+            if (self.max_en_espera is not None and self._libres.empty()
+                    and self._en_espera >= self.max_en_espera):
+                self.rechazadas += 1
+                raise PoolSaturado(f"Todas las sesiones ocupadas ({self._en_espera} en espera)")
+            self._en_espera += 1
+
+        inicio = time.perf_counter()
+        try:
+            sesion = self._libres.get(timeout=timeout)
+        except queue.Empty:
+            with self._lock:
+                self.rechazadas += 1
+            raise PoolSaturado(f"Sin sesión libre tras {timeout} s")
+        finally:
+            with self._lock:
+                self._en_espera -= 1
+                self.espera_total += time.perf_counter() - inicio
+
+        try:
+            yield sesion
+        finally:
+            self._libres.put(sesion)
+            with self._lock:
+                self.atendidas += 1
+
+    def run(self, batch, timeout=None):
+        """
+        Ejecuta el modelo en la primera sesión que quede libre.
+
+        Args:
+            batch (numpy.ndarray): Tensor (N, 512, 512, 1) float32
+            timeout (float): Espera máxima por una sesión en segundos
+
+        Returns:
+            numpy.ndarray: Probabilidades (N, clases)
+        """
+        with self.sesion(timeout) as sesion:
+            return sesion.run(batch)
+
+    def calentar(self):
+        """
+        Ejecuta cada sesión una vez con un lote de ceros.
+
+        La primera llamada real de una sesión paga la creación de las
+        primitivas de oneDNN; así la paga quien prepara el pool y no la
+        primera petición.
+        """
+        forma = tuple((self.model.inputs[0].shape if self.model.inputs else FORMA_ENTRADA)[1:])
+        for sesion in self._todas:
+            sesion.run(tf.zeros((1,) + forma, sesion.dtype))
+
+    def estadisticas(self):
+        """Contadores de uso del pool"""
+        with self._lock:
+            return {
+                'version': self.version,
+                'sesiones': self.sesiones,
+                'libres': self._libres.qsize(),
+                'en_espera': self._en_espera,
+                'atendidas': self.atendidas,
+                'rechazadas': self.rechazadas,
+                'espera_media_ms': round(1000 * self.espera_total / max(1, self.atendidas), 3),
+            }
+
+
+# Pool compartido del proceso
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configuracion_pool():
+    """
+    Argumentos de PoolSesiones por defecto: las sesiones del perfil de
+    ejecución activo, con prioridad para NEUMONIA_SESIONES,
+    NEUMONIA_INTRA_OP, NEUMONIA_INTER_OP y NEUMONIA_MAX_EN_ESPERA.
+
+    Returns:
+        dict: sesiones, intra_op, inter_op y max_en_espera
+    """
+    perfil = perfil_activo() or {}
+    return {
+        'sesiones': int(os.environ.get('NEUMONIA_SESIONES', perfil.get('sesiones', 1))),
+        'intra_op': os.environ.get('NEUMONIA_INTRA_OP'),
+        'inter_op': os.environ.get('NEUMONIA_INTER_OP'),
+        'max_en_espera': (int(os.environ['NEUMONIA_MAX_EN_ESPERA'])
+                          if os.environ.get('NEUMONIA_MAX_EN_ESPERA') else None),
+    }
+
+
+def get_pool(**kwargs):
+    """
+    Devuelve el pool de sesiones compartido, creándolo la primera vez.
+
+    Los argumentos (ver PoolSesiones) solo se usan al crearlo. Sin argumentos
+    se usa configuracion_pool(). Si ningún punto de entrada aplicó un perfil
+    de ejecución, se aplica aquí el configurado: los hilos todavía se pueden
+    fijar, pero oneDNN queda como estaba al importar TensorFlow.
+
+    Returns:
+        PoolSesiones: Pool listo para usar
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            aplicar_perfil_o_defecto()
+            if not kwargs:
+                kwargs = configuracion_pool()
+            _pool = PoolSesiones(**kwargs)
+            print(f"✅ Pool de inferencia listo: {_pool.sesiones} sesiones")
+        return _pool
+
+
+def reemplazar_pool(nuevo):
+    """
+    Sustituye el pool compartido de forma atómica.
+
+    Las peticiones que ya obtuvieron el pool anterior terminan con él; las
+    siguientes llamadas a get_pool devuelven ``nuevo``.
+
+    Args:
+        nuevo (PoolSesiones): Pool ya calentado
+
+    Returns:
+        PoolSesiones: El pool anterior (o None)
+    """
+    global _pool
+    with _pool_lock:
+        anterior, _pool = _pool, nuevo
+    return anterior
+
+
+def pool_actual():
+    """Pool compartido si ya existe (sin crearlo ni cargar el modelo)"""
+    return _pool
+
+
+def cerrar_pool():
+    """Descarta el pool compartido (el siguiente get_pool lo vuelve a crear)"""
+    global _pool
+    with _pool_lock:
+        _pool = None
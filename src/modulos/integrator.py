@@ -18,29 +18,183 @@ if parent_dir not in sys.path:
     sys.path.insert(0, parent_dir)
 
 try:
-    from .preprocess_img import preprocess
-    from .load_model import model_fun
-    from .grad_cam import grad_cam
+    from .preprocess_img import preprocess, preprocess_batch
+    from .read_img import read_dicom_frames
+    from .inference_session import get_pool, PoolSaturado
+    from .batch_planner import get_planificador
+    from .precision import dtype_entrada
+    from .load_model import version_modelo
+    from .profiler_hook import perfilable
+    from .grad_cam import (obtener_activaciones_cam, renderizar_overlay, generar_heatmap_simulado,
+                           predecir_con_activaciones, cam_por_activaciones, calcular_score_cam,
+                           EXPLICADORES)
 except ImportError as e:
     print(f"⚠️  Error en import relativo: {e}")
     # Fallback a imports absolutos
-    from src.modulos.preprocess_img import preprocess
-    from src.modulos.load_model import model_fun
-    from src.modulos.grad_cam import grad_cam
+    from src.modulos.preprocess_img import preprocess, preprocess_batch
+    from src.modulos.read_img import read_dicom_frames
+    from src.modulos.inference_session import get_pool, PoolSaturado
+    from src.modulos.batch_planner import get_planificador
+    from src.modulos.precision import dtype_entrada
+    from src.modulos.load_model import version_modelo
+    from src.modulos.profiler_hook import perfilable
+    from src.modulos.grad_cam import (obtener_activaciones_cam, renderizar_overlay, generar_heatmap_simulado,
+                                      predecir_con_activaciones, cam_por_activaciones, calcular_score_cam,
+                                      EXPLICADORES)
 
-def predict(array):
+class ResultadoPrediccion:
+    """
+    Resultado de predict con mapa de calor bajo demanda.
+    
+    La primera vez que se pide un heatmap se calculan, en una sola pasada,
+    las activaciones de conv10_thisone (float16) y los pesos Grad-CAM de las
+    tres clases. A partir de ahí el mapa de cualquier clase ("¿por qué
+    bacteriana?" frente a "¿por qué viral?") sale sin volver a ejecutar el
+    modelo. La superposición se renderiza en el tamaño que pida quien
+    muestra el resultado, por ejemplo 250x250 en la interfaz.
+    
+    Con los explicadores sin gradientes ("activaciones", "scorecam") las
+    activaciones salen de la misma pasada forward de la predicción.
+    
+    Por compatibilidad se puede desempaquetar como la tupla anterior:
+        diagnostico, probabilidad, heatmap = predict(array)
+    """
+    
+    def __init__(self, diagnostico, probabilidad, array=None, tensor=None, model=None,
+                 indice=None, probabilidades=None, imagen_error=None,
+                 explicador="gradcam", activaciones_conv=None, etapa=None,
+                 version_modelo=None):
+        self.diagnostico = diagnostico
+        self.probabilidad = probabilidad
+        self.indice = indice
+        self.probabilidades = probabilidades
+        self.explicador = explicador
+        # Etapa de la cascada que dio el resultado (1 = modelo rápido, 2 = completo)
+        self.etapa = etapa
+        # Versión del modelo que atendió la petición (ver model_manager)
+        self.version_modelo = version_modelo
+        self._array = array
+        self._tensor = tensor
+        self._model = model
+        self._activaciones = None
+        self._activaciones_conv = activaciones_conv
+        self._cams = {}
+        self._imagen_error = imagen_error
+    
+    @classmethod
+    def error(cls):
+        """Resultado para una predicción fallida"""
+        return cls("error", 0.0, imagen_error=generar_imagen_error())
+    
+    @property
+    def activaciones(self):
+        """
+        Activaciones y pesos Grad-CAM por clase, calculados la primera vez.
+        
+        Returns:
+            ActivacionesCam: o None si no se pudieron calcular
+        """
+        if self._activaciones is None and self._tensor is not None:
+            print("🔥 Generando mapa de calor...")
+            self._activaciones = obtener_activaciones_cam(self._model, self._tensor)
+            # El tensor de entrada (1 MB) ya no hace falta
+            self._tensor = None
+        return self._activaciones
+    
+    def cam_clase(self, clase=None):
+        """
+        CAM uint8 de baja resolución para una clase.
+        
+        Args:
+            clase (int o str): Índice o etiqueta ('bacteriana', 'normal', 'viral');
+                por defecto la clase predicha
+                
+        Returns:
+            numpy.ndarray: CAM (alto, ancho) o None si no se pudo calcular
+        """
+        indice = obtener_indice_clase(clase, self.indice)
+        
+        if self.explicador == "activaciones":
+            # No depende de la clase: se calcula una vez
+            if None not in self._cams and self._activaciones_conv is not None:
+                self._cams[None] = cam_por_activaciones(self._activaciones_conv)
+            return self._cams.get(None)
+        
+        if self.explicador == "scorecam":
+            if indice not in self._cams and self._tensor is not None:
+                print("🔥 Generando mapa de calor (Score-CAM)...")
+                self._cams[indice] = calcular_score_cam(
+                    self._model, self._tensor, clase=indice,
+                    activaciones=self._activaciones_conv)
+            return self._cams.get(indice)
+        
+        activaciones = self.activaciones
+        if activaciones is None:
+            return None
+        return activaciones.mapa(indice)
+    
+    @property
+    def cam(self):
+        """CAM uint8 de baja resolución de la clase predicha"""
+        return self.cam_clase()
+    
+    def heatmap(self, target_size=(512, 512), clase=None):
+        """
+        Renderiza la superposición del mapa de calor sobre la imagen original.
+        
+        Args:
+            target_size (tuple): Tamaño de salida (ancho, alto)
+            clase (int o str): Clase a explicar (por defecto la predicha)
+            
+        Returns:
+            numpy.ndarray: Imagen RGB del tamaño pedido
+        """
+        import cv2
+        if self._imagen_error is not None:
+            return cv2.resize(self._imagen_error, target_size)
+        
+        cam = self.cam_clase(clase)
+        if cam is None:
+            print("🔄 Usando método de heatmap simulado...")
+            return cv2.resize(generar_heatmap_simulado(self._array), target_size)
+        return renderizar_overlay(cam, self._array, target_size)
+    
+    def __iter__(self):
+        # Compatibilidad con: diagnostico, probabilidad, heatmap = predict(array)
+        return iter((self.diagnostico, self.probabilidad, self.heatmap()))
+    
+    def __repr__(self):
+        return f"ResultadoPrediccion({self.diagnostico!r}, {self.probabilidad:.2f})"
+
+@perfilable
+def predict(array, calcular_heatmap=False, explicador="gradcam", timeout=None, cascada=None):
     """
     Función principal que integra todo el pipeline de predicción:
-    1. Preprocesamiento → 2. Predicción → 3. Generación Grad-CAM
+    1. Preprocesamiento → 2. Predicción → 3. Grad-CAM (bajo demanda)
     
     Args:
         array (numpy.ndarray): Imagen médica como array numpy
+        calcular_heatmap (bool): Calcular el Grad-CAM de inmediato en lugar
+            de esperar a que se pida (libera antes el tensor de entrada)
+        explicador (str): Método del mapa de calor:
+            - "gradcam": Grad-CAM con backpropagation (por defecto)
+            - "activaciones": CAM ponderado por activaciones, sin gradientes
+            - "scorecam": Score-CAM con un presupuesto fijo de pasadas forward
+        timeout (float): Espera máxima por una sesión de inferencia libre
+        cascada (bool o Cascada): Clasificar primero con el modelo rápido y
+            usar el completo solo si no está seguro (por defecto según
+            NEUMONIA_CASCADA; ver cascade). El Grad-CAM de un estudio resuelto
+            por el modelo rápido se sigue calculando con el completo si se pide
         
     Returns:
-        tuple: (diagnóstico, probabilidad, heatmap)
-            - diagnóstico (str): 'bacteriana', 'normal', 'viral'
+        ResultadoPrediccion: diagnóstico, probabilidad y mapa de calor bajo demanda
+            - diagnostico (str): 'bacteriana', 'normal', 'viral'
             - probabilidad (float): Confianza de la predicción (0-100)
-            - heatmap (numpy.ndarray): Imagen con mapa de calor superpuesto
+            - heatmap(target_size): Imagen con mapa de calor superpuesto
+            
+    Raises:
+        PoolSaturado: Si todas las sesiones de inferencia están ocupadas y la
+            petición no se admite (el llamador decide si reintentar)
     """
     start_time = time.time()
     
@@ -49,25 +203,60 @@ def predict(array):
         
         # ✅ MEJORADO: Validación de entrada
         if not validar_entrada(array):
-            return "error", 0.0, generar_imagen_error()
+            return ResultadoPrediccion.error()
+        if explicador not in EXPLICADORES:
+            print(f"❌ Explicador desconocido: {explicador} (opciones: {EXPLICADORES})")
+            return ResultadoPrediccion.error()
         
         # 1. PREPROCESAMIENTO
-        print("🔧 Paso 1/3: Preprocesando imagen...")
+        print("🔧 Paso 1/2: Preprocesando imagen...")
         imagen_preprocesada = preprocess(array)
         if imagen_preprocesada is None:
             print("❌ Falló el preprocesamiento")
-            return "error", 0.0, generar_imagen_error()
+            return ResultadoPrediccion.error()
         
         # 2. PREDICCIÓN DEL MODELO
-        print("🤖 Paso 2/3: Ejecutando modelo...")
-        model = model_fun()
-        if model is None:
-            print("❌ No se pudo cargar el modelo")
-            return "error", 0.0, generar_imagen_error()
+        print("🤖 Paso 2/2: Ejecutando modelo...")
+        pool = get_pool()
+        model = pool.model
         
+        predicciones = None
+        activaciones_conv = None
+        etapa = None
+        version = pool.version
+        # Solo el Grad-CAM sin cascada conserva el respaldo "normal" ante un
+        # fallo; las demás pasadas devuelven error
+        ruta_original = False
         try:
-            predicciones = model.predict(imagen_preprocesada, verbose=0)
-            indice_prediccion = np.argmax(predicciones[0])
+            # "activaciones" necesita la pasada del modelo completo para su mapa
+            if explicador != "activaciones":
+                try:
+                    from .cascade import resolver_cascada
+                except ImportError:
+                    from src.modulos.cascade import resolver_cascada
+                cascada = resolver_cascada(cascada)
+                if cascada is not None:
+                    rapidas, resueltos = cascada.primera_etapa(imagen_preprocesada)
+                    etapa = 2
+                    if rapidas is not None and resueltos[0]:
+                        # El resultado lo dio el modelo rápido: se etiqueta con su versión
+                        predicciones, etapa = rapidas, 1
+                        version = version_modelo(cascada.rapido)
+                        print("⚡ Resuelto por la primera etapa de la cascada")
+            ruta_original = explicador == "gradcam" and cascada is None
+            if predicciones is None:
+                with pool.sesion(timeout) as sesion:
+                    if explicador == "gradcam":
+                        predicciones = sesion.run(imagen_preprocesada)
+                    else:
+                        # Una sola pasada forward da la predicción y las activaciones
+                        predicciones, conv = predecir_con_activaciones(model, imagen_preprocesada)
+                        if predicciones is None or conv is None:
+                            # Sin pasada forward no hay diagnóstico: no caer en "normal"
+                            print("❌ El modelo no devolvió predicción ni activaciones")
+                            return ResultadoPrediccion.error()
+                        activaciones_conv = conv[0].astype(np.float16)
+            indice_prediccion = int(np.argmax(predicciones[0]))
             probabilidad = np.max(predicciones[0]) * 100
             
             # Validar que la probabilidad sea razonable
@@ -75,30 +264,122 @@ def predict(array):
                 print("⚠️  Probabilidad inválida, ajustando a 50%")
                 probabilidad = 50.0
                 
+        except PoolSaturado:
+            raise
         except Exception as e:
             print(f"❌ Error en predicción del modelo: {e}")
+            if not ruta_original:
+                return ResultadoPrediccion.error()
             indice_prediccion = 1  # Fallback a "normal"
             probabilidad = 50.0
         
         # 3. CLASIFICACIÓN
         diagnostico = obtener_etiqueta_diagnostico(indice_prediccion)
         
-        # 4. GENERACIÓN GRAD-CAM
-        print("🔥 Paso 3/3: Generando mapa de calor...")
-        # CORREGIDO: Pasar el modelo como primer parámetro
-        heatmap = grad_cam(model, array)
+        # 4. GRAD-CAM: se calcula cuando alguien pida el heatmap
+        resultado = ResultadoPrediccion(
+            diagnostico, probabilidad, array=array, tensor=imagen_preprocesada, model=model,
+            indice=indice_prediccion,
+            probabilidades=None if predicciones is None else predicciones[0],
+            explicador=explicador, activaciones_conv=activaciones_conv, etapa=etapa,
+            version_modelo=version,
+        )
+        if calcular_heatmap:
+            resultado.cam
         
         tiempo_ejecucion = time.time() - start_time
         print(f"✅ Pipeline completado en {tiempo_ejecucion:.2f} segundos")
         print(f"📊 Resultado: {diagnostico} ({probabilidad:.2f}% de confianza)")
         
-        return diagnostico, probabilidad, heatmap
+        return resultado
         
+    except PoolSaturado as e:
+        print(f"⚠️  Predicción rechazada: {e}")
+        raise
     except Exception as e:
         print(f"❌ Error crítico en el pipeline: {e}")
         import traceback
         traceback.print_exc()
-        return "error", 0.0, generar_imagen_error()
+        return ResultadoPrediccion.error()
+
+@perfilable
+def predict_batch(batch, model=None, pool=None):
+    """
+    Ejecuta el modelo sobre un tensor batch ya preprocesado.
+    Pensado para trabajos en lote: no genera mapas de calor.
+
+    El batch se ejecuta en partes del tamaño que decide el planificador de
+    lotes según la memoria de activaciones del modelo; si una parte agota
+    la memoria, se parte por la mitad y se reintenta.
+
+    Args:
+        batch (numpy.ndarray): Tensor (N, 512, 512, 1) float32
+        model (tf.keras.Model): Modelo a usar (por defecto el del pool de sesiones)
+        pool (PoolSesiones): Pool ya obtenido por quien llama, para que todo
+            su trabajo use la misma versión del modelo aunque se sustituya
+
+    Returns:
+        numpy.ndarray: Probabilidades (N, 3) o None en caso de error
+    """
+    try:
+        if model is None:
+            pool = pool or get_pool()
+            return get_planificador(pool.model).ejecutar(batch, pool.run)
+
+        # predict_on_batch evita construir un data adapter en cada llamada
+        return get_planificador(model).ejecutar(
+            batch, lambda parte: np.asarray(model.predict_on_batch(parte)))
+
+    except Exception as e:
+        print(f"❌ Error en predicción por lotes: {e}")
+        return None
+
+@perfilable
+def predict_cuadros(path, seleccion="todos", model=None, workers=None):
+    """
+    Clasifica los cuadros de un DICOM multi-cuadro en un solo lote.
+    
+    Solo se decodifican los cuadros elegidos; se preprocesan en paralelo y
+    pasan juntos por el modelo. El diagnóstico del estudio sale del promedio
+    de las probabilidades de sus cuadros.
+    
+    Args:
+        path (str): Ruta del DICOM (o 'archivo.zip::miembro.dcm')
+        seleccion (str o int): 'primero', 'medio', 'todos' o un índice concreto
+        model (tf.keras.Model): Modelo a usar (por defecto el del pool de sesiones)
+        workers (int): Hilos de preprocesamiento
+        
+    Returns:
+        dict: diagnostico, probabilidad (0-100), probabilidades medias y por
+            cuadro (con su índice) y version_modelo, o None en caso de error
+    """
+    imagenes, indices = read_dicom_frames(path, seleccion)
+    if not imagenes:
+        return None
+    pool = None if model is not None else get_pool()
+    batch, validos = preprocess_batch(imagenes, workers=workers,
+                                      dtype=dtype_entrada(model or pool.model))
+    if not validos.all():
+        print(f"⚠️  {int((~validos).sum())} cuadros no se pudieron preprocesar")
+        batch = batch[validos]
+        indices = [i for i, valido in zip(indices, validos) if valido]
+    if not len(batch):
+        return None
+    probabilidades = predict_batch(batch, model, pool=pool)
+    if probabilidades is None:
+        return None
+    
+    media = probabilidades.mean(axis=0)
+    indice = int(np.argmax(media))
+    return {
+        'diagnostico': obtener_etiqueta_diagnostico(indice),
+        'probabilidad': float(media[indice] * 100),
+        'probabilidades': media.tolist(),
+        'cuadros': [{'cuadro': c, 'diagnostico': obtener_etiqueta_diagnostico(int(np.argmax(p))),
+                     'probabilidades': p.tolist()}
+                    for c, p in zip(indices, probabilidades)],
+        'version_modelo': pool.version if pool is not None else version_modelo(model),
+    }
 
 def validar_entrada(imagen_array):
     """
@@ -152,6 +433,26 @@ def obtener_etiqueta_diagnostico(indice):
     
     return diagnostico
 
+def obtener_indice_clase(clase, por_defecto=None):
+    """
+    Convierte una etiqueta de diagnóstico (o un índice) al índice de clase.
+    
+    Args:
+        clase (int o str): Índice o etiqueta ('bacteriana', 'normal', 'viral')
+        por_defecto (int): Índice a usar si clase es None
+        
+    Returns:
+        int: Índice de la clase
+    """
+    if clase is None:
+        return por_defecto
+    if isinstance(clase, str):
+        indices = {"bacteriana": 0, "normal": 1, "viral": 2}
+        if clase not in indices:
+            raise ValueError(f"Clase desconocida: {clase}")
+        return indices[clase]
+    return int(clase)
+
 def generar_imagen_error():
     """
     Genera una imagen de error para mostrar en la interfaz cuando falla el procesamiento.
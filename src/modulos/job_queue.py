@@ -0,0 +1,597 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Cola de trabajos en lote reanudable tras una caída.
+
+Cada archivo de un trabajo es una fila en una base SQLite local con su
+estado (pending, done o failed con el error). Los resultados se confirman
+por bloques en una sola transacción, así que si el proceso muere (memoria
+agotada con un DICOM enorme, reinicio del nodo) solo se repite el bloque en
+curso: al reanudar se saltan los archivos ya terminados.
+
+Un archivo que estaba en curso cuando el proceso murió se vuelve a intentar
+aislado (de uno en uno) para que no arrastre a los demás de su bloque; tras
+``max_intentos`` caídas se marca como failed.
+
+El progreso, el ETA y el rendimiento se leen de la misma base, también
+desde otro proceso mientras el trabajo corre (WAL).
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    from .read_img import read_image_file, normalizar_ruta, es_archivo_comprimido, listar_archivo
+    from .preprocess_img import preprocess_batch
+except ImportError:
+    from src.modulos.read_img import read_image_file, normalizar_ruta, es_archivo_comprimido, listar_archivo
+    from src.modulos.preprocess_img import preprocess_batch
+
+ESTADOS = ('pending', 'done', 'failed')
+# Las mismas extensiones que reconoce dataset.listar_dataset
+EXTENSIONES = ('.dcm', '.jpg', '.jpeg', '.png')
+
+
+class ColaTrabajos:
+    """
+    Estado persistente de un trabajo en lote.
+
+    Uso:
+        cola = ColaTrabajos('data/rescoring.sqlite')
+        cola.agregar_directorio('/pacs/export')
+        ejecutar_trabajo(cola)
+    """
+
+    def __init__(self, ruta_db, max_intentos=3, particion=None):
+        """
+        Args:
+            ruta_db (str): Archivo SQLite del trabajo (se crea si no existe)
+            max_intentos (int): Caídas toleradas por archivo antes de marcarlo failed
+            particion (tuple): (k, n) para que varios procesos compartan el
+                trabajo: este solo reclama los archivos con id % n == k
+        """
+        self.ruta_db = ruta_db
+        self.max_intentos = max(1, int(max_intentos))
+        self.particion = particion
+        if particion is not None:
+            self._filtro, self._parametros = " AND id % ? = ?", (int(particion[1]), int(particion[0]))
+        else:
+            self._filtro, self._parametros = "", ()
+        self._lock = threading.Lock()
+
+        directorio = os.path.dirname(os.path.abspath(ruta_db))
+        os.makedirs(directorio, exist_ok=True)
+        self._db = sqlite3.connect(ruta_db, check_same_thread=False, isolation_level=None,
+                                   timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS items (
+            id INTEGER PRIMARY KEY, ruta TEXT NOT NULL UNIQUE,
+            estado TEXT NOT NULL DEFAULT 'pending' CHECK (estado IN ('pending', 'done', 'failed')),
+            intentos INTEGER NOT NULL DEFAULT 0, error TEXT,
+            diagnostico TEXT, probabilidad REAL, probabilidades TEXT, actualizado REAL,
+            llegada REAL, heatmap TEXT, version_modelo TEXT)""")
+        columnas = {fila[1] for fila in self._db.execute("PRAGMA table_info(items)")}
+        for columna, tipo in (('llegada', 'REAL'), ('heatmap', 'TEXT'), ('version_modelo', 'TEXT')):
+            if columna not in columnas:
+                # Bases creadas antes de que existiera la columna
+                self._db.execute(f"ALTER TABLE items ADD COLUMN {columna} {tipo}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS items_estado ON items (estado, intentos, id)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (nombre TEXT PRIMARY KEY, valor TEXT)")
+
+    def agregar(self, rutas, llegadas=None):
+        """
+        Agrega archivos al trabajo como pending (los ya presentes se ignoran).
+
+        Args:
+            rutas (iterable): Rutas de los archivos
+            llegadas (list): Momento (time.time) en que llegó cada archivo,
+                para medir la latencia hasta el resultado (opcional)
+
+        Returns:
+            int: Archivos nuevos agregados
+        """
+        rutas = [normalizar_ruta(r) for r in rutas]
+        llegadas = list(llegadas) if llegadas is not None else [None] * len(rutas)
+        with self._lock:
+            antes = self._db.total_changes
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany("INSERT OR IGNORE INTO items (ruta, llegada) VALUES (?, ?)",
+                                     zip(rutas, llegadas))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            return self._db.total_changes - antes
+
+    def agregar_directorio(self, directorio, extensiones=EXTENSIONES):
+        """
+        Agrega recursivamente las imágenes de un directorio, o los miembros
+        de un archivo zip/tar sin extraerlo.
+
+        Returns:
+            int: Archivos nuevos agregados
+        """
+        if es_archivo_comprimido(directorio):
+            return self.agregar(listar_archivo(directorio, extensiones))
+        rutas = (os.path.join(raiz, archivo)
+                 for raiz, _, archivos in os.walk(directorio)
+                 for archivo in sorted(archivos) if archivo.lower().endswith(extensiones))
+        return self.agregar(rutas)
+
+    def iniciar_ejecucion(self):
+        """Marca el inicio de una ejecución (base para el rendimiento y el ETA)"""
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('inicio_ejecucion', ?)",
+                             (repr(time.time()),))
+
+    def reclamar(self, n, excluir=()):
+        """
+        Toma los siguientes archivos pending y cuenta el intento.
+
+        Si hay archivos que quedaron en curso en una ejecución que murió, se
+        devuelve solo uno de ellos para procesarlo aislado. Los que ya
+        agotaron sus intentos pasan a failed. Con ``particion`` solo se
+        consideran los archivos de la partición.
+
+        Args:
+            n (int): Archivos a tomar
+            excluir (iterable): Ids reclamados por este proceso que siguen en
+                curso (procesados pero sin confirmar todavía)
+
+        Returns:
+            list: Tuplas (id, ruta); vacía si no queda nada pendiente
+        """
+        excluir = tuple(excluir)
+        filtro = self._filtro + (f" AND id NOT IN ({','.join('?' * len(excluir))})" if excluir else "")
+        parametros = self._parametros + excluir
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "UPDATE items SET estado='failed', actualizado=?, "
+                    "error='el proceso se interrumpió ' || intentos || ' veces con este archivo' "
+                    "WHERE estado='pending' AND intentos>=?" + filtro,
+                    (time.time(), self.max_intentos) + parametros)
+                filas = self._db.execute(
+                    "SELECT id, ruta FROM items WHERE estado='pending' AND intentos>0"
+                    + filtro + " ORDER BY id LIMIT 1", parametros).fetchall()
+                if not filas:
+                    filas = self._db.execute(
+                        "SELECT id, ruta FROM items WHERE estado='pending'" + filtro
+                        + " ORDER BY id LIMIT ?", parametros + (int(n),)).fetchall()
+                self._db.executemany("UPDATE items SET intentos=intentos+1 WHERE id=?",
+                                     ((i,) for i, _ in filas))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return filas
+
+    def registrar(self, resultados):
+        """
+        Confirma un bloque de resultados en una sola transacción.
+
+        Args:
+            resultados (list): Diccionarios con 'id' y 'estado' ('done' o
+                'failed'), más 'diagnostico', 'probabilidad' y 'probabilidades'
+                o 'error' según el caso, 'heatmap' si se guardó uno y
+                'version_modelo' con la versión que lo clasificó
+        """
+        ahora = time.time()
+        filas = [(r['estado'], r.get('error'), r.get('diagnostico'), r.get('probabilidad'),
+                  None if r.get('probabilidades') is None else json.dumps(r['probabilidades']),
+                  r.get('heatmap'), r.get('version_modelo'), ahora, r['id']) for r in resultados]
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(
+                    "UPDATE items SET estado=?, error=?, diagnostico=?, probabilidad=?, "
+                    "probabilidades=?, heatmap=?, version_modelo=?, actualizado=? WHERE id=?", filas)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def reintentar_fallidos(self):
+        """
+        Devuelve los archivos failed a pending con los intentos a cero.
+
+        Returns:
+            int: Archivos devueltos a la cola
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE items SET estado='pending', intentos=0, error=NULL WHERE estado='failed'")
+            return cursor.rowcount
+
+    def progreso(self):
+        """
+        Estado del trabajo: conteos, rendimiento de la ejecución actual y ETA.
+        Con ``particion`` se cuentan solo los archivos de la partición.
+
+        Returns:
+            dict: total, pending, done, failed, porcentaje, imagenes_por_segundo
+                  y eta_segundos (None si todavía no se puede estimar)
+        """
+        with self._lock:
+            conteos = dict(self._db.execute(
+                "SELECT estado, COUNT(*) FROM items WHERE 1" + self._filtro + " GROUP BY estado",
+                self._parametros).fetchall())
+            fila = self._db.execute(
+                "SELECT valor FROM meta WHERE nombre='inicio_ejecucion'").fetchone()
+            inicio = float(fila[0]) if fila else None
+            recientes, ultimo = 0, None
+            if inicio is not None:
+                recientes, ultimo = self._db.execute(
+                    "SELECT COUNT(*), MAX(actualizado) FROM items "
+                    "WHERE estado<>'pending' AND actualizado>=?" + self._filtro,
+                    (inicio,) + self._parametros).fetchone()
+
+        progreso = {estado: conteos.get(estado, 0) for estado in ESTADOS}
+        total = sum(progreso.values())
+        terminados = progreso['done'] + progreso['failed']
+        # Con el trabajo terminado el rendimiento se mide hasta el último resultado
+        fin = time.time() if progreso['pending'] or ultimo is None else ultimo
+        segundos = fin - inicio if inicio is not None else 0.0
+        rendimiento = recientes / segundos if recientes and segundos > 0 else 0.0
+        progreso.update({
+            'total': total,
+            'porcentaje': round(100.0 * terminados / total, 2) if total else 100.0,
+            'imagenes_por_segundo': round(rendimiento, 2),
+            'eta_segundos': round(progreso['pending'] / rendimiento, 1) if rendimiento else None,
+        })
+        return progreso
+
+    def resultados(self, estado='done'):
+        """
+        Recorre los archivos en un estado.
+
+        Yields:
+            dict: ruta, estado, diagnostico, probabilidad, probabilidades, error,
+                  heatmap, version_modelo y latencia (segundos desde la llegada,
+                  si se conoce)
+        """
+        with self._lock:
+            filas = self._db.execute(
+                "SELECT ruta, estado, diagnostico, probabilidad, probabilidades, error, heatmap, "
+                "version_modelo, actualizado - llegada FROM items WHERE estado=? ORDER BY id",
+                (estado,)).fetchall()
+        for (ruta, estado, diagnostico, probabilidad, probabilidades, error, heatmap, version,
+             latencia) in filas:
+            yield {'ruta': ruta, 'estado': estado, 'diagnostico': diagnostico,
+                   'probabilidad': probabilidad, 'error': error, 'heatmap': heatmap,
+                   'version_modelo': version, 'latencia': latencia,
+                   'probabilidades': None if probabilidades is None else json.loads(probabilidades)}
+
+    def latencias(self, ids):
+        """
+        Segundos entre la llegada y el resultado confirmado de los archivos dados.
+
+        Args:
+            ids (list): Identificadores devueltos por reclamar
+
+        Returns:
+            list: Latencias de los que están done y tienen llegada registrada
+        """
+        ids = [int(i) for i in ids]
+        if not ids:
+            return []
+        marcas = ",".join("?" * len(ids))
+        with self._lock:
+            return [fila[0] for fila in self._db.execute(
+                f"SELECT actualizado - llegada FROM items WHERE id IN ({marcas}) "
+                "AND estado='done' AND llegada IS NOT NULL", ids)]
+
+    def rutas(self):
+        """Conjunto de rutas absolutas que ya forman parte del trabajo"""
+        with self._lock:
+            return {fila[0] for fila in self._db.execute("SELECT ruta FROM items")}
+
+    def ids_por_ruta(self):
+        """Diccionario ruta -> id de los archivos del trabajo"""
+        with self._lock:
+            return dict(self._db.execute("SELECT ruta, id FROM items"))
+
+    def close(self):
+        """Cierra la base del trabajo"""
+        self._db.close()
+
+
+def _leer(ruta):
+    """Lee un archivo y devuelve (array, error)"""
+    try:
+        array, _ = read_image_file(ruta)
+        if array is None:
+            return None, "no se pudo leer la imagen"
+        return array, None
+    except Exception as e:
+        return None, str(e)
+
+
+def procesar_lote(items, workers=None, cache=None, model=None, heatmaps=None,
+                  tamano_heatmap=(512, 512)):
+    """
+    Lee, preprocesa y clasifica un lote de archivos.
+
+    Args:
+        items (list): Tuplas (id, ruta) devueltas por ColaTrabajos.reclamar
+        workers (int): Hilos para decodificar y preprocesar
+        cache (TensorCache): Caché de tensores opcional
+        model (tf.keras.Model): Modelo (por defecto el del pool de sesiones; se
+            toma una vez, así que todo el lote usa la misma versión aunque el
+            gestor de modelos la sustituya mientras tanto)
+        heatmaps (str o SalidaAsincrona): Carpeta donde guardar el heatmap PNG
+            de cada imagen, o salida asíncrona que los codifica y escribe en
+            segundo plano (el lote siguiente no espera al disco); las
+            probabilidades salen de la misma pasada del Grad-CAM por lotes
+        tamano_heatmap (tuple): Tamaño (ancho, alto) de los heatmaps guardados
+
+    Returns:
+        list: Resultados listos para ColaTrabajos.registrar
+    """
+    # TensorFlow solo se importa al procesar: consultar el estado no lo necesita
+    try:
+        from .integrator import predict_batch, obtener_etiqueta_diagnostico
+        from .inference_session import get_pool
+        from .precision import dtype_entrada
+        from .load_model import version_modelo
+    except ImportError:
+        from src.modulos.integrator import predict_batch, obtener_etiqueta_diagnostico
+        from src.modulos.inference_session import get_pool
+        from src.modulos.precision import dtype_entrada
+        from src.modulos.load_model import version_modelo
+    if heatmaps is not None and cache is not None:
+        raise ValueError("Los heatmaps necesitan la imagen original: no se pueden usar con caché")
+    sesiones = get_pool() if model is None else None
+    modelo = model or sesiones.model
+
+    ids = [i for i, _ in items]
+    rutas = [r for _, r in items]
+    errores = [None] * len(items)
+    arrays = [None] * len(items)
+
+    if cache is not None:
+        batch, validos = cache.load_batch(rutas, workers=workers)
+        for i in np.flatnonzero(~validos):
+            errores[i] = "no se pudo leer o preprocesar la imagen"
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, int(workers or os.cpu_count() or 1))) as pool:
+            leidos = list(pool.map(_leer, rutas))
+        posiciones = [i for i, (a, _) in enumerate(leidos) if a is not None]
+        arrays = [a for a, _ in leidos]
+        # En el tipo de la entrada del modelo (bfloat16 ocupa la mitad que float32)
+        leidas, validos_leidos = preprocess_batch([arrays[i] for i in posiciones], workers=workers,
+                                                  dtype=dtype_entrada(modelo))
+        validos = np.zeros(len(items), dtype=bool)
+        validos[posiciones] = validos_leidos
+        for i, (array, error) in enumerate(leidos):
+            if array is None:
+                errores[i] = error
+            elif not validos[i]:
+                errores[i] = "falló el preprocesamiento"
+        # El batch solo tiene las imágenes leídas: reindexar a posiciones del lote
+        batch = np.zeros((len(items),) + leidas.shape[1:], dtype=leidas.dtype)
+        batch[posiciones] = leidas
+
+    probabilidades, cams = None, None
+    if validos.any() and heatmaps is not None:
+        try:
+            from .grad_cam import grad_cam_batch
+        except ImportError:
+            from src.modulos.grad_cam import grad_cam_batch
+        try:
+            from .batch_planner import get_planificador, unir_tuplas
+        except ImportError:
+            from src.modulos.batch_planner import get_planificador, unir_tuplas
+        resultado = get_planificador(modelo, 'gradientes').ejecutar(
+            batch[validos], lambda parte: grad_cam_batch(modelo, parte), unir=unir_tuplas)
+        cams, probabilidades = resultado if resultado is not None else (None, None)
+    if validos.any() and probabilidades is None:
+        probabilidades = predict_batch(batch[validos], model, pool=sesiones)
+        if probabilidades is None:
+            for i in np.flatnonzero(validos):
+                errores[i] = "falló la inferencia del lote"
+            validos[:] = False
+
+    rutas_heatmap = [None] * len(items)
+    if cams is not None and validos.any():
+        try:
+            from .grad_cam import renderizar_overlays
+            from .output_sink import SalidaAsincrona
+        except ImportError:
+            from src.modulos.grad_cam import renderizar_overlays
+            from src.modulos.output_sink import SalidaAsincrona
+        # Una carpeta sola: los hilos de la salida codifican en paralelo y se
+        # espera a que terminen antes de devolver el lote. Con una salida
+        # compartida las rutas quedan pendientes: ver confirmar_heatmaps
+        salida = heatmaps if isinstance(heatmaps, SalidaAsincrona) else SalidaAsincrona(heatmaps)
+        try:
+            indices = np.flatnonzero(validos)
+            overlays = None
+            if salida.formato != 'npz':
+                overlays = renderizar_overlays(cams, [arrays[i] for i in indices], tamano_heatmap)
+            for fila, i in enumerate(indices):
+                nombre = os.path.splitext(os.path.basename(rutas[i]))[0]
+                rutas_heatmap[i] = salida.escribir_heatmap(
+                    f"{ids[i]:08d}_{nombre}", overlay=None if overlays is None else overlays[fila],
+                    cam=cams[fila])
+        finally:
+            if salida is not heatmaps:
+                fallidas = salida.vaciar()
+                salida.cerrar()
+                rutas_heatmap = [None if r in fallidas else r for r in rutas_heatmap]
+
+    version = sesiones.version if sesiones is not None else version_modelo(model)
+    resultados = []
+    fila = 0
+    for i, id_item in enumerate(ids):
+        if not validos[i]:
+            resultados.append({'id': id_item, 'ruta': rutas[i], 'estado': 'failed',
+                               'error': errores[i]})
+            continue
+        p = probabilidades[fila]
+        fila += 1
+        indice = int(np.argmax(p))
+        resultados.append({
+            'id': id_item, 'ruta': rutas[i], 'estado': 'done',
+            'diagnostico': obtener_etiqueta_diagnostico(indice),
+            'probabilidad': float(p[indice] * 100),
+            'probabilidades': [float(x) for x in p],
+            'heatmap': rutas_heatmap[i],
+            'version_modelo': version,
+        })
+    return resultados
+
+
+def confirmar_heatmaps(salida, resultados, grupo=None):
+    """
+    Espera a las escrituras de los heatmaps y quita de los resultados los que fallaron.
+
+    Hay que llamarla antes de ColaTrabajos.registrar: un archivo done no
+    debe apuntar a un heatmap que no existe.
+
+    Args:
+        salida (SalidaAsincrona): Salida compartida con procesar_lote
+        resultados (list): Resultados de procesar_lote (se modifican)
+        grupo (list): Escrituras de esos resultados (por defecto, las
+            encoladas desde el último corte; ver SalidaAsincrona.cortar_grupo)
+
+    Returns:
+        set: Rutas cuya escritura falló
+    """
+    if grupo is None:
+        grupo = salida.cortar_grupo()
+    fallidas = salida.esperar_grupo(grupo)
+    for resultado in resultados:
+        if resultado.get('heatmap') in fallidas:
+            resultado['heatmap'] = None
+    return fallidas
+
+
+def _confirmar_bloques(cola, salida, bloques, en_curso=0):
+    """
+    Confirma en orden los bloques cuyos heatmaps y registros ya están en disco.
+
+    Args:
+        cola (ColaTrabajos): Trabajo
+        salida (SalidaAsincrona): Salida de los bloques
+        bloques (collections.deque): Listas [resultados, grupo, registros]
+            por confirmar; ``registros`` es None hasta que el bloque se pasa
+            a la salida
+        en_curso (int): Últimos bloques cuyas escrituras no se esperan todavía
+
+    Returns:
+        bool: False si falló la escritura de algún bloque de registros
+    """
+    for bloque in list(bloques)[:len(bloques) - en_curso]:
+        if bloque[2] is None:
+            # Los registros llevan la ruta del heatmap: se añaden cuando ya
+            # se sabe si se escribió
+            confirmar_heatmaps(salida, bloque[0], bloque[1])
+            salida.agregar_registros(bloque[0])
+            bloque[2] = salida.registros_agregados
+    while bloques and bloques[0][2] is not None and salida.registros_escritos >= bloques[0][2]:
+        cola.registrar(bloques.popleft()[0])
+    return salida.errores_registros == 0
+
+
+def formatear_segundos(segundos):
+    """Formatea una duración como h:mm:ss"""
+    if segundos is None:
+        return "--:--"
+    segundos = int(segundos)
+    return f"{segundos // 3600}:{segundos % 3600 // 60:02d}:{segundos % 60:02d}"
+
+
+def ejecutar_trabajo(cola, tamano_lote=None, lotes_por_commit=4, workers=None, cache=None,
+                     model=None, salida=None):
+    """
+    Procesa todos los archivos pending de un trabajo.
+
+    Se toman ``tamano_lote * lotes_por_commit`` archivos a la vez, se
+    clasifican en lotes de ``tamano_lote`` y el bloque se confirma en una
+    sola transacción. Se puede interrumpir y volver a llamar: continúa por
+    donde quedó.
+
+    Con ``salida`` un bloque se confirma cuando sus heatmaps y sus registros
+    ya están en disco (un trabajo reanudado no vuelve a emitir los done):
+    las escrituras del bloque k se esperan mientras se infiere el k+1, y los
+    registros se escriben cuando se juntan ``registros_por_escritura``. Tras
+    una caída los bloques sin confirmar se repiten: sus registros pueden
+    quedar duplicados, pero no se pierden.
+
+    Args:
+        cola (ColaTrabajos): Trabajo a procesar
+        tamano_lote (int): Imágenes por lote (por defecto, el que cabe en el
+            presupuesto de memoria según el planificador de lotes)
+        lotes_por_commit (int): Lotes confirmados en cada transacción
+        workers (int): Hilos para decodificar y preprocesar
+        cache (TensorCache): Caché de tensores opcional
+        model (tf.keras.Model): Modelo (por defecto el del pool de sesiones)
+        salida (SalidaAsincrona): Salida en segundo plano para los heatmaps
+            (si tiene carpeta) y los registros de resultados (si tiene archivo)
+
+    Returns:
+        dict: Progreso final (ver ColaTrabajos.progreso), o None si no se
+            pudieron escribir los registros
+    """
+    heatmaps = salida if salida is not None and salida.directorio is not None else None
+    if tamano_lote is None:
+        try:
+            from .batch_planner import tamano_lote_planificado
+        except ImportError:
+            from src.modulos.batch_planner import tamano_lote_planificado
+        tamano_lote = tamano_lote_planificado(model)
+    cola.iniciar_ejecucion()
+    progreso = cola.progreso()
+    print(f"🗂️  Trabajo {cola.ruta_db}: {progreso['pending']} pendientes, "
+          f"{progreso['done']} hechos, {progreso['failed']} fallidos")
+
+    # Bloques procesados que esperan a sus escrituras para confirmarse
+    bloques = deque()
+    while True:
+        items = cola.reclamar(tamano_lote * lotes_por_commit,
+                              excluir=[r['id'] for bloque in bloques for r in bloque[0]])
+        if not items:
+            break
+        resultados = []
+        for inicio in range(0, len(items), tamano_lote):
+            resultados.extend(procesar_lote(items[inicio:inicio + tamano_lote],
+                                            workers=workers, cache=cache, model=model,
+                                            heatmaps=heatmaps))
+        if salida is None:
+            cola.registrar(resultados)
+        else:
+            bloques.append([resultados, salida.cortar_grupo(), None])
+            # Un paso por detrás: este bloque se sigue escribiendo mientras
+            # se infiere el siguiente
+            if not _confirmar_bloques(cola, salida, bloques, en_curso=1):
+                print(f"❌ No se pudieron escribir los registros en {salida.registros}: "
+                      f"{len(bloques)} bloques quedan sin confirmar")
+                return None
+
+        progreso = cola.progreso()
+        print(f"   - {progreso['done'] + progreso['failed']}/{progreso['total']} "
+              f"({progreso['porcentaje']:.1f}%) | {progreso['imagenes_por_segundo']:.2f} img/s | "
+              f"ETA {formatear_segundos(progreso['eta_segundos'])}")
+
+    if salida is not None:
+        _confirmar_bloques(cola, salida, bloques)
+        salida.vaciar()
+        if not _confirmar_bloques(cola, salida, bloques):
+            print(f"❌ No se pudieron escribir los registros en {salida.registros}: "
+                  f"{len(bloques)} bloques quedan sin confirmar")
+            return None
+    progreso = cola.progreso()
+    print(f"✅ Trabajo terminado: {progreso['done']} hechos, {progreso['failed']} fallidos")
+    return progreso
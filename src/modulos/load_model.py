@@ -6,39 +6,126 @@ Módulo para carga y gestión del modelo de red neuronal convolucional
 Modelo principal: 'conv_MLP_84.h5'
 """
 
+# El perfil de ejecución (hilos y oneDNN) lo aplican los puntos de entrada
+# antes de importar TensorFlow: ver runtime_profile.aplicar_perfil
 import tensorflow as tf
 from tensorflow.keras.models import load_model
+import hashlib
 import os
+import weakref
 import numpy as np
 
-def model_fun():
+try:
+    from .model_optimizer import optimizar_para_inferencia, RAIZ
+    from .precision import reducir_precision
+except ImportError:
+    from src.modulos.model_optimizer import optimizar_para_inferencia, RAIZ
+    from src.modulos.precision import reducir_precision
+
+# Versión de cada modelo cargado ("archivo@huella"); se olvida al liberarlo
+_versiones = weakref.WeakKeyDictionary()
+
+
+def huella_archivo(ruta, bloque=1 << 20):
+    """
+    Huella SHA-256 del contenido de un archivo.
+
+    Args:
+        ruta (str): Ruta del archivo
+        bloque (int): Bytes leídos por iteración
+
+    Returns:
+        str: Hash hexadecimal
+    """
+    sha = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for parte in iter(lambda: f.read(bloque), b''):
+            sha.update(parte)
+    return sha.hexdigest()
+
+
+def version_modelo(model):
+    """
+    Versión con la que se etiquetan los resultados de un modelo.
+
+    Returns:
+        str: "conv_MLP_84.h5@<12 hex>", "temporal" o "desconocida"
+    """
+    try:
+        return _versiones.get(model, 'desconocida')
+    except TypeError:
+        return 'desconocida'
+
+
+def registrar_version(model, version):
+    """Asocia ``version`` al modelo (ver version_modelo)"""
+    try:
+        _versiones[model] = version
+    except TypeError:
+        pass
+    return model
+
+
+def ruta_modelo():
+    """
+    Primera ruta existente del modelo principal.
+
+    NEUMONIA_MODELO tiene prioridad sobre las rutas por defecto.
+
+    Returns:
+        str: Ruta del archivo o None si no existe en ninguna
+    """
+    possible_paths = [
+        'models/conv_MLP_84.h5',           # Desde raíz
+        '../models/conv_MLP_84.h5',        # Desde src/modulos
+        '../../models/conv_MLP_84.h5',     # Desde otras ubicaciones
+        os.path.join(RAIZ, 'models', 'conv_MLP_84.h5'),
+    ]
+    if os.environ.get('NEUMONIA_MODELO'):
+        possible_paths.insert(0, os.environ['NEUMONIA_MODELO'])
+    for path in possible_paths:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def model_fun(optimizar=None, precision=None, ruta=None):
     """
     Función principal para cargar el modelo pre-entrenado.
     Versión actualizada para TensorFlow 2.x con eager execution.
     
+    Tras cargarlo se pliegan las BatchNormalization en las convoluciones y se
+    fusionan las operaciones elemento a elemento (ver model_optimizer); el
+    modelo optimizado solo se usa si da las mismas probabilidades. Con
+    ``precision`` bfloat16/float16 se calcula además en precisión reducida
+    si la CPU la soporta y el diagnóstico coincide con float32 (ver precision).
+    
+    Args:
+        optimizar (bool): Optimizar el grafo de inferencia (por defecto sí,
+            salvo NEUMONIA_OPTIMIZAR_GRAFO=0)
+        precision (str): 'float32', 'bfloat16', 'float16' o 'auto'
+            (por defecto NEUMONIA_PRECISION o float32)
+        ruta (str): Archivo concreto a cargar (p. ej. una versión nueva para
+            el gestor de modelos); si falla se devuelve None en vez del
+            modelo temporal
+    
     Returns:
-        tf.keras.Model: Modelo cargado listo para predicción o None en caso de error
+        tf.keras.Model: Modelo cargado listo para predicción o None en caso de error.
+            Su versión queda registrada (ver version_modelo)
     """
     try:
-        # ✅ CORREGIDO: Rutas relativas a tu estructura de proyecto
-        possible_paths = [
-            'models/conv_MLP_84.h5',           # Desde raíz
-            '../models/conv_MLP_84.h5',        # Desde src/modulos
-            '../../models/conv_MLP_84.h5',     # Desde otras ubicaciones
-        ]
-        
-        model_path = None
-        for path in possible_paths:
-            if os.path.exists(path):
-                model_path = path
-                break
-        
-        if model_path is None:
+        model_path = ruta or ruta_modelo()
+        
+        if model_path is None or not os.path.exists(model_path):
+            if ruta is not None:
+                print(f"❌ No se encontró el modelo: {ruta}")
+                return None
             print("❌ No se encontró el modelo en ninguna ubicación posible")
             # Crear modelo temporal para desarrollo
             return crear_modelo_temporal()
         
         print(f"🔄 Cargando modelo desde: {model_path}")
+        version = f"{os.path.basename(model_path)}@{huella_archivo(model_path)[:12]}"
         
         # ✅ CORREGIDO: Cargar modelo CON eager execution (TensorFlow 2.x)
         model = load_model(model_path, compile=False)
@@ -55,13 +142,19 @@ def model_fun():
             print(f"✅ Modelo cargado exitosamente: {model_path}")
             print(f"   - Capas: {len(model.layers)}")
             print(f"   - Parámetros: {model.count_params():,}")
-            return model
         else:
             print("⚠️  Modelo cargado pero con advertencias, usando igualmente")
-            return model
+        
+        if optimizar is None:
+            optimizar = os.environ.get('NEUMONIA_OPTIMIZAR_GRAFO', '1') != '0'
+        if optimizar:
+            model = optimizar_para_inferencia(model)
+        return registrar_version(reducir_precision(model, precision), version)
         
     except Exception as e:
         print(f"❌ Error cargando el modelo: {e}")
+        if ruta is not None:
+            return None
         print("🔄 Creando modelo temporal para desarrollo...")
         return crear_modelo_temporal()
 
@@ -115,7 +208,8 @@ def crear_modelo_temporal():
         print("🔧 Creando modelo temporal para desarrollo...")
         
         model = models.Sequential([
-            layers.Conv2D(32, (3, 3), activation='relu', input_shape=(512, 512, 1), name='conv1'),
+            layers.Input(shape=(512, 512, 1)),
+            layers.Conv2D(32, (3, 3), activation='relu', name='conv1'),
             layers.MaxPooling2D((2, 2)),
             layers.Conv2D(64, (3, 3), activation='relu', name='conv2'),
             layers.MaxPooling2D((2, 2)),
@@ -132,7 +226,7 @@ def crear_modelo_temporal():
         )
         
         print("✅ Modelo temporal creado exitosamente")
-        return model
+        return registrar_version(model, 'temporal')
         
     except Exception as e:
         print(f"❌ Error creando modelo temporal: {e}")
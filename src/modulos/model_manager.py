@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Sustitución del modelo en caliente, sin reiniciar ni pausar el servicio.
+
+Hasta ahora actualizar el modelo era reemplazar conv_MLP_84.h5 y reiniciar
+el proceso. El gestor carga la versión nueva en un hilo de fondo mientras la
+anterior sigue atendiendo, construye su pool de sesiones y lo calienta
+(primitivas de oneDNN, modelo auxiliar de Grad-CAM y planificador de lotes).
+Solo entonces cambia el pool compartido de forma atómica (ver
+inference_session.reemplazar_pool).
+
+Cada petición toma el pool una vez al empezar: las que ya estaban en curso
+terminan con la versión anterior y las nuevas usan la nueva. El gestor no
+guarda referencias al pool retirado y limpia las cachés de ese modelo, así
+que se libera en cuanto termina su última petición; las dos versiones solo
+conviven durante la carga y ese final.
+
+Los resultados llevan la versión que los produjo ("archivo@huella", ver
+load_model.version_modelo).
+
+Uso:
+    gestor = GestorModelos()
+    gestor.cargar('models/conv_MLP_84_v2.h5')       # en segundo plano
+    gestor.vigilar_archivo('models/conv_MLP_84.h5')  # recarga al reemplazarlo
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .load_model import model_fun, ruta_modelo
+    from .inference_session import PoolSesiones, configuracion_pool, pool_actual, reemplazar_pool
+    from .grad_cam import obtener_modelo_grad_cam, olvidar_modelo as olvidar_grad_cam
+    from .batch_planner import get_planificador, olvidar_modelo as olvidar_planificador
+except ImportError:
+    from src.modulos.load_model import model_fun, ruta_modelo
+    from src.modulos.inference_session import (PoolSesiones, configuracion_pool, pool_actual,
+                                               reemplazar_pool)
+    from src.modulos.grad_cam import obtener_modelo_grad_cam, olvidar_modelo as olvidar_grad_cam
+    from src.modulos.batch_planner import get_planificador, olvidar_modelo as olvidar_planificador
+
+INTERVALO_VIGILANCIA = 5.0
+
+
+def firma_archivo(ruta):
+    """
+    Tamaño y fecha de modificación de un archivo.
+
+    Returns:
+        tuple: (tamaño, mtime_ns) o None si no existe
+    """
+    try:
+        estado = os.stat(ruta)
+    except OSError:
+        return None
+    return estado.st_size, estado.st_mtime_ns
+
+
+class GestorModelos:
+    """
+    Carga versiones nuevas del modelo en segundo plano y las activa sin pausa.
+
+    Las cargas se hacen de una en una: si se piden dos seguidas, la segunda
+    espera a que termine la primera.
+    """
+
+    def __init__(self, **kwargs_pool):
+        """
+        Args:
+            **kwargs_pool: Argumentos de PoolSesiones para los pools nuevos
+                (por defecto los del pool activo, o configuracion_pool())
+        """
+        self.kwargs_pool = kwargs_pool
+        self.historial = []
+        self._ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gestor-modelos')
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._vigilante = None
+
+    def _configuracion(self):
+        """Argumentos del pool nuevo: los hilos de TensorFlow son del proceso y ya están fijados"""
+        if self.kwargs_pool:
+            kwargs = dict(self.kwargs_pool)
+        else:
+            actual = pool_actual()
+            if actual is not None:
+                kwargs = {'sesiones': actual.sesiones, 'max_en_espera': actual.max_en_espera,
+                          'timeout': actual.timeout}
+            else:
+                kwargs = configuracion_pool()
+        kwargs.pop('intra_op', None)
+        kwargs.pop('inter_op', None)
+        return kwargs
+
+    def preparar(self, ruta):
+        """
+        Carga y calienta una versión sin activarla.
+
+        Args:
+            ruta (str): Archivo del modelo
+
+        Returns:
+            PoolSesiones: Pool de la versión nueva, listo para atender
+
+        Raises:
+            RuntimeError: Si el modelo no se pudo cargar
+        """
+        model = model_fun(ruta=ruta)
+        if model is None:
+            raise RuntimeError(f"No se pudo cargar el modelo: {ruta}")
+        pool = PoolSesiones(model, **self._configuracion())
+        pool.calentar()
+        obtener_modelo_grad_cam(model)
+        get_planificador(model)
+        return pool
+
+    def activar(self, pool):
+        """
+        Convierte ``pool`` en el pool compartido.
+
+        Las peticiones en curso terminan con el anterior; sus cachés se
+        descartan para que se libere al terminar la última.
+
+        Args:
+            pool (PoolSesiones): Pool preparado
+
+        Returns:
+            str: Versión anterior (None si no había pool)
+        """
+        with self._lock:
+            anterior = reemplazar_pool(pool)
+            version_anterior = None
+            if anterior is not None:
+                version_anterior = anterior.version
+                if anterior.model is not pool.model:
+                    olvidar_grad_cam(anterior.model)
+                    olvidar_planificador(anterior.model)
+            del anterior
+        print(f"🔄 Modelo activo: {pool.version} (antes: {version_anterior or 'ninguno'})")
+        return version_anterior
+
+    def _cargar(self, ruta):
+        inicio = time.perf_counter()
+        pool = self.preparar(ruta)
+        segundos = time.perf_counter() - inicio
+        version = pool.version
+        anterior = self.activar(pool)
+        self.historial.append({'version': version, 'anterior': anterior, 'ruta': ruta,
+                               'segundos_carga': round(segundos, 3), 'activado': time.time()})
+        return version
+
+    def cargar(self, ruta):
+        """
+        Carga, calienta y activa una versión en segundo plano.
+
+        Args:
+            ruta (str): Archivo del modelo
+
+        Returns:
+            concurrent.futures.Future: Da la versión activada, o la excepción
+                si la carga falló (la versión anterior sigue activa)
+        """
+        print(f"🔄 Cargando en segundo plano: {ruta}")
+        return self._ejecutor.submit(self._cargar, ruta)
+
+    @property
+    def version_activa(self):
+        """Versión del pool compartido (None si todavía no hay pool)"""
+        actual = pool_actual()
+        return None if actual is None else actual.version
+
+    def vigilar_archivo(self, ruta=None, intervalo=INTERVALO_VIGILANCIA):
+        """
+        Recarga el modelo cada vez que se reemplaza su archivo.
+
+        Un cambio cuenta cuando el tamaño y la fecha de modificación se
+        mantienen entre dos recorridos, para no cargar un archivo a medio
+        copiar.
+
+        Args:
+            ruta (str): Archivo vigilado (por defecto el del modelo principal)
+            intervalo (float): Segundos entre comprobaciones
+
+        Returns:
+            threading.Thread: Hilo de vigilancia (daemon)
+        """
+        ruta = ruta or ruta_modelo()
+        if ruta is None:
+            raise FileNotFoundError("No hay archivo de modelo que vigilar")
+
+        def avisar_error(futuro):
+            if futuro.exception() is not None:
+                print(f"❌ Recarga fallida, sigue activa {self.version_activa}: {futuro.exception()}")
+
+        def vigilar():
+            cargada = firma_archivo(ruta)
+            anterior = cargada
+            while not self._detener.wait(intervalo):
+                firma = firma_archivo(ruta)
+                if firma is not None and firma == anterior and firma != cargada:
+                    cargada = firma
+                    self.cargar(ruta).add_done_callback(avisar_error)
+                anterior = firma
+
+        print(f"👀 Vigilando el modelo: {ruta}")
+        self._vigilante = threading.Thread(target=vigilar, name='vigilante-modelo', daemon=True)
+        self._vigilante.start()
+        return self._vigilante
+
+    def detener(self, esperar=True):
+        """Detiene la vigilancia y el hilo de carga"""
+        self._detener.set()
+        self._ejecutor.shutdown(wait=esperar)
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Optimización del grafo de inferencia del modelo (Net5Blocks).
+
+Net5Blocks pone una BatchNormalization detrás de casi cada Conv2D, también
+en las ramas de atajo, y varias trabajan a 512x512x16. En inferencia una BN
+es solo una escala y un desplazamiento por canal, así que este módulo
+reconstruye el modelo sin ellas:
+
+- Conv2D (lineal) -> BN: la BN se pliega en el kernel y el sesgo de la convolución.
+- Conv2D -> Activation('relu'): la activación pasa a la propia convolución.
+- BN que no se puede plegar (detrás de una ReLU) -> Add: las escalas y el
+  desplazamiento se aplican dentro de la suma, en una sola capa SumaEscalada.
+- Add -> Activation('relu'): la ReLU se aplica dentro de esa misma capa.
+- Dropout: se elimina (en inferencia es la identidad).
+
+Las capas de ``preservar`` (por defecto ``conv10_thisone``, la de Grad-CAM)
+no se pliegan, así que su salida es la misma salvo redondeo y los mapas de
+calor no cambian. El modelo optimizado solo se usa si sus probabilidades
+coinciden con las del original sobre las imágenes de prueba.
+"""
+
+import json
+import os
+from collections import Counter
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import layers, models
+
+RAIZ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+RUTA_ARQUITECTURA = os.path.join(RAIZ, 'notebooks', 'modelo.json')
+CAPAS_PRESERVADAS = ('conv10_thisone',)
+# Capas que en inferencia no hacen nada
+CAPAS_IDENTIDAD = (layers.Dropout, layers.SpatialDropout2D, layers.GaussianNoise)
+
+
+class SumaEscalada(layers.Layer):
+    """
+    Suma de entradas con escala por canal, desplazamiento y activación:
+    ``activacion(sum(x_i * escala_i) + desplazamiento)`` en una sola capa.
+    """
+
+    def __init__(self, escalas, desplazamiento=None, activacion=None, **kwargs):
+        """
+        Args:
+            escalas (list): Escala por canal de cada entrada (None = sin escala)
+            desplazamiento (numpy.ndarray): Desplazamiento por canal (None = sin desplazamiento)
+            activacion (str): Activación final ('relu' o None)
+        """
+        super().__init__(**kwargs)
+        self._escalas_iniciales = [None if e is None else np.asarray(e, dtype=np.float32)
+                                   for e in escalas]
+        self._desplazamiento_inicial = (None if desplazamiento is None
+                                        else np.asarray(desplazamiento, dtype=np.float32))
+        self.activacion = activacion
+        self.escalas = []
+        self.desplazamiento = None
+
+    def build(self, forma):
+        for i, escala in enumerate(self._escalas_iniciales):
+            peso = None
+            if escala is not None:
+                peso = self.add_weight(name=f'escala_{i}', shape=escala.shape,
+                                       initializer='ones', trainable=False)
+                peso.assign(escala)
+            self.escalas.append(peso)
+        if self._desplazamiento_inicial is not None:
+            self.desplazamiento = self.add_weight(
+                name='desplazamiento', shape=self._desplazamiento_inicial.shape,
+                initializer='zeros', trainable=False)
+            self.desplazamiento.assign(self._desplazamiento_inicial)
+
+    def call(self, entradas):
+        if not isinstance(entradas, (list, tuple)):
+            entradas = [entradas]
+        salida = None
+        for x, escala in zip(entradas, self.escalas):
+            termino = x if escala is None else x * escala
+            salida = termino if salida is None else salida + termino
+        if self.desplazamiento is not None:
+            salida = salida + self.desplazamiento
+        if self.activacion == 'relu':
+            salida = tf.nn.relu(salida)
+        return salida
+
+    def compute_output_shape(self, forma):
+        return forma[0] if isinstance(forma, list) else forma
+
+    def get_config(self):
+        config = super().get_config()
+        config.update(
+            escalas=[None if e is None else e.tolist() for e in self._escalas_iniciales],
+            desplazamiento=(None if self._desplazamiento_inicial is None
+                            else self._desplazamiento_inicial.tolist()),
+            activacion=self.activacion)
+        return config
+
+
+def entradas_capa(capa):
+    """Nombres de las capas que alimentan a ``capa``"""
+    nodo = capa._inbound_nodes[0]
+    return [t._keras_history.operation.name for t in nodo.input_tensors]
+
+
+def _activacion(capa):
+    """Nombre de la activación de una capa ('linear' si no tiene)"""
+    return getattr(getattr(capa, 'activation', None), '__name__', 'linear')
+
+
+def _escala_batchnorm(capa):
+    """
+    Escala y desplazamiento por canal equivalentes a una BN en inferencia.
+
+    Returns:
+        tuple: (escala, desplazamiento) en float64
+    """
+    pesos = {p.path.split('/')[-1]: p.numpy().astype(np.float64) for p in capa.weights}
+    canales = pesos['moving_mean'].shape
+    gamma = pesos.get('gamma', np.ones(canales))
+    beta = pesos.get('beta', np.zeros(canales))
+    escala = gamma / np.sqrt(pesos['moving_variance'] + capa.epsilon)
+    return escala, beta - pesos['moving_mean'] * escala
+
+
+class _Constructor:
+    """Reconstruye el grafo aplicando los plegados de forma perezosa"""
+
+    def __init__(self, model, preservar):
+        self.model = model
+        self.preservar = set(preservar or ())
+        self.valores = {}
+        self.cambios = Counter()
+        self.consumidores = Counter()
+        self.alias = {}
+
+        entrada = model.inputs[0]
+        nombre_entrada = entrada._keras_history.operation.name
+        self.entrada = layers.Input(shape=tuple(entrada.shape[1:]), name=nombre_entrada)
+        self.valores[nombre_entrada] = {'tipo': 'tensor', 'tensor': self.entrada}
+
+        self.capas = [c for c in model.layers if not isinstance(c, layers.InputLayer)]
+        for capa in self.capas:
+            if isinstance(capa, CAPAS_IDENTIDAD):
+                self.alias[capa.name] = self.resolver(entradas_capa(capa)[0])
+        for capa in self.capas:
+            if capa.name not in self.alias:
+                for nombre in entradas_capa(capa):
+                    self.consumidores[self.resolver(nombre)] += 1
+        self.salidas = [self.resolver(t._keras_history.operation.name) for t in model.outputs]
+        for nombre in self.salidas:
+            self.consumidores[nombre] += 1
+
+    def resolver(self, nombre):
+        """Nombre de la capa real detrás de las capas identidad"""
+        while nombre in self.alias:
+            nombre = self.alias[nombre]
+        return nombre
+
+    def tensor(self, nombre):
+        """Tensor de salida de una capa, creando las capas pendientes"""
+        valor = self.valores[nombre]
+        if valor['tipo'] == 'conv':
+            capa = valor['capa']
+            config = capa.get_config()
+            config.update(activation=valor['activacion'], use_bias=True)
+            nueva = capa.__class__.from_config(config)
+            tensor = nueva(valor['entrada'])
+            nueva.set_weights([valor['kernel'].astype(np.float32), valor['bias'].astype(np.float32)])
+        elif valor['tipo'] == 'suma':
+            nueva = SumaEscalada([e for _, e in valor['entradas']], valor['desplazamiento'],
+                                 valor['activacion'], name=valor['nombre'])
+            tensor = nueva([t for t, _ in valor['entradas']] if len(valor['entradas']) > 1
+                           else valor['entradas'][0][0])
+        else:
+            return valor['tensor']
+        self.valores[nombre] = {'tipo': 'tensor', 'tensor': tensor}
+        return tensor
+
+    def _copiar(self, capa, entradas):
+        """Llama a una copia de la capa original sobre los tensores nuevos"""
+        nueva = capa.__class__.from_config(capa.get_config())
+        tensores = [self.tensor(n) for n in entradas]
+        tensor = nueva(tensores if len(tensores) > 1 else tensores[0])
+        if capa.weights:
+            nueva.set_weights(capa.get_weights())
+        return {'tipo': 'tensor', 'tensor': tensor}
+
+    def _plegable(self, nombre):
+        """La salida de la capa solo la usa la capa siguiente y no hay que conservarla"""
+        return self.consumidores[nombre] == 1 and nombre not in self.preservar
+
+    def procesar(self, capa):
+        nombre = capa.name
+        if nombre in self.alias:
+            self.cambios['dropout_eliminado'] += 1
+            return
+        entradas = [self.resolver(n) for n in entradas_capa(capa)]
+        previo = self.valores.get(entradas[0])
+
+        if type(capa) in (layers.Conv2D, layers.Dense):
+            kernel, *resto = [w.astype(np.float64) for w in capa.get_weights()]
+            bias = resto[0] if resto else np.zeros(kernel.shape[-1])
+            self.valores[nombre] = {'tipo': 'conv', 'capa': capa, 'kernel': kernel, 'bias': bias,
+                                    'activacion': _activacion(capa), 'entrada': self.tensor(entradas[0])}
+            if not self._plegable(nombre):
+                self.tensor(nombre)
+            return
+
+        if isinstance(capa, layers.BatchNormalization) and capa.axis in (-1, len(capa.input.shape) - 1):
+            escala, desplazamiento = _escala_batchnorm(capa)
+            if previo['tipo'] == 'conv' and previo['activacion'] == 'linear' and self._plegable(entradas[0]):
+                previo['kernel'] = previo['kernel'] * escala
+                previo['bias'] = previo['bias'] * escala + desplazamiento
+                self.valores[nombre] = previo
+                self.cambios['bn_plegada_en_conv'] += 1
+            else:
+                self.valores[nombre] = {'tipo': 'suma', 'nombre': nombre, 'activacion': None,
+                                        'entradas': [(self.tensor(entradas[0]), escala)],
+                                        'desplazamiento': desplazamiento}
+                self.cambios['bn_a_escala'] += 1
+            if not self._plegable(nombre):
+                self.tensor(nombre)
+            return
+
+        if isinstance(capa, layers.Add):
+            partes, desplazamiento = [], None
+            for entrada in entradas:
+                valor = self.valores[entrada]
+                if (valor['tipo'] == 'suma' and len(valor['entradas']) == 1
+                        and valor['activacion'] is None and self._plegable(entrada)):
+                    partes.append(valor['entradas'][0])
+                    if valor['desplazamiento'] is not None:
+                        desplazamiento = (valor['desplazamiento'] if desplazamiento is None
+                                          else desplazamiento + valor['desplazamiento'])
+                    self.cambios['escala_fusionada_en_suma'] += 1
+                else:
+                    partes.append((self.tensor(entrada), None))
+            self.valores[nombre] = {'tipo': 'suma', 'nombre': nombre, 'activacion': None,
+                                    'entradas': partes, 'desplazamiento': desplazamiento}
+            if not self._plegable(nombre):
+                self.tensor(nombre)
+            return
+
+        if isinstance(capa, layers.Activation) and _activacion(capa) == 'relu':
+            if (previo['tipo'] in ('conv', 'suma') and self._plegable(entradas[0])
+                    and previo['activacion'] in ('linear', None)):
+                previo['activacion'] = 'relu'
+                self.valores[nombre] = previo
+                self.cambios['relu_fusionada'] += 1
+                if not self._plegable(nombre):
+                    self.tensor(nombre)
+                return
+
+        self.valores[nombre] = self._copiar(capa, entradas)
+
+    def construir(self):
+        for capa in self.capas:
+            self.procesar(capa)
+        salidas = [self.tensor(n) for n in self.salidas]
+        return models.Model(self.entrada, salidas if len(salidas) > 1 else salidas[0],
+                            name=self.model.name)
+
+
+def optimizar_modelo(model, preservar=CAPAS_PRESERVADAS):
+    """
+    Construye un modelo de inferencia equivalente sin BatchNormalization ni
+    Dropout y con las operaciones elemento a elemento fusionadas.
+
+    Args:
+        model (tf.keras.Model): Modelo cargado (Functional o Sequential)
+        preservar (tuple): Capas cuya salida debe conservarse (Grad-CAM)
+
+    Returns:
+        tuple: (modelo, cambios)
+            - modelo (tf.keras.Model): Modelo optimizado, o el original si no
+              había nada que optimizar
+            - cambios (dict): Transformaciones aplicadas por tipo
+    """
+    constructor = _Constructor(model, preservar)
+    optimizado = constructor.construir()
+    cambios = dict(constructor.cambios)
+    if not cambios:
+        return model, cambios
+    return optimizado, cambios
+
+
+def verificar_paridad(original, optimizado, batch, tolerancia=1e-4):
+    """
+    Compara las salidas de los dos modelos sobre el mismo lote.
+
+    Args:
+        original (tf.keras.Model): Modelo de referencia
+        optimizado (tf.keras.Model): Modelo optimizado
+        batch (numpy.ndarray): Tensor (N, 512, 512, 1) float32
+        tolerancia (float): Diferencia absoluta máxima admitida en las probabilidades
+
+    Returns:
+        dict: diferencia_maxima, misma_clase (bool) y ok (bool)
+    """
+    esperado = np.asarray(original(batch, training=False))
+    obtenido = np.asarray(optimizado(batch, training=False))
+    diferencia = float(np.max(np.abs(esperado - obtenido)))
+    misma_clase = bool(np.array_equal(esperado.argmax(axis=1), obtenido.argmax(axis=1)))
+    return {'diferencia_maxima': diferencia, 'misma_clase': misma_clase,
+            'ok': misma_clase and diferencia <= tolerancia}
+
+
+def bytes_activaciones(model):
+    """
+    Memoria de las salidas de todas las capas para una imagen (float32).
+
+    Returns:
+        int: Bytes de activaciones intermedias por imagen
+    """
+    total = 0
+    for capa in model.layers:
+        if isinstance(capa, layers.InputLayer):
+            continue
+        total += int(np.prod(capa.output.shape[1:])) * 4
+    return total
+
+
+def optimizar_para_inferencia(model, tolerancia=1e-4, batch=None):
+    """
+    Optimiza el modelo y solo lo devuelve si mantiene la paridad numérica.
+
+    Args:
+        model (tf.keras.Model): Modelo cargado
+        tolerancia (float): Diferencia máxima admitida en las probabilidades
+        batch (numpy.ndarray): Lote de verificación (por defecto lote_de_verificacion())
+
+    Returns:
+        tf.keras.Model: Modelo optimizado, o el original si no hay nada que
+            optimizar o la verificación falla
+    """
+    try:
+        optimizado, cambios = optimizar_modelo(model)
+        if optimizado is model:
+            return model
+        paridad = verificar_paridad(model, optimizado,
+                                    lote_de_verificacion() if batch is None else batch, tolerancia)
+        if not paridad['ok']:
+            print(f"⚠️  Optimización descartada: diferencia {paridad['diferencia_maxima']:.2e}, "
+                  f"misma clase={paridad['misma_clase']}")
+            return model
+        resumen = ", ".join(f"{k}={v}" for k, v in sorted(cambios.items()))
+        print(f"🔧 Grafo optimizado: {len(model.layers)} -> {len(optimizado.layers)} capas ({resumen}); "
+              f"diferencia máxima {paridad['diferencia_maxima']:.2e}")
+        return optimizado
+    except Exception as e:
+        print(f"⚠️  No se pudo optimizar el grafo, se usa el original: {e}")
+        return model
+
+
+def lote_de_verificacion(n=4):
+    """
+    Lote para comprobar la paridad: las imágenes de prueba del repositorio
+    preprocesadas, o ruido si no están disponibles.
+
+    Returns:
+        numpy.ndarray: Tensor (n, 512, 512, 1) float32
+    """
+    try:
+        from .preprocess_img import preprocess_batch
+        from .read_img import read_image_file
+    except ImportError:
+        from src.modulos.preprocess_img import preprocess_batch
+        from src.modulos.read_img import read_image_file
+
+    directorio = os.path.join(RAIZ, 'tests', 'JPG', 'JPG')
+    rutas = []
+    if os.path.isdir(directorio):
+        for clase in sorted(os.listdir(directorio)):
+            carpeta = os.path.join(directorio, clase)
+            if os.path.isdir(carpeta):
+                rutas += [os.path.join(carpeta, f) for f in sorted(os.listdir(carpeta))[:1]]
+    imagenes = [read_image_file(r)[0] for r in rutas[:n]]
+    imagenes = [img for img in imagenes if img is not None]
+    if not imagenes:
+        return np.random.default_rng(0).random((n, 512, 512, 1), dtype=np.float32)
+    batch, validos = preprocess_batch(imagenes)
+    return batch[validos]
+
+
+def construir_net5blocks(ruta_json=RUTA_ARQUITECTURA, semilla=0):
+    """
+    Construye la arquitectura Net5Blocks desde su JSON (Keras 2) con pesos
+    aleatorios y estadísticas de BatchNormalization no triviales.
+
+    Sirve para medir y probar la optimización sin el archivo conv_MLP_84.h5.
+
+    Args:
+        ruta_json (str): Ruta de notebooks/modelo.json
+        semilla (int): Semilla de los pesos aleatorios
+
+    Returns:
+        tf.keras.Model: Modelo Net5Blocks
+    """
+    with open(ruta_json, 'r', encoding='utf-8') as f:
+        arquitectura = json.load(f)['config']
+
+    tensores = {}
+    for capa in arquitectura['layers']:
+        config = {k: v for k, v in capa['config'].items()
+                  if not k.endswith(('_initializer', '_regularizer', '_constraint'))}
+        if capa['class_name'] == 'InputLayer':
+            tensores[capa['name']] = layers.Input(shape=tuple(config['batch_input_shape'][1:]),
+                                                  name=capa['name'])
+            continue
+        if isinstance(config.get('axis'), list):
+            config['axis'] = config['axis'][0]
+        nueva = getattr(layers, capa['class_name']).from_config(config)
+        entradas = [tensores[nodo[0]] for nodo in capa['inbound_nodes'][0]]
+        tensores[capa['name']] = nueva(entradas if len(entradas) > 1 else entradas[0])
+
+    entrada = tensores[arquitectura['input_layers'][0][0]]
+    salida = tensores[arquitectura['output_layers'][0][0]]
+    model = models.Model(entrada, salida, name=arquitectura['name'])
+
+    rng = np.random.default_rng(semilla)
+    for capa in model.layers:
+        if isinstance(capa, layers.BatchNormalization):
+            canales = capa.moving_mean.shape[0]
+            capa.set_weights([rng.uniform(0.5, 1.5, canales), rng.normal(0, 0.1, canales),
+                              rng.normal(0, 0.1, canales), rng.uniform(0.5, 2.0, canales)])
+        elif capa.weights:
+            kernel, bias = capa.get_weights()
+            capa.set_weights([rng.normal(0, np.sqrt(2.0 / np.prod(kernel.shape[:-1])), kernel.shape),
+                              rng.normal(0, 0.01, bias.shape)])
+    return model
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Escritura de resultados en segundo plano.
+
+Guardar cada superposición de 512x512x3 con cv2.imwrite en el hilo que
+ejecuta el modelo lo detiene mientras codifica el PNG (~30 ms) y espera al
+disco. La salida asíncrona codifica y escribe en un pool de hilos propio:
+el llamador entrega el array y sigue con el lote siguiente.
+
+Formatos de los mapas de calor:
+    - png: sin pérdida; por defecto con los ajustes de cv2.imwrite, los más
+      rápidos, o con la compresión NEUMONIA_SALIDA_CALIDAD (0-9)
+    - webp / jpg: con pérdida, calidad 0-100 (por defecto 90); JPEG es con
+      diferencia el más rápido de codificar
+    - npz: el CAM uint8 de baja resolución comprimido, sin superponer; la
+      superposición se puede renderizar después (ver overlay)
+
+Los registros de resultados (CSV o JSON lines) se acumulan en memoria y se
+escriben de ``registros_por_escritura`` en ``registros_por_escritura``, en
+orden y con una sola escritura secuencial por bloque.
+
+Si el disco no da abasto, la contrapresión la pone ``max_pendientes``:
+cuando hay tantos archivos esperando a escribirse, el siguiente escribir_*
+espera a que se libere un hueco, así la memoria retenida no crece sin
+límite. El tiempo bloqueado se reporta junto con los bytes por imagen y el
+tiempo de codificación (ver estadisticas).
+
+Uso:
+    with SalidaAsincrona('data/heatmaps', formato='jpg', registros='data/resultados.csv') as salida:
+        salida.escribir_heatmap('00000001_estudio', overlay)
+        salida.agregar_registros(resultados)
+"""
+
+import csv
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+FORMATOS = ('png', 'webp', 'jpg', 'npz')
+CALIDAD_POR_DEFECTO = {'webp': 90, 'jpg': 90}
+CAMPOS_REGISTRO = ('id', 'ruta', 'estado', 'diagnostico', 'probabilidad', 'probabilidades',
+                   'heatmap', 'version_modelo', 'error')
+MAX_PENDIENTES = 32
+REGISTROS_POR_ESCRITURA = 256
+
+
+class SalidaAsincrona:
+    """
+    Codifica y escribe mapas de calor y registros de resultados en segundo plano.
+
+    Las rutas se devuelven de inmediato; el archivo existe cuando termina su
+    escritura (vaciar() o cerrar() esperan a todas, y vaciar() devuelve las
+    que fallaron; esperar_grupo() espera solo a las de un grupo). Los
+    registros se escriben en orden: ``registros_escritos`` dice cuántos de
+    los ``registros_agregados`` ya están en disco (tras un bloque fallido
+    no se escriben más).
+    """
+
+    def __init__(self, directorio=None, formato=None, calidad=None, workers=2,
+                 max_pendientes=MAX_PENDIENTES, registros=None,
+                 registros_por_escritura=REGISTROS_POR_ESCRITURA):
+        """
+        Args:
+            directorio (str): Carpeta de los mapas de calor (None = solo registros)
+            formato (str): 'png', 'webp', 'jpg' o 'npz' (por defecto
+                NEUMONIA_SALIDA_FORMATO o 'png')
+            calidad (int): Calidad de webp/jpg (0-100) o compresión de png
+                (0-9) (por defecto NEUMONIA_SALIDA_CALIDAD o la del formato;
+                png sin calidad usa los ajustes de cv2.imwrite)
+            workers (int): Hilos que codifican y escriben
+            max_pendientes (int): Archivos en espera antes de bloquear al llamador
+            registros (str): Archivo .csv o .jsonl donde se añaden los
+                registros (None = sin registros)
+            registros_por_escritura (int): Registros acumulados por escritura
+        """
+        self.formato = (formato or os.environ.get('NEUMONIA_SALIDA_FORMATO', 'png')).lower()
+        if self.formato == 'jpeg':
+            self.formato = 'jpg'
+        if self.formato not in FORMATOS:
+            raise ValueError(f"Formato desconocido: {self.formato} (opciones: {FORMATOS})")
+        if calidad is None and os.environ.get('NEUMONIA_SALIDA_CALIDAD'):
+            calidad = int(os.environ['NEUMONIA_SALIDA_CALIDAD'])
+        self.calidad = CALIDAD_POR_DEFECTO.get(self.formato) if calidad is None else int(calidad)
+        self.directorio = directorio
+        if directorio is not None:
+            os.makedirs(directorio, exist_ok=True)
+        self.registros = registros
+        self.registros_por_escritura = max(1, int(registros_por_escritura))
+
+        self._ejecutor = ThreadPoolExecutor(max(1, int(workers)), thread_name_prefix='salida')
+        # Un solo hilo para los registros: los bloques se escriben en orden
+        self._ejecutor_registros = ThreadPoolExecutor(1, thread_name_prefix='salida-registros')
+        self._huecos = threading.BoundedSemaphore(max(1, int(max_pendientes)))
+        self._futuros = set()
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._fallidas = set()
+        self._grupo = []
+
+        self.imagenes = 0
+        self.bytes_imagenes = 0
+        self.segundos_codificacion = 0.0
+        self.segundos_escritura = 0.0
+        self.segundos_contrapresion = 0.0
+        self.registros_agregados = 0
+        self.registros_escritos = 0
+        self.errores_registros = 0
+        self.escrituras_registros = 0
+        self.bytes_registros = 0
+        self.errores = 0
+
+    # ------------------------------------------------------------------
+    # Codificación (en los hilos de la salida)
+    # ------------------------------------------------------------------
+    def _codificar_imagen(self, overlay):
+        bgr = cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR)
+        if self.formato == 'png':
+            parametros = [] if self.calidad is None else [cv2.IMWRITE_PNG_COMPRESSION, self.calidad]
+        elif self.formato == 'webp':
+            parametros = [cv2.IMWRITE_WEBP_QUALITY, self.calidad]
+        else:
+            parametros = [cv2.IMWRITE_JPEG_QUALITY, self.calidad]
+        ok, codificada = cv2.imencode(f'.{self.formato}', bgr, parametros)
+        if not ok:
+            raise RuntimeError(f"No se pudo codificar en {self.formato}")
+        return codificada.tobytes()
+
+    @staticmethod
+    def _codificar_cam(cam):
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, cam=np.asarray(cam, dtype=np.uint8))
+        return buffer.getvalue()
+
+    def _escribir(self, destino, codificar, datos):
+        try:
+            inicio = time.perf_counter()
+            contenido = codificar(datos)
+            codificado = time.perf_counter()
+            with open(destino, 'wb') as f:
+                f.write(contenido)
+            escrito = time.perf_counter()
+            with self._lock:
+                self.imagenes += 1
+                self.bytes_imagenes += len(contenido)
+                self.segundos_codificacion += codificado - inicio
+                self.segundos_escritura += escrito - codificado
+            return True
+        except Exception as e:
+            with self._lock:
+                self.errores += 1
+                self._fallidas.add(destino)
+            print(f"❌ Error escribiendo {destino}: {e}")
+            return False
+        finally:
+            self._huecos.release()
+
+    def _enviar(self, destino, codificar, datos):
+        inicio = time.perf_counter()
+        # Contrapresión: espera a que haya hueco si el disco va por detrás
+        self._huecos.acquire()
+        futuro = self._ejecutor.submit(self._escribir, destino, codificar, datos)
+        with self._lock:
+            self.segundos_contrapresion += time.perf_counter() - inicio
+            self._futuros.add(futuro)
+            self._grupo.append((destino, futuro))
+        futuro.add_done_callback(self._terminado)
+        return destino
+
+    def _terminado(self, futuro):
+        with self._lock:
+            self._futuros.discard(futuro)
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+    def extension(self):
+        """Extensión de los archivos de mapas de calor ('.png', '.jpg', ...)"""
+        return f'.{self.formato}'
+
+    def escribir_heatmap(self, nombre, overlay=None, cam=None):
+        """
+        Encola un mapa de calor para codificarlo y escribirlo.
+
+        En formato 'npz' se guarda ``cam``; en los demás, ``overlay``. El
+        array no se copia: el llamador no debe modificarlo después.
+
+        Args:
+            nombre (str): Nombre del archivo sin extensión
+            overlay (numpy.ndarray): Superposición RGB (alto, ancho, 3) uint8
+            cam (numpy.ndarray): CAM uint8 de baja resolución (alto, ancho)
+
+        Returns:
+            str: Ruta donde quedará el archivo
+        """
+        if self.directorio is None:
+            raise ValueError("La salida no tiene carpeta de mapas de calor")
+        destino = os.path.join(self.directorio, nombre + self.extension())
+        if self.formato == 'npz':
+            if cam is None:
+                raise ValueError("El formato npz guarda el CAM: falta 'cam'")
+            return self._enviar(destino, self._codificar_cam, cam)
+        if overlay is None:
+            raise ValueError(f"El formato {self.formato} guarda la superposición: falta 'overlay'")
+        return self._enviar(destino, self._codificar_imagen, overlay)
+
+    def cortar_grupo(self):
+        """
+        Cierra el grupo de mapas de calor encolados desde el corte anterior.
+
+        Returns:
+            list: Pares (ruta, futuro) para esperar_grupo
+        """
+        with self._lock:
+            grupo, self._grupo = self._grupo, []
+        return grupo
+
+    @staticmethod
+    def esperar_grupo(grupo):
+        """
+        Espera solo a las escrituras de un grupo (ver cortar_grupo).
+
+        Returns:
+            set: Rutas del grupo cuya escritura falló
+        """
+        return {destino for destino, futuro in grupo if not futuro.result()}
+
+    def agregar_registros(self, registros):
+        """
+        Acumula registros de resultados y escribe un bloque cuando se llena.
+
+        Args:
+            registros (list): Diccionarios (ver procesar_lote); en CSV solo se
+                guardan los CAMPOS_REGISTRO
+        """
+        if self.registros is None:
+            return
+        bloques = []
+        with self._lock:
+            self._buffer.extend(registros)
+            self.registros_agregados += len(registros)
+            while len(self._buffer) >= self.registros_por_escritura:
+                bloques.append(self._buffer[:self.registros_por_escritura])
+                del self._buffer[:self.registros_por_escritura]
+        for bloque in bloques:
+            self._enviar_registros(bloque)
+
+    def _enviar_registros(self, bloque):
+        futuro = self._ejecutor_registros.submit(self._escribir_registros, bloque)
+        with self._lock:
+            self._futuros.add(futuro)
+        futuro.add_done_callback(self._terminado)
+
+    def _escribir_registros(self, bloque):
+        try:
+            if self.errores_registros:
+                # Tras un bloque fallido no se escriben los siguientes: lo
+                # escrito es siempre un prefijo de lo agregado
+                raise RuntimeError("falló un bloque anterior")
+            texto = io.StringIO()
+            es_csv = self.registros.lower().endswith('.csv')
+            if es_csv:
+                escritor = csv.DictWriter(texto, fieldnames=CAMPOS_REGISTRO, extrasaction='ignore')
+                if not os.path.exists(self.registros) or os.path.getsize(self.registros) == 0:
+                    escritor.writeheader()
+                for registro in bloque:
+                    fila = dict(registro)
+                    if fila.get('probabilidades') is not None:
+                        fila['probabilidades'] = json.dumps(fila['probabilidades'])
+                    escritor.writerow(fila)
+            else:
+                for registro in bloque:
+                    texto.write(json.dumps(registro, ensure_ascii=False) + '\n')
+            contenido = texto.getvalue().encode('utf-8')
+            # Todo el bloque en una sola escritura secuencial
+            with open(self.registros, 'ab') as f:
+                f.write(contenido)
+            with self._lock:
+                self.registros_escritos += len(bloque)
+                self.escrituras_registros += 1
+                self.bytes_registros += len(contenido)
+        except Exception as e:
+            with self._lock:
+                self.errores += 1
+                self.errores_registros += 1
+                self._fallidas.add(self.registros)
+            print(f"❌ Error escribiendo registros en {self.registros}: {e}")
+
+    def vaciar(self):
+        """
+        Escribe los registros acumulados y espera a todas las escrituras pendientes.
+
+        Returns:
+            set: Rutas cuya escritura falló desde el vaciar anterior (mapas de
+                calor y, si falló algún bloque de registros, el archivo de
+                registros)
+        """
+        with self._lock:
+            bloque, self._buffer = self._buffer, []
+        if bloque:
+            self._enviar_registros(bloque)
+        while True:
+            with self._lock:
+                pendientes = list(self._futuros)
+            if not pendientes:
+                break
+            for futuro in pendientes:
+                futuro.result()
+        with self._lock:
+            fallidas, self._fallidas = self._fallidas, set()
+            # Todo lo encolado ya terminó: de los grupos sin cortar solo
+            # importan los fallos (así no crecen si nadie los corta)
+            self._grupo = [(destino, futuro) for destino, futuro in self._grupo if not futuro.result()]
+        return fallidas
+
+    def estadisticas(self):
+        """
+        Bytes y tiempos de la salida.
+
+        Returns:
+            dict: imagenes, bytes_por_imagen, codificacion_ms y escritura_ms
+                medios por imagen, contrapresion_s total, registros,
+                escrituras_registros, bytes_registros y errores
+        """
+        with self._lock:
+            n = self.imagenes
+            return {
+                'formato': self.formato,
+                'calidad': self.calidad,
+                'imagenes': n,
+                'bytes_imagenes': self.bytes_imagenes,
+                'bytes_por_imagen': round(self.bytes_imagenes / n) if n else 0,
+                'codificacion_ms': round(self.segundos_codificacion / n * 1000, 2) if n else 0.0,
+                'escritura_ms': round(self.segundos_escritura / n * 1000, 2) if n else 0.0,
+                'contrapresion_s': round(self.segundos_contrapresion, 3),
+                'registros': self.registros_escritos,
+                'escrituras_registros': self.escrituras_registros,
+                'bytes_registros': self.bytes_registros,
+                'errores': self.errores,
+            }
+
+    def cerrar(self):
+        """Vacía la salida y libera sus hilos"""
+        self.vaciar()
+        self._ejecutor.shutdown(wait=True)
+        self._ejecutor_registros.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+
+def imprimir_estadisticas(estadisticas):
+    """Muestra en consola los bytes y tiempos de una salida asíncrona"""
+    e = estadisticas
+    if e['imagenes']:
+        calidad = '' if e['calidad'] is None else f" (calidad {e['calidad']})"
+        print(f"💾 {e['imagenes']} mapas de calor {e['formato']}{calidad}: "
+              f"{e['bytes_por_imagen'] / 1024:.0f} KB/imagen | codificación {e['codificacion_ms']:.1f} ms | "
+              f"escritura {e['escritura_ms']:.1f} ms | contrapresión {e['contrapresion_s']:.2f} s")
+    if e['registros']:
+        print(f"💾 {e['registros']} registros en {e['escrituras_registros']} escrituras "
+              f"({e['bytes_registros'] / 1024:.0f} KB)")
+    if e['errores']:
+        print(f"⚠️  {e['errores']} escrituras fallidas")
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Renderizado de la superposición del mapa de calor sobre la radiografía.
+
+Trabaja en RGB desde el principio: el mapa de colores JET se precalcula
+como una tabla de 256 colores RGB, así que no hace falta convertir BGR↔RGB
+ni para la imagen original ni para el resultado. Todos los pasos escriben
+en buffers preasignados por hilo y la mezcla se hace directamente en el
+array de salida.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+# Tabla JET de 256 entradas en RGB, en el formato que acepta cv2.applyColorMap
+LUT_JET_RGB = np.ascontiguousarray(
+    cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(256, 1), cv2.COLORMAP_JET)[:, :, ::-1]
+)
+# Imágenes por tramo de render_batch: acota los buffers de cada hilo
+# (~7 MB a 512x512) aunque se rendericen lotes grandes
+IMAGENES_POR_TRAMO = 4
+
+
+class RenderizadorOverlay:
+    """
+    Renderizador de superposiciones CAM + imagen original para un tamaño fijo.
+
+    Es seguro entre hilos: cada hilo usa sus propios buffers de trabajo.
+    """
+
+    def __init__(self, target_size=(512, 512), alpha=0.5, lut=LUT_JET_RGB):
+        """
+        Args:
+            target_size (tuple): Tamaño de salida (ancho, alto)
+            alpha (float): Transparencia del heatmap
+            lut (numpy.ndarray): Mapa de colores (256, 1, 3) en RGB
+        """
+        self.target_size = tuple(target_size)
+        self.alpha = float(alpha)
+        self.lut = lut
+        self._local = threading.local()
+
+    def _buffers(self, n=1):
+        """Buffers del hilo actual para ``n`` imágenes (n <= IMAGENES_POR_TRAMO)"""
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None or buffers["n"] < n:
+            ancho, alto = self.target_size
+            buffers = {
+                "n": n,
+                "heatmap": np.empty((n * alto, ancho), dtype=np.uint8),
+                "color": np.empty((n * alto, ancho, 3), dtype=np.uint8),
+                "original": np.empty((n * alto, ancho, 3), dtype=np.uint8),
+                "gris": np.empty((alto, ancho), dtype=np.uint8),
+            }
+            self._local.buffers = buffers
+        return buffers
+
+    def _preparar_original(self, array, destino, gris):
+        """Redimensiona la imagen original y la deja en 3 canales en ``destino``"""
+        if array.dtype != np.uint8:
+            array = cv2.normalize(array, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+        if array.ndim == 2 or array.shape[2] == 1:
+            cv2.resize(array, self.target_size, dst=gris)
+            cv2.cvtColor(gris, cv2.COLOR_GRAY2RGB, dst=destino)
+        else:
+            cv2.resize(array[:, :, :3], self.target_size, dst=destino)
+
+    def render(self, cam, array, out=None):
+        """
+        Superpone un CAM sobre su imagen original.
+
+        Args:
+            cam (numpy.ndarray): CAM uint8 de baja resolución (alto, ancho)
+            array (numpy.ndarray): Imagen original (gris o 3 canales)
+            out (numpy.ndarray): Destino (alto, ancho, 3) uint8 opcional
+
+        Returns:
+            numpy.ndarray: Imagen RGB con el mapa de calor superpuesto
+        """
+        return self.render_batch(cam[np.newaxis], [array],
+                                 None if out is None else out[np.newaxis])[0]
+
+    def render_batch(self, cams, arrays, out=None):
+        """
+        Superpone un lote de CAMs sobre sus imágenes originales.
+
+        El color y la mezcla se aplican a tramos de IMAGENES_POR_TRAMO
+        imágenes de una vez, así que los buffers no crecen con el lote.
+
+        Args:
+            cams (numpy.ndarray): CAMs uint8 (N, alto, ancho)
+            arrays (list): Imágenes originales (pueden tener tamaños distintos)
+            out (numpy.ndarray): Destino (N, alto, ancho, 3) uint8 opcional
+
+        Returns:
+            numpy.ndarray: Imágenes RGB (N, alto, ancho, 3)
+        """
+        ancho, alto = self.target_size
+        n = len(cams)
+        if out is None:
+            out = np.empty((n, alto, ancho, 3), dtype=np.uint8)
+        elif out.shape != (n, alto, ancho, 3) or not out.flags['C_CONTIGUOUS']:
+            raise ValueError(f"Destino inválido: se esperaba ({n}, {alto}, {ancho}, 3) contiguo")
+        buffers = self._buffers(min(n, IMAGENES_POR_TRAMO))
+
+        for inicio in range(0, n, IMAGENES_POR_TRAMO):
+            m = min(IMAGENES_POR_TRAMO, n - inicio)
+            heatmap = buffers["heatmap"][:m * alto]
+            color = buffers["color"][:m * alto]
+            original = buffers["original"][:m * alto]
+
+            for i in range(m):
+                filas = slice(i * alto, (i + 1) * alto)
+                cv2.resize(cams[inicio + i], self.target_size, dst=heatmap[filas])
+                self._preparar_original(arrays[inicio + i], original[filas], buffers["gris"])
+
+            # Color JET en RGB directamente con la tabla precalculada
+            cv2.applyColorMap(heatmap, self.lut, dst=color)
+            # Mezcla escrita directamente en la salida
+            cv2.addWeighted(original, 1 - self.alpha, color, self.alpha, 0,
+                            dst=out[inicio:inicio + m].reshape(m * alto, ancho, 3))
+        return out
+
+
+# Renderizadores compartidos por tamaño y transparencia
+_renderizadores = {}
+_renderizadores_lock = threading.Lock()
+
+
+def get_renderizador(target_size=(512, 512), alpha=0.5):
+    """
+    Devuelve un renderizador compartido para el tamaño y la transparencia dados.
+
+    Args:
+        target_size (tuple): Tamaño de salida (ancho, alto)
+        alpha (float): Transparencia del heatmap
+
+    Returns:
+        RenderizadorOverlay: Renderizador reutilizable
+    """
+    clave = (tuple(target_size), float(alpha))
+    with _renderizadores_lock:
+        renderizador = _renderizadores.get(clave)
+        if renderizador is None:
+            renderizador = _renderizadores[clave] = RenderizadorOverlay(*clave)
+    return renderizador
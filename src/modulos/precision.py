@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Inferencia en precisión reducida (bfloat16/float16) en CPU.
+
+La entrada del modelo es una imagen CLAHE de 8 bits dividida por 255: tiene
+256 niveles, que bfloat16 (8 bits de mantisa) representa casi sin error. Con
+la política mixta de Keras las convoluciones se calculan en bfloat16 y los
+pesos se guardan en float32; la capa de salida (softmax) se mantiene en
+float32 para que las probabilidades no pierdan resolución.
+
+En CPUs con AVX512-BF16 o AMX, oneDNN ejecuta las convoluciones bfloat16
+en hardware. Sin esas instrucciones TensorFlow las emula y es más lento que
+float32, así que se vuelve a float32. float16 solo se usa si se pide
+explícitamente: en CPU TensorFlow no tiene kernels float16 rápidos y solo
+ahorra memoria.
+
+El modo se elige con NEUMONIA_PRECISION (float32 por defecto, bfloat16,
+float16 o auto) y el modelo reducido solo se usa si su diagnóstico coincide
+con el de float32 en las imágenes de prueba (ver reporte_paridad).
+"""
+
+import os
+
+import numpy as np
+import tensorflow as tf
+import keras
+from tensorflow.keras import layers, models
+
+try:
+    from .model_optimizer import entradas_capa, lote_de_verificacion
+except ImportError:
+    from src.modulos.model_optimizer import entradas_capa, lote_de_verificacion
+
+PRECISIONES = ('float32', 'bfloat16', 'float16', 'auto')
+POLITICAS = {'bfloat16': 'mixed_bfloat16', 'float16': 'mixed_float16'}
+# Instrucciones con las que oneDNN calcula cada tipo en hardware
+INSTRUCCIONES = {'bfloat16': ('avx512_bf16', 'amx_bf16'),
+                 'float16': ('avx512_fp16', 'amx_fp16')}
+# Diferencia máxima admitida en las probabilidades frente a float32
+TOLERANCIA = 0.02
+
+_instrucciones_cpu = None
+
+
+def instrucciones_cpu():
+    """
+    Extensiones de la CPU según /proc/cpuinfo.
+
+    Returns:
+        set: Banderas de la CPU (vacío si no se pueden leer)
+    """
+    global _instrucciones_cpu
+    if _instrucciones_cpu is None:
+        banderas = set()
+        try:
+            with open('/proc/cpuinfo') as f:
+                for linea in f:
+                    if linea.startswith('flags'):
+                        banderas.update(linea.split(':', 1)[1].split())
+                        break
+        except OSError:
+            pass
+        _instrucciones_cpu = banderas
+    return _instrucciones_cpu
+
+
+def soporta(precision):
+    """Indica si la CPU calcula ``precision`` en hardware"""
+    if precision == 'float32':
+        return True
+    return any(i in instrucciones_cpu() for i in INSTRUCCIONES.get(precision, ()))
+
+
+def resolver_precision(precision=None):
+    """
+    Precisión que se usará realmente en esta máquina.
+
+    Args:
+        precision (str): 'float32', 'bfloat16', 'float16' o 'auto'
+            (por defecto NEUMONIA_PRECISION o 'float32')
+
+    Returns:
+        str: 'float32', 'bfloat16' o 'float16'
+
+    Raises:
+        ValueError: Si la precisión no existe
+    """
+    precision = (precision or os.environ.get('NEUMONIA_PRECISION') or 'float32').lower()
+    if precision not in PRECISIONES:
+        raise ValueError(f"Precisión desconocida: {precision} (opciones: {PRECISIONES})")
+    if precision == 'auto':
+        return 'bfloat16' if soporta('bfloat16') else 'float32'
+    if precision == 'bfloat16' and not soporta('bfloat16'):
+        print("⚠️  La CPU no tiene AVX512-BF16 ni AMX: se usa float32")
+        return 'float32'
+    if precision == 'float16' and not soporta('float16'):
+        print("⚠️  La CPU no calcula float16 en hardware: solo se ahorra memoria")
+    return precision
+
+
+def dtype_entrada(model):
+    """
+    Tipo numpy que espera la entrada del modelo.
+
+    Returns:
+        numpy.dtype: float32, bfloat16 o float16 (float32 si no se puede consultar)
+    """
+    try:
+        return np.dtype(tf.as_dtype(model.inputs[0].dtype).as_numpy_dtype)
+    except Exception:
+        return np.dtype(np.float32)
+
+
+def convertir_precision(model, precision):
+    """
+    Reconstruye el modelo con la política mixta de ``precision``.
+
+    Cada capa se recrea desde su configuración con la nueva política y
+    recibe los mismos pesos. La entrada pasa a ser del tipo reducido (los
+    lotes ocupan la mitad) y las capas de salida se quedan en float32.
+
+    Args:
+        model (tf.keras.Model): Modelo float32 (Functional o Sequential)
+        precision (str): 'bfloat16' o 'float16'
+
+    Returns:
+        tf.keras.Model: Modelo en precisión reducida
+    """
+    politica = keras.DTypePolicy(POLITICAS[precision])
+    entrada = model.inputs[0]
+    nombre_entrada = entrada._keras_history.operation.name
+    tensores = {nombre_entrada: layers.Input(shape=tuple(entrada.shape[1:]), name=nombre_entrada,
+                                             dtype=politica.compute_dtype)}
+    salidas = [t._keras_history.operation.name for t in model.outputs]
+
+    for capa in model.layers:
+        if isinstance(capa, layers.InputLayer):
+            continue
+        config = capa.get_config()
+        config['dtype'] = 'float32' if capa.name in salidas else politica.name
+        nueva = capa.__class__.from_config(config)
+        previos = [tensores[n] for n in entradas_capa(capa)]
+        tensores[capa.name] = nueva(previos if len(previos) > 1 else previos[0])
+        if capa.weights:
+            nueva.set_weights(capa.get_weights())
+
+    finales = [tensores[n] for n in salidas]
+    return models.Model(tensores[nombre_entrada], finales if len(finales) > 1 else finales[0],
+                        name=model.name)
+
+
+def reporte_paridad(original, reducido, batch):
+    """
+    Compara diagnósticos y probabilidades del modelo reducido con float32.
+
+    Args:
+        original (tf.keras.Model): Modelo float32
+        reducido (tf.keras.Model): Modelo en precisión reducida
+        batch (numpy.ndarray): Tensor (N, 512, 512, 1) float32
+
+    Returns:
+        dict: imagenes, concordancia (fracción con el mismo diagnóstico),
+            discrepancias (índices), delta_maximo, delta_medio y
+            delta_por_clase (máximo por clase)
+    """
+    esperado = np.asarray(original(batch, training=False), dtype=np.float32)
+    obtenido = np.asarray(reducido(batch.astype(dtype_entrada(reducido)), training=False),
+                          dtype=np.float32)
+    delta = np.abs(esperado - obtenido)
+    iguales = esperado.argmax(axis=1) == obtenido.argmax(axis=1)
+    return {
+        'imagenes': int(len(batch)),
+        'concordancia': float(iguales.mean()) if len(batch) else 1.0,
+        'discrepancias': np.flatnonzero(~iguales).tolist(),
+        'delta_maximo': float(delta.max()) if delta.size else 0.0,
+        'delta_medio': float(delta.mean()) if delta.size else 0.0,
+        'delta_por_clase': delta.max(axis=0).round(6).tolist() if delta.size else [],
+    }
+
+
+def reducir_precision(model, precision=None, tolerancia=TOLERANCIA, batch=None):
+    """
+    Convierte el modelo a precisión reducida si la CPU la soporta y el
+    resultado concuerda con float32; si no, devuelve el modelo original.
+
+    Args:
+        model (tf.keras.Model): Modelo float32 cargado
+        precision (str): Ver resolver_precision
+        tolerancia (float): Diferencia máxima admitida en las probabilidades
+        batch (numpy.ndarray): Lote de verificación (por defecto lote_de_verificacion())
+
+    Returns:
+        tf.keras.Model: Modelo reducido o el original
+    """
+    try:
+        precision = resolver_precision(precision)
+        if precision == 'float32':
+            return model
+        reducido = convertir_precision(model, precision)
+        reporte = reporte_paridad(model, reducido,
+                                  lote_de_verificacion() if batch is None else batch)
+        if reporte['concordancia'] < 1.0 or reporte['delta_maximo'] > tolerancia:
+            print(f"⚠️  {precision} descartado: concordancia {reporte['concordancia']:.0%}, "
+                  f"diferencia máxima {reporte['delta_maximo']:.2e}; se usa float32")
+            return model
+        print(f"🔧 Inferencia en {precision}: concordancia {reporte['concordancia']:.0%} "
+              f"en {reporte['imagenes']} imágenes, diferencia máxima {reporte['delta_maximo']:.2e}")
+        return reducido
+    except Exception as e:
+        print(f"⚠️  No se pudo reducir la precisión, se usa float32: {e}")
+        return model
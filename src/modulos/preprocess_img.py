@@ -11,9 +11,151 @@ Transforma las imágenes al formato requerido por el modelo:
 - Conversión a formato de batch (tensor)
 """
 
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import cv2
 import numpy as np
 
+TAMANO_MODELO = (512, 512)
+CLIP_LIMIT = 2.0
+TILE_GRID_SIZE = (4, 4)
+# Tipos de los tensores de entrada: float32, o la mitad de memoria para
+# los modelos en precisión reducida (ver precision)
+TIPOS_SALIDA = ('float32', 'bfloat16', 'float16')
+
+
+class Preprocessor:
+    """
+    Preprocesador reutilizable con buffers de trabajo preasignados.
+
+    Cada hilo obtiene su propia instancia de CLAHE y sus propios buffers
+    uint8 de 512x512, por lo que un mismo objeto puede compartirse entre
+    los hilos de un ThreadPoolExecutor sin bloqueos. El resultado se
+    escribe directamente en el destino indicado por el llamador (por
+    ejemplo ``batch[i]`` de un tensor (N, 512, 512, 1)), sin copias
+    intermedias.
+    """
+
+    def __init__(self, clip_limit=CLIP_LIMIT, tile_grid_size=TILE_GRID_SIZE,
+                 target_size=TAMANO_MODELO):
+        self.clip_limit = float(clip_limit)
+        self.tile_grid_size = tuple(tile_grid_size)
+        self.target_size = tuple(target_size)
+        self._local = threading.local()
+
+    def _estado_hilo(self):
+        """Devuelve (clahe, buffers) del hilo actual, creándolos si hace falta."""
+        estado = getattr(self._local, "estado", None)
+        if estado is None:
+            ancho, alto = self.target_size
+            clahe = cv2.createCLAHE(clipLimit=self.clip_limit,
+                                    tileGridSize=self.tile_grid_size)
+            buffers = {
+                "color": np.empty((alto, ancho, 3), dtype=np.uint8),
+                "gris": np.empty((alto, ancho), dtype=np.uint8),
+                "clahe": np.empty((alto, ancho), dtype=np.uint8),
+            }
+            estado = (clahe, buffers)
+            self._local.estado = estado
+        return estado
+
+    def firma(self):
+        """
+        Identifica los parámetros de preprocesamiento.
+
+        Returns:
+            str: Cadena estable que cambia si cambia algún parámetro
+        """
+        return (f"clahe={self.clip_limit}/{self.tile_grid_size[0]}x{self.tile_grid_size[1]};"
+                f"size={self.target_size[0]}x{self.target_size[1]}")
+
+    def equalize(self, array):
+        """
+        Ejecuta redimensionamiento, escala de grises y CLAHE.
+
+        El resultado vive en un buffer del hilo actual y se sobrescribe en
+        la siguiente llamada desde ese mismo hilo: copiarlo si se necesita
+        conservarlo.
+
+        Args:
+            array (numpy.ndarray): Imagen original (gris, RGB o BGR)
+
+        Returns:
+            numpy.ndarray: Imagen ecualizada uint8 de tamaño target_size
+        """
+        if array is None:
+            raise ValueError("El array de entrada es None")
+
+        clahe, buffers = self._estado_hilo()
+
+        # 1. REDIMENSIONAR (en el buffer del hilo cuando el formato lo permite)
+        if array.dtype == np.uint8 and array.ndim == 3 and array.shape[2] == 3:
+            array = cv2.resize(array, self.target_size, dst=buffers["color"])
+        elif array.dtype == np.uint8 and array.ndim == 2:
+            array = cv2.resize(array, self.target_size, dst=buffers["gris"])
+        else:
+            array = cv2.resize(array, self.target_size)
+
+        # 2. CONVERTIR a escala de grises (si es necesario)
+        if len(array.shape) == 3:
+            if array.dtype == np.uint8:
+                array = cv2.cvtColor(array, cv2.COLOR_BGR2GRAY, dst=buffers["gris"])
+            else:
+                array = cv2.cvtColor(array, cv2.COLOR_BGR2GRAY)
+
+        # 3. APLICAR CLAHE para mejora de contraste
+        if array.dtype == np.uint8:
+            return clahe.apply(array, buffers["clahe"])
+        return clahe.apply(array)
+
+    def preprocess_into(self, array, out):
+        """
+        Preprocesa una imagen escribiendo el resultado normalizado en ``out``.
+
+        Args:
+            array (numpy.ndarray): Imagen original
+            out (numpy.ndarray): Destino float32 (o bfloat16/float16) de forma
+                (alto, ancho, 1) o (alto, ancho), típicamente ``batch[i]``
+
+        Returns:
+            numpy.ndarray: ``out``
+        """
+        ecualizada = self.equalize(array)
+
+        # 4. NORMALIZAR valores al rango [0, 1] directamente en el destino
+        destino = out[..., 0] if out.ndim == 3 else out
+        np.divide(ecualizada, np.float32(255.0), out=destino, casting='unsafe')
+        return out
+
+    def preprocess(self, array, dtype=np.float32):
+        """
+        Preprocesa una imagen y devuelve un tensor nuevo (1, 512, 512, 1).
+
+        Args:
+            array (numpy.ndarray): Imagen original
+            dtype (numpy.dtype): Tipo del tensor (ver TIPOS_SALIDA)
+
+        Returns:
+            numpy.ndarray: Imagen preprocesada en formato batch
+        """
+        ancho, alto = self.target_size
+        # 5. PREPARAR para modelo: el tensor de salida ya tiene dimensiones de batch y canal
+        salida = np.empty((1, alto, ancho, 1), dtype=dtype)
+        self.preprocess_into(array, salida[0])
+        return salida
+
+
+# Preprocesador compartido por las funciones del módulo (seguro entre hilos)
+_preprocesador = Preprocessor()
+
+
+def get_preprocessor():
+    """Devuelve el preprocesador compartido con los parámetros por defecto"""
+    return _preprocesador
+
 def preprocess(array):
     """
     Función principal de preprocesamiento.
@@ -34,23 +176,8 @@ def preprocess(array):
         original_shape = array.shape
         print(f"🔧 Preprocesando imagen: {original_shape} -> (512, 512, 1)")
         
-        # 1. REDIMENSIONAR a 512x512
-        array = cv2.resize(array, (512, 512))
-        
-        # 2. CONVERTIR a escala de grises (si es necesario)
-        if len(array.shape) == 3:
-            array = cv2.cvtColor(array, cv2.COLOR_BGR2GRAY)
-        
-        # 3. APLICAR CLAHE para mejora de contraste
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(4, 4))
-        array = clahe.apply(array)
-        
-        # 4. NORMALIZAR valores al rango [0, 1]
-        array = array.astype(np.float32) / 255.0
-        
-        # 5. PREPARAR para modelo: agregar dimensiones de batch y canal
-        array = np.expand_dims(array, axis=-1)  # Agregar dimensión de canal
-        array = np.expand_dims(array, axis=0)   # Agregar dimensión de batch
+        # Redimensionar, gris, CLAHE y normalizar reutilizando buffers del hilo
+        array = _preprocesador.preprocess(array)
         
         print(f"✅ Preprocesamiento completado: {original_shape} -> {array.shape}")
         return array
@@ -59,6 +186,91 @@ def preprocess(array):
         print(f"❌ Error en el preprocesamiento: {e}")
         return None
 
+# Coordinación del pool interno de OpenCV entre lotes concurrentes
+_hilos_cv2_lock = threading.Lock()
+_hilos_cv2_usuarios = 0
+_hilos_cv2_original = None
+
+@contextmanager
+def opencv_threads(n):
+    """
+    Limita temporalmente los hilos internos de OpenCV.
+
+    Cuando el preprocesamiento ya se reparte en un pool de hilos, dejar que
+    cada llamada de OpenCV abra además su propio paralelismo sobresuscribe
+    la CPU. Las llamadas anidadas o concurrentes comparten el ajuste y el
+    valor original se restaura cuando termina la última.
+
+    Args:
+        n (int): Número de hilos internos para OpenCV (>= 1)
+    """
+    global _hilos_cv2_usuarios, _hilos_cv2_original
+    with _hilos_cv2_lock:
+        if _hilos_cv2_usuarios == 0:
+            _hilos_cv2_original = cv2.getNumThreads()
+        _hilos_cv2_usuarios += 1
+        cv2.setNumThreads(max(1, int(n)))
+    try:
+        yield
+    finally:
+        with _hilos_cv2_lock:
+            _hilos_cv2_usuarios -= 1
+            if _hilos_cv2_usuarios == 0:
+                cv2.setNumThreads(_hilos_cv2_original)
+
+def preprocess_batch(arrays, workers=None, out=None, preprocessor=None, dtype=np.float32):
+    """
+    Preprocesa varias imágenes en paralelo y arma un tensor batch contiguo.
+
+    Resize, cvtColor y CLAHE liberan el GIL, así que un pool de hilos escala
+    con los núcleos disponibles. Cada hilo escribe directamente en su
+    posición del batch.
+
+    Args:
+        arrays (list): Imágenes originales como arrays numpy
+        workers (int): Hilos del pool (por defecto, uno por núcleo)
+        out (numpy.ndarray): Tensor destino (N, 512, 512, 1) opcional
+        preprocessor (Preprocessor): Preprocesador a usar (por defecto el compartido)
+        dtype (numpy.dtype): Tipo del tensor si no se da ``out``: float32, o
+            bfloat16/float16 para modelos en precisión reducida
+        
+    Returns:
+        tuple: (batch, validos)
+            - batch (numpy.ndarray): Tensor (N, 512, 512, 1)
+            - validos (numpy.ndarray): Máscara bool; las imágenes que fallan
+              quedan en cero y marcadas como False
+    """
+    preprocessor = preprocessor or _preprocesador
+    arrays = list(arrays)
+    n = len(arrays)
+    ancho, alto = preprocessor.target_size
+    
+    if out is None:
+        out = np.empty((n, alto, ancho, 1), dtype=dtype)
+    elif out.shape[0] < n or out.dtype.name not in TIPOS_SALIDA:
+        raise ValueError(f"Destino inválido para {n} imágenes: {out.shape} {out.dtype}")
+    validos = np.zeros(n, dtype=bool)
+    
+    def _procesar(i):
+        try:
+            preprocessor.preprocess_into(arrays[i], out[i])
+            validos[i] = True
+        except Exception as e:
+            print(f"❌ Error preprocesando imagen {i} del lote: {e}")
+            out[i] = 0.0
+    
+    workers = max(1, min(int(workers or os.cpu_count() or 1), n or 1))
+    if workers == 1:
+        for i in range(n):
+            _procesar(i)
+    else:
+        # Repartir los núcleos entre el pool y el paralelismo interno de OpenCV
+        with opencv_threads((os.cpu_count() or 1) // workers):
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(_procesar, range(n)))
+    
+    return out[:n], validos
+
 # ✅ MANTENIDO: Funciones auxiliares para mayor modularidad
 def resize_image(array, target_size=(512, 512)):
     """
@@ -99,8 +311,21 @@ def apply_clahe(array, clip_limit=2.0, tile_grid_size=(4, 4)):
     Returns:
         numpy.ndarray: Imagen con contraste mejorado
     """
-    clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
-    return clahe.apply(array)
+    return _clahe_del_hilo(clip_limit, tile_grid_size).apply(array)
+
+_clahes = threading.local()
+
+def _clahe_del_hilo(clip_limit, tile_grid_size):
+    """Devuelve una instancia de CLAHE del hilo actual para los parámetros dados"""
+    cache = getattr(_clahes, "por_parametros", None)
+    if cache is None:
+        cache = _clahes.por_parametros = {}
+    clave = (float(clip_limit), tuple(tile_grid_size))
+    clahe = cache.get(clave)
+    if clahe is None:
+        clahe = cv2.createCLAHE(clipLimit=clave[0], tileGridSize=clave[1])
+        cache[clave] = clahe
+    return clahe
 
 def normalize_image(array):
     """
@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Captura de perfiles bajo demanda de las próximas N predicciones.
+
+Cuando la latencia empeora en producción, activar una captura registra las
+siguientes N llamadas a integrator.predict / predict_batch / predict_cuadros
+y escribe en un directorio con fecha (perfiles/AAAAMMDD-HHMMSS-pid/):
+
+    tf/             traza del profiler de TensorFlow (abrir con TensorBoard,
+                    pestaña Profile): operaciones del grafo, oneDNN, copias
+    perfil.pstats   cProfile de las llamadas (python -m pstats, snakeviz)
+    perfil.txt      las funciones con más tiempo acumulado
+    pilas.collapsed pilas de Python muestreadas cada 5 ms en formato
+                    "a;b;c cuenta" (flamegraph.pl, speedscope)
+    resumen.json    llamadas, latencia de cada una y duración de la captura
+
+Se activa de tres formas:
+    - NEUMONIA_PERFILAR=N al arrancar el proceso
+    - ``python -m src.modulos.cli --perfilar N ...``
+    - ``kill -USR2 <pid>`` con la señal instalada (la CLI la instala siempre;
+      en otros procesos con NEUMONIA_PERFILAR_SENAL=1 o instalar_senal())
+
+Si no llegan N predicciones, la captura se cierra sola a los
+NEUMONIA_PERFILAR_LIMITE segundos de armarse (300 por defecto) y escribe lo
+que haya registrado; desactivar() la cierra antes.
+
+Sin captura activa las funciones decoradas con @perfilable solo leen una
+variable global antes de llamar a la original: no se importa el profiler de
+TensorFlow ni se crea ningún hilo.
+"""
+
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+try:
+    from .runtime_profile import RAIZ
+except ImportError:
+    from src.modulos.runtime_profile import RAIZ
+
+LLAMADAS_POR_DEFECTO = 10
+LIMITE_POR_DEFECTO = 300.0
+INTERVALO_MUESTREO = 0.005
+FUNCIONES_TXT = 40
+
+# Captura activa (None = apagado: el único costo de @perfilable es leer esto)
+_captura = None
+_captura_lock = threading.Lock()
+# Llamadas perfiladas en curso en cada hilo, para no contar dos veces las anidadas
+_local = threading.local()
+
+
+def directorio_perfiles():
+    """Carpeta base de las capturas (NEUMONIA_PERFILADO_DIR o perfiles/ en la raíz)"""
+    return os.environ.get('NEUMONIA_PERFILADO_DIR', os.path.join(RAIZ, 'perfiles'))
+
+
+class Captura:
+    """
+    Perfil de las próximas ``llamadas`` predicciones.
+
+    El profiler de TensorFlow arranca con la primera llamada perfilada y se
+    detiene con la última, al vencer el límite o con detener(); los
+    resultados se escriben en un hilo aparte para no sumar latencia a la
+    última petición.
+    """
+
+    def __init__(self, llamadas=LLAMADAS_POR_DEFECTO, directorio=None, traza_tf=True,
+                 intervalo=INTERVALO_MUESTREO, limite=None):
+        """
+        Args:
+            llamadas (int): Predicciones a registrar
+            directorio (str): Carpeta de salida (por defecto una con fecha
+                dentro de directorio_perfiles())
+            traza_tf (bool): Capturar también la traza de TensorFlow
+            intervalo (float): Segundos entre muestras de las pilas de Python
+            limite (float): Segundos desde que se arma tras los que la
+                captura se cierra aunque falten llamadas (por defecto
+                NEUMONIA_PERFILAR_LIMITE o 300)
+        """
+        self.llamadas = max(1, int(llamadas))
+        if limite is None:
+            limite = float(os.environ.get('NEUMONIA_PERFILAR_LIMITE') or LIMITE_POR_DEFECTO)
+        self.limite = float(limite)
+        if directorio is None:
+            nombre = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+            directorio = os.path.join(directorio_perfiles(), nombre)
+        self.directorio = directorio
+        self.traza_tf = traza_tf
+        self.intervalo = intervalo
+
+        self._lock = threading.Lock()
+        self._admitidas = 0
+        self._terminadas = 0
+        self._perfiles = []
+        self._registro = []
+        self._pilas = Counter()
+        self._hilos = {}
+        self._tf_activo = False
+        self._inicio = None
+        self._muestreador = None
+        self._cerrada = False
+        self._listo = threading.Event()
+        self._escrita = threading.Event()
+        # Sin él, una captura con menos de N llamadas mantendría la traza de
+        # TensorFlow acumulándose en memoria para siempre
+        self._plazo = threading.Timer(self.limite, self.detener)
+        self._plazo.name = 'perfil-limite'
+        self._plazo.daemon = True
+        self._plazo.start()
+
+    # ------------------------------------------------------------------
+    # Muestreo de pilas
+    # ------------------------------------------------------------------
+    def _muestrear(self):
+        while not self._listo.is_set():
+            with self._lock:
+                hilos = dict(self._hilos)
+            if hilos:
+                marcos = sys._current_frames()
+                for ident in hilos:
+                    marco = marcos.get(ident)
+                    pila = []
+                    while marco is not None:
+                        codigo = marco.f_code
+                        pila.append(f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}")
+                        marco = marco.f_back
+                    if pila:
+                        self._pilas[";".join(reversed(pila))] += 1
+            self._listo.wait(self.intervalo)
+
+    def _arrancar(self):
+        """Se llama con la primera predicción admitida"""
+        self._inicio = time.time()
+        os.makedirs(self.directorio, exist_ok=True)
+        if self.traza_tf:
+            try:
+                import tensorflow as tf
+                tf.profiler.experimental.start(os.path.join(self.directorio, 'tf'))
+                self._tf_activo = True
+            except Exception as e:
+                print(f"⚠️  Sin traza de TensorFlow: {e}")
+        self._muestreador = threading.Thread(target=self._muestrear, name='perfil-muestreo', daemon=True)
+        self._muestreador.start()
+        print(f"🔬 Perfilando las próximas {self.llamadas} predicciones en {self.directorio}")
+
+    # ------------------------------------------------------------------
+    # Llamadas
+    # ------------------------------------------------------------------
+    def perfilar(self, funcion, args, kwargs):
+        """
+        Ejecuta ``funcion`` bajo cProfile si la captura admite otra llamada.
+
+        Returns:
+            El resultado de ``funcion``
+        """
+        with self._lock:
+            admitida = not self._cerrada and self._admitidas < self.llamadas
+            if admitida:
+                self._admitidas += 1
+                if self._admitidas == 1:
+                    self._arrancar()
+        if not admitida:
+            return funcion(*args, **kwargs)
+
+        ident = threading.get_ident()
+        inicio = time.perf_counter()
+        with self._lock:
+            # Desde Python 3.12 solo puede haber un cProfile activo a la vez:
+            # las llamadas concurrentes quedan en las pilas muestreadas
+            perfil = None if self._hilos else cProfile.Profile()
+            self._hilos[ident] = funcion.__name__
+        try:
+            if perfil is None:
+                return funcion(*args, **kwargs)
+            return perfil.runcall(funcion, *args, **kwargs)
+        finally:
+            segundos = time.perf_counter() - inicio
+            with self._lock:
+                self._hilos.pop(ident, None)
+                if perfil is not None:
+                    self._perfiles.append(perfil)
+                self._registro.append({'funcion': funcion.__name__, 'hilo': threading.current_thread().name,
+                                       'ms': round(segundos * 1000, 3)})
+                self._terminadas += 1
+                ultima = self._terminadas == self.llamadas and not self._cerrada
+                if ultima:
+                    self._cerrada = True
+            if ultima:
+                threading.Thread(target=self._terminar, name='perfil-escritura', daemon=True).start()
+
+    def detener(self):
+        """
+        Cierra la captura aunque falten llamadas y escribe lo registrado.
+
+        Las llamadas en curso terminan sin contar en el perfil. Si no llegó
+        ninguna no se escribe nada.
+
+        Returns:
+            bool: True si esta llamada la cerró (False si ya estaba cerrada)
+        """
+        with self._lock:
+            if self._cerrada:
+                return False
+            self._cerrada = True
+            vacia = self._admitidas == 0
+        if vacia:
+            self._desarmar()
+            print("🔬 Captura cerrada sin predicciones: no se escribe nada")
+            self._escrita.set()
+        else:
+            print(f"🔬 Captura cerrada con {self._terminadas} de {self.llamadas} predicciones")
+            self._terminar()
+        return True
+
+    def _desarmar(self):
+        global _captura
+        self._plazo.cancel()
+        with _captura_lock:
+            if _captura is self:
+                _captura = None
+
+    def _terminar(self):
+        """Detiene la captura y escribe los resultados"""
+        self._desarmar()
+        self._listo.set()
+        if self._muestreador is not None:
+            self._muestreador.join()
+        if self._tf_activo:
+            try:
+                import tensorflow as tf
+                tf.profiler.experimental.stop()
+            except Exception as e:
+                print(f"⚠️  No se pudo cerrar la traza de TensorFlow: {e}")
+
+        with self._lock:
+            perfiles, registro = list(self._perfiles), list(self._registro)
+        try:
+            if not perfiles:
+                raise ValueError("ninguna llamada perfilada terminó")
+            estadisticas = pstats.Stats(*perfiles)
+            estadisticas.dump_stats(os.path.join(self.directorio, 'perfil.pstats'))
+            texto = io.StringIO()
+            pstats.Stats(*perfiles, stream=texto).sort_stats('cumulative').print_stats(FUNCIONES_TXT)
+            with open(os.path.join(self.directorio, 'perfil.txt'), 'w', encoding='utf-8') as f:
+                f.write(texto.getvalue())
+            with open(os.path.join(self.directorio, 'pilas.collapsed'), 'w', encoding='utf-8') as f:
+                f.writelines(f"{pila} {n}\n" for pila, n in self._pilas.most_common())
+            latencias = [r['ms'] for r in registro]
+            resumen = {
+                'llamadas': registro,
+                'completa': len(registro) >= self.llamadas,
+                'ms_medio': round(sum(latencias) / len(latencias), 3),
+                'ms_max': max(latencias),
+                'segundos_captura': round(time.time() - self._inicio, 3),
+                'muestras_pilas': sum(self._pilas.values()),
+                'traza_tf': self._tf_activo,
+                'inicio': self._inicio,
+            }
+            with open(os.path.join(self.directorio, 'resumen.json'), 'w', encoding='utf-8') as f:
+                json.dump(resumen, f, indent=2)
+            print(f"🔬 Perfil guardado en {self.directorio} ({len(latencias)} llamadas, "
+                  f"{resumen['ms_medio']:.1f} ms de media)")
+        except Exception as e:
+            print(f"❌ Error guardando el perfil: {e}")
+        finally:
+            self._perfiles = []
+            self._escrita.set()
+
+    def esperar(self, timeout=None):
+        """
+        Espera a que la captura termine y se escriba.
+
+        Returns:
+            str: Directorio de la captura, o None si no terminó a tiempo o
+                se cerró sin predicciones
+        """
+        if not self._escrita.wait(timeout) or self._admitidas == 0:
+            return None
+        return self.directorio
+
+
+def activar(llamadas=LLAMADAS_POR_DEFECTO, directorio=None, traza_tf=True, limite=None):
+    """
+    Perfila las próximas ``llamadas`` predicciones.
+
+    Args:
+        llamadas (int): Predicciones a registrar
+        directorio (str): Carpeta de salida (por defecto una con fecha)
+        traza_tf (bool): Capturar también la traza de TensorFlow
+        limite (float): Segundos tras los que se cierra aunque falten
+            llamadas (ver Captura)
+
+    Returns:
+        Captura: La captura armada, o la que ya estaba en curso
+    """
+    global _captura
+    with _captura_lock:
+        if _captura is not None:
+            print(f"⚠️  Ya hay una captura en curso: {_captura.directorio}")
+            return _captura
+        _captura = Captura(llamadas, directorio, traza_tf, limite=limite)
+        print(f"🔬 Captura armada: {_captura.llamadas} predicciones (límite {_captura.limite:.0f} s)")
+        return _captura
+
+
+def desactivar():
+    """
+    Cierra la captura armada o en curso y escribe lo que haya registrado.
+
+    Returns:
+        Captura: La captura cerrada (ver Captura.esperar), o None si no había
+    """
+    captura = _captura
+    if captura is None:
+        return None
+    captura.detener()
+    return captura
+
+
+def captura_activa():
+    """Captura armada o en curso (None si el perfilado está apagado)"""
+    return _captura
+
+
+def perfilable(funcion):
+    """
+    Decorador: la llamada cuenta como una predicción si hay una captura activa.
+
+    Las llamadas anidadas (predict_cuadros -> predict_batch) cuentan una vez.
+    """
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        captura = _captura
+        if captura is None or getattr(_local, 'dentro', False):
+            return funcion(*args, **kwargs)
+        _local.dentro = True
+        try:
+            return captura.perfilar(funcion, args, kwargs)
+        finally:
+            _local.dentro = False
+    return envoltura
+
+
+def instalar_senal(llamadas=None, senal=None):
+    """
+    Arma una captura cada vez que el proceso recibe ``senal``.
+
+    Args:
+        llamadas (int): Predicciones por captura (por defecto
+            NEUMONIA_PERFILAR o 10)
+        senal (int): Señal (por defecto SIGUSR2)
+
+    Returns:
+        bool: True si se instaló (solo desde el hilo principal, y no en Windows)
+    """
+    senal = senal or getattr(signal, 'SIGUSR2', None)
+    if senal is None:
+        return False
+    llamadas = llamadas or int(os.environ.get('NEUMONIA_PERFILAR') or LLAMADAS_POR_DEFECTO)
+
+    def manejar(numero, marco):
+        # El manejador interrumpe al hilo principal, que puede tener tomado el
+        # lock de la captura o la salida estándar: se arma desde otro hilo
+        threading.Thread(target=activar, args=(llamadas,), name='perfil-senal', daemon=True).start()
+
+    try:
+        signal.signal(senal, manejar)
+    except ValueError:
+        return False
+    return True
+
+
+if os.environ.get('NEUMONIA_PERFILAR'):
+    activar(int(os.environ['NEUMONIA_PERFILAR']))
+if os.environ.get('NEUMONIA_PERFILAR_SENAL'):
+    instalar_senal()
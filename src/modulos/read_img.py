@@ -4,6 +4,12 @@
     
 """
 Módulo para lectura de imágenes médicas en formatos DICOM, JPG y PNG
+
+También lee directamente miembros de archivos zip/tar sin extraerlos, con
+rutas de la forma ``estudios.zip::carpeta/imagen.dcm``.
+
+Los DICOM se abren de forma diferida y, en estudios multi-cuadro, solo se
+decodifican los cuadros que se van a analizar (primero, medio o todos).
 """
 
 import pydicom as dicom
@@ -11,13 +17,239 @@ import cv2
 import numpy as np
 from PIL import Image
 import os
+import tarfile
+import threading
+import zipfile
+from collections import OrderedDict
+
+try:
+    # pydicom >= 3: decodifica solo los cuadros pedidos
+    from pydicom.pixels import iter_pixels
+except ImportError:
+    iter_pixels = None
+
+# Separador entre el archivo comprimido y el miembro: 'estudios.zip::normal/img1.dcm'
+SEPARADOR_ARCHIVO = '::'
+EXTENSIONES_ARCHIVO = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+EXTENSIONES_IMAGEN = ('.dcm', '.jpg', '.jpeg', '.png')
+# Archivos comprimidos abiertos que cada hilo mantiene para reutilizar su índice
+MAX_ARCHIVOS_ABIERTOS = 4
+_archivos_abiertos = threading.local()
+# Cuadros a analizar en DICOM multi-cuadro
+SELECCIONES_CUADRO = ('primero', 'medio', 'todos')
+# Elementos más grandes que esto se leen solo si se usan
+TAMANO_DIFERIDO = '64 KB'
+
+def es_archivo_comprimido(path):
+    """Indica si la ruta es un archivo zip/tar por su extensión"""
+    return str(path).lower().endswith(EXTENSIONES_ARCHIVO)
+
+def dividir_ruta(path):
+    """
+    Separa una ruta 'archivo.zip::miembro' en sus dos partes.
+    
+    Solo se separa en un '::' precedido de una extensión de archivo
+    comprimido: una ruta normal que contenga '::' se deja entera.
+    
+    Args:
+        path (str): Ruta normal o de miembro de archivo comprimido
+        
+    Returns:
+        tuple: (archivo, miembro) o (path, None) si no es un miembro
+    """
+    posicion = path.find(SEPARADOR_ARCHIVO)
+    while posicion > 0:
+        if es_archivo_comprimido(path[:posicion]):
+            return path[:posicion], path[posicion + len(SEPARADOR_ARCHIVO):]
+        posicion = path.find(SEPARADOR_ARCHIVO, posicion + 1)
+    return path, None
+
+def normalizar_ruta(path):
+    """Ruta absoluta; en los miembros solo se normaliza la parte del archivo"""
+    archivo, miembro = dividir_ruta(path)
+    if miembro is None:
+        return os.path.abspath(path)
+    return f"{os.path.abspath(archivo)}{SEPARADOR_ARCHIVO}{miembro}"
+
+def firma_archivo(path):
+    """
+    Identifica el contenido actual de un archivo (o miembro) para cachés.
+    
+    Returns:
+        tuple: (ruta normalizada, mtime_ns, tamaño) del archivo que lo contiene
+    """
+    archivo, _ = dividir_ruta(path)
+    info = os.stat(archivo)
+    return normalizar_ruta(path), info.st_mtime_ns, info.st_size
+
+class _ArchivoAbierto:
+    """Archivo zip/tar abierto con un índice de sus miembros por nombre"""
+    
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.mtime_ns = os.stat(ruta).st_mtime_ns
+        if zipfile.is_zipfile(ruta):
+            self._zip = zipfile.ZipFile(ruta)
+            self._tar = None
+        else:
+            self._zip = None
+            self._tar = tarfile.open(ruta)
+            # getmember recorre la lista entera en cada búsqueda: indexar una vez
+            self._miembros = {m.name: m for m in self._tar.getmembers() if m.isfile()}
+    
+    def nombres(self):
+        """Nombres de los miembros que son archivos"""
+        if self._zip is not None:
+            return [i.filename for i in self._zip.infolist() if not i.is_dir()]
+        return list(self._miembros)
+    
+    def abrir(self, miembro):
+        """Objeto tipo archivo de solo lectura para un miembro"""
+        if self._zip is not None:
+            return self._zip.open(miembro)
+        if miembro not in self._miembros:
+            raise KeyError(f"{miembro} no está en {self.ruta}")
+        return self._tar.extractfile(self._miembros[miembro])
+    
+    def close(self):
+        (self._zip or self._tar).close()
+
+def _archivo_abierto(ruta):
+    """
+    Devuelve el archivo comprimido abierto por este hilo (LRU por hilo: los
+    objetos ZipFile/TarFile no se comparten entre hilos).
+    """
+    abiertos = getattr(_archivos_abiertos, "lru", None)
+    if abiertos is None:
+        abiertos = _archivos_abiertos.lru = OrderedDict()
+    ruta = os.path.abspath(ruta)
+    archivo = abiertos.get(ruta)
+    if archivo is not None and archivo.mtime_ns != os.stat(ruta).st_mtime_ns:
+        # El archivo cambió en disco: reabrir
+        abiertos.pop(ruta).close()
+        archivo = None
+    if archivo is None:
+        archivo = abiertos[ruta] = _ArchivoAbierto(ruta)
+        while len(abiertos) > MAX_ARCHIVOS_ABIERTOS:
+            abiertos.popitem(last=False)[1].close()
+    abiertos.move_to_end(ruta)
+    return archivo
+
+def abrir_miembro(path):
+    """
+    Abre un miembro de un archivo zip/tar como objeto tipo archivo.
+    
+    Args:
+        path (str): Ruta 'archivo.zip::miembro'
+        
+    Returns:
+        file-like: Lectura del miembro sin extraerlo a disco
+    """
+    archivo, miembro = dividir_ruta(path)
+    return _archivo_abierto(archivo).abrir(miembro)
+
+def listar_archivo(path, extensiones=EXTENSIONES_IMAGEN):
+    """
+    Lista las imágenes de un archivo zip/tar como rutas 'archivo::miembro'.
+    
+    Args:
+        path (str): Ruta del archivo comprimido
+        extensiones (tuple): Extensiones de los miembros a incluir
+        
+    Returns:
+        list: Rutas de miembros ordenadas
+    """
+    nombres = _archivo_abierto(path).nombres()
+    return sorted(f"{path}{SEPARADOR_ARCHIVO}{n}" for n in nombres
+                  if n.lower().endswith(extensiones))
+
+def indices_cuadros(n, seleccion='primero'):
+    """
+    Índices de los cuadros a analizar de un DICOM con ``n`` cuadros.
+    
+    Args:
+        n (int): Número de cuadros del estudio
+        seleccion (str o int): 'primero', 'medio', 'todos' o un índice concreto
+        
+    Returns:
+        list: Índices de cuadro
+    """
+    if seleccion == 'primero':
+        return [0]
+    if seleccion == 'medio':
+        return [n // 2]
+    if seleccion == 'todos':
+        return list(range(n))
+    if isinstance(seleccion, int) and not isinstance(seleccion, bool) and -n <= seleccion < n:
+        return [seleccion % n]
+    raise ValueError(f"Selección de cuadros inválida: {seleccion!r} "
+                     f"(opciones: {SELECCIONES_CUADRO} o un índice menor que {n})")
+
+def leer_cuadros_dicom(path, seleccion='primero', transformar=None):
+    """
+    Decodifica solo los cuadros elegidos de un DICOM (multi-cuadro o no).
+    
+    La cabecera se lee sin los píxeles y con los elementos grandes diferidos;
+    luego pydicom decodifica únicamente los cuadros pedidos, leyendo del
+    archivo solo sus bytes. Con 'primero' en un estudio de 100 cuadros la
+    memoria pico es la de un cuadro, no la del volumen entero.
+    
+    Args:
+        path (str o file-like): Ruta del archivo DICOM u objeto tipo archivo con seek
+        seleccion (str o int): 'primero', 'medio', 'todos' o un índice concreto
+        transformar (callable): Función aplicada a cada cuadro en cuanto se
+            decodifica (así no se acumulan los píxeles crudos de todos)
+        
+    Returns:
+        tuple: (cuadros, indices, total)
+            - cuadros (list): Cada cuadro elegido (transformado si se pidió)
+            - indices (list): Índice de cada cuadro dentro del estudio
+            - total (int): Cuadros del estudio
+    """
+    posicion = path.tell() if hasattr(path, 'read') else None
+    cabecera = dicom.dcmread(path, stop_before_pixels=True, defer_size=TAMANO_DIFERIDO)
+    if posicion is not None:
+        path.seek(posicion)
+    total = int(cabecera.get('NumberOfFrames') or 1)
+    indices = indices_cuadros(total, seleccion)
+    transformar = transformar or (lambda cuadro: cuadro)
+    if iter_pixels is not None:
+        cuadros = [transformar(c) for c in iter_pixels(path, indices=indices)]
+    else:
+        # pydicom 2.x no decodifica cuadros sueltos: se decodifica el volumen
+        # y se toman los elegidos (misma salida, más memoria pico)
+        volumen = dicom.dcmread(path).pixel_array
+        if total == 1:
+            volumen = volumen[np.newaxis]
+        cuadros = [transformar(volumen[i]) for i in indices]
+    return cuadros, indices, total
+
+def cuadro_a_rgb(img_array):
+    """
+    Escala un cuadro DICOM a uint8 (0-255) y lo pasa a 3 canales.
+    
+    Args:
+        img_array (numpy.ndarray): Píxeles del cuadro (gris o color)
+        
+    Returns:
+        numpy.ndarray: Imagen RGB uint8
+    """
+    img2 = img_array.astype(float)
+    img2 = (np.maximum(img2, 0) / img2.max()) * 255.0
+    img2 = np.uint8(img2)
+    if img2.ndim == 3:
+        return img2
+    return cv2.cvtColor(img2, cv2.COLOR_GRAY2RGB)
 
-def read_dicom_file(path):
+def read_dicom_file(path, cuadro='primero'):
     """
     Lee un archivo DICOM y lo convierte a formato RGB para procesamiento.
     
+    En estudios multi-cuadro solo se decodifica el cuadro elegido.
+    
     Args:
-        path (str): Ruta del archivo DICOM
+        path (str o file-like): Ruta del archivo DICOM u objeto tipo archivo
+        cuadro (str o int): Cuadro a leer: 'primero', 'medio' o un índice
         
     Returns:
         tuple: (img_RGB, img2show)
@@ -25,34 +257,63 @@ def read_dicom_file(path):
             - img2show: Imagen PIL para visualización en interfaz
     """
     try:
-        # ✅ MEJORADO: Usar dcmread en lugar de read_file (más moderno)
-        dataset = dicom.dcmread(path)
-        img_array = dataset.pixel_array
+        # ✅ MEJORADO: Lectura diferida, solo se decodifica el cuadro pedido
+        cuadros, indices, total = leer_cuadros_dicom(path, cuadro)
+        if len(cuadros) != 1:
+            raise ValueError("read_dicom_file lee un solo cuadro; usar read_dicom_frames")
+        img_array = cuadros[0]
         
         # Crear imagen PIL para visualización
         img2show = Image.fromarray(img_array)
         
-        # Normalizar la imagen para procesamiento
-        img2 = img_array.astype(float)
-        img2 = (np.maximum(img2, 0) / img2.max()) * 255.0
-        img2 = np.uint8(img2)
+        # Normalizar la imagen para procesamiento y convertir a RGB (3 canales)
+        img_RGB = cuadro_a_rgb(img_array)
         
-        # Convertir a RGB (3 canales)
-        img_RGB = cv2.cvtColor(img2, cv2.COLOR_GRAY2RGB)
-        
-        print(f"✅ DICOM cargado: {os.path.basename(path)} - Tamaño: {img_array.shape}")
+        detalle = f" (cuadro {indices[0] + 1}/{total})" if total > 1 else ""
+        print(f"✅ DICOM cargado: {_nombre(path)} - Tamaño: {img_array.shape}{detalle}")
         return img_RGB, img2show
         
     except Exception as e:
-        print(f"❌ Error leyendo archivo DICOM {path}: {e}")
+        print(f"❌ Error leyendo archivo DICOM {_nombre(path)}: {e}")
         return None, None
 
+def read_dicom_frames(path, seleccion='todos'):
+    """
+    Lee varios cuadros de un DICOM para analizarlos como un lote.
+    
+    Args:
+        path (str): Ruta del archivo DICOM o 'archivo.zip::miembro.dcm'
+        seleccion (str o int): 'primero', 'medio', 'todos' o un índice concreto
+        
+    Returns:
+        tuple: (imagenes, indices)
+            - imagenes (list): Cuadros en RGB uint8
+            - indices (list): Índice de cada cuadro dentro del estudio
+            o (None, None) en caso de error
+    """
+    try:
+        archivo, miembro = dividir_ruta(path)
+        if miembro is not None:
+            with abrir_miembro(path) as f:
+                imagenes, indices, total = leer_cuadros_dicom(f, seleccion, cuadro_a_rgb)
+        else:
+            imagenes, indices, total = leer_cuadros_dicom(path, seleccion, cuadro_a_rgb)
+        print(f"✅ DICOM cargado: {_nombre(path)} - {len(imagenes)} de {total} cuadros")
+        return imagenes, indices
+    except Exception as e:
+        print(f"❌ Error leyendo cuadros del DICOM {_nombre(path)}: {e}")
+        return None, None
+
+def _nombre(path):
+    """Nombre para los mensajes de una ruta u objeto tipo archivo"""
+    return os.path.basename(str(getattr(path, 'name', path)))
+
 def read_jpg_file(path):
     """
     Lee un archivo de imagen en formato JPG/PNG y lo procesa.
     
     Args:
-        path (str): Ruta del archivo de imagen
+        path (str o bytes): Ruta del archivo de imagen o su contenido en memoria
         
     Returns:
         tuple: (img_processed, img2show)
@@ -60,8 +321,12 @@ def read_jpg_file(path):
             - img2show: Imagen PIL para visualización
     """
     try:
-        # Leer imagen con OpenCV
-        img = cv2.imread(path)
+        # Leer imagen con OpenCV (desde disco o decodificando el buffer en memoria)
+        if isinstance(path, (bytes, bytearray, memoryview)):
+            img = cv2.imdecode(np.frombuffer(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+            path = "<memoria>"
+        else:
+            img = cv2.imread(path)
         if img is None:
             raise ValueError(f"No se pudo leer la imagen: {path}")
             
@@ -80,29 +345,63 @@ def read_jpg_file(path):
         print(f"❌ Error leyendo archivo de imagen {path}: {e}")
         return None, None
 
-def read_image_file(path):
+def read_archive_member(path, cuadro='primero'):
+    """
+    Lee una imagen que está dentro de un archivo zip/tar sin extraerla.
+    
+    Los DICOM se leen con dcmread sobre el objeto tipo archivo del miembro;
+    JPG/PNG se decodifican con cv2.imdecode desde el buffer en memoria.
+    
+    Args:
+        path (str): Ruta 'archivo.zip::miembro'
+        cuadro (str o int): Cuadro a leer en DICOM multi-cuadro
+        
+    Returns:
+        tuple: (img_processed, img2show) o (None, None) en caso de error
+    """
+    _, miembro = dividir_ruta(path)
+    file_extension = miembro.lower().split('.')[-1]
+    try:
+        with abrir_miembro(path) as f:
+            if file_extension == 'dcm':
+                return read_dicom_file(f, cuadro)
+            return read_jpg_file(f.read())
+    except Exception as e:
+        print(f"❌ Error leyendo {miembro} desde el archivo comprimido: {e}")
+        return None, None
+
+def read_image_file(path, cuadro='primero'):
     """
     Función principal unificada que detecta automáticamente el tipo de archivo
     y llama a la función de lectura apropiada.
     
     Args:
-        path (str): Ruta del archivo de imagen
+        path (str): Ruta del archivo de imagen, o 'archivo.zip::miembro' para
+            leer un miembro de un zip/tar sin extraerlo
+        cuadro (str o int): Cuadro a leer en DICOM multi-cuadro ('primero',
+            'medio' o un índice)
         
     Returns:
         tuple: (img_processed, img2show) o (None, None) en caso de error
     """
-    if not path or not os.path.exists(path):
+    archivo, miembro = dividir_ruta(path) if path else (path, None)
+    if not path or not os.path.exists(archivo):
         print(f"❌ Archivo no encontrado: {path}")
         return None, None
     
     # Obtener extensión del archivo
-    file_extension = path.lower().split('.')[-1]
+    file_extension = (miembro or path).lower().split('.')[-1]
     
-    print(f"📁 Cargando archivo: {os.path.basename(path)}")
+    print(f"📁 Cargando archivo: {os.path.basename(miembro or path)}")
     
     try:
-        if file_extension == 'dcm':
-            return read_dicom_file(path)
+        if miembro is not None:
+            if file_extension not in ['dcm', 'jpg', 'jpeg', 'png']:
+                print(f"⚠️ Formato de archivo no soportado: {file_extension}")
+                return None, None
+            return read_archive_member(path, cuadro)
+        elif file_extension == 'dcm':
+            return read_dicom_file(path, cuadro)
         elif file_extension in ['jpg', 'jpeg', 'png']:
             return read_jpg_file(path)
         else:
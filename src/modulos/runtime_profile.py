@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Perfiles de ejecución en CPU: hilos de TensorFlow, oneDNN y OpenCV.
+
+Sin configuración TensorFlow reparte cada operación entre todos los núcleos,
+lo que está bien para un único proceso pero sobresuscribe la CPU cuando
+corren varios workers en el mismo nodo. Un perfil fija, antes de cargar el
+modelo:
+
+    - intra_op: hilos por sesión de inferencia dentro de cada operación
+    - inter_op: operaciones independientes ejecutadas a la vez
+    - sesiones: peticiones de inferencia simultáneas del pool
+    - onednn: kernels oneDNN de TensorFlow (TF_ENABLE_ONEDNN_OPTS)
+    - hilos_cv2: hilos internos de OpenCV
+
+Perfiles predefinidos:
+    - "latency": una petición a la vez usando todos los núcleos
+    - "throughput": varias sesiones pequeñas en paralelo, OpenCV secuencial
+    - "shared-node": pocos hilos por proceso, para varios workers por nodo
+    - "autotune": el mejor perfil medido en esta máquina (ver autoajustar)
+
+El perfil se elige con la variable NEUMONIA_PERFIL; si no está definida se
+usa el guardado en config/runtime.json y, si tampoco existe, "latency".
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+RUTA_CONFIG = os.path.join(RAIZ, 'config', 'runtime.json')
+PERFIL_POR_DEFECTO = "latency"
+CAMPOS = ('intra_op', 'inter_op', 'sesiones', 'onednn', 'hilos_cv2')
+
+# Perfil aplicado en este proceso (solo se aplica una vez)
+_perfil_activo = None
+
+
+def perfiles_predefinidos(nucleos=None):
+    """
+    Perfiles con nombre calculados para el número de núcleos dado.
+
+    Args:
+        nucleos (int): Núcleos disponibles (por defecto os.cpu_count())
+
+    Returns:
+        dict: nombre -> parámetros del perfil
+    """
+    nucleos = max(1, int(nucleos or os.cpu_count() or 1))
+    sesiones = max(1, nucleos // 4)
+    return {
+        "latency": {'intra_op': nucleos, 'inter_op': 1, 'sesiones': 1,
+                    'onednn': True, 'hilos_cv2': nucleos},
+        "throughput": {'intra_op': max(1, nucleos // sesiones), 'inter_op': 2,
+                       'sesiones': sesiones, 'onednn': True, 'hilos_cv2': 1},
+        "shared-node": {'intra_op': min(2, nucleos), 'inter_op': 1, 'sesiones': 1,
+                        'onednn': True, 'hilos_cv2': 1},
+    }
+
+
+def ruta_config():
+    """Archivo de configuración de runtime (NEUMONIA_CONFIG_RUNTIME o config/runtime.json)"""
+    return os.environ.get('NEUMONIA_CONFIG_RUNTIME', RUTA_CONFIG)
+
+
+def leer_config():
+    """
+    Lee el perfil guardado por autoajustar.
+
+    Returns:
+        dict: Contenido de la configuración o None si no existe o es inválida
+    """
+    ruta = ruta_config()
+    if not os.path.exists(ruta):
+        return None
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Configuración de runtime inválida en {ruta}: {e}")
+        return None
+
+
+def resolver_perfil(nombre=None):
+    """
+    Devuelve los parámetros del perfil pedido.
+
+    Args:
+        nombre (str): Nombre del perfil; por defecto NEUMONIA_PERFIL, el de
+            config/runtime.json o "latency"
+
+    Returns:
+        dict: Parámetros del perfil con su 'nombre'
+
+    Raises:
+        ValueError: Si el perfil no existe
+    """
+    if not nombre and os.environ.get('NEUMONIA_PERFIL_JSON'):
+        # Configuración candidata que autoajustar pasa a sus procesos de medición
+        return dict(json.loads(os.environ['NEUMONIA_PERFIL_JSON']), nombre="candidato")
+
+    config = leer_config()
+    nombre = nombre or os.environ.get('NEUMONIA_PERFIL') or (config or {}).get('perfil')
+    nombre = nombre or PERFIL_POR_DEFECTO
+
+    if nombre == "autotune":
+        if not config or config.get('perfil') != "autotune":
+            raise ValueError(f"No hay perfil autotune guardado en {ruta_config()}")
+        perfil = {campo: config[campo] for campo in CAMPOS}
+    else:
+        predefinidos = perfiles_predefinidos()
+        if nombre not in predefinidos:
+            raise ValueError(f"Perfil desconocido: {nombre} "
+                             f"(opciones: {sorted(predefinidos) + ['autotune']})")
+        perfil = dict(predefinidos[nombre])
+    perfil['nombre'] = nombre
+    return perfil
+
+
+def configurar_hilos_tf(intra_op=None, inter_op=None):
+    """
+    Fija los pools de hilos de TensorFlow del proceso.
+
+    Solo tiene efecto antes de que el runtime de TensorFlow se inicialice
+    (antes de crear el primer tensor o cargar el modelo).
+
+    Args:
+        intra_op (int): Hilos para paralelizar dentro de una operación
+        inter_op (int): Hilos para ejecutar operaciones independientes a la vez
+
+    Returns:
+        bool: True si se aplicó, False si el runtime ya estaba inicializado
+    """
+    import tensorflow as tf
+    try:
+        if intra_op:
+            tf.config.threading.set_intra_op_parallelism_threads(int(intra_op))
+        if inter_op:
+            tf.config.threading.set_inter_op_parallelism_threads(int(inter_op))
+        return True
+    except RuntimeError:
+        actuales = (tf.config.threading.get_intra_op_parallelism_threads(),
+                    tf.config.threading.get_inter_op_parallelism_threads())
+        if actuales != (int(intra_op or actuales[0]), int(inter_op or actuales[1])):
+            print(f"⚠️  TensorFlow ya está inicializado: se mantienen intra/inter = {actuales}")
+        return False
+
+
+def aplicar_perfil(nombre=None):
+    """
+    Aplica un perfil de ejecución al proceso, antes de cargar el modelo.
+
+    oneDNN se decide con TF_ENABLE_ONEDNN_OPTS, que TensorFlow solo lee al
+    importarse: si ya estaba importado el ajuste no cambia y se avisa. Una
+    variable TF_ENABLE_ONEDNN_OPTS definida por el usuario tiene prioridad.
+    Solo se aplica un perfil por proceso; las llamadas siguientes devuelven
+    el ya activo.
+
+    Args:
+        nombre (str): Perfil a aplicar (ver resolver_perfil)
+
+    Returns:
+        dict: Perfil activo
+    """
+    global _perfil_activo
+    if _perfil_activo is not None:
+        if nombre and nombre != _perfil_activo['nombre']:
+            print(f"⚠️  Ya está activo el perfil {_perfil_activo['nombre']}; se ignora {nombre}")
+        return _perfil_activo
+
+    perfil = resolver_perfil(nombre)
+
+    if 'tensorflow' in sys.modules:
+        efectivo = os.environ.get('TF_ENABLE_ONEDNN_OPTS', '1') != '0'
+        if efectivo != perfil['onednn']:
+            print("⚠️  TensorFlow ya estaba importado: oneDNN queda como estaba")
+    else:
+        os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '1' if perfil['onednn'] else '0')
+        efectivo = os.environ['TF_ENABLE_ONEDNN_OPTS'] != '0'
+    perfil['onednn'] = efectivo
+
+    import cv2
+    cv2.setNumThreads(int(perfil['hilos_cv2']))
+    perfil['aplicado'] = configurar_hilos_tf(perfil['intra_op'] * perfil['sesiones'],
+                                             perfil['inter_op'])
+
+    _perfil_activo = perfil
+    return perfil
+
+
+def aplicar_perfil_o_defecto(nombre=None):
+    """
+    Como aplicar_perfil, pero si el perfil pedido no existe (por ejemplo
+    autotune sin configuración guardada) avisa y aplica el de por defecto.
+    Para los puntos de entrada que no deben fallar por el perfil.
+
+    Returns:
+        dict: Perfil activo
+    """
+    try:
+        return aplicar_perfil(nombre)
+    except ValueError as e:
+        print(f"⚠️  {e}; se usa el perfil {PERFIL_POR_DEFECTO}")
+        return aplicar_perfil(PERFIL_POR_DEFECTO)
+
+
+def ejecutar_con_perfil(modulo, funcion, *args):
+    """
+    Punto de entrada de los procesos hijos (spawn).
+
+    Este módulo no importa TensorFlow: el hijo aplica el perfil heredado por
+    NEUMONIA_PERFIL y solo después importa ``modulo``, que sí lo trae.
+
+    Args:
+        modulo (str): Módulo con la función del proceso (su ``__name__``)
+        funcion (str): Nombre de la función
+        *args: Argumentos de la función
+
+    Returns:
+        Lo que devuelva la función
+    """
+    import importlib
+    aplicar_perfil_o_defecto()
+    return getattr(importlib.import_module(modulo), funcion)(*args)
+
+
+def perfil_activo():
+    """Perfil aplicado en este proceso (o None si todavía no se aplicó ninguno)"""
+    return _perfil_activo
+
+
+def describir_perfil(perfil):
+    """Línea legible con los parámetros de un perfil"""
+    return (f"perfil={perfil['nombre']} intra_op={perfil['intra_op']} "
+            f"inter_op={perfil['inter_op']} sesiones={perfil['sesiones']} "
+            f"onednn={'sí' if perfil['onednn'] else 'no'} hilos_cv2={perfil['hilos_cv2']}")
+
+
+def candidatos_autoajuste(nucleos=None):
+    """
+    Configuraciones a probar: los perfiles predefinidos más un barrido de
+    hilos intra-op (repartiendo los núcleos entre sesiones) con y sin oneDNN.
+
+    Returns:
+        list: Perfiles candidatos sin duplicados
+    """
+    nucleos = max(1, int(nucleos or os.cpu_count() or 1))
+    candidatos = list(perfiles_predefinidos(nucleos).values())
+    intra = 1
+    while intra <= nucleos:
+        for onednn in (True, False):
+            candidatos.append({'intra_op': intra, 'inter_op': 1 if intra == nucleos else 2,
+                               'sesiones': max(1, nucleos // intra), 'onednn': onednn,
+                               'hilos_cv2': 1 if intra < nucleos else nucleos})
+        intra *= 2
+    unicos = []
+    for candidato in candidatos:
+        if candidato not in unicos:
+            unicos.append(candidato)
+    return unicos
+
+
+def medir_configuracion(lote=8, lotes=4):
+    """
+    Mide preprocesamiento + inferencia con el perfil activo de este proceso.
+
+    Args:
+        lote (int): Imágenes por lote
+        lotes (int): Lotes medidos por sesión (tras uno de calentamiento)
+
+    Returns:
+        dict: latencia de una imagen en ms e imágenes por segundo con todas las sesiones
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+    try:
+        from .preprocess_img import preprocess_batch
+        from .inference_session import get_pool
+    except ImportError:
+        from src.modulos.preprocess_img import preprocess_batch
+        from src.modulos.inference_session import get_pool
+
+    pool = get_pool()
+    rng = np.random.default_rng(0)
+    imagenes = [rng.integers(0, 256, (1024, 1024, 3), dtype=np.uint8) for _ in range(lote)]
+
+    def ciclo(_):
+        batch, _ = preprocess_batch(imagenes, workers=1)
+        pool.run(batch)
+
+    ciclo(None)
+    inicio = time.perf_counter()
+    pool.run(preprocess_batch(imagenes[:1], workers=1)[0])
+    latencia = time.perf_counter() - inicio
+
+    total = lotes * pool.sesiones
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=pool.sesiones) as ejecutor:
+        list(ejecutor.map(ciclo, range(total)))
+    segundos = time.perf_counter() - inicio
+    return {'latencia_ms': round(1000 * latencia, 2),
+            'imagenes_por_segundo': round(total * lote / segundos, 2)}
+
+
+def autoajustar(objetivo="rendimiento", lote=8, lotes=4, guardar=True, candidatos=None):
+    """
+    Prueba cada configuración candidata en un proceso nuevo (los hilos de
+    TensorFlow y oneDNN no se pueden cambiar una vez inicializados) y guarda
+    la mejor en config/runtime.json como perfil "autotune".
+
+    Args:
+        objetivo (str): "rendimiento" (máximas img/s) o "latencia" (mínima latencia)
+        lote (int): Imágenes por lote en la medición
+        lotes (int): Lotes medidos por sesión
+        guardar (bool): Escribir el mejor perfil en el archivo de configuración
+        candidatos (list): Configuraciones a probar (por defecto candidatos_autoajuste())
+
+    Returns:
+        dict: Mejor configuración con sus mediciones, o None si ninguna funcionó
+    """
+    if objetivo not in ("rendimiento", "latencia"):
+        raise ValueError(f"Objetivo desconocido: {objetivo}")
+    candidatos = candidatos or candidatos_autoajuste()
+    print(f"🔧 Autoajuste ({objetivo}): {len(candidatos)} configuraciones en {os.cpu_count()} núcleos")
+
+    mediciones = []
+    for candidato in candidatos:
+        entorno = dict(os.environ, NEUMONIA_PERFIL_JSON=json.dumps(candidato),
+                       TF_ENABLE_ONEDNN_OPTS='1' if candidato['onednn'] else '0',
+                       TF_CPP_MIN_LOG_LEVEL='2')
+        codigo = ("import json; from src.modulos.runtime_profile import aplicar_perfil, "
+                  "medir_configuracion; aplicar_perfil(); "
+                  f"print(json.dumps(medir_configuracion({int(lote)}, {int(lotes)})))")
+        proceso = subprocess.run([sys.executable, '-c', codigo], cwd=RAIZ, env=entorno,
+                                 capture_output=True, text=True)
+        try:
+            medicion = json.loads(proceso.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            print(f"❌ Falló la medición de {candidato}: {proceso.stderr.strip()[-300:]}")
+            continue
+        medicion.update(candidato)
+        mediciones.append(medicion)
+        print(f"   - intra={candidato['intra_op']:>3} inter={candidato['inter_op']} "
+              f"sesiones={candidato['sesiones']:>2} onednn={'sí' if candidato['onednn'] else 'no'} "
+              f"-> {medicion['imagenes_por_segundo']:>8.2f} img/s, {medicion['latencia_ms']:>8.2f} ms")
+
+    if not mediciones:
+        return None
+    if objetivo == "latencia":
+        mejor = min(mediciones, key=lambda m: m['latencia_ms'])
+    else:
+        mejor = max(mediciones, key=lambda m: m['imagenes_por_segundo'])
+
+    config = {'perfil': "autotune", 'objetivo': objetivo, 'nucleos': os.cpu_count(),
+              'fecha': time.strftime('%Y-%m-%d %H:%M:%S')}
+    config.update({campo: mejor[campo] for campo in CAMPOS})
+    config['medicion'] = {'latencia_ms': mejor['latencia_ms'],
+                          'imagenes_por_segundo': mejor['imagenes_por_segundo']}
+    if guardar:
+        ruta = ruta_config()
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'w', encoding='utf-8') as f:
+            json.dump(config, f, indent=2, ensure_ascii=False)
+        print(f"💾 Perfil autotune guardado en: {ruta}")
+    return config
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Caché persistente en disco de imágenes preprocesadas.
+
+Guarda la salida del preprocesamiento (512x512 tras CLAHE) de cada archivo en
+un shard memory-mapped con un índice SQLite. La clave combina ruta, mtime,
+tamaño del archivo y parámetros de preprocesamiento, así que cualquier cambio
+en el archivo o en el pipeline invalida la entrada. En una segunda pasada no
+hay decodificación ni CLAHE: las entradas se normalizan directamente del
+memmap al batch, sin copias intermedias.
+Cada geometría (capacidad, tamaño y tipo) tiene su propio shard e índice, así
+que abrir la caché con otra configuración nunca trunca la que usa otro proceso.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    from .preprocess_img import get_preprocessor
+    from .read_img import read_image_file, firma_archivo, normalizar_ruta
+except ImportError:
+    from src.modulos.preprocess_img import get_preprocessor
+    from src.modulos.read_img import read_image_file, firma_archivo, normalizar_ruta
+
+TIPOS_SOPORTADOS = ('uint8', 'float16')
+# Accesos acumulados antes de escribir las marcas de tiempo LRU en el índice
+ACCESOS_POR_ESCRITURA = 256
+# Segundos tras los que una entrada reservada y nunca terminada se puede desalojar
+ESCRITURA_ABANDONADA = 60
+
+
+class TensorCache:
+    """
+    Caché de tensores preprocesados con capacidad limitada y desalojo LRU.
+
+    - ``uint8``: guarda la imagen ecualizada sin pérdida (256 KB por imagen)
+    - ``float16``: guarda la imagen ya normalizada a [0, 1] (512 KB por imagen)
+
+    Es segura entre hilos y admite varios procesos sobre el mismo directorio
+    (SQLite serializa la asignación de posiciones).
+    """
+
+    def __init__(self, directorio, max_bytes=2 * 1024 ** 3, dtype='uint8', preprocessor=None):
+        """
+        Args:
+            directorio (str): Carpeta donde viven el shard y el índice
+            max_bytes (int): Tamaño máximo del shard en bytes
+            dtype (str): 'uint8' o 'float16'
+            preprocessor (Preprocessor): Preprocesador usado en los fallos de caché
+        """
+        if dtype not in TIPOS_SOPORTADOS:
+            raise ValueError(f"dtype no soportado: {dtype} (usar {TIPOS_SOPORTADOS})")
+
+        self.directorio = directorio
+        self.dtype = np.dtype(dtype)
+        self.preprocessor = preprocessor or get_preprocessor()
+        ancho, alto = self.preprocessor.target_size
+        self.forma = (alto, ancho)
+        self.bytes_por_entrada = alto * ancho * self.dtype.itemsize
+        self.capacidad = int(max_bytes // self.bytes_por_entrada)
+        if self.capacidad < 1:
+            raise ValueError(f"max_bytes={max_bytes} no alcanza para una sola entrada")
+
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+        # clave -> último acceso aún no escrito en el índice
+        self._accesos = {}
+
+        os.makedirs(directorio, exist_ok=True)
+        self.geometria = f"{self.capacidad}x{self.forma[0]}x{self.forma[1]}_{self.dtype.name}"
+        self._db = sqlite3.connect(os.path.join(directorio, f'indice_{self.geometria}.sqlite'),
+                                   check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS entradas (
+            clave TEXT PRIMARY KEY, ruta TEXT NOT NULL,
+            slot INTEGER NOT NULL UNIQUE, ultimo_acceso REAL NOT NULL,
+            listo INTEGER NOT NULL DEFAULT 0)""")
+        self._abrir_shard()
+
+    def _abrir_shard(self):
+        """Abre el shard de esta geometría, creándolo si todavía no existe"""
+        ruta_shard = os.path.join(self.directorio, f'tensores_{self.geometria}.bin')
+        tamano = self.capacidad * self.bytes_por_entrada
+        try:
+            descriptor = os.open(ruta_shard, os.O_RDWR | os.O_CREAT | os.O_EXCL)
+            creado = True
+        except FileExistsError:
+            descriptor = os.open(ruta_shard, os.O_RDWR)
+            creado = False
+        try:
+            # Extender a un tamaño que ya tiene no borra nada de otro proceso
+            if os.fstat(descriptor).st_size < tamano:
+                os.ftruncate(descriptor, tamano)
+        finally:
+            os.close(descriptor)
+        if creado:
+            # Un índice sin su shard apunta a posiciones vacías
+            print(f"🗄️  Inicializando caché de tensores: {self.geometria}")
+            self._db.execute("DELETE FROM entradas")
+        self._shard = np.memmap(ruta_shard, dtype=self.dtype, mode='r+',
+                                shape=(self.capacidad,) + self.forma)
+
+    def clave(self, ruta):
+        """
+        Calcula la clave de caché de un archivo.
+
+        Args:
+            ruta (str): Ruta del archivo de imagen (o 'archivo.zip::miembro')
+
+        Returns:
+            str: Hash de ruta absoluta + mtime + tamaño + parámetros
+        """
+        ruta_abs, mtime_ns, tamano = firma_archivo(ruta)
+        texto = (f"{ruta_abs}|{mtime_ns}|{tamano}|"
+                 f"{self.preprocessor.firma()}|{self.dtype.name}")
+        return hashlib.sha1(texto.encode('utf-8')).hexdigest()
+
+    def get(self, ruta, out=None):
+        """
+        Busca un archivo en la caché.
+
+        Args:
+            ruta (str): Ruta del archivo de imagen
+            out (numpy.ndarray): Destino float32 (alto, ancho) donde se
+                normaliza la entrada directamente desde el shard
+
+        Returns:
+            numpy.ndarray: ``out`` con la imagen normalizada a [0, 1] (o una
+                copia de la imagen almacenada si no se pasó ``out``), o None
+                si no está en caché; en ese caso ``out`` queda sin definir
+        """
+        try:
+            clave = self.clave(ruta)
+        except OSError:
+            return None
+        consulta = "SELECT slot FROM entradas WHERE clave=? AND listo=1"
+        with self._lock:
+            fila = self._db.execute(consulta, (clave,)).fetchone()
+            # Se lee con el lock tomado: un put concurrente puede desalojar
+            # la posición y sobrescribirla en cuanto se suelta
+            entrada = None
+            if fila is not None:
+                origen = self._shard[fila[0]]
+                if out is None:
+                    entrada = np.array(origen)
+                else:
+                    entrada = self._normalizar(origen, out)
+            # Otro proceso borra la entrada desalojada antes de escribir en su
+            # posición: si sigue en el índice, lo leído no se mezcló
+            if entrada is not None and self._db.execute(consulta, (clave,)).fetchone() != fila:
+                entrada = None
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self._accesos[clave] = time.time()
+            if len(self._accesos) >= ACCESOS_POR_ESCRITURA:
+                self._escribir_accesos()
+            self.aciertos += 1
+        return entrada
+
+    def _normalizar(self, origen, destino):
+        """Normaliza una entrada del shard (o una imagen ecualizada) a [0, 1] en destino"""
+        if origen.dtype == np.uint8:
+            np.divide(origen, np.float32(255.0), out=destino)
+            if self.dtype == np.float16:
+                # Mismo redondeo que la entrada guardada en float16
+                destino[...] = destino.astype(np.float16)
+        else:
+            destino[...] = origen
+        return destino
+
+    def _escribir_accesos(self):
+        """Escribe en el índice las marcas LRU acumuladas (con el lock tomado)"""
+        if self._accesos:
+            self._db.executemany("UPDATE entradas SET ultimo_acceso=? WHERE clave=?",
+                                 [(t, clave) for clave, t in self._accesos.items()])
+            self._accesos.clear()
+
+    def put(self, ruta, ecualizada):
+        """
+        Guarda en caché la imagen ecualizada (uint8) de un archivo.
+
+        Si la caché está llena se desaloja la entrada usada hace más tiempo.
+
+        Args:
+            ruta (str): Ruta del archivo de imagen
+            ecualizada (numpy.ndarray): Salida uint8 de Preprocessor.equalize
+
+        Returns:
+            numpy.ndarray: La misma ``ecualizada`` (sin leer de vuelta el shard)
+        """
+        clave = self.clave(ruta)
+        ruta_abs = normalizar_ruta(ruta)
+        with self._lock:
+            # El desalojo necesita los accesos recientes de este proceso
+            self._escribir_accesos()
+            # Primero se reserva la posición (y se borra la entrada desalojada)
+            # y después se escribe: la entrada solo se lee cuando está lista
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Versiones anteriores del mismo archivo quedan obsoletas
+                self._db.execute("DELETE FROM entradas WHERE ruta=? AND clave<>?", (ruta_abs, clave))
+                fila = self._db.execute("SELECT slot FROM entradas WHERE clave=?", (clave,)).fetchone()
+                if fila is not None:
+                    slot = fila[0]
+                else:
+                    slot = self._slot_libre()
+                    self._db.execute("INSERT INTO entradas VALUES (?, ?, ?, ?, 0)",
+                                     (clave, ruta_abs, slot, time.time()))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            destino = self._shard[slot]
+            if self.dtype == np.uint8:
+                destino[...] = ecualizada
+            else:
+                np.divide(ecualizada, np.float32(255.0), out=destino, casting='unsafe')
+            self._db.execute("UPDATE entradas SET listo=1 WHERE clave=? AND slot=?", (clave, slot))
+        return ecualizada
+
+    def _slot_libre(self):
+        """Devuelve una posición libre del shard, desalojando la menos reciente si hace falta"""
+        ocupados = self._db.execute("SELECT COUNT(*) FROM entradas").fetchone()[0]
+        if ocupados < self.capacidad:
+            # Primer hueco libre en la secuencia de posiciones
+            fila = self._db.execute("""SELECT MIN(s) FROM (
+                SELECT 0 AS s WHERE NOT EXISTS (SELECT 1 FROM entradas WHERE slot=0)
+                UNION ALL
+                SELECT slot + 1 FROM entradas
+                WHERE slot + 1 < ? AND slot + 1 NOT IN (SELECT slot FROM entradas))""",
+                                    (self.capacidad,)).fetchone()
+            return fila[0]
+        # Las entradas que otro proceso está escribiendo no se desalojan, salvo
+        # que lleven tanto tiempo sin terminar que ese proceso haya muerto
+        fila = self._db.execute(
+            "SELECT clave, slot FROM entradas WHERE listo=1 OR ultimo_acceso<? "
+            "ORDER BY ultimo_acceso LIMIT 1", (time.time() - ESCRITURA_ABANDONADA,)).fetchone()
+        clave, slot = fila or self._db.execute(
+            "SELECT clave, slot FROM entradas ORDER BY ultimo_acceso LIMIT 1").fetchone()
+        self._db.execute("DELETE FROM entradas WHERE clave=?", (clave,))
+        return slot
+
+    def load_batch(self, rutas, out=None, workers=None):
+        """
+        Arma un tensor batch para el modelo a partir de archivos.
+
+        Los aciertos se normalizan del memmap directamente en el batch; los
+        fallos se leen, se preprocesan en paralelo y se guardan en la caché.
+
+        Args:
+            rutas (list): Rutas de los archivos de imagen
+            out (numpy.ndarray): Tensor destino (N, 512, 512, 1) float32 opcional
+            workers (int): Hilos para decodificar y preprocesar los fallos
+
+        Returns:
+            tuple: (batch, validos) con la misma semántica que preprocess_batch
+        """
+        rutas = list(rutas)
+        n = len(rutas)
+        if out is None:
+            out = np.empty((n,) + self.forma + (1,), dtype=np.float32)
+        validos = np.zeros(n, dtype=bool)
+
+        def _cargar(i):
+            try:
+                if self.get(rutas[i], out=out[i, ..., 0]) is None:
+                    array, _ = read_image_file(rutas[i])
+                    if array is None:
+                        raise ValueError("no se pudo leer la imagen")
+                    self._normalizar(self.put(rutas[i], self.preprocessor.equalize(array)),
+                                     out[i, ..., 0])
+                validos[i] = True
+            except Exception as e:
+                print(f"❌ Error cargando {rutas[i]} desde caché: {e}")
+                out[i] = 0.0
+
+        workers = max(1, min(int(workers or os.cpu_count() or 1), n or 1))
+        if workers == 1:
+            for i in range(n):
+                _cargar(i)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(_cargar, range(n)))
+        return out[:n], validos
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entradas").fetchone()[0]
+
+    def flush(self):
+        """Asegura que los datos del shard y los accesos pendientes lleguen a disco"""
+        with self._lock:
+            self._escribir_accesos()
+        self._shard.flush()
+
+    def close(self):
+        """Cierra el shard y el índice"""
+        self.flush()
+        self._db.close()
@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Procesos de inferencia que comparten los pesos del modelo.
+
+Con N procesos cada uno carga su copia de los pesos. Hacer fork del proceso
+que ya cargó el modelo no sirve: el runtime de TensorFlow no sobrevive al
+fork (sus hilos no existen en el hijo y la primera inferencia se bloquea).
+En su lugar el proceso padre carga, optimiza y valida el modelo una sola
+vez y escribe sus pesos en un archivo plano con cada tensor alineado a
+página (en /dev/shm si existe). Cada worker arranca con ``spawn``, mapea ese
+archivo con mmap y crea los tensores de TensorFlow sobre la memoria mapeada
+con DLPack, sin copiarlos: las páginas de los pesos están una sola vez en
+memoria física para todos los workers.
+
+El modelo del worker se construye dentro de un ``keras.StatelessScope`` sin
+inicializar sus variables, así que no reservan memoria, y se ejecuta en otro
+StatelessScope que las sustituye por los tensores mapeados. Lo que sigue siendo de cada proceso es el
+runtime de TensorFlow y las activaciones.
+
+Cada worker procesa una partición del trabajo en lote (id % n == k) y el
+padre mide su memoria en /proc: RSS, PSS (la parte compartida repartida
+entre quienes la usan) y memoria privada.
+
+Uso:
+    lanzador = LanzadorWorkers(procesos=4)
+    reporte = lanzador.ejecutar_trabajo('data/rescoring.sqlite')
+    imprimir_memoria(reporte)
+"""
+
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+import keras
+
+try:
+    from .load_model import model_fun, registrar_version, version_modelo
+    from .runtime_profile import perfil_activo, ejecutar_con_perfil
+    from .model_optimizer import SumaEscalada
+    from .job_queue import ColaTrabajos, ejecutar_trabajo
+    from .output_sink import SalidaAsincrona
+    from .tensor_cache import TensorCache
+except ImportError:
+    from src.modulos.load_model import model_fun, registrar_version, version_modelo
+    from src.modulos.runtime_profile import perfil_activo, ejecutar_con_perfil
+    from src.modulos.model_optimizer import SumaEscalada
+    from src.modulos.job_queue import ColaTrabajos, ejecutar_trabajo
+    from src.modulos.output_sink import SalidaAsincrona
+    from src.modulos.tensor_cache import TensorCache
+
+ALINEACION = 4096
+ARCHIVO_PESOS = 'pesos.bin'
+ARCHIVO_INDICE = 'indice.json'
+# Lote sintético con el que cada worker comprueba que reproduce al padre
+LOTE_REFERENCIA = 2
+TOLERANCIA_REFERENCIA = 1e-4
+INTERVALO_MUESTREO = 0.5
+# Capas propias que puede tener el modelo optimizado (ver model_optimizer)
+OBJETOS_PERSONALIZADOS = {'SumaEscalada': SumaEscalada}
+
+
+def memoria_proceso(pid=None):
+    """
+    Memoria de un proceso según /proc/<pid>/smaps_rollup.
+
+    Args:
+        pid (int): Proceso (por defecto el actual)
+
+    Returns:
+        dict: rss_mb, pss_mb, compartida_mb y privada_mb (vacío si no se puede leer)
+    """
+    campos = {}
+    try:
+        with open(f"/proc/{pid or 'self'}/smaps_rollup") as f:
+            for linea in f:
+                partes = linea.split()
+                if len(partes) >= 2 and partes[0].endswith(':') and partes[1].isdigit():
+                    campos[partes[0][:-1]] = int(partes[1])
+    except OSError:
+        return {}
+    mb = lambda *claves: round(sum(campos.get(c, 0) for c in claves) / 1024, 1)
+    return {
+        'rss_mb': mb('Rss'),
+        'pss_mb': mb('Pss'),
+        'compartida_mb': mb('Shared_Clean', 'Shared_Dirty'),
+        'privada_mb': mb('Private_Clean', 'Private_Dirty'),
+    }
+
+
+def _lote_referencia(forma, dtype):
+    """Lote sintético y determinista para comparar al padre con los workers"""
+    rng = np.random.default_rng(0)
+    return rng.random((LOTE_REFERENCIA,) + tuple(forma), dtype=np.float32).astype(dtype)
+
+
+def exportar_pesos(model, directorio):
+    """
+    Escribe la arquitectura y los pesos de un modelo para los workers.
+
+    Los pesos van en el orden de ``trainable_variables`` seguido de
+    ``non_trainable_variables``, cada uno en un desplazamiento múltiplo de
+    ALINEACION.
+
+    Args:
+        model (tf.keras.Model): Modelo ya cargado y optimizado
+        directorio (str): Carpeta de salida
+
+    Returns:
+        dict: Índice (arquitectura, tensores, versión y salida de referencia)
+    """
+    os.makedirs(directorio, exist_ok=True)
+    variables = list(model.trainable_variables) + list(model.non_trainable_variables)
+    tensores = []
+    desplazamiento = 0
+    with open(os.path.join(directorio, ARCHIVO_PESOS), 'wb') as f:
+        for variable in variables:
+            valor = np.ascontiguousarray(variable.value.numpy())
+            relleno = -desplazamiento % ALINEACION
+            f.write(b'\0' * relleno)
+            desplazamiento += relleno
+            tensores.append({'desplazamiento': desplazamiento, 'forma': list(valor.shape),
+                             'dtype': valor.dtype.name})
+            f.write(valor.tobytes())
+            desplazamiento += valor.nbytes
+
+    dtype = tf.as_dtype(model.inputs[0].dtype).as_numpy_dtype
+    referencia = model(_lote_referencia(model.inputs[0].shape[1:], dtype), training=False)
+    # Solo inferencia: sin la compilación (optimizador y métricas crearían variables)
+    arquitectura = json.loads(model.to_json())
+    arquitectura.pop('compile_config', None)
+    indice = {
+        'arquitectura': json.dumps(arquitectura),
+        'tensores': tensores,
+        'bytes': desplazamiento,
+        'version': version_modelo(model),
+        'referencia': np.asarray(referencia, dtype=np.float32).tolist(),
+    }
+    with open(os.path.join(directorio, ARCHIVO_INDICE), 'w', encoding='utf-8') as f:
+        json.dump(indice, f)
+    return indice
+
+
+class ModeloCompartido:
+    """
+    Modelo de solo inferencia sobre pesos mapeados en memoria.
+
+    Expone lo que usan predict_batch, el planificador de lotes y la cola de
+    trabajos (``predict_on_batch``, ``inputs``, ``outputs``, ``layers``,
+    ``count_params``). No sirve para Grad-CAM: sus variables no tienen valor.
+    """
+
+    def __init__(self, directorio, compartir=True):
+        """
+        Args:
+            directorio (str): Carpeta escrita por exportar_pesos
+            compartir (bool): Usar los pesos mapeados sin copiarlos; con False
+                cada proceso copia los pesos en sus variables (para comparar)
+
+        Raises:
+            RuntimeError: Si la salida no coincide con la del proceso padre
+        """
+        with open(os.path.join(directorio, ARCHIVO_INDICE), encoding='utf-8') as f:
+            indice = json.load(f)
+        # Copia al escribir: las páginas solo se duplican si alguien las modifica
+        self._mapa = np.memmap(os.path.join(directorio, ARCHIVO_PESOS), mode='c')
+        valores = [np.ndarray(t['forma'], dtype=np.dtype(t['dtype']), buffer=self._mapa,
+                              offset=t['desplazamiento']) for t in indice['tensores']]
+        self.compartidos = 0
+        if compartir:
+            # Sin initialize_variables las variables no llegan a reservar memoria
+            with keras.StatelessScope(initialize_variables=False):
+                self.model = keras.models.model_from_json(indice['arquitectura'],
+                                                          custom_objects=OBJETOS_PERSONALIZADOS)
+            variables = self.model.trainable_variables + self.model.non_trainable_variables
+            asignacion = list(zip(variables, [self._tensor(v) for v in valores]))
+
+            def funcion(x):
+                # Como stateless_call, pero sin inicializar las variables al salir
+                with keras.StatelessScope(state_mapping=asignacion, initialize_variables=False):
+                    return self.model(x, training=False)
+        else:
+            self.model = keras.models.model_from_json(indice['arquitectura'],
+                                                      custom_objects=OBJETOS_PERSONALIZADOS)
+            variables = self.model.trainable_variables + self.model.non_trainable_variables
+            for variable, valor in zip(variables, valores):
+                variable.assign(valor)
+            funcion = lambda x: self.model(x, training=False)
+
+        self.dtype = tf.as_dtype(self.model.inputs[0].dtype)
+        firma = tf.TensorSpec((None,) + tuple(self.model.inputs[0].shape[1:]), self.dtype)
+        self._funcion = tf.function(funcion).get_concrete_function(firma)
+        self.bytes_pesos = indice['bytes']
+        registrar_version(self, indice['version'])
+
+        # Calentamiento y comprobación frente a la salida del padre
+        salida = self.predict_on_batch(
+            _lote_referencia(self.model.inputs[0].shape[1:], self.dtype.as_numpy_dtype))
+        diferencia = float(np.abs(salida - np.asarray(indice['referencia'])).max())
+        if diferencia > TOLERANCIA_REFERENCIA:
+            raise RuntimeError(f"Los pesos mapeados no reproducen el modelo (diferencia {diferencia:.2e})")
+
+    def _tensor(self, valor):
+        """Tensor sobre la memoria de ``valor`` (DLPack) o, si el tipo no lo permite, una copia"""
+        try:
+            tensor = tf.experimental.dlpack.from_dlpack(valor.__dlpack__())
+            self.compartidos += 1
+            return tensor
+        except Exception:
+            return tf.convert_to_tensor(valor)
+
+    @property
+    def inputs(self):
+        """Entradas simbólicas del modelo (tipo y forma del lote)"""
+        return self.model.inputs
+
+    @property
+    def outputs(self):
+        """Salidas simbólicas del modelo"""
+        return self.model.outputs
+
+    @property
+    def layers(self):
+        """Capas del modelo (para el planificador de lotes)"""
+        return self.model.layers
+
+    def count_params(self):
+        """Número de parámetros del modelo"""
+        return self.model.count_params()
+
+    def predict_on_batch(self, batch):
+        """
+        Probabilidades de un lote preprocesado.
+
+        Args:
+            batch (numpy.ndarray): Tensor (N, 512, 512, 1)
+
+        Returns:
+            numpy.ndarray: Probabilidades (N, clases) en float32
+        """
+        return np.asarray(self._funcion(tf.cast(batch, self.dtype)), dtype=np.float32)
+
+
+def registros_del_worker(registros, k):
+    """Archivo de registros propio del worker k ('resultados.csv' -> 'resultados.worker0.csv')"""
+    base, extension = os.path.splitext(registros)
+    return f"{base}.worker{k}{extension}"
+
+
+def _trabajador(k, n, directorio, ruta_db, opciones, mensajes):
+    """Proceso worker: mapea los pesos y procesa su partición del trabajo"""
+    try:
+        modelo = ModeloCompartido(directorio, compartir=opciones.pop('compartir', True))
+        mensajes.put(('listo', k, memoria_proceso()))
+        cola = ColaTrabajos(ruta_db, max_intentos=opciones.pop('max_intentos', 3), particion=(k, n))
+        # Cada worker abre su propia caché y su propia salida (con su archivo
+        # de registros): ninguna de las dos se puede pasar a otro proceso
+        cache, salida = opciones.pop('cache', None), opciones.pop('salida', None)
+        try:
+            if cache is not None:
+                cache = TensorCache(cache)
+            if salida is not None:
+                salida = dict(salida)
+                if salida.get('registros'):
+                    salida['registros'] = registros_del_worker(salida['registros'], k)
+                salida = SalidaAsincrona(**salida)
+            progreso = ejecutar_trabajo(cola, model=modelo, cache=cache, salida=salida, **opciones)
+        finally:
+            if salida is not None:
+                salida.cerrar()
+            if cache is not None:
+                cache.close()
+            cola.close()
+        if progreso is None:
+            raise RuntimeError("no se pudieron escribir los registros")
+        mensajes.put(('fin', k, {'memoria': memoria_proceso(), 'progreso': progreso,
+                                 'tensores_compartidos': modelo.compartidos,
+                                 'salida': None if salida is None else salida.estadisticas()}))
+    except Exception as e:
+        mensajes.put(('error', k, str(e)))
+
+
+class LanzadorWorkers:
+    """
+    Reparte un trabajo en lote entre procesos que comparten los pesos del modelo.
+    """
+
+    def __init__(self, procesos=2, model=None, directorio=None, compartir=True):
+        """
+        Args:
+            procesos (int): Número de workers
+            model (tf.keras.Model): Modelo a servir (por defecto se carga con model_fun)
+            directorio (str): Carpeta para los pesos exportados (por defecto
+                una temporal en /dev/shm, que se borra al terminar)
+            compartir (bool): Pesos compartidos (True) o una copia por worker
+        """
+        self.procesos = max(1, int(procesos))
+        self.model = model
+        self.directorio = directorio
+        self.compartir = compartir
+        self.indice = None
+        self._temporal = False
+
+    def preparar(self):
+        """
+        Carga el modelo (una vez, en este proceso) y exporta sus pesos.
+
+        Returns:
+            dict: Índice de los pesos exportados
+        """
+        if self.directorio is None:
+            base = '/dev/shm' if os.path.isdir('/dev/shm') else None
+            self.directorio = tempfile.mkdtemp(prefix='neumonia_pesos_', dir=base)
+            self._temporal = True
+        model = self.model if self.model is not None else model_fun()
+        if model is None:
+            raise RuntimeError("No se pudo cargar el modelo")
+        self.indice = exportar_pesos(model, self.directorio)
+        # Los workers usan el archivo: el padre no necesita conservar el modelo
+        self.model = None
+        print(f"💾 Pesos exportados: {self.indice['bytes'] / 2 ** 20:.1f} MB en {self.directorio}")
+        return self.indice
+
+    def ejecutar_trabajo(self, ruta_db, tamano_lote=None, lotes_por_commit=4, workers=None,
+                         max_intentos=3, cache=None, salida=None):
+        """
+        Procesa los archivos pending de un trabajo con ``procesos`` workers.
+
+        Args:
+            ruta_db (str): Archivo SQLite del trabajo (ver ColaTrabajos)
+            tamano_lote (int): Imágenes por lote de cada worker
+            lotes_por_commit (int): Lotes confirmados en cada transacción
+            workers (int): Hilos de preprocesamiento de cada worker
+            max_intentos (int): Caídas toleradas por archivo
+            cache (str): Carpeta de la caché de tensores; cada worker abre la suya
+            salida (dict): Argumentos de SalidaAsincrona sin carpeta de
+                heatmaps (formato, calidad, registros); cada worker crea su
+                salida y escribe los registros en su propio archivo (ver
+                registros_del_worker)
+
+        Returns:
+            dict: procesos, compartidos, pesos_mb, segundos, progreso del
+                trabajo, padre (memoria) y
+                por worker: memoria al quedar listo, pico de RSS y PSS, memoria
+                final, progreso, tensores_compartidos y salida (estadísticas
+                de su SalidaAsincrona, si se pidió)
+
+        Raises:
+            RuntimeError: Si algún worker falla
+            ValueError: Si la salida pide heatmaps: el modelo compartido de
+                los workers no admite Grad-CAM
+        """
+        if salida is not None and salida.get('directorio') is not None:
+            raise ValueError("Los workers no calculan heatmaps: la salida solo puede tener registros")
+        if self.indice is None:
+            self.preparar()
+        pesos_mb = round(self.indice['bytes'] / 2 ** 20, 1)
+        perfil = perfil_activo()
+        if perfil is not None:
+            # Los workers aplican el mismo perfil antes de importar TensorFlow
+            os.environ.setdefault('NEUMONIA_PERFIL', perfil['nombre'])
+
+        contexto = multiprocessing.get_context('spawn')
+        mensajes = contexto.Queue()
+        opciones = {'tamano_lote': tamano_lote, 'lotes_por_commit': lotes_por_commit,
+                    'workers': workers, 'max_intentos': max_intentos, 'compartir': self.compartir,
+                    'cache': cache, 'salida': salida}
+        procesos = [contexto.Process(target=ejecutar_con_perfil, name=f"worker-{k}",
+                                     args=(__name__, '_trabajador', k, self.procesos, self.directorio,
+                                           ruta_db, dict(opciones), mensajes))
+                    for k in range(self.procesos)]
+        inicio = time.perf_counter()
+        for proceso in procesos:
+            proceso.start()
+        print(f"🚀 {self.procesos} workers lanzados ({'pesos compartidos' if self.compartir else 'pesos copiados'})")
+
+        reporte = {k: {'pid': p.pid, 'pico_rss_mb': 0.0, 'pico_pss_mb': 0.0}
+                   for k, p in enumerate(procesos)}
+        errores = {}
+        pendientes = set(reporte)
+        try:
+            while pendientes:
+                try:
+                    tipo, k, dato = mensajes.get(timeout=INTERVALO_MUESTREO)
+                    if tipo == 'listo':
+                        reporte[k]['listo'] = dato
+                        print(f"   - worker-{k} listo: RSS {dato.get('rss_mb')} MB, PSS {dato.get('pss_mb')} MB")
+                    elif tipo == 'fin':
+                        reporte[k].update(dato)
+                        pendientes.discard(k)
+                    else:
+                        errores[k] = dato
+                        pendientes.discard(k)
+                except queue.Empty:
+                    pass
+                for k in list(pendientes):
+                    memoria = memoria_proceso(procesos[k].pid)
+                    if memoria:
+                        reporte[k]['pico_rss_mb'] = max(reporte[k]['pico_rss_mb'], memoria['rss_mb'])
+                        reporte[k]['pico_pss_mb'] = max(reporte[k]['pico_pss_mb'], memoria['pss_mb'])
+                    elif not procesos[k].is_alive():
+                        errores[k] = f"terminó con código {procesos[k].exitcode}"
+                        pendientes.discard(k)
+        finally:
+            for proceso in procesos:
+                proceso.join(timeout=30)
+            if self._temporal:
+                shutil.rmtree(self.directorio, ignore_errors=True)
+                self.directorio, self.indice, self._temporal = None, None, False
+
+        if errores:
+            raise RuntimeError(f"Fallaron workers: {errores}")
+        cola = ColaTrabajos(ruta_db)
+        try:
+            progreso = cola.progreso()
+        finally:
+            cola.close()
+        return {
+            'procesos': self.procesos,
+            'compartidos': self.compartir,
+            'pesos_mb': pesos_mb,
+            'segundos': round(time.perf_counter() - inicio, 2),
+            'progreso': progreso,
+            'padre': memoria_proceso(),
+            'workers': [reporte[k] for k in sorted(reporte)],
+        }
+
+
+def imprimir_memoria(reporte):
+    """Muestra en consola la memoria por worker de LanzadorWorkers.ejecutar_trabajo"""
+    modo = 'compartidos' if reporte['compartidos'] else 'copiados'
+    print(f"\n🧠 {reporte['procesos']} workers, pesos {modo} ({reporte['pesos_mb']} MB), "
+          f"{reporte['segundos']} s")
+    print(f"{'worker':>8} {'RSS':>8} {'PSS':>8} {'privada':>8} {'pico RSS':>9} {'pico PSS':>9} {'hechos':>7}")
+    for k, w in enumerate(reporte['workers']):
+        listo = w.get('listo', {})
+        print(f"{k:>8} {listo.get('rss_mb', 0):>8.1f} {listo.get('pss_mb', 0):>8.1f} "
+              f"{listo.get('privada_mb', 0):>8.1f} {w['pico_rss_mb']:>9.1f} {w['pico_pss_mb']:>9.1f} "
+              f"{w.get('progreso', {}).get('done', 0):>7}")
+    print(f"   - Proceso padre: RSS {reporte['padre'].get('rss_mb')} MB")
@@ -8,6 +8,8 @@ Ejecutar con: pytest tests/test_modulos.py -v
 
 import sys
 import os
+import glob
+import time
 import numpy as np
 import pytest
 import cv2
@@ -16,9 +18,19 @@ from PIL import Image
 # Agregar el directorio src al path para imports
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from modulos.read_img import read_image_file, read_jpg_file
+from modulos.read_img import read_image_file, read_jpg_file, listar_archivo
+from modulos.read_img import read_dicom_frames, cuadro_a_rgb
 from modulos.preprocess_img import preprocess, resize_image, convert_to_grayscale, normalize_image
+from modulos.preprocess_img import Preprocessor, preprocess_batch
 from modulos.load_model import model_fun
+from modulos.tensor_cache import TensorCache
+from modulos.dataset import empaquetar_dataset, DatasetEmpaquetado, evaluar, listar_dataset
+from modulos.overlay import RenderizadorOverlay
+from modulos.grad_cam import preparar_imagen_original
+from modulos.inference_session import PoolSesiones, PoolSaturado
+from modulos import runtime_profile
+from modulos.job_queue import ColaTrabajos, ejecutar_trabajo
+from modulos.hot_folder import ObservadorCarpeta
 
 # ✅ IMPORTACIÓN SEGURA: Solo importar lo que realmente existe
 try:
@@ -53,6 +65,30 @@ except ImportError:
             return False
         return True
 
+def crear_dicom(ruta, frames=1, alto=64, ancho=48):
+    """Escribe un DICOM sintético de 12 bits con ``frames`` cuadros distintos"""
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, SecondaryCaptureImageStorage, generate_uid
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = SecondaryCaptureImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Rows, ds.Columns = alto, ancho
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 12, 11, 0
+    pixeles = np.arange(frames * alto * ancho, dtype=np.uint16).reshape(frames, alto, ancho)
+    pixeles = (pixeles + np.arange(frames, dtype=np.uint16)[:, None, None] * 97) % 4096
+    if frames > 1:
+        ds.NumberOfFrames = frames
+    ds.PixelData = pixeles.tobytes()
+    ds.save_as(str(ruta), enforce_file_format=True)
+    return pixeles
+
 class TestReadImg:
     """Pruebas para el módulo de lectura de imágenes"""
     
@@ -129,6 +165,1216 @@ class TestPreprocessImg:
         # Puede retornar None o un array de error, ambos son aceptables
         print("✅ Test preprocess_entrada_invalida: PASÓ")
 
+class TestPreprocessor:
+    """Pruebas para el preprocesador con buffers reutilizables"""
+    
+    def setup_method(self):
+        """Configuración antes de cada prueba"""
+        self.test_image = np.random.randint(0, 255, (300, 200, 3), dtype=np.uint8)
+    
+    def _preprocess_referencia(self, array):
+        """Pipeline original, paso a paso, para comparar resultados"""
+        array = cv2.resize(array, (512, 512))
+        array = cv2.cvtColor(array, cv2.COLOR_BGR2GRAY)
+        array = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(4, 4)).apply(array)
+        return (array.astype(np.float32) / 255.0)[np.newaxis, ..., np.newaxis]
+    
+    def test_preprocess_identico_a_referencia(self):
+        """Probar que el resultado coincide bit a bit con el pipeline original"""
+        resultado = Preprocessor().preprocess(self.test_image)
+        assert np.array_equal(resultado, self._preprocess_referencia(self.test_image))
+        print("✅ Test preprocess_identico_a_referencia: PASÓ")
+    
+    def test_preprocess_into_slice_de_batch(self):
+        """Probar escritura directa en una posición de un tensor batch"""
+        batch = np.zeros((3, 512, 512, 1), dtype=np.float32)
+        salida = Preprocessor().preprocess_into(self.test_image, batch[1])
+        assert salida is not None
+        assert np.shares_memory(salida, batch)
+        assert np.array_equal(batch[1:2], self._preprocess_referencia(self.test_image))
+        assert not batch[0].any() and not batch[2].any()
+        print("✅ Test preprocess_into_slice_de_batch: PASÓ")
+    
+    def test_preprocessor_desde_varios_hilos(self):
+        """Probar que un mismo preprocesador es seguro desde un pool de hilos"""
+        from concurrent.futures import ThreadPoolExecutor
+        
+        imagenes = [np.random.randint(0, 255, (128 + i, 128, 3), dtype=np.uint8) for i in range(8)]
+        preprocesador = Preprocessor()
+        batch = np.empty((len(imagenes), 512, 512, 1), dtype=np.float32)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(lambda i: preprocesador.preprocess_into(imagenes[i], batch[i]),
+                          range(len(imagenes))))
+        for i, imagen in enumerate(imagenes):
+            assert np.array_equal(batch[i:i + 1], self._preprocess_referencia(imagen))
+        print("✅ Test preprocessor_desde_varios_hilos: PASÓ")
+
+    def test_preprocess_batch_con_hilos(self):
+        """Probar el lote paralelo contra el preprocesamiento individual"""
+        imagenes = [np.random.randint(0, 255, (150, 120 + i, 3), dtype=np.uint8) for i in range(5)]
+        imagenes.append(None)  # Una entrada inválida no debe tumbar el lote
+        batch, validos = preprocess_batch(imagenes, workers=3)
+        assert batch.shape == (6, 512, 512, 1)
+        assert batch.dtype == np.float32 and batch.flags['C_CONTIGUOUS']
+        assert validos.tolist() == [True] * 5 + [False]
+        for i, imagen in enumerate(imagenes[:-1]):
+            assert np.array_equal(batch[i:i + 1], self._preprocess_referencia(imagen))
+        assert not batch[5].any()
+        print("✅ Test preprocess_batch_con_hilos: PASÓ")
+
+class TestTensorCache:
+    """Pruebas para la caché de tensores preprocesados en disco"""
+    
+    def setup_method(self):
+        """Configuración antes de cada prueba"""
+        self.rutas = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'JPG', 'JPG', '*', '*.jpeg')))
+        if len(self.rutas) < 3:
+            pytest.skip("Imágenes de prueba no encontradas")
+    
+    def test_cache_caliente_igual_a_preprocess(self, tmp_path):
+        """Probar que un acierto de caché entrega el mismo tensor que el pipeline"""
+        cache = TensorCache(str(tmp_path), max_bytes=4 * 512 * 512)
+        fria, validos = cache.load_batch(self.rutas[:2])
+        caliente, _ = cache.load_batch(self.rutas[:2])
+        esperado = np.concatenate([preprocess(read_image_file(r)[0]) for r in self.rutas[:2]])
+        assert validos.all()
+        assert np.array_equal(fria, esperado) and np.array_equal(caliente, esperado)
+        assert cache.aciertos == 2
+        # get entrega una copia: un desalojo posterior no cambia lo leído
+        assert not np.shares_memory(cache.get(self.rutas[0]), cache._shard)
+        # Con out normaliza del shard al destino en una sola pasada
+        destino = np.empty((512, 512), dtype=np.float32)
+        assert cache.get(self.rutas[0], out=destino) is destino
+        assert np.array_equal(destino, esperado[0, ..., 0])
+        ecualizada = np.zeros((512, 512), dtype=np.uint8)
+        assert cache.put(self.rutas[2], ecualizada) is ecualizada
+        # Otra geometría usa su propio shard y no trunca el de esta
+        otra = TensorCache(str(tmp_path), max_bytes=8 * 512 * 512)
+        assert len(otra) == 0 and len(cache) == 3
+        otra.close()
+        assert np.array_equal(cache.load_batch(self.rutas[:2])[0], esperado)
+        cache.close()
+        reabierta = TensorCache(str(tmp_path), max_bytes=4 * 512 * 512)
+        assert len(reabierta) == 3 and reabierta.get(self.rutas[1]) is not None
+        reabierta.close()
+        print("✅ Test cache_caliente_igual_a_preprocess: PASÓ")
+    
+    def test_cache_desaloja_lru(self, tmp_path):
+        """Probar que la caché respeta el tamaño máximo desalojando la entrada más antigua"""
+        cache = TensorCache(str(tmp_path), max_bytes=2 * 512 * 512)
+        cache.load_batch(self.rutas[:2], workers=1)
+        cache.get(self.rutas[0])  # La primera pasa a ser la más reciente
+        cache.load_batch(self.rutas[2:3], workers=1)
+        assert len(cache) == 2
+        assert cache.get(self.rutas[0]) is not None
+        assert cache.get(self.rutas[1]) is None
+        cache.close()
+        print("✅ Test cache_desaloja_lru: PASÓ")
+
+class TestDataset:
+    """Pruebas para el dataset empaquetado y la evaluación en streaming"""
+    
+    DIRECTORIO = os.path.join(os.path.dirname(__file__), 'JPG', 'JPG')
+    
+    class ModeloSiempreNormal:
+        """Modelo mínimo que siempre predice 'normal'"""
+        def predict_on_batch(self, batch):
+            return np.tile(np.array([[0.1, 0.8, 0.1]], dtype=np.float32), (len(batch), 1))
+    
+    def setup_method(self):
+        """Configuración antes de cada prueba"""
+        if not os.path.isdir(self.DIRECTORIO):
+            pytest.skip("Imágenes de prueba no encontradas")
+    
+    def test_empaquetar_y_recorrer(self, tmp_path):
+        """Probar que los lotes del dataset empaquetado coinciden con preprocess"""
+        indice = empaquetar_dataset(self.DIRECTORIO, str(tmp_path), imagenes_por_shard=5)
+        assert indice['total'] == 12 and len(indice['shards']) == 3
+        dataset = DatasetEmpaquetado(str(tmp_path))
+        vistas = 0
+        for batch, etiquetas in dataset.iterar_lotes(tamano_lote=4):
+            for i, etiqueta in enumerate(etiquetas):
+                ruta = indice['rutas'][vistas + i]
+                assert etiqueta == {'bacteria': 0, 'normal': 1, 'virus': 2}[ruta.split(os.sep)[0]]
+                esperado = preprocess(read_image_file(os.path.join(self.DIRECTORIO, ruta))[0])
+                assert np.array_equal(batch[i:i + 1], esperado)
+            vistas += len(etiquetas)
+        assert vistas == 12
+        print("✅ Test empaquetar_y_recorrer: PASÓ")
+    
+    def test_evaluar_matriz_confusion(self, tmp_path):
+        """Probar accuracy y matriz de confusión con un modelo conocido"""
+        empaquetar_dataset(self.DIRECTORIO, str(tmp_path))
+        reporte = evaluar(str(tmp_path), model=self.ModeloSiempreNormal(), tamano_lote=5)
+        assert reporte['imagenes'] == 12
+        assert reporte['matriz_confusion'] == [[0, 4, 0], [0, 4, 0], [0, 4, 0]]
+        assert abs(reporte['accuracy'] - 1 / 3) < 1e-9
+        assert reporte['imagenes_por_segundo'] > 0
+        print("✅ Test evaluar_matriz_confusion: PASÓ")
+
+class TestJobQueue:
+    """Pruebas para la cola de trabajos reanudable"""
+    
+    def setup_method(self):
+        """Configuración antes de cada prueba"""
+        if not os.path.isdir(TestDataset.DIRECTORIO):
+            pytest.skip("Imágenes de prueba no encontradas")
+        self.modelo = TestDataset.ModeloSiempreNormal()
+    
+    def test_trabajo_completo_con_fallidos(self, tmp_path):
+        """Probar el procesamiento por bloques con un archivo ilegible"""
+        roto = tmp_path / 'roto.jpg'
+        roto.write_bytes(b'no es una imagen')
+        cola = ColaTrabajos(str(tmp_path / 'trabajo.sqlite'))
+        assert cola.agregar_directorio(TestDataset.DIRECTORIO) == 12
+        assert cola.agregar([str(roto)]) == 1
+        assert cola.agregar_directorio(TestDataset.DIRECTORIO) == 0
+        progreso = ejecutar_trabajo(cola, tamano_lote=4, lotes_por_commit=2, workers=2,
+                                    model=self.modelo)
+        assert (progreso['done'], progreso['failed'], progreso['pending']) == (12, 1, 0)
+        assert progreso['imagenes_por_segundo'] > 0
+        assert all(r['diagnostico'] == "normal" for r in cola.resultados('done'))
+        assert [r['ruta'] for r in cola.resultados('failed')] == [str(roto)]
+        assert cola.reintentar_fallidos() == 1
+        cola.close()
+        print("✅ Test trabajo_completo_con_fallidos: PASÓ")
+    
+    def test_reanudar_tras_caida(self, tmp_path):
+        """Probar que al reanudar se saltan los hechos y se aísla el bloque interrumpido"""
+        ruta_db = str(tmp_path / 'trabajo.sqlite')
+        cola = ColaTrabajos(ruta_db, max_intentos=2)
+        cola.agregar_directorio(TestDataset.DIRECTORIO)
+        ejecutar_trabajo(cola, tamano_lote=4, lotes_por_commit=1, model=self.modelo)
+        # Simular una caída: tres archivos vuelven a pending y se reclaman sin confirmar
+        cola._db.execute("UPDATE items SET estado='pending', intentos=0 WHERE id IN (1, 2, 3)")
+        assert len(cola.reclamar(10)) == 3
+        cola.close()
+        
+        cola = ColaTrabajos(ruta_db, max_intentos=2)
+        # Al reanudar, los interrumpidos se reintentan de uno en uno
+        assert [i for i, _ in cola.reclamar(10)] == [1]
+        # Segunda caída con el 1: agota sus intentos y pasa a failed
+        for esperado in (2, 3):
+            items = cola.reclamar(10)
+            assert [i for i, _ in items] == [esperado]
+            cola.registrar([{'id': esperado, 'estado': 'done', 'diagnostico': "normal"}])
+        assert cola.reclamar(10) == []
+        progreso = cola.progreso()
+        assert (progreso['done'], progreso['failed'], progreso['pending']) == (11, 1, 0)
+        assert "interrumpió 2 veces" in next(cola.resultados('failed'))['error']
+        cola.close()
+        print("✅ Test reanudar_tras_caida: PASÓ")
+
+class TestArchivos:
+    """Pruebas para la lectura de estudios dentro de archivos zip/tar"""
+    
+    def setup_method(self):
+        """Configuración antes de cada prueba"""
+        self.rutas = sorted(glob.glob(os.path.join(TestDataset.DIRECTORIO, '*', '*.jpeg')))
+        if len(self.rutas) < 12:
+            pytest.skip("Imágenes de prueba no encontradas")
+    
+    def _crear_archivos(self, tmp_path):
+        """Empaqueta las imágenes de prueba y un DICOM sintético en un zip y un tar"""
+        import tarfile
+        import zipfile
+        dicom = tmp_path / 'estudio.dcm'
+        crear_dicom(dicom)
+        miembros = [(r, os.path.relpath(r, TestDataset.DIRECTORIO).replace(os.sep, '/'))
+                    for r in self.rutas] + [(str(dicom), 'virus/estudio.dcm')]
+        ruta_zip, ruta_tar = str(tmp_path / 'estudios.zip'), str(tmp_path / 'estudios.tar')
+        with zipfile.ZipFile(ruta_zip, 'w') as z, tarfile.open(ruta_tar, 'w') as t:
+            for origen, nombre in miembros:
+                z.write(origen, nombre)
+                t.add(origen, nombre)
+        return miembros, ruta_zip, ruta_tar
+    
+    def test_lectura_igual_a_extraida(self, tmp_path):
+        """Probar que un miembro del archivo se lee igual que el archivo extraído"""
+        miembros, ruta_zip, ruta_tar = self._crear_archivos(tmp_path)
+        for archivo in (ruta_zip, ruta_tar):
+            assert len(listar_archivo(archivo)) == 13
+            for origen, nombre in (miembros[0], miembros[-1]):
+                esperado, _ = read_image_file(origen)
+                leido, _ = read_image_file(f"{archivo}::{nombre}")
+                assert np.array_equal(leido, esperado)
+        assert read_image_file(f"{ruta_zip}::normal/no-existe.jpeg")[0] is None
+        # Solo se separa tras una extensión de archivo comprimido
+        from modulos.read_img import dividir_ruta
+        assert dividir_ruta("/datos/a::b/img.jpeg") == ("/datos/a::b/img.jpeg", None)
+        assert dividir_ruta("/x::y/e.tar.gz::n/a::b.dcm") == ("/x::y/e.tar.gz", "n/a::b.dcm")
+        import shutil
+        rara = tmp_path / 'serie::1'
+        rara.mkdir()
+        shutil.copy(miembros[0][0], rara / 'img.jpeg')
+        assert np.array_equal(read_image_file(str(rara / 'img.jpeg'))[0], read_image_file(miembros[0][0])[0])
+        
+        cache = TensorCache(str(tmp_path / 'cache'))
+        rutas = [f"{ruta_tar}::{nombre}" for _, nombre in miembros[:3]]
+        fria, validos = cache.load_batch(rutas, workers=2)
+        caliente, _ = cache.load_batch(rutas)
+        assert validos.all() and cache.aciertos == 3
+        assert np.array_equal(fria, caliente)
+        cache.close()
+        print("✅ Test lectura_igual_a_extraida: PASÓ")
+    
+    def test_dataset_y_cola_desde_zip(self, tmp_path):
+        """Probar el listado por clases y el procesamiento por lotes sin extraer"""
+        _, ruta_zip, _ = self._crear_archivos(tmp_path)
+        listado = listar_dataset(ruta_zip)
+        assert len(listado) == 13
+        assert dict(listado)[f"{ruta_zip}::virus/estudio.dcm"] == 2
+        
+        cola = ColaTrabajos(str(tmp_path / 'trabajo.sqlite'))
+        assert cola.agregar_directorio(ruta_zip) == 13
+        progreso = ejecutar_trabajo(cola, tamano_lote=4, model=TestDataset.ModeloSiempreNormal())
+        assert (progreso['done'], progreso['failed']) == (13, 0)
+        cola.close()
+        print("✅ Test dataset_y_cola_desde_zip: PASÓ")
+
+class TestDicomMultiCuadro:
+    """Pruebas para la lectura selectiva de cuadros en DICOM multi-cuadro"""
+    
+    def test_seleccion_de_cuadros(self, tmp_path, monkeypatch):
+        """Probar que solo se decodifican los cuadros pedidos y coinciden con el volumen"""
+        import zipfile
+        ruta = str(tmp_path / 'multi.dcm')
+        pixeles = crear_dicom(ruta, frames=5)
+        medio, _ = read_image_file(ruta, cuadro='medio')
+        assert np.array_equal(medio, cuadro_a_rgb(pixeles[2]))
+        assert np.array_equal(read_image_file(ruta)[0], cuadro_a_rgb(pixeles[0]))
+        
+        ruta_zip = str(tmp_path / 'multi.zip')
+        with zipfile.ZipFile(ruta_zip, 'w') as z:
+            z.write(ruta, 'viral/multi.dcm')
+        for origen in (ruta, f"{ruta_zip}::viral/multi.dcm"):
+            imagenes, indices = read_dicom_frames(origen, 'todos')
+            assert indices == [0, 1, 2, 3, 4]
+            assert all(np.array_equal(img, cuadro_a_rgb(p)) for img, p in zip(imagenes, pixeles))
+        assert read_dicom_frames(ruta, -1)[1] == [4]
+        assert read_dicom_frames(ruta, 7) == (None, None)
+        # Con pydicom 2.x (sin iter_pixels) la selección da los mismos cuadros
+        from modulos import read_img
+        monkeypatch.setattr(read_img, 'iter_pixels', None)
+        for origen in (ruta, f"{ruta_zip}::viral/multi.dcm"):
+            imagenes, indices = read_dicom_frames(origen, 'medio')
+            assert indices == [2] and np.array_equal(imagenes[0], cuadro_a_rgb(pixeles[2]))
+        unico = str(tmp_path / 'unico.dcm')
+        pixeles_unico = crear_dicom(unico)
+        assert np.array_equal(read_image_file(unico)[0], cuadro_a_rgb(pixeles_unico[0]))
+        print("✅ Test seleccion_de_cuadros: PASÓ")
+    
+    def test_cuadros_como_lote(self, tmp_path):
+        """Probar que los cuadros pasan juntos por el modelo y se promedian"""
+        from modulos.integrator import predict_cuadros
+        
+        class ModeloContador(TestDataset.ModeloSiempreNormal):
+            lotes = []
+            def predict_on_batch(self, batch):
+                self.lotes.append(len(batch))
+                return super().predict_on_batch(batch)
+        
+        ruta = str(tmp_path / 'multi.dcm')
+        crear_dicom(ruta, frames=4)
+        modelo = ModeloContador()
+        resultado = predict_cuadros(ruta, 'todos', model=modelo, workers=2)
+        assert modelo.lotes == [4]
+        assert resultado['diagnostico'] == "normal"
+        assert abs(resultado['probabilidad'] - 80.0) < 1e-4
+        assert [c['cuadro'] for c in resultado['cuadros']] == [0, 1, 2, 3]
+        assert predict_cuadros(ruta, 'medio', model=modelo)['cuadros'][0]['cuadro'] == 2
+        print("✅ Test cuadros_como_lote: PASÓ")
+
+class TestHotFolder:
+    """Pruebas para la carpeta vigilada"""
+    
+    def setup_method(self):
+        """Configuración antes de cada prueba"""
+        self.imagenes = sorted(glob.glob(os.path.join(TestDataset.DIRECTORIO, '*', '*.jpeg')))[:3]
+        if len(self.imagenes) < 3:
+            pytest.skip("Imágenes de prueba no encontradas")
+    
+    def test_espera_archivo_completo(self, tmp_path):
+        """Probar que un archivo a medio escribir no se encola hasta que deja de cambiar"""
+        entrada = tmp_path / 'entrada'
+        entrada.mkdir()
+        cola = ColaTrabajos(str(tmp_path / 'trabajo.sqlite'))
+        observador = ObservadorCarpeta(str(entrada), cola, estabilidad=1.0)
+        contenido = open(self.imagenes[0], 'rb').read()
+        destino = entrada / 'estudio.jpeg'
+        destino.write_bytes(contenido[:1000])
+        (entrada / 'notas.txt').write_text("ignorar")
+        
+        assert observador.escanear(ahora=100.0) == []
+        with open(destino, 'ab') as f:
+            f.write(contenido[1000:])
+        os.utime(destino, ns=(1, 2))
+        # Cambió el tamaño: vuelve a contar la estabilidad, pero conserva la llegada
+        assert observador.escanear(ahora=100.8) == []
+        assert observador.escanear(ahora=101.5) == []
+        assert observador.escanear(ahora=102.0) == [(str(destino), 100.0)]
+        assert observador.escanear(ahora=110.0) == []
+        cola.close()
+        print("✅ Test espera_archivo_completo: PASÓ")
+    
+    def test_micro_lotes_y_heatmaps(self, tmp_path):
+        """Probar el micro-lote por tiempo de espera, los heatmaps y la latencia"""
+        import shutil
+        entrada, heatmaps = tmp_path / 'entrada', tmp_path / 'heatmaps'
+        entrada.mkdir()
+        cola = ColaTrabajos(str(tmp_path / 'trabajo.sqlite'))
+        observador = ObservadorCarpeta(str(entrada), cola, heatmaps=str(heatmaps),
+                                       tamano_lote=8, max_espera=0.5, estabilidad=0.2)
+        for ruta in self.imagenes:
+            shutil.copy(ruta, entrada)
+        
+        ahora = time.time()
+        assert observador.paso(ahora) == 0
+        # Completos pero el lote no está lleno: esperan hasta max_espera
+        assert observador.paso(ahora + 0.3) == 0
+        assert cola.progreso()['pending'] == 3
+        assert observador.paso(ahora + 0.9) == 3
+        
+        resultados = list(cola.resultados('done'))
+        assert len(resultados) == 3
+        assert all(os.path.exists(r['heatmap']) for r in resultados)
+        assert cv2.imread(resultados[0]['heatmap']).shape == (512, 512, 3)
+        estadisticas = observador.estadisticas()
+        assert estadisticas['procesados'] == 3 and estadisticas['p95_ms'] > 0
+        # Un observador nuevo sobre el mismo almacén no repite lo ya procesado
+        assert ObservadorCarpeta(str(entrada), cola).escanear() == []
+        cola.close()
+        print("✅ Test micro_lotes_y_heatmaps: PASÓ")
+
+class TestModelOptimizer:
+    """Pruebas para el plegado de BatchNorm y la fusión de operaciones"""
+    
+    def test_net5blocks_optimizado_equivalente(self):
+        """Probar que Net5Blocks optimizado da las mismas probabilidades y el mismo Grad-CAM"""
+        from tensorflow.keras import layers
+        from modulos.model_optimizer import (construir_net5blocks, optimizar_modelo,
+                                             verificar_paridad, lote_de_verificacion)
+        from modulos.grad_cam import calcular_cam
+        original = construir_net5blocks()
+        optimizado, cambios = optimizar_modelo(original)
+        assert cambios['bn_plegada_en_conv'] == 11 and cambios['dropout_eliminado'] == 3
+        assert not any(isinstance(c, (layers.BatchNormalization, layers.Dropout, layers.Activation))
+                       for c in optimizado.layers)
+        batch = lote_de_verificacion()
+        paridad = verificar_paridad(original, optimizado, batch)
+        assert paridad['ok'], paridad
+        for clase in range(3):
+            esperado = calcular_cam(original, batch[:1], clase).astype(int)
+            assert np.abs(calcular_cam(optimizado, batch[:1], clase).astype(int) - esperado).max() <= 1
+        print("✅ Test net5blocks_optimizado_equivalente: PASÓ")
+    
+    def test_sequential_y_modelo_sin_cambios(self):
+        """Probar el plegado en un Sequential y que un modelo sin BN se devuelve tal cual"""
+        from tensorflow.keras import layers, models
+        from modulos.model_optimizer import optimizar_modelo, verificar_paridad
+        model = models.Sequential([
+            layers.Input(shape=(32, 32, 1)),
+            layers.Conv2D(4, 3, padding='same', name='conv'),
+            layers.BatchNormalization(name='bn'),
+            layers.Activation('relu'),
+            layers.GlobalAveragePooling2D(),
+            layers.Dense(3, activation='softmax'),
+        ])
+        rng = np.random.default_rng(1)
+        model.get_layer('bn').set_weights([rng.uniform(0.5, 1.5, 4), rng.normal(0, 1, 4),
+                                           rng.normal(0, 1, 4), rng.uniform(0.5, 2, 4)])
+        optimizado, cambios = optimizar_modelo(model)
+        assert cambios == {'bn_plegada_en_conv': 1, 'relu_fusionada': 1}
+        batch = rng.random((2, 32, 32, 1), dtype=np.float32)
+        assert verificar_paridad(model, optimizado, batch)['ok']
+        
+        temporal = model_fun(optimizar=True)
+        assert optimizar_modelo(temporal)[0] is temporal
+        print("✅ Test sequential_y_modelo_sin_cambios: PASÓ")
+
+class TestBatchPlanner:
+    """Pruebas para la planificación del tamaño de lote según la memoria"""
+    
+    def test_estimacion_y_tamano_de_lote(self):
+        """Probar la memoria estimada de Net5Blocks y que el lote escala con el presupuesto"""
+        from modulos.model_optimizer import construir_net5blocks, bytes_activaciones
+        from modulos.batch_planner import memoria_por_muestra, PlanificadorLotes
+        model = construir_net5blocks()
+        inferencia = memoria_por_muestra(model)
+        # Al menos un mapa (512, 512, 16) float32, pero menos que todas las activaciones juntas
+        assert 16 * 2 ** 20 < inferencia < bytes_activaciones(model)
+        assert memoria_por_muestra(model, 'gradientes') > bytes_activaciones(model)
+        
+        chico = PlanificadorLotes(model, presupuesto_mb=512)
+        grande = PlanificadorLotes(model, presupuesto_mb=4096)
+        assert 1 <= chico.tamano_lote < grande.tamano_lote
+        assert PlanificadorLotes(model, presupuesto_mb=4096, modo='gradientes').tamano_lote < grande.tamano_lote
+        assert PlanificadorLotes(model, presupuesto_mb=10 ** 6, maximo=32).tamano_lote == 32
+        assert PlanificadorLotes(model, presupuesto_mb=1).tamano_lote == 1
+        with pytest.raises(ValueError):
+            memoria_por_muestra(model, 'entrenamiento')
+        print("✅ Test estimacion_y_tamano_de_lote: PASÓ")
+    
+    def test_presupuesto_desde_memavailable(self, tmp_path, monkeypatch):
+        """Probar que el presupuesto usa MemAvailable (con caché recuperable) y no solo la memoria libre"""
+        from modulos import batch_planner
+        meminfo = tmp_path / 'meminfo'
+        meminfo.write_text("MemTotal:       16000000 kB\nMemFree:          500000 kB\n"
+                           "MemAvailable:   12000000 kB\nCached:         10000000 kB\n")
+        assert batch_planner.memoria_disponible(str(meminfo)) == 12000000 * 1024
+        # Sin /proc/meminfo se usa la memoria libre
+        assert batch_planner.memoria_disponible(str(tmp_path / 'no-existe')) > 0
+        monkeypatch.delenv('NEUMONIA_MEMORIA_LOTE_MB', raising=False)
+        monkeypatch.setattr(batch_planner, 'memoria_disponible', lambda: 8 * 2 ** 30)
+        assert batch_planner.presupuesto_por_defecto() == 4 * 2 ** 30
+        monkeypatch.setattr(batch_planner, 'memoria_disponible', lambda: None)
+        assert batch_planner.presupuesto_por_defecto() == batch_planner.PRESUPUESTO_POR_DEFECTO_MB * 2 ** 20
+        print("✅ Test presupuesto_desde_memavailable: PASÓ")
+    
+    def test_reduce_el_lote_ante_falta_de_memoria(self):
+        """Probar que un lote que agota la memoria se parte por la mitad y el tamaño se recuerda"""
+        import tensorflow as tf
+        from modulos.integrator import predict_batch
+        from modulos.batch_planner import get_planificador
+        
+        class ModeloLimitado:
+            layers = []
+            def __init__(self):
+                self.llamadas = []
+            def predict_on_batch(self, batch):
+                self.llamadas.append(len(batch))
+                if len(batch) > 3:
+                    raise tf.errors.ResourceExhaustedError(None, None, "OOM")
+                return np.tile([0.2, 0.3, 0.5], (len(batch), 1)).astype(np.float32)
+        
+        model = ModeloLimitado()
+        batch = np.zeros((10, 512, 512, 1), dtype=np.float32)
+        probabilidades = predict_batch(batch, model)
+        assert probabilidades.shape == (10, 3)
+        planificador = get_planificador(model)
+        assert planificador.tamano_lote <= 3 and planificador.reducciones > 0
+        
+        # La siguiente llamada ya usa el tamaño reducido, sin reintentos
+        model.llamadas.clear()
+        assert predict_batch(batch, model).shape == (10, 3)
+        assert max(model.llamadas) <= 3 and sum(model.llamadas) == 10
+        print("✅ Test reduce_el_lote_ante_falta_de_memoria: PASÓ")
+
+class TestPrecision:
+    """Pruebas para la inferencia en precisión reducida"""
+    
+    def test_resolver_precision_y_entrada_reducida(self, monkeypatch):
+        """Probar la elección de precisión según la CPU y el preprocesamiento a bfloat16"""
+        from modulos import precision
+        with pytest.raises(ValueError):
+            precision.resolver_precision('int8')
+        assert precision.resolver_precision('float32') == 'float32'
+        monkeypatch.setattr(precision, '_instrucciones_cpu', {'avx2'})
+        assert precision.resolver_precision('auto') == 'float32'
+        assert precision.resolver_precision('bfloat16') == 'float32'
+        monkeypatch.setattr(precision, '_instrucciones_cpu', {'avx2', 'amx_bf16'})
+        assert precision.resolver_precision('auto') == 'bfloat16'
+        
+        imagenes = [np.random.default_rng(i).integers(0, 256, (300, 400), dtype=np.uint8) for i in range(3)]
+        completo, _ = preprocess_batch(imagenes, workers=1)
+        reducido, validos = preprocess_batch(imagenes, workers=1, dtype=np.dtype('bfloat16'))
+        assert validos.all() and reducido.dtype.name == 'bfloat16'
+        assert reducido.nbytes * 2 == completo.nbytes
+        # bfloat16 tiene 8 bits de mantisa: error relativo menor a 2^-8
+        assert np.abs(reducido.astype(np.float32) - completo).max() <= 2 ** -8
+        print("✅ Test resolver_precision_y_entrada_reducida: PASÓ")
+    
+    def test_modelo_bfloat16_concuerda_con_float32(self):
+        """Probar la conversión a bfloat16, su reporte de paridad, la sesión y el Grad-CAM"""
+        import tensorflow as tf
+        from tensorflow.keras import layers, models
+        from modulos.precision import convertir_precision, reporte_paridad, dtype_entrada
+        from modulos.inference_session import InferenceSession
+        from modulos.grad_cam import grad_cam_batch
+        entrada = layers.Input(shape=(64, 64, 1))
+        x = layers.Conv2D(8, 3, activation='relu', name='conv1')(entrada)
+        x = layers.MaxPooling2D(2)(x)
+        x = layers.Conv2D(8, 3, activation='relu', name='conv10_thisone')(x)
+        x = layers.GlobalAveragePooling2D()(x)
+        salida = layers.Dense(3, activation='softmax')(x)
+        model = models.Model(entrada, salida)
+        
+        reducido = convertir_precision(model, 'bfloat16')
+        assert dtype_entrada(reducido).name == 'bfloat16' and reducido.outputs[0].dtype == 'float32'
+        batch = np.random.default_rng(0).random((6, 64, 64, 1), dtype=np.float32)
+        reporte = reporte_paridad(model, reducido, batch)
+        assert reporte['imagenes'] == 6 and reporte['delta_maximo'] < 0.02
+        assert set(reporte) >= {'concordancia', 'discrepancias', 'delta_medio', 'delta_por_clase'}
+        
+        probabilidades = InferenceSession(reducido).run(batch)
+        assert probabilidades.dtype == np.float32 and probabilidades.shape == (6, 3)
+        cams, probabilidades_cam = grad_cam_batch(reducido, batch.astype(dtype_entrada(reducido)))
+        assert cams.shape == (6, 29, 29) and cams.dtype == np.uint8
+        assert np.abs(probabilidades_cam - probabilidades).max() < 0.02
+        print("✅ Test modelo_bfloat16_concuerda_con_float32: PASÓ")
+
+class TestCascada:
+    """Pruebas para la cascada de cribado en dos etapas"""
+    
+    class ModeloFijo:
+        """Modelo de prueba que devuelve probabilidades dadas y registra los lotes"""
+        layers = []
+        def __init__(self, funcion):
+            self.funcion = funcion
+            self.lotes = []
+        def predict_on_batch(self, batch):
+            self.lotes.append(len(batch))
+            return self.funcion(batch)
+    
+    def test_solo_los_dudosos_pasan_al_modelo_completo(self):
+        """Probar el enrutado por umbral y el reporte de acierto, concordancia y rendimiento"""
+        from modulos.cascade import Cascada, evaluar_cascada
+        # La primera columna de la imagen indica si el modelo rápido está seguro
+        rapido = self.ModeloFijo(lambda b: np.where(b[:, 0, 0, :] > 0.5, [[0.02, 0.96, 0.02]],
+                                                    [[0.3, 0.4, 0.3]]).astype(np.float32))
+        completo = self.ModeloFijo(lambda b: np.tile([0.8, 0.1, 0.1], (len(b), 1)).astype(np.float32))
+        batch = np.zeros((6, 8, 8, 1), dtype=np.float32)
+        batch[::2, 0, 0, 0] = 1.0
+        cascada = Cascada(rapido, completo, umbral=0.9)
+        
+        probabilidades, etapa = cascada.clasificar(batch)
+        assert etapa.tolist() == [1, 2, 1, 2, 1, 2]
+        assert completo.lotes == [3]
+        assert probabilidades.argmax(axis=1).tolist() == [1, 0, 1, 0, 1, 0]
+        assert cascada.tasa_acierto() == 0.5
+        
+        etiquetas = np.array([1, 0, 1, 0, 0, 0])
+        reporte = evaluar_cascada([(batch, etiquetas)], Cascada(rapido, completo, umbral=0.9))
+        assert reporte['imagenes'] == 6 and reporte['tasa_acierto'] == 0.5
+        assert reporte['concordancia'] == 0.5
+        assert reporte['accuracy_cascada'] == round(5 / 6, 4) and reporte['accuracy_completo'] == round(4 / 6, 4)
+        assert reporte['imagenes_por_segundo_cascada'] > 0 and reporte['imagenes_por_segundo_completo'] > 0
+        print("✅ Test solo_los_dudosos_pasan_al_modelo_completo: PASÓ")
+    
+    def test_destilar_guardar_y_predict_en_cascada(self, tmp_path):
+        """Probar la destilación del modelo rápido, su guardado y predict con cascada"""
+        from modulos.cascade import (construir_modelo_rapido, destilar, guardar_modelo_rapido,
+                                     cargar_modelo_rapido, Cascada)
+        from modulos.integrator import predict
+        maestro = self.ModeloFijo(lambda b: np.tile([0.05, 0.9, 0.05], (len(b), 1)).astype(np.float32))
+        rng = np.random.default_rng(0)
+        lotes = [rng.random((4, 512, 512, 1), dtype=np.float32) for _ in range(2)]
+        rapido = construir_modelo_rapido()
+        historial = destilar(rapido, lambda: iter(lotes), maestro=maestro, epocas=8)
+        assert historial[-1] < historial[0]
+        assert maestro.lotes == [4, 4]  # Las salidas del maestro se calculan una sola vez
+        
+        ruta = guardar_modelo_rapido(rapido, str(tmp_path / 'rapido.keras'))
+        cargado = cargar_modelo_rapido(ruta)
+        assert np.allclose(cargado.predict_on_batch(lotes[0]), rapido.predict_on_batch(lotes[0]), atol=1e-6)
+        assert cargar_modelo_rapido(str(tmp_path / 'no_existe.keras')) is None
+        
+        imagen = rng.integers(0, 255, (100, 100, 3), dtype=np.uint8)
+        resultado = predict(imagen, cascada=Cascada(cargado, umbral=0.0, clases_salida=(0, 1, 2)))
+        assert resultado.etapa == 1 and resultado.diagnostico in ("bacteriana", "normal", "viral")
+        # Lo resolvió el modelo rápido: lleva su versión, no la del completo
+        from modulos.load_model import huella_archivo
+        assert resultado.version_modelo == f"rapido.keras@{huella_archivo(ruta)[:12]}"
+        assert resultado.heatmap((64, 64)).shape == (64, 64, 3)
+        completo = predict(imagen, cascada=Cascada(cargado, umbral=1.01))
+        assert completo.etapa == 2 and completo.version_modelo != resultado.version_modelo
+        assert predict(imagen, cascada=False).etapa is None
+        print("✅ Test destilar_guardar_y_predict_en_cascada: PASÓ")
+
+class TestModelManager:
+    """Pruebas para la sustitución del modelo en caliente con resultados versionados"""
+
+    @staticmethod
+    def _guardar_version(ruta, semilla):
+        """Guarda el modelo temporal con pesos distintos en un .h5"""
+        from modulos.load_model import crear_modelo_temporal
+        import warnings
+        model = crear_modelo_temporal()
+        rng = np.random.default_rng(semilla)
+        model.set_weights([rng.normal(0, 0.05, w.shape).astype(np.float32) for w in model.get_weights()])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            model.save(str(ruta))
+        return str(ruta)
+
+    def test_version_del_modelo_y_columna_en_la_cola(self, tmp_path):
+        """Probar la versión archivo@huella, la ruta explícita y la versión guardada por la cola"""
+        from modulos.load_model import version_modelo, huella_archivo, crear_modelo_temporal
+        ruta = self._guardar_version(tmp_path / 'v1.h5', 1)
+        model = model_fun(optimizar=False, precision='float32', ruta=ruta)
+        assert version_modelo(model) == f"v1.h5@{huella_archivo(ruta)[:12]}"
+        assert PoolSesiones(model).version == version_modelo(model)
+        assert version_modelo(crear_modelo_temporal()) == 'temporal'
+        # Una ruta explícita que no existe no cae en el modelo temporal
+        assert model_fun(ruta=str(tmp_path / 'no_existe.h5')) is None
+
+        cola = ColaTrabajos(str(tmp_path / 'trabajo.sqlite'))
+        cola.agregar(['a.jpg'])
+        (id_item, _), = cola.reclamar(1)
+        cola.registrar([{'id': id_item, 'estado': 'done', 'diagnostico': 'normal', 'probabilidad': 90.0,
+                         'probabilidades': [0.05, 0.9, 0.05], 'version_modelo': 'v1.h5@abc'}])
+        assert next(cola.resultados())['version_modelo'] == 'v1.h5@abc'
+        cola.close()
+        print("✅ Test version_del_modelo_y_columna_en_la_cola: PASÓ")
+
+    def test_sustitucion_en_caliente_sin_pausa(self, tmp_path):
+        """Probar que las peticiones siguen durante la carga, cambian de versión y el modelo viejo se libera"""
+        import gc
+        import threading
+        import weakref
+        from modulos.model_manager import GestorModelos
+        from modulos.inference_session import get_pool, cerrar_pool
+        v1 = self._guardar_version(tmp_path / 'v1.h5', 1)
+        v2 = self._guardar_version(tmp_path / 'v2.h5', 2)
+        gestor = GestorModelos(sesiones=1)
+        try:
+            version_1 = gestor.cargar(v1).result()
+            viejo = weakref.ref(get_pool().model)
+            versiones, errores = [], []
+            detener = threading.Event()
+
+            def atender():
+                batch = np.zeros((1, 512, 512, 1), dtype=np.float32)
+                while not detener.is_set() or len(versiones) < 3:
+                    try:
+                        pool = get_pool()
+                        pool.run(batch)
+                        versiones.append(pool.version)
+                    except Exception as e:
+                        errores.append(e)
+                        return
+
+            hilo = threading.Thread(target=atender)
+            hilo.start()
+            version_2 = gestor.cargar(v2).result()
+            n = len(versiones)
+            while len(versiones) < n + 3:
+                time.sleep(0.01)
+            detener.set()
+            hilo.join()
+
+            assert not errores
+            assert version_1.startswith('v1.h5@') and version_2.startswith('v2.h5@')
+            # Todas las peticiones se atendieron: primero con v1 y, tras el cambio, solo con v2
+            assert versiones[0] == version_1 and versiones[-1] == version_2
+            cambio = versiones.index(version_2)
+            assert set(versiones[:cambio]) == {version_1} and set(versiones[cambio:]) == {version_2}
+            assert gestor.version_activa == version_2 and gestor.historial[-1]['anterior'] == version_1
+            # Un resultado antiguo que pide su heatmap no retiene el modelo viejo
+            from modulos.grad_cam import obtener_modelo_grad_cam
+            from modulos.batch_planner import get_planificador
+            modelo_v1 = viejo()
+            obtener_modelo_grad_cam(modelo_v1)
+            get_planificador(modelo_v1)
+            del modelo_v1
+            gc.collect()
+            assert viejo() is None
+        finally:
+            gestor.detener()
+            cerrar_pool()
+        print("✅ Test sustitucion_en_caliente_sin_pausa: PASÓ")
+
+class TestWorkerLauncher:
+    """Pruebas para los procesos worker con pesos compartidos"""
+
+    def test_modelo_compartido_y_particiones(self, tmp_path):
+        """Probar que el modelo sobre pesos mapeados reproduce al original y las particiones de la cola"""
+        from modulos.load_model import crear_modelo_temporal, version_modelo
+        from modulos.worker_launcher import exportar_pesos, ModeloCompartido, memoria_proceso
+        model = crear_modelo_temporal()
+        indice = exportar_pesos(model, str(tmp_path / 'pesos'))
+        assert all(t['desplazamiento'] % 4096 == 0 for t in indice['tensores'])
+
+        compartido = ModeloCompartido(str(tmp_path / 'pesos'))
+        assert compartido.compartidos == len(indice['tensores'])
+        # Las variables del modelo del worker no tienen memoria propia
+        assert all(v._value is None for v in compartido.model.weights)
+        batch = np.random.default_rng(1).random((3, 512, 512, 1), dtype=np.float32)
+        assert np.allclose(compartido.predict_on_batch(batch), model.predict_on_batch(batch), atol=1e-5)
+        assert version_modelo(compartido) == 'temporal'
+        assert memoria_proceso()['rss_mb'] > 0
+
+        ruta_db = str(tmp_path / 'trabajo.sqlite')
+        cola = ColaTrabajos(ruta_db)
+        cola.agregar([f'{i}.jpg' for i in range(6)])
+        cola.close()
+        particiones = [ColaTrabajos(ruta_db, particion=(k, 2)) for k in range(2)]
+        reclamados = [{i for i, _ in c.reclamar(10)} for c in particiones]
+        assert not reclamados[0] & reclamados[1] and len(reclamados[0] | reclamados[1]) == 6
+        assert all(i % 2 == k for k, ids in enumerate(reclamados) for i in ids)
+        assert particiones[0].progreso()['total'] == 3
+        for c in particiones:
+            c.close()
+        print("✅ Test modelo_compartido_y_particiones: PASÓ")
+
+    def test_trabajo_repartido_entre_procesos(self, tmp_path):
+        """Probar un trabajo en lote con dos workers y el reporte de memoria por worker"""
+        from modulos.load_model import crear_modelo_temporal
+        from modulos.worker_launcher import LanzadorWorkers
+        rutas = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'JPG', 'JPG', '*', '*.jpeg')))[:4]
+        ruta_db = str(tmp_path / 'trabajo.sqlite')
+        cola = ColaTrabajos(ruta_db)
+        cola.agregar(rutas)
+        cola.close()
+
+        lanzador = LanzadorWorkers(procesos=2, model=crear_modelo_temporal(),
+                                   directorio=str(tmp_path / 'pesos'))
+        with pytest.raises(ValueError):
+            lanzador.ejecutar_trabajo(ruta_db, salida={'directorio': str(tmp_path / 'heatmaps')})
+        # Cada worker abre su caché y escribe sus registros en su propio archivo
+        reporte = lanzador.ejecutar_trabajo(ruta_db, tamano_lote=2, cache=str(tmp_path / 'cache'),
+                                            salida={'registros': str(tmp_path / 'resultados.jsonl')})
+        assert reporte['progreso']['done'] == len(rutas)
+        assert [w['progreso']['done'] for w in reporte['workers']] == [2, 2]
+        for worker in reporte['workers']:
+            assert worker['listo']['rss_mb'] > 0 and worker['tensores_compartidos'] > 0
+            assert worker['salida']['registros'] == 2
+        registros = [l for k in range(2)
+                     for l in open(tmp_path / f'resultados.worker{k}.jsonl', encoding='utf-8')]
+        assert len(registros) == len(rutas)
+        cola = ColaTrabajos(ruta_db)
+        assert {r['version_modelo'] for r in cola.resultados()} == {'temporal'}
+        cola.close()
+        print("✅ Test trabajo_repartido_entre_procesos: PASÓ")
+
+class TestAsyncApi:
+    """Pruebas para la API de predicción asyncio con lotes compartidos"""
+
+    def test_peticiones_concurrentes_en_lotes_compartidos(self):
+        """Probar que las predicciones concurrentes se agrupan y el bucle sigue atendiendo"""
+        import asyncio
+        from modulos.load_model import crear_modelo_temporal
+        from modulos.async_api import AgrupadorAsync
+        model = crear_modelo_temporal()
+        rutas = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'JPG', 'JPG', '*', '*.jpeg')))[:3]
+        rng = np.random.default_rng(2)
+        arrays = [rng.integers(0, 255, (300, 260, 3), dtype=np.uint8) for _ in range(3)]
+
+        async def principal():
+            agrupador = AgrupadorAsync(tamano_lote=8, espera_max=0.5, model=model)
+            latidos = 0
+            terminado = asyncio.Event()
+
+            async def latir():
+                nonlocal latidos
+                while not terminado.is_set():
+                    latidos += 1
+                    await asyncio.sleep(0.005)
+
+            latido = asyncio.ensure_future(latir())
+            try:
+                resultados = await agrupador.predict_many(arrays + rutas, timeout=60)
+            finally:
+                terminado.set()
+                await latido
+                agrupador.cerrar()
+            return agrupador.estadisticas(), resultados, latidos
+
+        estadisticas, resultados, latidos = asyncio.run(principal())
+        assert estadisticas['peticiones'] == 6 and estadisticas['lotes'] < 6
+        assert latidos > 1
+        esperadas = model.predict_on_batch(np.concatenate([preprocess(a) for a in arrays]))
+        for resultado, esperada in zip(resultados, esperadas):
+            assert np.allclose(resultado.probabilidades, esperada, atol=1e-5)
+            assert resultado.version_modelo == 'temporal'
+        assert all(r.diagnostico in ('bacteriana', 'normal', 'viral') for r in resultados)
+        print("✅ Test peticiones_concurrentes_en_lotes_compartidos: PASÓ")
+
+    def test_timeout_cancelacion_y_semaforo(self):
+        """Probar que las peticiones vencidas o canceladas salen del lote y el semáforo limita las admitidas"""
+        import asyncio
+        from modulos.load_model import crear_modelo_temporal
+        from modulos.async_api import AgrupadorAsync
+        array = np.random.default_rng(3).integers(0, 255, (128, 128), dtype=np.uint8)
+
+        async def principal():
+            # Con un lote que nunca se completa, las peticiones esperan en él
+            agrupador = AgrupadorAsync(tamano_lote=100, espera_max=30, max_en_vuelo=1,
+                                       model=crear_modelo_temporal())
+            try:
+                with pytest.raises(asyncio.TimeoutError):
+                    await agrupador.predict(array, timeout=0.3)
+                tarea = asyncio.ensure_future(agrupador.predict(array))
+                await asyncio.sleep(0.3)
+                assert agrupador.estadisticas()['pendientes'] == 1
+                # La única plaza está ocupada: la siguiente vence esperando turno
+                with pytest.raises(asyncio.TimeoutError):
+                    await agrupador.predict(array, timeout=0.1)
+                tarea.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await tarea
+                agrupador._despachar()
+                return agrupador.estadisticas()
+            finally:
+                agrupador.cerrar()
+
+        estadisticas = asyncio.run(principal())
+        assert estadisticas['vencidas'] == 2 and estadisticas['canceladas'] == 1
+        # Ninguna petición retirada llegó al modelo y todos los turnos se devolvieron
+        assert estadisticas['lotes'] == 0 and estadisticas['pendientes'] == 0
+        assert estadisticas['en_vuelo'] == 0
+        print("✅ Test timeout_cancelacion_y_semaforo: PASÓ")
+
+    def test_agrupador_se_libera_con_su_bucle(self):
+        """Probar que el agrupador de get_agrupador y sus hilos se liberan al terminar asyncio.run"""
+        import asyncio
+        import gc
+        import threading
+        import weakref
+        from modulos import async_api
+        from modulos.load_model import crear_modelo_temporal
+        model = crear_modelo_temporal()
+        array = np.random.default_rng(4).integers(0, 255, (128, 128), dtype=np.uint8)
+
+        async def principal():
+            # Con una sola plaza las peticiones compiten por el turno
+            agrupador = async_api.get_agrupador(max_en_vuelo=1, espera_max=0.01, model=model)
+            resultados = await asyncio.gather(*(agrupador.predict(array) for _ in range(3)))
+            assert all(r.version_modelo == 'temporal' for r in resultados)
+            return weakref.ref(agrupador)
+
+        referencias = [asyncio.run(principal()) for _ in range(2)]
+        gc.collect()
+        assert all(r() is None for r in referencias) and len(async_api._agrupadores) == 0
+        limite = time.time() + 5
+        while (any(h.name.startswith('async-') for h in threading.enumerate())
+               and time.time() < limite):
+            time.sleep(0.05)
+        assert not any(h.name.startswith('async-') for h in threading.enumerate())
+        print("✅ Test agrupador_se_libera_con_su_bucle: PASÓ")
+
+class TestOutputSink:
+    """Pruebas para la escritura de heatmaps y registros en segundo plano"""
+
+    def test_formatos_y_registros_por_bloques(self, tmp_path):
+        """Probar los cuatro formatos, los bytes por imagen y los registros escritos en bloques"""
+        import csv
+        from modulos.output_sink import SalidaAsincrona
+        rng = np.random.default_rng(4)
+        overlay = rng.integers(0, 255, (64, 64, 3), dtype=np.uint8)
+        cam = rng.integers(0, 255, (16, 16), dtype=np.uint8)
+        for formato in ('png', 'webp', 'jpg', 'npz'):
+            with SalidaAsincrona(str(tmp_path / formato), formato=formato) as salida:
+                destino = salida.escribir_heatmap('estudio', overlay=overlay, cam=cam)
+            assert destino.endswith('.' + formato) and os.path.getsize(destino) > 0
+            estadisticas = salida.estadisticas()
+            assert estadisticas['imagenes'] == 1 and estadisticas['bytes_por_imagen'] == os.path.getsize(destino)
+            assert estadisticas['codificacion_ms'] > 0
+            if formato == 'npz':
+                assert np.array_equal(np.load(destino)['cam'], cam)
+            elif formato == 'png':
+                assert np.array_equal(cv2.cvtColor(cv2.imread(destino), cv2.COLOR_BGR2RGB), overlay)
+            else:
+                assert cv2.imread(destino).shape == (64, 64, 3)
+        with pytest.raises(ValueError):
+            SalidaAsincrona(str(tmp_path / 'gif'), formato='gif')
+
+        ruta_csv = str(tmp_path / 'resultados.csv')
+        with SalidaAsincrona(registros=ruta_csv, registros_por_escritura=4) as salida:
+            for i in range(10):
+                salida.agregar_registros([{'id': i, 'estado': 'done', 'diagnostico': 'normal',
+                                           'probabilidades': [0.1, 0.8, 0.1]}])
+        filas = list(csv.DictReader(open(ruta_csv, encoding='utf-8')))
+        assert [int(f['id']) for f in filas] == list(range(10))
+        assert salida.estadisticas()['escrituras_registros'] == 3
+        print("✅ Test formatos_y_registros_por_bloques: PASÓ")
+
+    def test_contrapresion_y_trabajo_en_lote(self, tmp_path):
+        """Probar que un disco lento bloquea al productor y los heatmaps del trabajo en lote"""
+        import json
+        import threading
+        from modulos.output_sink import SalidaAsincrona
+        from modulos.load_model import crear_modelo_temporal
+
+        class SalidaLenta(SalidaAsincrona):
+            def _codificar_imagen(self, overlay):
+                time.sleep(0.1)
+                return super()._codificar_imagen(overlay)
+
+        overlay = np.zeros((32, 32, 3), dtype=np.uint8)
+        with SalidaLenta(str(tmp_path / 'lenta'), workers=1, max_pendientes=1) as salida:
+            inicio = time.perf_counter()
+            for i in range(3):
+                salida.escribir_heatmap(f'{i}', overlay=overlay)
+            # El tercero tuvo que esperar a que terminaran los dos primeros
+            assert time.perf_counter() - inicio >= 0.15
+        assert salida.estadisticas()['contrapresion_s'] >= 0.15
+        assert not any(t.name.startswith('salida') for t in threading.enumerate())
+
+        rutas = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'JPG', 'JPG', '*', '*.jpeg')))[:3]
+        cola = ColaTrabajos(str(tmp_path / 'trabajo.sqlite'))
+        cola.agregar(rutas)
+        with SalidaAsincrona(str(tmp_path / 'heatmaps'), formato='jpg', calidad=80,
+                             registros=str(tmp_path / 'resultados.jsonl')) as salida:
+            ejecutar_trabajo(cola, tamano_lote=2, model=crear_modelo_temporal(), salida=salida)
+        resultados = list(cola.resultados('done'))
+        assert len(resultados) == 3
+        assert all(r['heatmap'].endswith('.jpg') and os.path.exists(r['heatmap']) for r in resultados)
+        registros = [json.loads(l) for l in open(tmp_path / 'resultados.jsonl', encoding='utf-8')]
+        assert sorted(r['ruta'] for r in registros) == sorted(rutas)
+        assert salida.estadisticas()['imagenes'] == 3
+        cola.close()
+        print("✅ Test contrapresion_y_trabajo_en_lote: PASÓ")
+
+    def test_bloque_confirmado_tras_sus_escrituras(self, tmp_path):
+        """Probar que cada bloque se confirma con sus heatmaps y registros en disco y sin esperar al resto"""
+        import json
+        from modulos.output_sink import SalidaAsincrona
+        from modulos.load_model import crear_modelo_temporal
+
+        class SalidaFallida(SalidaAsincrona):
+            def _codificar_imagen(self, overlay):
+                if self.imagenes + self.errores == 0:
+                    raise OSError("disco lleno")
+                return super()._codificar_imagen(overlay)
+
+        rutas = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'JPG', 'JPG', '*', '*.jpeg')))[:5]
+        cola = ColaTrabajos(str(tmp_path / 'trabajo.sqlite'))
+        cola.agregar(rutas)
+        ruta_registros = str(tmp_path / 'resultados.jsonl')
+        salida = SalidaFallida(str(tmp_path / 'heatmaps'), formato='jpg', workers=1,
+                               registros=ruta_registros, registros_por_escritura=2)
+        confirmados = []
+        registrar = cola.registrar
+
+        def registrar_comprobando(resultados):
+            # Al confirmar, los heatmaps y los registros del bloque ya están en disco
+            en_disco = {json.loads(l)['id'] for l in open(ruta_registros, encoding='utf-8')}
+            for r in resultados:
+                assert r['id'] in en_disco
+                assert r['heatmap'] is None or os.path.exists(r['heatmap'])
+            confirmados.append(len(resultados))
+            registrar(resultados)
+
+        cola.registrar = registrar_comprobando
+        ejecutar_trabajo(cola, tamano_lote=1, lotes_por_commit=1,
+                         model=crear_modelo_temporal(), salida=salida)
+        salida.cerrar()
+        assert sum(confirmados) == 5
+        # Los registros se escriben por tamaño (2 + 2 + 1), no uno por bloque
+        assert salida.estadisticas()['escrituras_registros'] == 3
+        resultados = list(cola.resultados('done'))
+        assert len(resultados) == 5
+        assert sum(r['heatmap'] is None for r in resultados) == 1
+        registros = [json.loads(l) for l in open(ruta_registros, encoding='utf-8')]
+        assert sorted(r['ruta'] for r in registros) == sorted(rutas)
+        assert sum(r['heatmap'] is None for r in registros) == 1
+        cola.close()
+        print("✅ Test bloque_confirmado_tras_sus_escrituras: PASÓ")
+
+class TestTrabajoDistribuido:
+    """Pruebas para el reparto de trabajos entre nodos con leases en una carpeta compartida"""
+
+    def test_leases_recuperacion_y_fusion(self, tmp_path):
+        """Probar el reclamo exclusivo, la recuperación de leases vencidos y la fusión sin duplicados"""
+        from modulos.distributed_job import crear_trabajo, TrabajoCompartido, fusionar, progreso
+        compartido = str(tmp_path / 'compartido')
+        rutas = [str(tmp_path / f'{i}.jpg') for i in range(5)]
+        assert crear_trabajo(compartido, rutas, por_bloque=2)['bloques'] == 3
+        with pytest.raises(FileExistsError):
+            crear_trabajo(compartido, rutas)
+
+        a = TrabajoCompartido(compartido, nodo='a', ttl=30)
+        b = TrabajoCompartido(compartido, nodo='b', ttl=30)
+        bloque_a, _ = a.reclamar()
+        reclamados = {bloque_a}
+        while True:
+            reclamado = b.reclamar()
+            if reclamado is None:
+                break
+            reclamados.add(reclamado[0])
+        # b tomó los otros dos y no el de a, que sigue vivo
+        assert reclamados == {0, 1, 2} and set(b._leases) == {0, 1, 2} - {bloque_a}
+        assert progreso(compartido, ttl=30)['en_curso'] == 3
+
+        def resultados(trabajo, bloque):
+            return [{'id': i, 'ruta': r, 'estado': 'done', 'diagnostico': 'normal', 'probabilidad': 90.0,
+                     'probabilidades': [0.05, 0.9, 0.05]} for i, r in trabajo.items(bloque)]
+
+        # a deja de latir: b recupera su bloque y a se entera en su siguiente latido
+        lease = a._ruta_lease(bloque_a)
+        os.utime(lease, (time.time() - 60, time.time() - 60))
+        c = TrabajoCompartido(compartido, nodo='c', ttl=30)
+        assert c.reclamar() == (bloque_a, 2) and c.recuperados == 1
+        a.latir()
+        assert a.perdidos == 1 and not a._leases
+        # a termina igualmente su bloque: el resultado duplicado se descarta al fusionar
+        a.completar(bloque_a, resultados(a, bloque_a))
+        c.completar(bloque_a, resultados(c, bloque_a))
+        for bloque in list(b._leases):
+            b.completar(bloque, resultados(b, bloque))
+        assert not os.listdir(os.path.join(compartido, 'leases'))
+        assert a.reclamar() is None and not a.pendientes()
+
+        reporte = fusionar(compartido, str(tmp_path / 'fusion.sqlite'))
+        assert reporte['done'] == 5 and reporte['pending'] == 0
+        assert reporte['duplicados'] == len(a.items(bloque_a)) and reporte['nodos'] == ['a', 'b', 'c']
+        cola = ColaTrabajos(str(tmp_path / 'fusion.sqlite'))
+        assert sorted(r['ruta'] for r in cola.resultados()) == sorted(rutas)
+        cola.close()
+        print("✅ Test leases_recuperacion_y_fusion: PASÓ")
+
+    def test_intentos_fuera_del_lease(self, tmp_path):
+        """Probar que los intentos de un bloque no se reinician cuando otro nodo crea el lease tras retirarlo"""
+        from modulos.distributed_job import crear_trabajo, TrabajoCompartido
+        compartido = str(tmp_path / 'compartido')
+        crear_trabajo(compartido, [str(tmp_path / 'a.jpg')], por_bloque=1)
+        nodos = {n: TrabajoCompartido(compartido, nodo=n, ttl=30) for n in 'abcde'}
+        lease = nodos['a']._ruta_lease(0)
+
+        def vencer():
+            os.utime(lease, (time.time() - 60, time.time() - 60))
+
+        assert nodos['a'].reclamar() == (0, 1)
+        vencer()
+        # b retira el lease vencido y, antes de que cree el suyo, c lo toma
+        assert nodos['b']._recuperar(lease) is True and not os.path.exists(lease)
+        assert nodos['c'].reclamar() == (0, 2)
+        assert nodos['b']._tomar(0) is None
+        vencer()
+        assert nodos['d'].reclamar() == (0, 3)
+        # Un lease soltado a tiempo no cuenta como intento
+        nodos['d'].detener()
+        assert nodos['e'].reclamar() == (0, 3)
+        print("✅ Test intentos_fuera_del_lease: PASÓ")
+
+    def test_nodos_locales_con_un_nodo_muerto(self, tmp_path):
+        """Probar un trabajo repartido entre dos procesos con un bloque abandonado por un nodo muerto"""
+        import json
+        from modulos.distributed_job import crear_trabajo, lanzar_nodos, fusionar
+        rutas = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'JPG', 'JPG', '*', '*.jpeg')))[:4]
+        compartido = str(tmp_path / 'compartido')
+        crear_trabajo(compartido, rutas, por_bloque=1)
+        ruta_modelo = TestModelManager._guardar_version(tmp_path / 'v1.h5', 1)
+        # Lease de un nodo que murió hace rato, y un bloque que ya tumbó a tres nodos
+        for bloque, intentos in ((0, 1), (3, 3)):
+            lease = os.path.join(compartido, 'leases', f'{bloque:06d}.lease')
+            with open(lease, 'w') as f:
+                json.dump({'nodo': 'muerto', 'token': 'x', 'intentos': intentos}, f)
+            os.utime(lease, (time.time() - 600, time.time() - 600))
+            marcas = os.path.join(compartido, 'intentos', f'{bloque:06d}')
+            os.makedirs(marcas)
+            for k in range(intentos):
+                open(os.path.join(marcas, f'muerto.{k}'), 'w').close()
+
+        reportes = lanzar_nodos(compartido, procesos=2, prefijo='nodo', ruta_modelo=ruta_modelo,
+                                tamano_lote=2, ttl=30)
+        assert sum(r['bloques'] for r in reportes) == 4
+        assert sum(r['recuperados'] for r in reportes) == 2
+        assert reportes[-1]['progreso']['hechos'] == 4
+
+        reporte = fusionar(compartido, str(tmp_path / 'fusion.sqlite'))
+        assert reporte['done'] == 3 and reporte['failed'] == 1 and reporte['pending'] == 0
+        cola = ColaTrabajos(str(tmp_path / 'fusion.sqlite'))
+        assert {r['version_modelo'][:6] for r in cola.resultados()} == {'v1.h5@'}
+        assert 'interrumpió 3 veces' in next(cola.resultados('failed'))['error']
+        cola.close()
+        print("✅ Test nodos_locales_con_un_nodo_muerto: PASÓ")
+
+class TestProfilerHook:
+    """Pruebas para la captura de perfiles bajo demanda de las próximas N predicciones"""
+
+    def test_captura_de_n_predicciones(self, tmp_path):
+        """Probar que se registran solo N predicciones y se escriben la traza, el cProfile y las pilas"""
+        import json
+        from modulos import profiler_hook
+        from modulos.integrator import predict_batch
+        from modulos.load_model import crear_modelo_temporal
+        model = crear_modelo_temporal()
+        batch = np.zeros((2, 512, 512, 1), dtype=np.float32)
+
+        captura = profiler_hook.activar(2, directorio=str(tmp_path / 'perfil'))
+        assert profiler_hook.activar(5) is captura
+        for _ in range(3):
+            assert predict_batch(batch, model).shape == (2, 3)
+        directorio = captura.esperar(timeout=60)
+        assert directorio == str(tmp_path / 'perfil') and profiler_hook.captura_activa() is None
+        for nombre in ('perfil.pstats', 'perfil.txt', 'pilas.collapsed', 'resumen.json'):
+            assert os.path.getsize(os.path.join(directorio, nombre)) > 0
+        assert os.listdir(os.path.join(directorio, 'tf'))
+        with open(os.path.join(directorio, 'resumen.json')) as f:
+            resumen = json.load(f)
+        assert [r['funcion'] for r in resumen['llamadas']] == ['predict_batch', 'predict_batch']
+        assert resumen['traza_tf'] and resumen['muestras_pilas'] > 0
+        with open(os.path.join(directorio, 'perfil.txt')) as f:
+            assert 'predict_batch' in f.read()
+        print("✅ Test captura_de_n_predicciones: PASÓ")
+
+    def test_apagado_anidadas_y_senal(self, tmp_path, monkeypatch):
+        """Probar que apagado no hay captura, que las llamadas anidadas cuentan una vez y la señal"""
+        import signal
+        import threading
+        from modulos import profiler_hook
+
+        @profiler_hook.perfilable
+        def interna(x):
+            return x + 1
+
+        @profiler_hook.perfilable
+        def externa(x):
+            return interna(x) * 2
+
+        hilos = threading.active_count()
+        assert externa(1) == 4 and threading.active_count() == hilos
+        assert profiler_hook.captura_activa() is None and externa.__name__ == 'externa'
+
+        if not hasattr(signal, 'SIGUSR2'):
+            pytest.skip("SIGUSR2 no disponible en esta plataforma")
+        monkeypatch.setenv('NEUMONIA_PERFILADO_DIR', str(tmp_path))
+        anterior = signal.getsignal(signal.SIGUSR2)
+        try:
+            assert profiler_hook.instalar_senal(1)
+            os.kill(os.getpid(), signal.SIGUSR2)
+            limite = time.time() + 5
+            while profiler_hook.captura_activa() is None and time.time() < limite:
+                time.sleep(0.01)
+        finally:
+            signal.signal(signal.SIGUSR2, anterior)
+        captura = profiler_hook.captura_activa()
+        assert captura is not None and captura.llamadas == 1
+        captura.traza_tf = False
+        assert externa(1) == 4
+        assert captura.esperar(timeout=30) and os.path.dirname(captura.directorio) == str(tmp_path)
+        assert captura._terminadas == 1 and captura._registro[0]['funcion'] == 'externa'
+        print("✅ Test apagado_anidadas_y_senal: PASÓ")
+
+    def test_captura_con_menos_de_n_predicciones(self, tmp_path):
+        """Probar que desactivar() y el límite cierran una captura incompleta y escriben lo registrado"""
+        import json
+        from modulos import profiler_hook
+        from modulos.integrator import predict_batch
+        from modulos.load_model import crear_modelo_temporal
+        model = crear_modelo_temporal()
+        batch = np.zeros((1, 512, 512, 1), dtype=np.float32)
+
+        # Dos de cinco predicciones y desactivar(): se para la traza y se escribe lo parcial
+        captura = profiler_hook.activar(5, directorio=str(tmp_path / 'parcial'))
+        for _ in range(2):
+            predict_batch(batch, model)
+        assert profiler_hook.desactivar() is captura and profiler_hook.captura_activa() is None
+        directorio = captura.esperar(timeout=60)
+        assert directorio == str(tmp_path / 'parcial') and os.listdir(os.path.join(directorio, 'tf'))
+        with open(os.path.join(directorio, 'resumen.json')) as f:
+            resumen = json.load(f)
+        assert len(resumen['llamadas']) == 2 and not resumen['completa']
+        assert profiler_hook.desactivar() is None
+        # Una predicción más ya no cuenta
+        predict_batch(batch, model)
+        assert captura._admitidas == 2
+
+        # El límite cierra sola una captura con menos llamadas de las pedidas
+        captura = profiler_hook.activar(3, directorio=str(tmp_path / 'limite'), traza_tf=False, limite=1.0)
+        predict_batch(batch, model)
+        assert captura.esperar(timeout=30) == str(tmp_path / 'limite')
+        assert profiler_hook.captura_activa() is None
+
+        # Armada sin ninguna predicción (p. ej. una señal a un proceso ocioso): no escribe nada
+        captura = profiler_hook.activar(3, directorio=str(tmp_path / 'vacia'), limite=0.2)
+        assert captura.esperar(timeout=30) is None and captura._escrita.is_set()
+        assert profiler_hook.captura_activa() is None and not os.path.exists(tmp_path / 'vacia')
+        print("✅ Test captura_con_menos_de_n_predicciones: PASÓ")
+
+
 class TestLoadModel:
     """Pruebas para el módulo de carga de modelos"""
     
@@ -176,6 +1422,273 @@ class TestIntegrator:
         assert validate_inputs(np.array([])) == False
         print("✅ Test validate_inputs_invalido: PASÓ")
 
+class TestGradCamPorClase:
+    """Pruebas para el Grad-CAM por clase a partir de activaciones cacheadas"""
+    
+    def setup_method(self):
+        """Configuración antes de cada prueba"""
+        from modulos.grad_cam import calcular_cam, obtener_activaciones_cam
+        self.calcular_cam = calcular_cam
+        self.obtener_activaciones_cam = obtener_activaciones_cam
+        self.model = model_fun()
+        self.tensor = preprocess(np.random.randint(0, 255, (300, 300, 3), dtype=np.uint8))
+    
+    def test_mapas_por_clase_iguales_a_grad_cam(self):
+        """Probar que el Jacobiano por clase reproduce el Grad-CAM de cada clase"""
+        activaciones = self.obtener_activaciones_cam(self.model, self.tensor)
+        assert activaciones.num_clases == 3
+        for clase in range(3):
+            esperado = self.calcular_cam(self.model, self.tensor, clase).astype(int)
+            # Las activaciones se guardan en float16: se toleran diferencias de redondeo
+            assert np.abs(activaciones.mapa(clase).astype(int) - esperado).max() <= 2
+        print("✅ Test mapas_por_clase_iguales_a_grad_cam: PASÓ")
+    
+    def test_cache_por_estudio(self):
+        """Probar que un segundo pedido del mismo estudio no recalcula nada"""
+        primera = self.obtener_activaciones_cam(self.model, self.tensor, clave="estudio-1")
+        segunda = self.obtener_activaciones_cam(self.model, self.tensor, clave="estudio-1")
+        assert primera is segunda
+        print("✅ Test cache_por_estudio: PASÓ")
+
+    def test_grad_cam_batch_por_muestra(self):
+        """Probar que el Grad-CAM por lotes coincide con el individual de cada muestra"""
+        from modulos.grad_cam import grad_cam_batch, renderizar_overlays, renderizar_overlay
+        imagenes = [np.random.randint(0, 255, (200 + 10 * i, 220, 3), dtype=np.uint8) for i in range(3)]
+        batch, _ = preprocess_batch(imagenes)
+        clases = [2, 0, 1]
+        cams, probabilidades = grad_cam_batch(self.model, batch, clases)
+        assert cams.shape[0] == 3 and cams.dtype == np.uint8
+        assert probabilidades.shape == (3, 3)
+        for i, clase in enumerate(clases):
+            esperado = self.calcular_cam(self.model, batch[i:i + 1], clase).astype(int)
+            # Con otro tamaño de batch oneDNN puede sumar en otro orden: se toleran redondeos
+            assert np.abs(cams[i].astype(int) - esperado).max() <= 2
+        overlays = renderizar_overlays(cams, imagenes, (250, 250))
+        assert overlays.shape == (3, 250, 250, 3)
+        for i in range(3):
+            esperado = renderizar_overlay(cams[i], imagenes[i], (250, 250)).astype(int)
+            assert np.abs(overlays[i].astype(int) - esperado).max() <= 1
+        print("✅ Test grad_cam_batch_por_muestra: PASÓ")
+
+class TestPrediccionBajoDemanda:
+    """Pruebas para el resultado de predict con heatmap perezoso"""
+    
+    def setup_method(self):
+        """Configuración antes de cada prueba"""
+        if not has_predict:
+            pytest.skip("Función predict no disponible")
+        self.test_image = np.random.randint(0, 255, (300, 300, 3), dtype=np.uint8)
+    
+    def test_heatmap_solo_cuando_se_pide(self):
+        """Probar que el Grad-CAM no se calcula hasta pedir el heatmap"""
+        resultado = predict(self.test_image)
+        assert resultado.diagnostico in ("bacteriana", "normal", "viral")
+        assert resultado._activaciones is None
+        overlay = resultado.heatmap((250, 250))
+        assert overlay.shape == (250, 250, 3) and overlay.dtype == np.uint8
+        # El CAM se guarda en la resolución de la capa convolucional, compacto
+        assert resultado.cam.dtype == np.uint8 and resultado.cam.ndim == 2
+        assert resultado.cam.shape[0] < 512
+        print("✅ Test heatmap_solo_cuando_se_pide: PASÓ")
+    
+    def test_heatmap_de_otra_clase(self):
+        """Probar heatmaps de clases distintas a la predicha desde el mismo resultado"""
+        resultado = predict(self.test_image)
+        viral = resultado.heatmap((250, 250), clase="viral")
+        bacteriana = resultado.heatmap((250, 250), clase=0)
+        assert viral.shape == bacteriana.shape == (250, 250, 3)
+        with pytest.raises(ValueError):
+            resultado.heatmap(clase="desconocida")
+        print("✅ Test heatmap_de_otra_clase: PASÓ")
+    
+    def test_desempaquetado_compatible(self):
+        """Probar que el resultado se sigue pudiendo usar como tupla"""
+        diagnostico, probabilidad, heatmap = predict(self.test_image)
+        assert isinstance(diagnostico, str)
+        assert 0.0 <= probabilidad <= 100.0
+        assert heatmap.shape == (512, 512, 3)
+        print("✅ Test desempaquetado_compatible: PASÓ")
+    
+    def test_explicadores_sin_gradientes(self):
+        """Probar los modos de mapa de calor que solo usan pasadas forward"""
+        for explicador in ("activaciones", "scorecam"):
+            resultado = predict(self.test_image, explicador=explicador)
+            assert resultado.diagnostico in ("bacteriana", "normal", "viral")
+            assert resultado.cam.dtype == np.uint8 and resultado.cam.ndim == 2
+            assert resultado.heatmap((250, 250)).shape == (250, 250, 3)
+        assert predict(self.test_image, explicador="inexistente").diagnostico == "error"
+        print("✅ Test explicadores_sin_gradientes: PASÓ")
+    
+    def test_activaciones_fallidas_no_son_normal(self, monkeypatch):
+        """Probar que si la pasada con activaciones falla el resultado es error y no 'normal'"""
+        from modulos import integrator
+        monkeypatch.setattr(integrator, 'predecir_con_activaciones', lambda *a, **k: (None, None))
+        resultado = integrator.predict(self.test_image, explicador="activaciones")
+        assert resultado.diagnostico == "error" and resultado.probabilidad == 0.0
+        print("✅ Test activaciones_fallidas_no_son_normal: PASÓ")
+    
+    def test_excepciones_de_las_pasadas_nuevas_son_error(self, monkeypatch):
+        """Probar que una excepción en la pasada con activaciones o en la cascada da error y no 'normal'"""
+        from modulos import grad_cam, integrator
+
+        def fallar(*args, **kwargs):
+            raise RuntimeError("fallo simulado")
+
+        with monkeypatch.context() as m:
+            m.setattr(grad_cam, '_activaciones_y_logits', fallar)
+            assert grad_cam.predecir_con_activaciones(integrator.get_pool().model,
+                                                      np.zeros((1, 512, 512, 1), np.float32)) == (None, None)
+            for explicador in ("activaciones", "scorecam"):
+                resultado = integrator.predict(self.test_image, explicador=explicador)
+                assert resultado.diagnostico == "error" and resultado.probabilidad == 0.0
+
+        class CascadaRota:
+            def primera_etapa(self, batch):
+                raise RuntimeError("fallo simulado")
+
+        resultado = integrator.predict(self.test_image, cascada=CascadaRota())
+        assert resultado.diagnostico == "error" and resultado.probabilidad == 0.0
+        print("✅ Test excepciones_de_las_pasadas_nuevas_son_error: PASÓ")
+    
+    def test_resultado_error(self):
+        """Probar que una entrada inválida produce un resultado de error renderizable"""
+        resultado = predict(None)
+        assert resultado.diagnostico == "error"
+        assert resultado.heatmap((250, 250)).shape == (250, 250, 3)
+        print("✅ Test resultado_error: PASÓ")
+
+class TestInferenceSession:
+    """Pruebas para el pool de sesiones de inferencia"""
+    
+    def setup_method(self):
+        """Configuración antes de cada prueba"""
+        self.model = model_fun()
+        if self.model is None:
+            pytest.skip("Modelo no disponible")
+        self.batch = np.random.rand(3, 512, 512, 1).astype(np.float32)
+    
+    def test_sesion_igual_a_predict(self):
+        """Probar que la función concreta da lo mismo que model.predict"""
+        pool = PoolSesiones(self.model, sesiones=2)
+        esperado = self.model.predict(self.batch, verbose=0)
+        assert np.allclose(pool.run(self.batch), esperado, atol=1e-5)
+        assert pool.run(self.batch[:1]).shape == (1, 3)
+        print("✅ Test sesion_igual_a_predict: PASÓ")
+    
+    def test_concurrencia_y_contrapresion(self):
+        """Probar llamadas desde varios hilos y el rechazo con el pool ocupado"""
+        import threading
+        pool = PoolSesiones(self.model, sesiones=2, max_en_espera=0)
+        resultados = []
+        
+        def llamar():
+            try:
+                resultados.append(pool.run(self.batch[:1], timeout=30))
+            except PoolSaturado:
+                pass
+        
+        hilos = [threading.Thread(target=llamar) for _ in range(4)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        assert len(resultados) + pool.rechazadas == 4
+        
+        with pool.sesion(), pool.sesion():
+            with pytest.raises(PoolSaturado):
+                pool.run(self.batch[:1])
+        pool.max_en_espera = None
+        with pool.sesion(), pool.sesion():
+            with pytest.raises(PoolSaturado):
+                pool.run(self.batch[:1], timeout=0.05)
+        assert pool.estadisticas()['libres'] == 2
+        print("✅ Test concurrencia_y_contrapresion: PASÓ")
+
+class TestRuntimeProfile:
+    """Pruebas para los perfiles de ejecución"""
+    
+    def test_perfiles_predefinidos(self, monkeypatch, tmp_path):
+        """Probar la resolución de perfiles con nombre y el perfil por defecto"""
+        monkeypatch.setenv('NEUMONIA_CONFIG_RUNTIME', str(tmp_path / 'runtime.json'))
+        monkeypatch.delenv('NEUMONIA_PERFIL', raising=False)
+        assert runtime_profile.resolver_perfil()['nombre'] == "latency"
+        perfiles = runtime_profile.perfiles_predefinidos(nucleos=16)
+        assert perfiles["throughput"]['sesiones'] * perfiles["throughput"]['intra_op'] == 16
+        assert perfiles["shared-node"]['intra_op'] <= 2
+        monkeypatch.setenv('NEUMONIA_PERFIL', "shared-node")
+        assert runtime_profile.resolver_perfil()['nombre'] == "shared-node"
+        with pytest.raises(ValueError):
+            runtime_profile.resolver_perfil("inexistente")
+        with pytest.raises(ValueError):
+            runtime_profile.resolver_perfil("autotune")
+        # Importar los módulos no aplica ningún perfil: lo hace el punto de entrada
+        import subprocess
+        raiz = os.path.join(os.path.dirname(__file__), '..')
+        codigo = ("import sys; from src.modulos import load_model, runtime_profile; "
+                  "print(runtime_profile.perfil_activo() is None and 'tensorflow' in sys.modules)")
+        salida = subprocess.run([sys.executable, '-c', codigo], cwd=raiz, capture_output=True, text=True)
+        assert salida.stdout.strip().splitlines()[-1] == "True"
+        assert runtime_profile.aplicar_perfil_o_defecto() is runtime_profile.perfil_activo()
+        print("✅ Test perfiles_predefinidos: PASÓ")
+    
+    def test_autotune_guarda_perfil(self, monkeypatch, tmp_path):
+        """Probar que el autoajuste mide en otro proceso y guarda el perfil"""
+        ruta = tmp_path / 'runtime.json'
+        monkeypatch.setenv('NEUMONIA_CONFIG_RUNTIME', str(ruta))
+        monkeypatch.delenv('NEUMONIA_PERFIL', raising=False)
+        candidato = {'intra_op': 1, 'inter_op': 1, 'sesiones': 1, 'onednn': True, 'hilos_cv2': 1}
+        config = runtime_profile.autoajustar(lote=1, lotes=1, candidatos=[candidato])
+        assert config is not None and ruta.exists()
+        assert config['medicion']['imagenes_por_segundo'] > 0
+        perfil = runtime_profile.resolver_perfil()
+        assert perfil['nombre'] == "autotune" and perfil['intra_op'] == 1
+        print("✅ Test autotune_guarda_perfil: PASÓ")
+
+class TestOverlay:
+    """Pruebas para el renderizador de superposiciones con LUT"""
+    
+    def setup_method(self):
+        """Configuración antes de cada prueba"""
+        rng = np.random.default_rng(0)
+        self.cams = rng.integers(0, 256, (3, 31, 31), dtype=np.uint8)
+        self.imagenes = [rng.integers(0, 256, (300, 280), dtype=np.uint8),
+                         rng.integers(0, 256, (512, 512, 3), dtype=np.uint8),
+                         rng.integers(0, 256, (200, 200), dtype=np.uint8)]
+    
+    @staticmethod
+    def _referencia(cam, imagen, tamano):
+        """Camino original: JET en BGR, mezcla y conversión final a RGB"""
+        color = cv2.applyColorMap(cv2.resize(cam, tamano), cv2.COLORMAP_JET)
+        original = preparar_imagen_original(imagen, tamano)
+        return cv2.cvtColor(cv2.addWeighted(original, 0.5, color, 0.5, 0), cv2.COLOR_BGR2RGB)
+    
+    def test_render_identico_a_referencia(self):
+        """Probar que el renderizado con LUT RGB es idéntico al camino original"""
+        for tamano in ((512, 512), (250, 250)):
+            renderizador = RenderizadorOverlay(tamano)
+            for cam, imagen in zip(self.cams, self.imagenes):
+                esperado = self._referencia(cam, imagen, tamano)
+                assert np.array_equal(renderizador.render(cam, imagen), esperado)
+        print("✅ Test render_identico_a_referencia: PASÓ")
+    
+    def test_render_batch_en_destino(self):
+        """Probar el renderizado por lotes escribiendo en un buffer preasignado"""
+        renderizador = RenderizadorOverlay((250, 250))
+        salida = np.zeros((3, 250, 250, 3), dtype=np.uint8)
+        assert renderizador.render_batch(self.cams, self.imagenes, out=salida) is salida
+        for i in range(3):
+            assert np.array_equal(salida[i], self._referencia(self.cams[i], self.imagenes[i], (250, 250)))
+        with pytest.raises(ValueError):
+            renderizador.render_batch(self.cams, self.imagenes, out=salida[:, ::2])
+        # Un lote grande se renderiza por tramos sin agrandar los buffers del hilo
+        from modulos.overlay import IMAGENES_POR_TRAMO
+        n = 3 * IMAGENES_POR_TRAMO + 1
+        indices = [i % 3 for i in range(n)]
+        grande = renderizador.render_batch(self.cams[indices], [self.imagenes[i] for i in indices])
+        assert all(np.array_equal(grande[j], salida[i]) for j, i in enumerate(indices))
+        assert renderizador._buffers()["n"] == IMAGENES_POR_TRAMO
+        print("✅ Test render_batch_en_destino: PASÓ")
+
 def test_sistema_sin_modelo():
     """Prueba básica del sistema sin depender del modelo"""
     # Esta prueba no requiere el modelo cargado